@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
+from typing import List
 
 class Settings(BaseSettings):
     APP_NAME: str = 'Ai_wolf Backend'
@@ -15,6 +16,21 @@ class Settings(BaseSettings):
 
     GEMINI_API_KEY: str = 'YOUR_GEMINI_API_KEY_HERE' # User must provide this
 
+    # Parallel per-section generation of initial_analysis reports
+    SECTION_GENERATION_MAX_CONCURRENCY: int = 5 # Sections generated at the same time (bounded by Gemini RPM)
+    SECTION_GENERATION_MAX_RETRIES: int = 2 # Extra attempts for a single failed section
+    SECTION_GENERATION_RETRY_BACKOFF_SECONDS: float = 2.0
+
+    # Batch analysis of the weekly post backlog (source_documents tree)
+    SOURCE_DOCUMENTS_DIR: Path = Path.home() / 'Wolf_Data' / 'source_documents'
+    BATCH_POST_EXTENSIONS: List[str] = ['.txt', '.md']
+    BATCH_MAX_CONCURRENCY: int = 3 # Weeks generated at the same time
+    BATCH_REQUESTS_PER_MINUTE: int = 10 # Stay under the Gemini key's RPM quota
+    BATCH_MAX_RETRIES: int = 2 # Extra attempts for a failed week within one run
+    BATCH_FRED_SERIES_IDS: List[str] = ['GDP', 'CPIAUCSL'] # Market data attached to each week's prompt
+    BATCH_MARKET_DATA_LOOKBACK_DAYS: int = 120 # Covers the latest release of monthly/quarterly series
+    BATCH_MARKET_DATA_MAX_OBSERVATIONS: int = 6 # Most recent observations kept per series
+
     JWT_SECRET_KEY: str = 'a_very_secret_and_random_key_please_change_this' # Should be complex, .env will override
     JWT_ALGORITHM: str = 'HS256'
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 # As per .env in step 1, this default will be overridden if .env is set
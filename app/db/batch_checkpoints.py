@@ -0,0 +1,216 @@
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import structlog
+
+from app.db.database import get_db_connection
+
+logger = structlog.get_logger(__name__)
+
+
+def initialize_batch_tables():
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        logger.info("Initializing database: Checking/creating batch analysis tables...")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                job_id TEXT PRIMARY KEY,
+                source_dir TEXT NOT NULL,
+                status TEXT NOT NULL,          -- 'running', 'completed', 'completed_with_errors', 'interrupted'
+                total_weeks INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME NOT NULL,
+                run_started_at DATETIME NOT NULL, -- Start of the current (possibly resumed) run
+                finished_at DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_week_results (
+                job_id TEXT NOT NULL,
+                week_id TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                date_range TEXT NOT NULL,
+                status TEXT NOT NULL,          -- 'completed' or 'failed'
+                report TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                elapsed_seconds REAL NOT NULL DEFAULT 0,
+                completed_at DATETIME NOT NULL,
+                PRIMARY KEY (job_id, week_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_week_manifest (
+                job_id TEXT NOT NULL,
+                week_id TEXT NOT NULL,
+                post_hash TEXT NOT NULL,          -- SHA256 of the week's post text
+                template_hash TEXT NOT NULL,      -- SHA256 of the prompt template
+                experts_hash TEXT NOT NULL,       -- SHA256 of the expert summaries
+                external_data_hash TEXT NOT NULL, -- SHA256 of the market data snapshot
+                model_name TEXT NOT NULL,
+                recorded_at DATETIME NOT NULL,
+                PRIMARY KEY (job_id, week_id)
+            )
+        ''')
+        conn.commit()
+        logger.info("Batch analysis tables initialized/checked successfully.")
+    except sqlite3.Error as e:
+        logger.error('Failed to initialize batch analysis tables', error=str(e), exc_info=True)
+    finally:
+        if conn:
+            conn.close()
+
+
+def start_batch_job_run(job_id: str, source_dir: str, total_weeks: int) -> None:
+    """Creates the job row, or marks an existing job as running again (resume) with a new run start time."""
+    now_str = datetime.now(timezone.utc).isoformat()
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            INSERT INTO batch_jobs (job_id, source_dir, status, total_weeks, created_at, run_started_at, finished_at)
+            VALUES (?, ?, 'running', ?, ?, ?, NULL)
+            ON CONFLICT(job_id) DO UPDATE SET
+                source_dir = excluded.source_dir,
+                status = 'running',
+                total_weeks = excluded.total_weeks,
+                run_started_at = excluded.run_started_at,
+                finished_at = NULL
+        ''', (job_id, source_dir, total_weeks, now_str, now_str))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def finish_batch_job_run(job_id: str, status: str) -> None:
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            'UPDATE batch_jobs SET status = ?, finished_at = ? WHERE job_id = ?',
+            (status, datetime.now(timezone.utc).isoformat(), job_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_batch_job(job_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT * FROM batch_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def get_completed_week_manifests(job_id: str) -> Dict[str, Dict[str, str]]:
+    """Input manifests of the weeks checkpointed as completed, keyed by week_id."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT m.week_id, m.post_hash, m.template_hash, m.experts_hash, m.external_data_hash, m.model_name
+            FROM batch_week_manifest m
+            JOIN batch_week_results r ON r.job_id = m.job_id AND r.week_id = m.week_id
+            WHERE m.job_id = ? AND r.status = 'completed'
+        ''', (job_id,)).fetchall()
+        return {row['week_id']: {k: row[k] for k in row.keys() if k != 'week_id'} for row in rows}
+    finally:
+        conn.close()
+
+
+def save_week_manifest(job_id: str, week_id: str, manifest: Dict[str, str]) -> None:
+    """Records the input hashes a week's report was generated from."""
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO batch_week_manifest
+                (job_id, week_id, post_hash, template_hash, experts_hash, external_data_hash, model_name, recorded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            job_id, week_id, manifest['post_hash'], manifest['template_hash'], manifest['experts_hash'],
+            manifest['external_data_hash'], manifest['model_name'], datetime.now(timezone.utc).isoformat()
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def save_week_result(
+    job_id: str,
+    week_id: str,
+    source_path: str,
+    date_range: str,
+    status: str,
+    report: Optional[str] = None,
+    error: Optional[str] = None,
+    attempts: int = 1,
+    prompt_tokens: int = 0,
+    output_tokens: int = 0,
+    elapsed_seconds: float = 0.0
+) -> None:
+    """Checkpoints one week. Written as soon as the week finishes so a disconnect loses at most in-flight weeks."""
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO batch_week_results
+                (job_id, week_id, source_path, date_range, status, report, error, attempts,
+                 prompt_tokens, output_tokens, elapsed_seconds, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            job_id, week_id, source_path, date_range, status, report, error, attempts,
+            prompt_tokens, output_tokens, elapsed_seconds, datetime.now(timezone.utc).isoformat()
+        ))
+        conn.commit()
+        logger.debug('Batch week checkpointed.', job_id=job_id, week_id=week_id, status=status)
+    finally:
+        conn.close()
+
+
+def get_week_result(job_id: str, week_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            'SELECT * FROM batch_week_results WHERE job_id = ? AND week_id = ?', (job_id, week_id)
+        ).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def get_week_result_stats(job_id: str, since: Optional[str] = None) -> Dict[str, int]:
+    """
+    Aggregates checkpointed weeks of a job: counts per status and token spend.
+    If `since` (ISO timestamp) is given, 'completed_since' and 'failed_since' count weeks completed or failed
+    at or after it.
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute('''
+            SELECT
+                COALESCE(SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END), 0) AS completed,
+                COALESCE(SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END), 0) AS failed,
+                COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                COALESCE(SUM(CASE WHEN status = 'completed' AND completed_at >= ? THEN 1 ELSE 0 END), 0) AS completed_since,
+                COALESCE(SUM(CASE WHEN status = 'failed' AND completed_at >= ? THEN 1 ELSE 0 END), 0) AS failed_since
+            FROM batch_week_results WHERE job_id = ?
+        ''', (since or '', since or '', job_id)).fetchone()
+        return dict(row)
+    finally:
+        conn.close()
+
+
+def list_week_results(job_id: str) -> List[Dict[str, Any]]:
+    """Per-week status without report bodies, ordered by week."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT week_id, date_range, status, error, attempts, prompt_tokens, output_tokens, elapsed_seconds, completed_at
+            FROM batch_week_results WHERE job_id = ? ORDER BY week_id
+        ''', (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
@@ -1,10 +1,11 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
-from app.routers import health, auth, db_management, data_fetcher, chat # Add chat router import
+from app.routers import health, auth, db_management, data_fetcher, chat, batch
 from app.core.logging_config import setup_logging
 from app.core.middlewares import RequestContextLogMiddleware
 from app.core.exceptions import global_exception_handler, APIBaseException, api_base_exception_handler
 from app.db.database import initialize_db
+from app.db.batch_checkpoints import initialize_batch_tables
 import structlog # Ensure structlog is imported
 
 # Configure logging
@@ -17,6 +18,7 @@ async def on_startup():
     logger = structlog.get_logger("app.startup")
     try:
         initialize_db()
+        initialize_batch_tables()
         logger.info("Database initialized successfully.")
     except Exception as e:
         logger.error("Failed to initialize database during startup.", error=str(e), exc_info=True)
@@ -35,6 +37,7 @@ app.include_router(auth.router, prefix="/api")
 app.include_router(db_management.router, prefix="/api")
 app.include_router(data_fetcher.router, prefix="/api")
 app.include_router(chat.router, prefix="/api") # chat.router has prefix="/chat", so full is /api/chat
+app.include_router(batch.router, prefix="/api") # /api/batch
 
 @app.get('/')
 async def root():
@@ -0,0 +1,93 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.schemas.batch_schemas import BatchJobCreateRequest, BatchJobProgress, BatchJobWeeksResponse, BatchWeekReport, BatchStaleWeeksResponse
+from app.services.batch_analysis_service import (
+    start_batch_job, get_batch_job_progress, find_stale_weeks, rebuild_stale_weeks, BatchJobError, BatchSourceDirError
+)
+from app.db import batch_checkpoints
+from app.core.dependencies import get_current_user
+from app.schemas.auth_schemas import User # For type hint
+import structlog
+
+logger = structlog.get_logger(__name__)
+router = APIRouter(
+    prefix="/batch",
+    tags=["Batch Analysis"]
+)
+
+@router.post(
+    '/jobs',
+    response_model=BatchJobProgress,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary='Start or resume a batch initial-analysis job over a directory of weekly posts.',
+    description='Generates the initial analysis report for each week in the background. '
+                'Finished weeks are checkpointed, so starting the same job again resumes where it stopped. '
+                'source_dir must lie inside the configured source documents directory.'
+)
+async def create_batch_job(request_data: BatchJobCreateRequest, current_user: User = Depends(get_current_user)):
+    logger.info('Batch job requested.', user_id=current_user.id, source_dir=request_data.source_dir, job_id=request_data.job_id)
+    try:
+        job_id = await start_batch_job(
+            source_dir=request_data.source_dir,
+            job_id=request_data.job_id,
+            max_concurrency=request_data.max_concurrency
+        )
+    except BatchSourceDirError as e:
+        logger.warn('Batch job source directory rejected.', user_id=current_user.id, error_details=str(e))
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except BatchJobError as e:
+        logger.warn('Batch job could not be started.', user_id=current_user.id, error_details=str(e))
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    progress = await asyncio.to_thread(get_batch_job_progress, job_id)
+    return BatchJobProgress(**progress)
+
+@router.get('/jobs/{job_id}', response_model=BatchJobProgress, summary='Get progress, ETA, throughput and token spend of a batch job.')
+async def get_batch_job(job_id: str, current_user: User = Depends(get_current_user)):
+    progress = await asyncio.to_thread(get_batch_job_progress, job_id)
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Batch job {job_id} not found.')
+    return BatchJobProgress(**progress)
+
+@router.get('/jobs/{job_id}/weeks', response_model=BatchJobWeeksResponse, summary='List the checkpointed weeks of a batch job.')
+async def list_batch_job_weeks(job_id: str, current_user: User = Depends(get_current_user)):
+    if await asyncio.to_thread(batch_checkpoints.get_batch_job, job_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Batch job {job_id} not found.')
+    weeks = await asyncio.to_thread(batch_checkpoints.list_week_results, job_id)
+    return BatchJobWeeksResponse(job_id=job_id, weeks=weeks)
+
+@router.get('/jobs/{job_id}/weeks/{week_id:path}', response_model=BatchWeekReport, summary='Get the generated report of one week.')
+async def get_batch_week_report(job_id: str, week_id: str, current_user: User = Depends(get_current_user)):
+    week_result = await asyncio.to_thread(batch_checkpoints.get_week_result, job_id, week_id)
+    if week_result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Week {week_id} not found in batch job {job_id}.')
+    return BatchWeekReport(**week_result)
+
+@router.get(
+    '/jobs/{job_id}/stale',
+    response_model=BatchStaleWeeksResponse,
+    summary='List the weeks whose inputs changed since their report was generated (dry run of rebuild_stale).'
+)
+async def get_batch_job_stale_weeks(job_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        stale_weeks = await asyncio.to_thread(find_stale_weeks, job_id)
+    except BatchJobError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return BatchStaleWeeksResponse(job_id=job_id, stale_weeks=stale_weeks)
+
+@router.post(
+    '/jobs/{job_id}/rebuild_stale',
+    response_model=BatchJobProgress,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary='Regenerate only the weeks whose post, prompt template, expert summaries, market data or model changed.'
+)
+async def rebuild_batch_job_stale_weeks(job_id: str, current_user: User = Depends(get_current_user)):
+    if await asyncio.to_thread(batch_checkpoints.get_batch_job, job_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Batch job {job_id} not found.')
+    logger.info('Batch stale rebuild requested.', user_id=current_user.id, job_id=job_id)
+    try:
+        await rebuild_stale_weeks(job_id)
+    except BatchJobError as e:
+        logger.warn('Batch stale rebuild could not be started.', user_id=current_user.id, error_details=str(e))
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return BatchJobProgress(**await asyncio.to_thread(get_batch_job_progress, job_id))
@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from app.schemas.chat_schemas import ChatRequest, ChatResponse, ChatMessage, ChatContext # Ensured ChatContext is imported
 from app.services.ai_service import get_ai_chat_completion, AIServiceError
 from app.services.prompt_engineering_service import build_initial_analysis_prompt, build_final_report_preview_prompt
+from app.services.report_generation_service import generate_initial_analysis_in_parallel, assemble_report_sections
 from app.core.dependencies import get_current_user
 from app.schemas.auth_schemas import User
 import structlog
 from typing import List, Optional # Added Optional
 import re
+import time
 # import json # No longer needed for parsing sections from user_message for final_report_preview
 
 logger = structlog.get_logger(__name__)
@@ -68,7 +70,7 @@ async def process_chat_message(
             enable_ai_search = True
 
     try:
-        ai_reply_text: str
+        ai_reply_text: Optional[str] = None
         prompt_to_send: Optional[str] = None
         history_for_ai: List[ChatMessage] = [
             msg for msg in chat_context.chat_history
@@ -76,7 +78,18 @@ async def process_chat_message(
         ]
         user_message_for_ai: Optional[str] = user_message
 
-        if trigger_action == 'initial_analysis':
+        analysis_started_at = time.perf_counter()
+
+        if trigger_action == 'initial_analysis' and request_data.analysis_mode == 'parallel_sections':
+            # Sections A-E are generated concurrently from prompts sharing one context prefix, then assembled in order.
+            ai_reply_text = await generate_initial_analysis_in_parallel(
+                shan_jia_lang_post=chat_context.file_content,
+                date_range=chat_context.date_range_for_analysis,
+                external_data=chat_context.external_data,
+                selected_modules=chat_context.selected_modules
+            )
+
+        elif trigger_action == 'initial_analysis':
             # context.file_content and context.date_range_for_analysis are now guaranteed by Pydantic validator
             prompt_to_send = build_initial_analysis_prompt(
                 shan_jia_lang_post=chat_context.file_content,
@@ -89,7 +102,13 @@ async def process_chat_message(
             enable_ai_search = False # Typically, specific analysis prompts don't need general search unless designed to
             logger.debug('Built "initial_analysis" prompt using structured context.', user_id=user_id, prompt_length=len(prompt_to_send or ''))
 
+        elif trigger_action == 'final_report_preview' and request_data.report_preview_mode == 'local':
+            # The confirmed sections are final text; assembling them locally is deterministic and needs no AI call.
+            ai_reply_text = assemble_report_sections(chat_context.confirmed_sections_for_report)
+            logger.debug('Assembled "final_report_preview" locally.', user_id=user_id, report_length=len(ai_reply_text))
+
         elif trigger_action == 'final_report_preview':
+            # Opt-in "llm_polish" mode
             # context.confirmed_sections_for_report is guaranteed by Pydantic validator
             prompt_to_send = build_final_report_preview_prompt(
                 sections=chat_context.confirmed_sections_for_report
@@ -100,7 +119,9 @@ async def process_chat_message(
             logger.debug('Built "final_report_preview" prompt using structured context.', user_id=user_id, prompt_length=len(prompt_to_send or ''))
 
         # Call AI Service
-        if prompt_to_send is not None:
+        if ai_reply_text is not None:
+            pass # Already generated above (parallel section mode or local report assembly)
+        elif prompt_to_send is not None:
             ai_reply_text = get_ai_chat_completion(prompt=prompt_to_send, enable_search=enable_ai_search)
         elif user_message_for_ai is not None: # General conversational turn
             ai_reply_text = get_ai_chat_completion(chat_history=history_for_ai, user_message=user_message_for_ai, enable_search=enable_ai_search)
@@ -109,6 +130,15 @@ async def process_chat_message(
             logger.error('No valid prompt or (history+user_message) for AI service. Should be caught by validation.', user_id=user_id, trigger_action=trigger_action)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Internal error: Could not determine AI input based on request.')
 
+        if trigger_action == 'initial_analysis':
+            # Logged for both modes so single-prompt and parallel-section latency can be compared.
+            logger.info(
+                'Initial analysis latency.',
+                user_id=user_id,
+                analysis_mode=request_data.analysis_mode,
+                elapsed_seconds=round(time.perf_counter() - analysis_started_at, 3)
+            )
+
         logger.info('AI reply generated successfully.', user_id=user_id, reply_length=len(ai_reply_text), search_enabled_for_call=enable_ai_search)
         return ChatResponse(reply=ai_reply_text)
 
@@ -0,0 +1,50 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class BatchJobCreateRequest(BaseModel):
+    source_dir: Optional[str] = Field(None, description='Directory of weekly posts to analyse, inside the configured source_documents directory (relative paths are taken relative to it). Defaults to that directory.')
+    job_id: Optional[str] = Field(None, description='Job id to start or resume. Defaults to an id derived from source_dir, so the same directory resumes the same job.')
+    max_concurrency: Optional[int] = Field(None, ge=1, le=10, description='Weeks generated at the same time. Defaults to BATCH_MAX_CONCURRENCY.')
+
+class BatchJobProgress(BaseModel):
+    job_id: str
+    status: str = Field(..., description="'running', 'completed', 'completed_with_errors' or 'interrupted'")
+    source_dir: str
+    is_running: bool
+    total_weeks: int
+    completed_weeks: int
+    failed_weeks: int
+    pending_weeks: int
+    elapsed_seconds: float = Field(..., description='Elapsed time of the current (or last) run.')
+    throughput_weeks_per_hour: Optional[float] = Field(None, description='Weeks completed per hour in the current run.')
+    eta_seconds: Optional[float] = Field(None, description='Estimated time until the remaining weeks finish, while running.')
+    prompt_tokens: int
+    output_tokens: int
+    total_tokens: int
+
+class BatchWeekStatus(BaseModel):
+    week_id: str
+    date_range: str
+    status: str
+    error: Optional[str] = None
+    attempts: int
+    prompt_tokens: int
+    output_tokens: int
+    elapsed_seconds: float
+    completed_at: str
+
+class BatchWeekReport(BatchWeekStatus):
+    report: Optional[str] = None
+
+class BatchJobWeeksResponse(BaseModel):
+    job_id: str
+    weeks: List[BatchWeekStatus]
+
+class BatchStaleWeek(BaseModel):
+    week_id: str
+    date_range: str
+    changed_inputs: List[str] = Field(..., description="Inputs that changed since the week was generated: 'post_hash', 'template_hash', 'experts_hash', 'external_data_hash', 'model_name', or 'new' if it has no completed report.")
+
+class BatchStaleWeeksResponse(BaseModel):
+    job_id: str
+    stale_weeks: List[BatchStaleWeek]
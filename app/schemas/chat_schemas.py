@@ -19,6 +19,8 @@ class ChatRequest(BaseModel):
     user_message: str = Field(description='The latest message/query from the user. For some trigger_actions, this might be supplemental or ignored if dedicated context fields are used.')
     trigger_action: Optional[str] = Field(None, description='Specific action to trigger, e.g., "initial_analysis", "final_report_preview"')
     context: ChatContext = Field(description='The complete context for the AI.')
+    analysis_mode: Literal['single', 'parallel_sections'] = Field('single', description='For trigger_action="initial_analysis": "single" generates the whole report in one prompt; "parallel_sections" generates sections A-E concurrently and assembles them in order.')
+    report_preview_mode: Literal['local', 'llm_polish'] = Field('local', description='For trigger_action="final_report_preview": "local" assembles the confirmed sections verbatim without calling the AI; "llm_polish" sends them to the AI for formatting.')
 
     # Using model_validator for cross-field validation in Pydantic v2
     @model_validator(mode='after') # 'before' or 'after' depending on when you need to validate
@@ -78,8 +78,14 @@ def get_ai_chat_completion(
     prompt: Optional[str] = None,
     chat_history: Optional[List[ChatMessage]] = None,
     user_message: Optional[str] = None,
-    enable_search: bool = False
+    enable_search: bool = False,
+    usage_out: Optional[Dict[str, int]] = None
 ) -> str:
+    """
+    Returns the AI reply text for a single prompt or a chat turn.
+    If `usage_out` is given, it is filled with the token usage reported by Gemini
+    ('prompt_tokens', 'output_tokens', 'total_tokens') for callers that track token spend.
+    """
     if not settings.GEMINI_API_KEY or settings.GEMINI_API_KEY in ['YOUR_GEMINI_API_KEY_HERE', 'your_gemini_api_key_from_user']:
         logger.error('Gemini API key not configured. Cannot get AI completion.')
         raise AIServiceError('Gemini API key is not configured. AI service is unavailable.')
@@ -181,6 +187,12 @@ def get_ai_chat_completion(
                              candidates_info=str(response.candidates),
                              prompt_feedback_info=str(response.prompt_feedback))
 
+        if usage_out is not None:
+            usage_metadata = getattr(response, 'usage_metadata', None)
+            usage_out['prompt_tokens'] = int(getattr(usage_metadata, 'prompt_token_count', 0) or 0)
+            usage_out['output_tokens'] = int(getattr(usage_metadata, 'candidates_token_count', 0) or 0)
+            usage_out['total_tokens'] = int(getattr(usage_metadata, 'total_token_count', 0) or 0)
+
         logger.info('AI completion received.', reply_length=len(response_text))
         return response_text.strip()
 
@@ -0,0 +1,459 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+from app.core.config import settings
+from app.db import batch_checkpoints
+from app.db.database import get_cached_data, set_cached_data
+from app.services.ai_service import get_ai_chat_completion, AIServiceError, GEMINI_MODEL_NAME
+from app.services.external_data_service import fetch_fred_data, ExternalDataError
+from app.services.prompt_engineering_service import build_initial_analysis_prompt, DEFAULT_EXPERT_SUMMARIES
+
+logger = structlog.get_logger(__name__)
+
+
+class BatchJobError(Exception):
+    """Custom exception for batch analysis job errors (e.g., invalid source directory, job already running)."""
+    pass
+
+
+class BatchSourceDirError(BatchJobError):
+    """Raised when a requested source directory lies outside the configured source documents directory."""
+    pass
+
+
+# Week markers recognised in post file names: ISO week ("2023-W40") or a date ("2023-10-02", "20231002").
+_ISO_WEEK_PATTERN = re.compile(r'(\d{4})-?W(\d{1,2})', re.IGNORECASE)
+_DATE_PATTERN = re.compile(r'(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})')
+
+POST_SEPARATOR = '\n\n---\n\n'
+
+
+@dataclass
+class WeeklyPost:
+    """All posts of one week (or one unparseable file) and the date range they cover."""
+    week_id: str
+    date_range: str
+    week_start: Optional[date] = None
+    week_end: Optional[date] = None
+    source_paths: List[Path] = field(default_factory=list)
+
+    def read_text(self) -> str:
+        return POST_SEPARATOR.join(p.read_text(encoding='utf-8') for p in self.source_paths)
+
+
+def _parse_week_start(file_stem: str) -> Optional[date]:
+    """Returns the Monday of the week named in a file name, or None if no week marker is found."""
+    iso_match = _ISO_WEEK_PATTERN.search(file_stem)
+    if iso_match:
+        try:
+            return date.fromisocalendar(int(iso_match.group(1)), int(iso_match.group(2)), 1)
+        except ValueError:
+            pass
+    date_match = _DATE_PATTERN.search(file_stem)
+    if date_match:
+        try:
+            day = date(int(date_match.group(1)), int(date_match.group(2)), int(date_match.group(3)))
+            return day - timedelta(days=day.weekday())
+        except ValueError:
+            pass
+    return None
+
+
+def discover_weekly_posts(source_dir: Path) -> List[WeeklyPost]:
+    """
+    Scans `source_dir` recursively for post files and groups them by ISO week.
+    Files without a recognisable week marker become their own unit, keyed by relative path.
+    Weeks are returned in chronological order, followed by the unparseable files.
+    """
+    source_dir = Path(source_dir)
+    if not source_dir.is_dir():
+        raise BatchJobError(f'Source directory not found: {source_dir}')
+
+    extensions = tuple(ext.lower() for ext in settings.BATCH_POST_EXTENSIONS)
+    weeks: Dict[str, WeeklyPost] = {}
+    for path in sorted(p for p in source_dir.rglob('*') if p.is_file() and p.suffix.lower() in extensions):
+        week_start = _parse_week_start(path.stem)
+        if week_start:
+            iso_year, iso_week, _ = week_start.isocalendar()
+            week_id = f'{iso_year}-W{iso_week:02d}'
+            week_end = week_start + timedelta(days=6)
+            date_range = f'{week_start.isoformat()}至{week_end.isoformat()}'
+        else:
+            week_id = path.relative_to(source_dir).with_suffix('').as_posix()
+            week_end = None
+            date_range = path.stem
+        weeks.setdefault(week_id, WeeklyPost(week_id, date_range, week_start, week_end)).source_paths.append(path)
+
+    ordered = sorted(weeks.values(), key=lambda w: (w.week_start is None, w.week_start or date.min, w.week_id))
+    logger.info('Weekly posts discovered.', source_dir=str(source_dir), week_count=len(ordered))
+    return ordered
+
+
+# Returned by build_week_market_data(cached_only=True) when a series would have to be fetched.
+MARKET_DATA_NOT_CACHED = object()
+
+
+def build_week_market_data(week: WeeklyPost, cached_only: bool = False) -> Any:
+    """
+    Fetches the configured FRED series up to the end of the week (through the external data cache)
+    and keeps the most recent observations of each. Series that fail are skipped.
+    With `cached_only`, nothing is fetched: MARKET_DATA_NOT_CACHED is returned if any series is not cached.
+    """
+    if not week.week_end or not settings.BATCH_FRED_SERIES_IDS:
+        return None
+
+    market_data: Dict[str, Any] = {}
+    for series_id in settings.BATCH_FRED_SERIES_IDS:
+        params = {
+            'symbol': series_id,
+            'observation_start': (week.week_end - timedelta(days=settings.BATCH_MARKET_DATA_LOOKBACK_DAYS)).isoformat(),
+            'observation_end': week.week_end.isoformat(),
+        }
+        data = get_cached_data(source='fred', params=params)
+        if data is None and cached_only:
+            return MARKET_DATA_NOT_CACHED
+        if data is None:
+            try:
+                data = fetch_fred_data(symbol=series_id, parameters={k: v for k, v in params.items() if k != 'symbol'})
+                set_cached_data(source='fred', params=params, data=data)
+            except ExternalDataError as e:
+                logger.warn('Skipping market data series for week.', week_id=week.week_id, series_id=series_id, error_details=str(e))
+                continue
+        observations = data.get('observations', []) if isinstance(data, dict) else []
+        market_data[series_id] = [
+            {'date': obs.get('date'), 'value': obs.get('value')}
+            for obs in observations[-settings.BATCH_MARKET_DATA_MAX_OBSERVATIONS:]
+        ]
+    return market_data or None
+
+
+class _RequestPacer:
+    """Spaces out request starts so the batch stays under a requests-per-minute quota."""
+
+    def __init__(self, requests_per_minute: int):
+        self._interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            delay = self._next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_at = time.monotonic() + self._interval
+
+
+def _sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compute_template_hash() -> str:
+    """Hash of the initial analysis prompt template alone (built with fixed placeholder inputs)."""
+    template = build_initial_analysis_prompt(
+        shan_jia_lang_post='{post}', date_range='{date_range}', expert_summaries={}, external_data=None
+    )
+    return _sha256_text(template)
+
+
+def compute_week_manifest(post_text: str, external_data: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Input hashes a week's report depends on: post text, prompt template, expert summaries, market data and model."""
+    return {
+        'post_hash': _sha256_text(post_text),
+        'template_hash': compute_template_hash(),
+        'experts_hash': _sha256_text(json.dumps(DEFAULT_EXPERT_SUMMARIES, sort_keys=True, ensure_ascii=False)),
+        'external_data_hash': _sha256_text(json.dumps(external_data, sort_keys=True, ensure_ascii=False)),
+        'model_name': GEMINI_MODEL_NAME,
+    }
+
+
+def diff_manifest(stored_manifest: Optional[Dict[str, str]], current_manifest: Dict[str, str]) -> List[str]:
+    """Names of the inputs that changed since the stored report was generated (['new'] if there is none)."""
+    if not stored_manifest:
+        return ['new']
+    return [name for name, value in current_manifest.items() if stored_manifest.get(name) != value]
+
+
+async def _process_week(
+    job_id: str,
+    week: WeeklyPost,
+    stored_manifest: Optional[Dict[str, str]],
+    semaphore: asyncio.Semaphore,
+    pacer: _RequestPacer,
+    max_retries: int,
+    retry_backoff_seconds: float
+) -> str:
+    """Generates one week if its inputs changed. Returns 'generated', 'unchanged' or 'failed'."""
+    async with semaphore:
+        started_at = time.perf_counter()
+        source_path = ';'.join(str(p) for p in week.source_paths)
+        try:
+            post_text = week.read_text()
+            external_data = await asyncio.to_thread(build_week_market_data, week)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warn('Batch week inputs could not be read.', job_id=job_id, week_id=week.week_id, error_details=str(e))
+            await asyncio.to_thread(
+                batch_checkpoints.save_week_result, job_id, week.week_id, source_path, week.date_range, 'failed',
+                error=str(e), attempts=0
+            )
+            return 'failed'
+
+        manifest = compute_week_manifest(post_text, external_data)
+        changed_inputs = diff_manifest(stored_manifest, manifest)
+        if not changed_inputs:
+            logger.debug('Batch week unchanged, skipped.', job_id=job_id, week_id=week.week_id)
+            return 'unchanged'
+        logger.info('Batch week needs generation.', job_id=job_id, week_id=week.week_id, changed_inputs=changed_inputs)
+
+        prompt = build_initial_analysis_prompt(
+            shan_jia_lang_post=post_text,
+            date_range=week.date_range,
+            external_data=external_data
+        )
+        attempts = max_retries + 1
+        last_error = ''
+        for attempt in range(1, attempts + 1):
+            try:
+                usage: Dict[str, int] = {}
+                await pacer.wait()
+                report = await asyncio.to_thread(get_ai_chat_completion, prompt=prompt, usage_out=usage)
+                elapsed = round(time.perf_counter() - started_at, 3)
+                await asyncio.to_thread(
+                    batch_checkpoints.save_week_result,
+                    job_id, week.week_id, source_path, week.date_range, 'completed',
+                    report=report, attempts=attempt,
+                    prompt_tokens=usage.get('prompt_tokens', 0), output_tokens=usage.get('output_tokens', 0),
+                    elapsed_seconds=elapsed
+                )
+                await asyncio.to_thread(batch_checkpoints.save_week_manifest, job_id, week.week_id, manifest)
+                logger.info('Batch week completed.', job_id=job_id, week_id=week.week_id, attempt=attempt, elapsed_seconds=elapsed, **usage)
+                return 'generated'
+            except AIServiceError as e:
+                last_error = str(e)
+                logger.warn('Batch week failed.', job_id=job_id, week_id=week.week_id, attempt=attempt, error_details=last_error)
+                if attempt < attempts:
+                    await asyncio.sleep(retry_backoff_seconds * (2 ** (attempt - 1)))
+
+        await asyncio.to_thread(
+            batch_checkpoints.save_week_result,
+            job_id, week.week_id, source_path, week.date_range, 'failed',
+            error=last_error, attempts=attempts, elapsed_seconds=round(time.perf_counter() - started_at, 3)
+        )
+        return 'failed'
+
+
+def _prepare_run(job_id: str, source_dir: Path) -> Tuple[List[WeeklyPost], Dict[str, Dict[str, str]]]:
+    """Registers a (resumed) run of the job; returns all weeks and the manifests of those already completed."""
+    weeks = discover_weekly_posts(source_dir)
+    batch_checkpoints.start_batch_job_run(job_id, str(source_dir), len(weeks))
+    stored_manifests = batch_checkpoints.get_completed_week_manifests(job_id)
+    logger.info(
+        'Batch job run started.',
+        job_id=job_id,
+        total_weeks=len(weeks),
+        previously_completed=len(stored_manifests)
+    )
+    return weeks, stored_manifests
+
+
+async def _execute_run(
+    job_id: str,
+    weeks: List[WeeklyPost],
+    stored_manifests: Dict[str, Dict[str, str]],
+    max_concurrency: Optional[int] = None,
+    requests_per_minute: Optional[int] = None,
+    max_retries: Optional[int] = None,
+    retry_backoff_seconds: float = 2.0
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(max_concurrency or settings.BATCH_MAX_CONCURRENCY)
+    pacer = _RequestPacer(requests_per_minute if requests_per_minute is not None else settings.BATCH_REQUESTS_PER_MINUTE)
+    retries = settings.BATCH_MAX_RETRIES if max_retries is None else max_retries
+
+    try:
+        outcomes = await asyncio.gather(*[
+            _process_week(job_id, week, stored_manifests.get(week.week_id), semaphore, pacer, retries, retry_backoff_seconds)
+            for week in weeks
+        ])
+    except asyncio.CancelledError:
+        # Synchronous on purpose: the task is being cancelled and must not await again.
+        batch_checkpoints.finish_batch_job_run(job_id, 'interrupted')
+        logger.warn('Batch job run cancelled.', job_id=job_id)
+        raise
+
+    status = 'completed_with_errors' if 'failed' in outcomes else 'completed'
+    await asyncio.to_thread(batch_checkpoints.finish_batch_job_run, job_id, status)
+    progress = await asyncio.to_thread(get_batch_job_progress, job_id)
+    logger.info(
+        'Batch job run finished.',
+        job_id=job_id,
+        status=status,
+        generated_weeks=outcomes.count('generated'),
+        unchanged_weeks=outcomes.count('unchanged'),
+        failed_weeks=outcomes.count('failed'),
+        progress=progress
+    )
+    return progress
+
+
+async def run_batch_job(
+    job_id: str,
+    source_dir: Path,
+    max_concurrency: Optional[int] = None,
+    requests_per_minute: Optional[int] = None,
+    max_retries: Optional[int] = None,
+    retry_backoff_seconds: float = 2.0
+) -> Dict[str, Any]:
+    """
+    Generates the initial analysis report for every week under `source_dir` whose inputs changed since its
+    report was generated (see compute_week_manifest); new and failed weeks are always generated. Each finished
+    week is written to SQLite immediately, so re-running the same job after a disconnect resumes where it
+    stopped, and re-running it after an edit (a corrected post, new expert summaries, a different model)
+    only rebuilds the stale weeks.
+    Returns the job progress at the end of the run.
+    """
+    weeks, stored_manifests = await asyncio.to_thread(_prepare_run, job_id, Path(source_dir))
+    return await _execute_run(
+        job_id, weeks, stored_manifests, max_concurrency, requests_per_minute, max_retries, retry_backoff_seconds
+    )
+
+
+# Jobs running in this process. A job left 'running' in the DB but absent here was interrupted.
+_running_jobs: Dict[str, asyncio.Task] = {}
+
+
+def make_job_id(source_dir: Path) -> str:
+    """Derives a stable job id from the source directory, so starting the same directory again resumes it."""
+    return 'batch-' + hashlib.sha256(str(Path(source_dir).resolve()).encode('utf-8')).hexdigest()[:12]
+
+
+def resolve_source_dir(source_dir: Optional[Path] = None) -> Path:
+    """
+    Resolves a requested source directory against SOURCE_DOCUMENTS_DIR (relative paths are taken relative
+    to it). Raises BatchSourceDirError if the result, after resolving symlinks and '..', lies outside it.
+    """
+    base_dir = Path(settings.SOURCE_DOCUMENTS_DIR).expanduser().resolve()
+    resolved_dir = (base_dir / Path(source_dir).expanduser()).resolve() if source_dir else base_dir
+    if not resolved_dir.is_relative_to(base_dir):
+        raise BatchSourceDirError(f'Source directory must be inside {base_dir}: {source_dir}')
+    return resolved_dir
+
+
+async def start_batch_job(
+    source_dir: Optional[Path] = None,
+    job_id: Optional[str] = None,
+    max_concurrency: Optional[int] = None
+) -> str:
+    """
+    Starts (or resumes) a batch job as a background task on the running event loop and returns its id.
+    `source_dir` must lie inside SOURCE_DOCUMENTS_DIR (see resolve_source_dir).
+    """
+    resolved_dir = resolve_source_dir(source_dir)
+    if not resolved_dir.is_dir():
+        raise BatchJobError(f'Source directory not found: {resolved_dir}')
+    job_id = job_id or make_job_id(resolved_dir)
+    if job_id in _running_jobs:
+        raise BatchJobError(f'Batch job {job_id} is already running.')
+
+    weeks, stored_manifests = await asyncio.to_thread(_prepare_run, job_id, resolved_dir)
+    if job_id in _running_jobs: # Started by a concurrent request while the directory was being scanned
+        raise BatchJobError(f'Batch job {job_id} is already running.')
+    task = asyncio.create_task(_execute_run(job_id, weeks, stored_manifests, max_concurrency=max_concurrency))
+    _running_jobs[job_id] = task
+
+    def _on_done(finished_task: asyncio.Task):
+        _running_jobs.pop(job_id, None)
+        if not finished_task.cancelled() and finished_task.exception():
+            logger.error('Batch job run failed.', job_id=job_id, error_details=str(finished_task.exception()))
+            batch_checkpoints.finish_batch_job_run(job_id, 'interrupted')
+
+    task.add_done_callback(_on_done)
+    logger.info('Batch job started.', job_id=job_id, source_dir=str(resolved_dir))
+    return job_id
+
+
+def find_stale_weeks(job_id: str) -> List[Dict[str, Any]]:
+    """
+    Dry run of a stale rebuild: lists the weeks of a job that would be regenerated and which inputs changed.
+    Makes no network calls: market data is taken from the external data cache only, and a week whose market
+    data is not cached is compared on its other inputs. Raises BatchJobError if the job is unknown.
+    """
+    job = batch_checkpoints.get_batch_job(job_id)
+    if not job:
+        raise BatchJobError(f'Batch job {job_id} not found.')
+    stored_manifests = batch_checkpoints.get_completed_week_manifests(job_id)
+    stale_weeks = []
+    for week in discover_weekly_posts(Path(job['source_dir'])):
+        external_data = build_week_market_data(week, cached_only=True)
+        if external_data is MARKET_DATA_NOT_CACHED:
+            manifest = compute_week_manifest(week.read_text(), None)
+            del manifest['external_data_hash'] # Unknown without fetching
+        else:
+            manifest = compute_week_manifest(week.read_text(), external_data)
+        changed_inputs = diff_manifest(stored_manifests.get(week.week_id), manifest)
+        if changed_inputs:
+            stale_weeks.append({'week_id': week.week_id, 'date_range': week.date_range, 'changed_inputs': changed_inputs})
+    return stale_weeks
+
+
+async def rebuild_stale_weeks(job_id: str, max_concurrency: Optional[int] = None) -> str:
+    """Starts a run of an existing job over its source directory; only weeks with changed inputs are generated."""
+    job = await asyncio.to_thread(batch_checkpoints.get_batch_job, job_id)
+    if not job:
+        raise BatchJobError(f'Batch job {job_id} not found.')
+    return await start_batch_job(source_dir=Path(job['source_dir']), job_id=job_id, max_concurrency=max_concurrency)
+
+
+def get_batch_job_progress(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns progress, ETA, throughput (weeks/hour over the current run) and token spend of a job,
+    or None if the job is unknown.
+    """
+    job = batch_checkpoints.get_batch_job(job_id)
+    if not job:
+        return None
+
+    stats = batch_checkpoints.get_week_result_stats(job_id, since=job['run_started_at'])
+    is_running = job_id in _running_jobs
+    status = job['status']
+    if status == 'running' and not is_running:
+        status = 'interrupted' # The process that ran it is gone (e.g., Colab disconnect)
+
+    run_started_at = datetime.fromisoformat(job['run_started_at'])
+    run_ended_at = datetime.fromisoformat(job['finished_at']) if job['finished_at'] else datetime.now(timezone.utc)
+    elapsed_seconds = max((run_ended_at - run_started_at).total_seconds(), 0.0)
+
+    throughput = None
+    if stats['completed_since'] and elapsed_seconds > 0:
+        throughput = stats['completed_since'] / (elapsed_seconds / 3600)
+
+    # While running, weeks that failed in an earlier run will be retried, so only this run's failures are done.
+    failed_done = stats['failed_since'] if is_running else stats['failed']
+    pending_weeks = max(job['total_weeks'] - stats['completed'] - failed_done, 0)
+    eta_seconds = None
+    if is_running and throughput:
+        eta_seconds = round(pending_weeks / throughput * 3600, 1)
+
+    return {
+        'job_id': job_id,
+        'status': status,
+        'source_dir': job['source_dir'],
+        'is_running': is_running,
+        'total_weeks': job['total_weeks'],
+        'completed_weeks': stats['completed'],
+        'failed_weeks': stats['failed'],
+        'pending_weeks': pending_weeks,
+        'elapsed_seconds': round(elapsed_seconds, 1),
+        'throughput_weeks_per_hour': round(throughput, 2) if throughput else None,
+        'eta_seconds': eta_seconds,
+        'prompt_tokens': stats['prompt_tokens'],
+        'output_tokens': stats['output_tokens'],
+        'total_tokens': stats['prompt_tokens'] + stats['output_tokens'],
+    }
@@ -14,15 +14,20 @@ DEFAULT_EXPERT_SUMMARIES = {
 }
 
 
-def build_initial_analysis_prompt(
-    shan_jia_lang_post: str,
-    date_range: str, # Example: "2023-10-01至2023-10-07" or "2023年第40週"
-    expert_summaries: Optional[Dict[str, str]] = None,
-    external_data: Optional[Dict[str, Any]] = None,
-    selected_modules: Optional[List[str]] = None
-) -> str:
-    logger.info('Building initial analysis prompt.', date_range=date_range, selected_modules=selected_modules)
+# Section keys and titles of the weekly report, in report order (shared by the prompts and the local assembler).
+REPORT_SECTION_TITLES: Dict[str, str] = {
+    'A': '週次與日期範圍',
+    'B': '「善甲狼」核心觀點摘要',
+    'C': '當週市場重點回顧',
+    'D': '當週其他市場觀點/大師風向探索',
+    'E': '「看到->想到->做到」框架下的潛在交易機會回顧',
+}
 
+
+def _build_expert_block(
+    expert_summaries: Optional[Dict[str, str]],
+    selected_modules: Optional[List[str]]
+) -> str:
     active_expert_summaries = expert_summaries if expert_summaries is not None else DEFAULT_EXPERT_SUMMARIES.copy()
 
     # If selected_modules are provided, filter the summaries to include only those selected experts.
@@ -37,7 +42,10 @@ def build_initial_analysis_prompt(
     expert_block = "\n".join([f'- 「{name}」: {summary}' for name, summary in active_expert_summaries.items()])
     if not expert_block: # Handle case where no experts are selected or available
         expert_block = "    [未指定或無可用專家策略參考]"
+    return expert_block
 
+
+def _build_external_data_block(external_data: Optional[Dict[str, Any]]) -> str:
     external_data_block = "\n            [無外部經濟數據參考]" # Default if no data
     if external_data:
         try:
@@ -56,9 +64,20 @@ def build_initial_analysis_prompt(
     {str(external_data)}
     ```
     [注意：以上數據格式化失敗，可能影響AI判讀]'''
+    return external_data_block
 
 
-    prompt = f'''任務指令：金融市場分析週報撰寫 (初稿)
+def _build_analysis_context(
+    shan_jia_lang_post: str,
+    date_range: str,
+    expert_summaries: Optional[Dict[str, str]],
+    external_data: Optional[Dict[str, Any]],
+    selected_modules: Optional[List[str]]
+) -> str:
+    """Task instruction and background material shared by the single prompt and every per-section prompt."""
+    expert_block = _build_expert_block(expert_summaries, selected_modules)
+    external_data_block = _build_external_data_block(external_data)
+    return f'''任務指令：金融市場分析週報撰寫 (初稿)
 
 作為一位頂尖的金融市場分析師，請根據以下提供的多元背景資料，針對「{date_range}」這段期間，撰寫一份專業、深入、結構化的週報分析初稿。請使用**繁體中文**，並以條理清晰、層次分明的 **Markdown** 格式進行輸出。
 
@@ -72,45 +91,98 @@ def build_initial_analysis_prompt(
 2.  **輔助分析框架與專家策略參考:**
     你將運用以下幾位市場專家的核心交易理念來豐富你的分析維度：
 {expert_block}
-{external_data_block}
+{external_data_block}'''
 
-**報告結構要求：**
-
-請**嚴格按照**以下五個部分結構，生成報告內容。每一部分的標題和子標題都必須清晰呈現。
 
-**A. 週次與日期範圍:**
-    *   [請直接填寫當週的具體日期範圍，例如：{date_range}]
-
-**B. 「善甲狼」核心觀點摘要:**
+def _build_section_requirements(date_range: str) -> Dict[str, str]:
+    """Returns the writing requirements of each report section (A-E), keyed by section."""
+    return {
+        'A': f'''**A. 週次與日期範圍:**
+    *   [請直接填寫當週的具體日期範圍，例如：{date_range}]''',
+        'B': '''**B. 「善甲狼」核心觀點摘要:**
     *   精確提煉「善甲狼」在當週貼文中的核心觀點、市場情緒、關鍵的買賣決策或持倉變化。
-    *   深入分析其操作背後的主要邏輯和判斷依據。
-
-**C. 當週市場重點回顧:**
+    *   深入分析其操作背後的主要邏輯和判斷依據。''',
+        'C': '''**C. 當週市場重點回顧:**
     *   基於「善甲狼」貼文內容、**您獲得的外部經濟數據**以及您自身的金融知識庫，全面回顧並總結當週全球及台灣市場的宏觀經濟動態與重大金融事件。
-    *   簡述主要市場指數（例如：S&P 500、NASDAQ、道瓊工業指數、台股加權指數、櫃買指數等）的整體表現及其關鍵驅動因素。
-
-**D. 當週其他市場觀點/大師風向探索 (深入對比分析):**
+    *   簡述主要市場指數（例如：S&P 500、NASDAQ、道瓊工業指數、台股加權指數、櫃買指數等）的整體表現及其關鍵驅動因素。''',
+        'D': '''**D. 當週其他市場觀點/大師風向探索 (深入對比分析):**
     *   請進行一次有深度的對比分析。將「善甲狼」當週的市場行為和觀點，與我們提供的其他專家理念（見「輔助分析框架」部分）進行比較。
     *   **具體操作指引：**
         *   思考「善甲狼」的決策，在何種程度上呼應或偏離了其他專家的策略？
         *   例如：若「善甲狼」在市場急跌時進行了某項操作，這更接近「刀疤老二」所提倡的「順勢回檔」機會，還是「Comemail」視角下的「錯殺冷門股」的佈局良機？
         *   若「善甲狼」看好某特定產業或股票，嘗試運用「Vincent余鄭文」的ROIC及TAM等基本面分析標準來初步檢視，這是否構成一個具吸引力的投資機會？
-    *   請清晰闡述您的判斷邏輯和理由。
-
-**E. 「看到->想到->做到」框架下的潛在交易機會回顧:**
+    *   請清晰闡述您的判斷邏輯和理由。''',
+        'E': '''**E. 「看到->想到->做到」框架下的潛在交易機會回顧:**
     *   **看到 (Observation):** 綜合以上所有資訊（「善甲狼」觀點、市場動態、專家策略、外部數據），條列出當週市場最值得關注的幾個關鍵現象、訊號、數據點或潛在預期差。
     *   **想到 (Analysis/Hypothesis):** 針對您「看到」的每一個現象，進行策略性思考和深度分析。請務必融合**至少兩位以上**提供的專家分析角度，來形成具體的交易假設或市場判斷。
     *   **做到 (Actionable Plan):** 將上述交易假設轉化為具體的、可回顧的「紙上談兵」交易計畫。內容應包含：
         *   明確的進場條件或觀察訊號。
         *   假設性的初始停損點設定。
         *   初步的資金管理考量（例如，為何這是個值得投入注意力的機會）。
-        *   這個部分是回顧性質，旨在提煉和學習，而非實際交易指令。
+        *   這個部分是回顧性質，旨在提煉和學習，而非實際交易指令。''',
+    }
+
+
+def build_initial_analysis_prompt(
+    shan_jia_lang_post: str,
+    date_range: str, # Example: "2023-10-01至2023-10-07" or "2023年第40週"
+    expert_summaries: Optional[Dict[str, str]] = None,
+    external_data: Optional[Dict[str, Any]] = None,
+    selected_modules: Optional[List[str]] = None
+) -> str:
+    logger.info('Building initial analysis prompt.', date_range=date_range, selected_modules=selected_modules)
+
+    analysis_context = _build_analysis_context(
+        shan_jia_lang_post, date_range, expert_summaries, external_data, selected_modules
+    )
+    section_block = "\n\n".join(_build_section_requirements(date_range).values())
+
+    prompt = f'''{analysis_context}
+
+**報告結構要求：**
+
+請**嚴格按照**以下五個部分結構，生成報告內容。每一部分的標題和子標題都必須清晰呈現。
+
+{section_block}
 
 請確保報告內容的專業性和洞察力，充分利用所提供的所有上下文信息。
 '''
     logger.debug("Initial analysis prompt built.", prompt_length=len(prompt))
     return prompt
 
+def build_initial_analysis_section_prompts(
+    shan_jia_lang_post: str,
+    date_range: str,
+    expert_summaries: Optional[Dict[str, str]] = None,
+    external_data: Optional[Dict[str, Any]] = None,
+    selected_modules: Optional[List[str]] = None
+) -> Dict[str, str]:
+    """
+    Builds one prompt per report section (A-E) for parallel generation.
+    All prompts start with the same analysis context, so the shared prefix is identical across sections
+    and only the trailing section requirement differs.
+    Returns an ordered dict of section key -> prompt.
+    """
+    logger.info('Building per-section initial analysis prompts.', date_range=date_range, selected_modules=selected_modules)
+
+    analysis_context = _build_analysis_context(
+        shan_jia_lang_post, date_range, expert_summaries, external_data, selected_modules
+    )
+    section_prompts: Dict[str, str] = {}
+    for section_key, section_requirement in _build_section_requirements(date_range).items():
+        section_prompts[section_key] = f'''{analysis_context}
+
+**本次撰寫範圍：**
+
+完整週報共有 A、B、C、D、E 五個部分，將分別撰寫後再依序彙整。請**只撰寫**以下這一個部分，不要輸出其他部分的內容，也不要重複本部分的標題。
+
+{section_requirement}
+
+請確保報告內容的專業性和洞察力，充分利用所提供的所有上下文信息。
+'''
+    logger.debug("Per-section initial analysis prompts built.", section_count=len(section_prompts))
+    return section_prompts
+
 def build_final_report_preview_prompt(sections: Dict[str, str]) -> str:
     logger.info('Building final report preview prompt.')
 
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+from app.core.config import settings
+from app.services.ai_service import get_ai_chat_completion, AIServiceError
+from app.services.prompt_engineering_service import (
+    REPORT_SECTION_TITLES,
+    build_initial_analysis_section_prompts,
+)
+
+logger = structlog.get_logger(__name__)
+
+
+def assemble_report_sections(sections: Dict[str, str]) -> str:
+    """
+    Joins section texts into one Markdown report in A-E order, each under its bold section heading.
+    Missing sections are kept as an explicit "[X節內容未提供]" placeholder.
+
+    Section text is copied verbatim apart from leading/trailing blank lines, so the same sections always
+    produce byte-identical output. Used for final_report_preview and for assembling parallel sections.
+    """
+    blocks = []
+    for section_key, title in REPORT_SECTION_TITLES.items():
+        section_text = sections.get(section_key)
+        if section_text is None:
+            section_text = f'[{section_key}節內容未提供]'
+        blocks.append(f'**{section_key}. {title}:**\n' + section_text.strip('\r\n'))
+    return '\n\n'.join(blocks) + '\n'
+
+
+async def _generate_section(
+    section_key: str,
+    prompt: str,
+    semaphore: asyncio.Semaphore,
+    max_retries: int,
+    backoff_seconds: float
+) -> Tuple[str, str]:
+    attempts = max_retries + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            async with semaphore:
+                started_at = time.perf_counter()
+                # get_ai_chat_completion is blocking; run it in a worker thread so sections overlap.
+                section_text = await asyncio.to_thread(get_ai_chat_completion, prompt=prompt)
+            logger.info(
+                'Report section generated.',
+                section=section_key,
+                attempt=attempt,
+                elapsed_seconds=round(time.perf_counter() - started_at, 3),
+                reply_length=len(section_text)
+            )
+            return section_key, section_text
+        except AIServiceError as e:
+            if attempt == attempts:
+                logger.error('Report section failed after all retries.', section=section_key, attempts=attempts, error_details=str(e))
+                raise AIServiceError(f'Section {section_key} failed after {attempts} attempts: {e}')
+            logger.warn('Report section failed, retrying.', section=section_key, attempt=attempt, error_details=str(e))
+            await asyncio.sleep(backoff_seconds * (2 ** (attempt - 1)))
+    raise AIServiceError(f'Section {section_key} was not generated.') # Unreachable; keeps type checkers satisfied
+
+
+async def generate_initial_analysis_in_parallel(
+    shan_jia_lang_post: str,
+    date_range: str,
+    expert_summaries: Optional[Dict[str, str]] = None,
+    external_data: Optional[Dict[str, Any]] = None,
+    selected_modules: Optional[List[str]] = None,
+    max_concurrency: Optional[int] = None,
+    max_retries: Optional[int] = None,
+    retry_backoff_seconds: Optional[float] = None
+) -> str:
+    """
+    Generates the initial analysis report one section (A-E) per prompt, concurrently, and assembles the
+    sections in order. Every section prompt shares the same analysis context prefix. A failed section is
+    retried on its own; if it still fails, AIServiceError is raised.
+    """
+    section_prompts = build_initial_analysis_section_prompts(
+        shan_jia_lang_post=shan_jia_lang_post,
+        date_range=date_range,
+        expert_summaries=expert_summaries,
+        external_data=external_data,
+        selected_modules=selected_modules
+    )
+    semaphore = asyncio.Semaphore(max_concurrency or settings.SECTION_GENERATION_MAX_CONCURRENCY)
+    retries = settings.SECTION_GENERATION_MAX_RETRIES if max_retries is None else max_retries
+    backoff = settings.SECTION_GENERATION_RETRY_BACKOFF_SECONDS if retry_backoff_seconds is None else retry_backoff_seconds
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*[
+        _generate_section(section_key, prompt, semaphore, retries, backoff)
+        for section_key, prompt in section_prompts.items()
+    ])
+    report = assemble_report_sections(dict(results))
+    logger.info(
+        'Parallel initial analysis completed.',
+        date_range=date_range,
+        section_count=len(results),
+        elapsed_seconds=round(time.perf_counter() - started_at, 3),
+        report_length=len(report)
+    )
+    return report
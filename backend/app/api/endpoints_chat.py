@@ -1,10 +1,13 @@
+import asyncio
 import logging
-import random # For basic API key rotation
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, BackgroundTasks, Request
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, Any
 
-from app.services import prompt_builder, gemini_service, model_catalog, file_service # Added file_service
+from app.services import prompt_builder, prompt_planner, model_catalog, upload_preprocessing, context_cache, gemini_service, response_cache, history_compaction, chat_sessions, document_summarizer, model_router
+from app.services.retrieval_index import get_retrieval_index
+from app.utils.token_utils import estimate_tokens, estimate_tokens_for_parts
+from app.services.gemini_dispatcher import get_dispatcher, PRIORITY_INTERACTIVE
 from app.config import settings
 from app.config.settings import AI_DATA_PATH # Added AI_DATA_PATH
 
@@ -27,73 +30,177 @@ class ChatRequest(BaseModel):
     selectedModelName: Optional[str] = None
     systemPromptOverride: Optional[str] = None
     generationConfig: Optional[Dict[str, Any]] = None
+    userId: Optional[str] = Field(None, description="呼叫者識別碼，用於 Gemini 配額的公平分配；未提供時依工作階段或用戶端位址區分")
+    sessionId: Optional[str] = Field(None, description="伺服器端對話工作階段識別碼；提供時，聊天歷史、已選文件、外部數據與系統提示詞皆由伺服器保存，請求只需包含新訊息（其他欄位若提供則更新工作階段）")
+    reuseCachedResponse: bool = Field(False, description="允許重用先前相同請求的快取回應（temperature 為 0 時自動允許）")
+    useRetrieval: bool = Field(False, description="從來源文件索引中檢索與問題最相關的片段並加入提示詞，取代整份文件")
+    retrievalTopK: Optional[int] = Field(None, ge=1, le=50, description="檢索片段數，預設為 RETRIEVAL_TOP_K")
+    triggerAction: Optional[str] = Field(None, description="觸發的動作（如 'initial_analysis'），重型動作會路由至 pro 等級模型")
+    latencyTargetMs: Optional[int] = Field(None, ge=1, description="本次請求的延遲目標（毫秒）；pro 模型預估無法達成時改用 flash 模型")
 
 class ChatResponse(BaseModel):
     response: str
     isError: bool = False
     errorDetail: Optional[str] = None
+    servedFromCache: bool = False
+    sessionId: Optional[str] = None
+    pendingSummaries: Optional[List[str]] = Field(None, description="摘要仍在背景產生中的過大文件；本次回答使用其截斷內容，稍後重新提問即可使用摘要")
     # modelUsed: Optional[str] = None
     # tokensUsed: Optional[int] = None
     # wasTruncated: Optional[bool] = None
 
+class ChatSessionCreateRequest(BaseModel):
+    sessionId: Optional[str] = Field(None, description="自訂工作階段識別碼；未提供時由伺服器產生")
+    userId: Optional[str] = None
+    uploadedFileInfo: Optional[List[Dict[str,str]]] = Field(None, description="工作階段選用的上傳檔案，格式: [{'file_id': '...', 'file_name': '...'}, ...]")
+    externalDataSummaries: Optional[Dict[str, Any]] = Field(None, description="工作階段的外部數據快照")
+    selectedModelName: Optional[str] = None
+    systemPromptOverride: Optional[str] = None
+    generationConfig: Optional[Dict[str, Any]] = None
+
+class ChatSessionResponse(BaseModel):
+    sessionId: str
+    userId: Optional[str] = None
+    uploadedFileInfo: Optional[List[Dict[str,str]]] = None
+    externalDataSummaries: Optional[Dict[str, Any]] = None
+    selectedModelName: Optional[str] = None
+    systemPromptOverride: Optional[str] = None
+    generationConfig: Optional[Dict[str, Any]] = None
+    createdAt: str
+    updatedAt: str
+    messages: List[ChatMessage] = Field(default_factory=list)
+    historyTokens: int = Field(0, description="聊天歷史的估計 token 數")
+
+async def _record_turn(session_id: str, user_input: str, response_text: str) -> None:
+    """Appends a completed turn (user message and model reply) to the session history."""
+    await chat_sessions.append_messages(session_id, [
+        {"role": "user", "parts": [user_input]},
+        {"role": "model", "parts": [response_text]},
+    ])
+
+async def _session_response(session: Dict[str, Any]) -> ChatSessionResponse:
+    return ChatSessionResponse(
+        sessionId=session["session_id"],
+        userId=session["user_id"],
+        uploadedFileInfo=session["uploaded_file_info"],
+        externalDataSummaries=session["external_data"],
+        selectedModelName=session["selected_model"],
+        systemPromptOverride=session["system_prompt"],
+        generationConfig=session["generation_config"],
+        createdAt=session["created_at"],
+        updatedAt=session["updated_at"],
+        messages=await chat_sessions.get_messages(session["session_id"]),
+        historyTokens=await chat_sessions.get_history_token_total(session["session_id"])
+    )
+
 @router.post("/chat", response_model=ChatResponse)
-async def handle_chat_request(request: ChatRequest = Body(...)):
+async def handle_chat_request(background_tasks: BackgroundTasks, http_request: Request, request: ChatRequest = Body(...)):
     '''
     處理聊天請求，與 Gemini 模型互動並返回結果。
     '''
     logger.info(f"API CALL: POST /api/chat with userInput: '{request.userInput[:50]}...'")
 
     try:
+        # 0. Load the server-side session (created on first use). Context fields sent with the request
+        # update the session; fields left out are taken from it, so clients only need sessionId + userInput.
+        session = None
+        uploaded_file_info = request.uploadedFileInfo
+        external_data_summaries = request.externalDataSummaries
+        selected_model_name = request.selectedModelName
+        system_prompt_override = request.systemPromptOverride
+        generation_config = request.generationConfig
+        request_context = dict(
+            user_id=request.userId,
+            system_prompt=request.systemPromptOverride,
+            selected_model=request.selectedModelName,
+            uploaded_file_info=request.uploadedFileInfo,
+            external_data=request.externalDataSummaries,
+            generation_config=request.generationConfig
+        )
+        if request.sessionId:
+            session = await chat_sessions.get_session(request.sessionId)
+            if session is None:
+                session = await chat_sessions.create_session(
+                    session_id=request.sessionId,
+                    initial_history=[msg.model_dump() for msg in request.chatHistory] if request.chatHistory else None,
+                    **request_context
+                )
+            else:
+                await chat_sessions.update_session_context(request.sessionId, **request_context)
+                if request.chatHistory:
+                    logger.info(f"工作階段 '{request.sessionId}' 已保存歷史，忽略請求中的 chatHistory。")
+            uploaded_file_info = uploaded_file_info if uploaded_file_info is not None else session["uploaded_file_info"]
+            external_data_summaries = external_data_summaries if external_data_summaries is not None else session["external_data"]
+            selected_model_name = selected_model_name or session["selected_model"]
+            system_prompt_override = system_prompt_override or session["system_prompt"]
+            generation_config = generation_config or session["generation_config"]
+        # Fair-share identity in the dispatcher queue: the caller's userId, else its session, else its address,
+        # so clients that send no userId are not all queued as a single user.
+        caller_id = (
+            request.userId
+            or (session["user_id"] if session else None)
+            or (f"session:{request.sessionId}" if request.sessionId else None)
+            or (f"client:{http_request.client.host}" if http_request.client else None)
+        )
+
         # 1. Select API Key
         if not settings.AVAILABLE_GEMINI_API_KEYS:
             logger.error("沒有可用的 Gemini API 金鑰設定。")
             raise HTTPException(status_code=500, detail="後端 Gemini API 金鑰未設定。")
 
-        current_api_key = random.choice(settings.AVAILABLE_GEMINI_API_KEYS)
-        logger.info(f"使用 Gemini API 金鑰 (隨機選擇尾號 ...{current_api_key[-4:]})。")
+        # The dispatcher picks the key with the most remaining interactive quota; the call is pinned to it
+        # because the context cache acquired below belongs to that key.
+        dispatcher = get_dispatcher()
+        current_api_key = dispatcher.select_api_key(PRIORITY_INTERACTIVE)
+        logger.info(f"使用 Gemini API 金鑰 (尾號 ...{current_api_key[-4:]})。")
 
-        # 2. Determine Model
-        model_to_use = request.selectedModelName or model_catalog.get_default_model()
-        logger.info(f"使用模型: {model_to_use}")
+        # 2. The model is routed in step 5b, once the prompt size is known
 
         # 3. Determine System Prompt
-        system_prompt_to_use = request.systemPromptOverride or settings.DEFAULT_MAIN_GEMINI_PROMPT
+        system_prompt_to_use = system_prompt_override or settings.DEFAULT_MAIN_GEMINI_PROMPT
         plot_instruction = "\n如果需要生成圖表，請嚴格以 Plotly JSON schema 格式提供圖表數據。不要生成 Python 繪圖代碼。\n"
         if "Plotly JSON schema" not in system_prompt_to_use:
              system_prompt_to_use += plot_instruction
         logger.debug(f"使用的系統提示詞 (前100字符): {system_prompt_to_use[:100]}...")
 
-        # 4. Prepare uploaded file contents
+        # 4. Prepare uploaded file contents (repeated turns are served from load_document_text's byte-bounded LRU)
         core_docs_for_builder = [] # Initialize as empty list
-        if request.uploadedFileInfo:
-            logger.info(f"Processing {len(request.uploadedFileInfo)} uploaded file(s) information.")
-            for file_info in request.uploadedFileInfo:
+        if uploaded_file_info:
+            logger.info(f"Processing {len(uploaded_file_info)} uploaded file(s) information.")
+
+            async def load_core_doc(file_info: Dict[str, Any]) -> Optional[Dict[str, str]]:
                 file_id = file_info.get("file_id")
                 file_name = file_info.get("file_name")
 
                 if not file_id or not file_name:
                     logger.warning(f"Skipping a file due to missing file_id or file_name in uploadedFileInfo: {file_info}")
                     # Optionally, communicate this back to the user if possible/needed
-                    continue
+                    return None
 
                 try:
                     logger.debug(f"Attempting to read content for file_id: {file_id}, file_name: {file_name}")
-                    # Assuming file content should be read as text (UTF-8)
-                    content_str = await file_service.get_uploaded_file_content(
+                    # Extracted text from the upload's preprocessing artifacts (parsed once, tables rendered as CSV);
+                    # very large texts are read as head + tail from the memory-mapped artifact
+                    content_str = await upload_preprocessing.load_document_text(
                         file_id=file_id,
                         file_name=file_name,
                         base_upload_dir=AI_DATA_PATH,
-                        mode='r' # Read as text
+                        max_chars=settings.CORE_DOC_LOAD_MAX_CHARS
                     )
                     if content_str is not None:
-                        core_docs_for_builder.append({"name": file_name, "content": content_str})
                         logger.info(f"Successfully read and added content for: {file_name} (ID: {file_id})")
-                    else:
-                        logger.warning(f"Failed to read content for file: {file_name} (ID: {file_id}). File not found or empty.")
-                        # Optionally, add a notice to the user or error log that a file was not processed
+                        # file_id lets the summariser read the whole document if content_str is only its head and tail
+                        return {"name": file_name, "content": content_str, "file_id": file_id}
+                    logger.warning(f"Failed to read content for file: {file_name} (ID: {file_id}). File not found or empty.")
+                    # Optionally, add a notice to the user or error log that a file was not processed
                 except Exception as e:
                     logger.error(f"Error reading file {file_name} (ID: {file_id}): {e}", exc_info=True)
                     # Optionally, add a notice to the user
+                return None
+
+            # Files are loaded concurrently; the documents keep the order of uploadedFileInfo
+            loaded_docs = await asyncio.gather(*(load_core_doc(file_info) for file_info in uploaded_file_info))
+            core_docs_for_builder = [doc for doc in loaded_docs if doc is not None]
 
             if not core_docs_for_builder: # If list is empty after processing
                  logger.info("No file contents were successfully processed from uploadedFileInfo.")
@@ -101,32 +208,135 @@ async def handle_chat_request(request: ChatRequest = Body(...)):
 
         # 5. Prepare chat history
         chat_history_for_builder = None
-        if request.chatHistory:
+        if session:
+            chat_history_for_builder = await chat_sessions.get_messages(request.sessionId) or None
+            logger.info(f"工作階段 '{request.sessionId}' 包含 {len(chat_history_for_builder or [])} 條聊天歷史。")
+        elif request.chatHistory:
             chat_history_for_builder = [msg.model_dump() for msg in request.chatHistory]
             logger.info(f"包含 {len(chat_history_for_builder)} 條聊天歷史。")
+        full_chat_history = chat_history_for_builder
+        # Older turns are replaced by the session's cached digest once the history is long (no model call here).
+        chat_history_for_builder, _ = await history_compaction.compact_history_for_prompt(request.sessionId, chat_history_for_builder)
+
+        # 5a. Retrieve the source document passages most relevant to the question (local BM25 index)
+        retrieved_passages = None
+        if request.useRetrieval and settings.RETRIEVAL_ENABLED:
+            retrieval_index = get_retrieval_index()
+            await retrieval_index.ensure_loaded()
+            retrieved_passages = retrieval_index.search(request.userInput, top_k=request.retrievalTopK or settings.RETRIEVAL_TOP_K)
+            logger.info(f"檢索到 {len(retrieved_passages)} 段相關文件片段。")
+
+        # 5b. Route between the flash and pro tier by prompt size, trigger action and latency target
+        routing_decision = model_router.route_model(
+            prompt_tokens=prompt_planner.estimate_prompt_tokens(
+                system_prompt_to_use, core_docs_for_builder, external_data_summaries,
+                chat_history_for_builder, request.userInput, retrieved_passages
+            ),
+            requested_model=selected_model_name,
+            trigger_action=request.triggerAction,
+            latency_target_ms=request.latencyTargetMs
+        )
+        model_to_use = routing_decision.model_name
+        logger.info(f"使用模型: {model_to_use} (路由原因: {routing_decision.reason})")
+
+        # 5c. Replace documents too large for the prompt by their map-reduce summaries (cached by content hash)
+        model_token_limit = model_catalog.get_model_input_token_limit(model_to_use)
+        token_budget = int(model_token_limit * settings.TOKEN_SAFETY_FACTOR) if model_token_limit else None
+        core_docs_for_builder, summarized_doc_names, pending_summary_names = await document_summarizer.summarize_oversized_docs(
+            core_docs_for_builder, token_budget, user_id=caller_id
+        )
+        if summarized_doc_names:
+            logger.info(f"以摘要取代過大的文件: {', '.join(summarized_doc_names)}")
+        if pending_summary_names:
+            logger.info(f"過大文件的摘要正在背景產生，本次先以截斷內容回答: {', '.join(pending_summary_names)}")
 
-        # 6. Build prompt parts
-        logger.info("正在建構提示詞...")
-        prompt_parts = prompt_builder.build_gemini_request_contents(
+        # 5d. Fit every prompt section into its share of the model's input budget (local estimates, one pass)
+        prompt_plan = prompt_planner.plan_prompt(
             main_system_prompt=system_prompt_to_use,
             core_docs_contents=core_docs_for_builder,
-            external_data_summaries=request.externalDataSummaries,
+            external_data_summaries=external_data_summaries,
             chat_history_for_prompt=chat_history_for_builder,
-            current_user_input=request.userInput
+            current_user_input=request.userInput,
+            token_budget=token_budget,
+            retrieved_passages=retrieved_passages
         )
+        if prompt_plan.was_trimmed:
+            logger.info(f"提示詞已依各區段預算縮減: {prompt_plan.section_tokens}")
+
+        # 6. Split the prompt into the stable prefix (system prompt + core documents) and the per-turn suffix
+        prefix_parts = prompt_builder.build_stable_prefix_parts(prompt_plan.main_system_prompt, prompt_plan.core_docs_contents)
+        prefix_hash = context_cache.compute_prefix_hash(prefix_parts) if prefix_parts else None
+        def build_prompt_parts(with_prefix: bool) -> List[str]:
+            return prompt_builder.build_gemini_request_contents(
+                main_system_prompt=prompt_plan.main_system_prompt if with_prefix else None,
+                core_docs_contents=prompt_plan.core_docs_contents if with_prefix else None,
+                external_data_summaries=prompt_plan.external_data_summaries,
+                chat_history_for_prompt=prompt_plan.chat_history_for_prompt,
+                current_user_input=prompt_plan.current_user_input,
+                retrieved_passages=prompt_plan.retrieved_passages
+            )
+        suffix_parts = build_prompt_parts(with_prefix=False)
+        generation_config_to_use = generation_config or settings.DEFAULT_GENERATION_CONFIG
+
+        # 7. Serve from the response cache when the request is deterministic or reuse was requested.
+        # Checked before any context cache is acquired, so a hit costs no Gemini call at all.
+        cache_key = None
+        if response_cache.is_cacheable_request(generation_config_to_use, reuse=request.reuseCachedResponse):
+            cache_key = response_cache.compute_response_cache_key(
+                model_to_use, generation_config_to_use, suffix_parts, prefix_hash
+            )
+            cached_response_text = await response_cache.get_cached_response(cache_key)
+            if cached_response_text is not None:
+                logger.info(f"回應由快取提供。回應長度: {len(cached_response_text)}")
+                if session:
+                    await _record_turn(request.sessionId, request.userInput, cached_response_text)
+                return ChatResponse(response=cached_response_text, servedFromCache=True, sessionId=request.sessionId)
 
-        # 7. Call Gemini API
-        generation_config_to_use = request.generationConfig or settings.DEFAULT_GENERATION_CONFIG
+        # 8. Reuse or create a Gemini context cache for the stable prefix.
+        # When a cache is available, only the suffix (external data, history, current input) is sent.
+        cache_lease = await asyncio.to_thread(
+            context_cache.acquire_prefix_cache,
+            api_key=current_api_key,
+            model_name=model_to_use,
+            system_instruction=prefix_parts[0],
+            prefix_contents=prefix_parts[1:],
+            prefix_hash=prefix_hash,
+            max_tokens=token_budget
+        ) if prefix_parts else None
+        cached_content_name = cache_lease[0] if cache_lease else None
+        logger.info(f"正在建構提示詞... (使用上下文快取: {'是' if cached_content_name else '否'})")
+        prompt_parts = suffix_parts if cached_content_name else build_prompt_parts(with_prefix=True)
+
+        # 9. Call Gemini API
         logger.info(f"正在調用 Gemini API。模型: {model_to_use}")
 
-        # call_gemini_api is synchronous, FastAPI will run it in a threadpool
-        api_response_text, was_truncated = gemini_service.call_gemini_api(
-            prompt_parts=prompt_parts,
-            current_api_key=current_api_key,
-            selected_model=model_to_use,
-            generation_config_dict=generation_config_to_use,
-            logger_object=logger
-        )
+        try:
+            # Interactive priority: dispatched ahead of queued batch work, within the key's RPM/TPM quota.
+            api_response_text, was_truncated, call_seconds = await dispatcher.submit_timed(
+                prompt_parts=prompt_parts,
+                selected_model=model_to_use,
+                priority=PRIORITY_INTERACTIVE,
+                user_id=caller_id,
+                api_key=current_api_key,
+                generation_config_dict=generation_config_to_use,
+                cached_content_name=cached_content_name,
+                cached_prefix_tokens=estimate_tokens_for_parts(prefix_parts) if cached_content_name else 0
+            )
+        except gemini_service.CachedContentNotFoundError as e:
+            # The cache expired or was deleted remotely: forget it and resend this turn with the full prompt.
+            logger.warning(f"上下文快取已失效，改以完整提示詞重新調用: {e}")
+            context_cache.invalidate_cache_name(e.cache_name)
+            api_response_text, was_truncated, call_seconds = await dispatcher.submit_timed(
+                prompt_parts=build_prompt_parts(with_prefix=True),
+                selected_model=model_to_use,
+                priority=PRIORITY_INTERACTIVE,
+                user_id=caller_id,
+                api_key=current_api_key,
+                generation_config_dict=generation_config_to_use
+            )
+        finally:
+            if cache_lease:
+                context_cache.release_prefix_cache(current_api_key, model_to_use, cache_lease[1])
 
         # Optionally include was_truncated in the response if needed by client
         # For now, just logging it.
@@ -139,7 +349,14 @@ async def handle_chat_request(request: ChatRequest = Body(...)):
             return ChatResponse(response=api_response_text, isError=True, errorDetail=api_response_text)
 
         logger.info(f"Gemini API 成功返回。回應長度: {len(api_response_text)}")
-        return ChatResponse(response=api_response_text)
+        model_router.record_model_call(routing_decision, call_seconds, estimate_tokens(api_response_text))
+        # Summarise older turns after the response has been sent, off the critical path.
+        background_tasks.add_task(history_compaction.refresh_history_digest, request.sessionId, full_chat_history, model_to_use)
+        if cache_key and not was_truncated:
+            await response_cache.set_cached_response(cache_key, model_to_use, api_response_text)
+        if session:
+            await _record_turn(request.sessionId, request.userInput, api_response_text)
+        return ChatResponse(response=api_response_text, sessionId=request.sessionId, pendingSummaries=pending_summary_names or None)
 
     except HTTPException as http_exc:
         logger.error(f"HTTPException in /api/chat: {http_exc.detail}", exc_info=True)
@@ -148,3 +365,43 @@ async def handle_chat_request(request: ChatRequest = Body(...)):
         logger.error(f"處理 /api/chat 請求時發生未預期錯誤: {e}", exc_info=True)
         # Return a generic error response to the client
         return ChatResponse(response="處理您的請求時發生意外的內部錯誤。", isError=True, errorDetail=str(e))
+
+
+@router.post("/chat/sessions", response_model=ChatSessionResponse, status_code=201)
+async def create_chat_session(request: ChatSessionCreateRequest = Body(...)):
+    '''
+    建立伺服器端對話工作階段，保存已選文件、外部數據快照與系統提示詞；之後 /api/chat 只需傳送 sessionId 與新訊息。
+    '''
+    logger.info("API CALL: POST /api/chat/sessions")
+    if request.sessionId and await chat_sessions.get_session(request.sessionId):
+        raise HTTPException(status_code=409, detail=f"工作階段 '{request.sessionId}' 已存在。")
+    session = await chat_sessions.create_session(
+        session_id=request.sessionId,
+        user_id=request.userId,
+        system_prompt=request.systemPromptOverride,
+        selected_model=request.selectedModelName,
+        uploaded_file_info=request.uploadedFileInfo,
+        external_data=request.externalDataSummaries,
+        generation_config=request.generationConfig
+    )
+    return await _session_response(session)
+
+@router.get("/chat/sessions/{session_id}", response_model=ChatSessionResponse)
+async def get_chat_session(session_id: str):
+    '''
+    獲取對話工作階段的內容與完整聊天歷史。
+    '''
+    logger.debug(f"API CALL: GET /api/chat/sessions/{session_id}")
+    session = await chat_sessions.get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"找不到工作階段 '{session_id}'。")
+    return await _session_response(session)
+
+@router.delete("/chat/sessions/{session_id}", status_code=204)
+async def delete_chat_session(session_id: str):
+    '''
+    刪除對話工作階段及其聊天歷史。
+    '''
+    logger.info(f"API CALL: DELETE /api/chat/sessions/{session_id}")
+    if not await chat_sessions.delete_session(session_id):
+        raise HTTPException(status_code=404, detail=f"找不到工作階段 '{session_id}'。")
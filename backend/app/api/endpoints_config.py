@@ -1,5 +1,5 @@
 import logging
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional, Any
 
@@ -35,31 +35,29 @@ class AppConfigResponse(BaseModel):
 #     return settings.AVAILABLE_GEMINI_API_KEYS[0] # Use the first one
 
 @router.get("/config", response_model=AppConfigResponse)
-async def get_app_config(): # Removed api_key: str = Depends(get_api_key) for now as get_available_models handles it
+async def get_app_config(request: Request, response: Response):
     '''
     獲取應用程式的前端動態配置，例如可用的模型列表。
+    模型列表來自記憶體中的模型目錄快照（啟動時從資料庫載入並於背景定期更新），不會在請求中呼叫 Gemini API。
+    回應帶有 ETag；若 If-None-Match 相符則回傳 304。
     '''
     logger.info("API CALL: GET /api/config")
     try:
-        # get_available_models now attempts to use a key from settings if none provided
-        raw_models_data = model_catalog.get_available_models()
+        snapshot = model_catalog.get_catalog_snapshot()
+        etag = snapshot["etag"]
+        if etag and request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
 
-        available_models_pydantic = []
-        if raw_models_data:
-            for model_obj in raw_models_data:
-                # model_catalog.get_available_models returns list of Model objects from genai
-                # These objects have .name and .display_name attributes
-                available_models_pydantic.append(ModelInfo(
-                    name=getattr(model_obj, 'name', 'Unknown Name'),
-                    displayName=getattr(model_obj, 'display_name', getattr(model_obj, 'name', 'Unknown Display Name'))
-                ))
-        else:
-            logger.warning("/api/config - get_available_models returned empty or None. Check model_catalog service and API key validity.")
-            # Decide if an empty model list is an error or acceptable
-            # For now, returning empty list if that's what the service provides.
+        available_models_pydantic = [
+            ModelInfo(name=m["name"], displayName=m["display_name"]) for m in snapshot["models"]
+        ]
+        if not available_models_pydantic:
+            logger.warning("/api/config - model catalog snapshot is empty. Check model_catalog refresh task and API key validity.")
 
         default_model_name = model_catalog.get_default_model()
 
+        if etag:
+            response.headers["ETag"] = etag
         return AppConfigResponse(
             appName=settings.APP_NAME,
             appVersion=settings.APP_VERSION,
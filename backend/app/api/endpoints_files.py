@@ -1,12 +1,16 @@
+import codecs
 import logging
+import mimetypes
 import os
 from typing import Optional, List
 
-from fastapi import APIRouter, HTTPException, File, UploadFile, Form
+from fastapi import APIRouter, HTTPException, File, UploadFile, Form, Query, BackgroundTasks, Request, Header
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel, Field
 
 from app.config.settings import AI_DATA_PATH
 from app.services import file_service # Assuming file_service.py is in app/services/
+from app.services import upload_preprocessing, chunked_uploads
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -18,21 +22,76 @@ class FileUploadResponse(BaseModel):
     message: str = Field("檔案上傳成功", description="操作結果訊息")
     content_type: Optional[str] = Field(None, description="檔案的 Content-Type")
     size: Optional[int] = Field(None, description="檔案大小 (bytes)")
+    sha256: Optional[str] = Field(None, description="檔案內容的 SHA-256 雜湊值")
+    deduplicated: bool = Field(False, description="相同內容與檔名先前已上傳過，回傳既有的 file_id")
+    processing_status: str = Field("pending", description="前處理狀態：'ready' (已可使用)、'failed' 或 'pending' (背景處理中)")
 
 class FileInfo(BaseModel):
     file_id: str
     file_name: str
     content_type: Optional[str]
     size: Optional[int]
+    sha256: Optional[str] = None
+    uploaded_at: Optional[str] = None
+    last_accessed_at: Optional[str] = None
+
+class FileListResponse(BaseModel):
+    files: List[FileInfo] = Field(default_factory=list, description="本頁的檔案，依上傳時間由新到舊排列")
+    total: int = Field(..., description="符合篩選條件的檔案總數")
+    limit: int
+    offset: int
 
 class MultipleFileUploadResponse(BaseModel):
     successful_uploads: List[FileUploadResponse] = Field(default_factory=list)
     failed_uploads: List[dict] = Field(default_factory=list) # Store filename and error message
 
+class FilePreviewResponse(BaseModel):
+    file_id: str
+    file_name: str
+    status: str = Field(..., description="前處理狀態：'ready' 或 'failed'")
+    kind: Optional[str] = Field(None, description="'text'、'table' 或 'binary'")
+    token_count: Optional[int] = Field(None, description="擷取文字的估計 token 數")
+    summary: Optional[dict] = Field(None, description="檔案摘要：表格為欄位型別與統計，文字為字元與行數")
+    rows: Optional[List[dict]] = Field(None, description="表格的前幾列")
+    sample: Optional[List[dict]] = Field(None, description="從整個表格均勻抽樣的列")
+    text: Optional[str] = Field(None, description="文字的開頭部分")
+
+class ChunkedUploadCreateRequest(BaseModel):
+    file_name: str = Field(..., description="原始檔案名稱")
+    size: int = Field(..., ge=0, description="檔案總大小 (bytes)")
+    content_type: Optional[str] = Field(None, description="檔案的 Content-Type")
+    chunk_size: Optional[int] = Field(None, gt=0, description="每個分段的大小 (bytes)，未提供時使用伺服器預設值")
+    sha256: Optional[str] = Field(None, description="整個檔案的 SHA-256，完成時用於驗證 (可選)")
+
+class ChunkedUploadStatus(BaseModel):
+    upload_id: str
+    file_name: str
+    content_type: Optional[str] = None
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received_chunks: List[int] = Field(default_factory=list, description="已收到的分段編號 (分段 i 的位移為 i * chunk_size)")
+    missing_chunks: List[int] = Field(default_factory=list, description="尚未收到的分段編號")
+    bytes_received: int
+
+async def _upload_response(saved: dict, background_tasks: BackgroundTasks) -> FileUploadResponse:
+    """Builds the response and, unless the content was already preprocessed, schedules its preprocessing (again, if it failed)."""
+    artifacts = await upload_preprocessing.get_artifacts(saved["sha256"])
+    if artifacts is None or artifacts["status"] == "failed":
+        background_tasks.add_task(upload_preprocessing.preprocess_upload, saved["file_id"], AI_DATA_PATH)
+        artifacts = None
+    if saved["deduplicated"]:
+        message = f"檔案 '{saved['file_name']}' 先前已上傳過，沿用既有檔案。"
+    else:
+        message = f"檔案 '{saved['file_name']}' 上傳成功。"
+    return FileUploadResponse(**saved, message=message, processing_status=artifacts["status"] if artifacts else "pending")
+
 @router.post("/upload", response_model=FileUploadResponse)
-async def upload_single_file(file: UploadFile = File(...)):
+async def upload_single_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
-    上傳單個檔案。檔案將儲存在伺服器的 `AI_data/uploads/<file_id>/<original_filename>` 路徑下。
+    上傳單個檔案。檔案內容以 SHA-256 定址儲存在 `AI_data/uploads/blobs/` 下，相同內容只存一份；
+    相同內容與檔名的重複上傳會直接回傳既有的 file_id。上傳完成後在背景解析檔案一次並保存結果
+    (擷取文字、表格的 Parquet 副本、摘要與 token 數)，供聊天與預覽直接使用。
     """
     if not file.filename:
         logger.error("File upload attempt with no filename.")
@@ -42,20 +101,14 @@ async def upload_single_file(file: UploadFile = File(...)):
 
     try:
         # AI_DATA_PATH is the base for all AI-related data, including uploads
-        file_id, saved_filename, content_type, size = await file_service.save_uploaded_file(
+        saved = await file_service.save_uploaded_file(
             file=file,
             base_upload_dir=AI_DATA_PATH
         )
 
-        logger.info(f"File '{saved_filename}' (ID: {file_id}) processed successfully by file_service.")
+        logger.info(f"File '{saved['file_name']}' (ID: {saved['file_id']}) processed successfully by file_service.")
 
-        return FileUploadResponse(
-            file_id=file_id,
-            file_name=saved_filename,
-            content_type=content_type,
-            size=size,
-            message=f"檔案 '{saved_filename}' 上傳成功。"
-        )
+        return await _upload_response(saved, background_tasks)
     except IOError as e:
         logger.error(f"IOError during file upload of '{file.filename}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"儲存檔案 '{file.filename}' 時發生錯誤: {str(e)}")
@@ -65,9 +118,9 @@ async def upload_single_file(file: UploadFile = File(...)):
 
 
 @router.post("/upload_multiple", response_model=MultipleFileUploadResponse)
-async def upload_multiple_files(files: List[UploadFile] = File(...)):
+async def upload_multiple_files(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
     """
-    上傳多個檔案。每個檔案將儲存在伺服器的 `AI_data/uploads/<file_id>/<original_filename>` 路徑下。
+    上傳多個檔案。每個檔案的儲存與去重方式與 `/upload` 相同。
     """
     logger.info(f"API CALL: POST /api/files/upload_multiple - Received {len(files)} files.")
 
@@ -82,18 +135,12 @@ async def upload_multiple_files(files: List[UploadFile] = File(...)):
 
         logger.info(f"Processing file in multiple upload: '{file.filename}', Content-Type: {file.content_type}")
         try:
-            file_id, saved_filename, content_type, size = await file_service.save_uploaded_file(
+            saved = await file_service.save_uploaded_file(
                 file=file,
                 base_upload_dir=AI_DATA_PATH
             )
-            successful_uploads.append(FileUploadResponse(
-                file_id=file_id,
-                file_name=saved_filename,
-                content_type=content_type,
-                size=size,
-                message=f"檔案 '{saved_filename}' 上傳成功。"
-            ))
-            logger.info(f"Successfully uploaded '{saved_filename}' (ID: {file_id}) in multiple upload.")
+            successful_uploads.append(await _upload_response(saved, background_tasks))
+            logger.info(f"Successfully uploaded '{saved['file_name']}' (ID: {saved['file_id']}) in multiple upload.")
         except IOError as e:
             logger.error(f"IOError during multiple file upload of '{file.filename}': {e}", exc_info=True)
             failed_uploads.append({"file_name": file.filename, "error": f"儲存檔案時發生錯誤: {str(e)}"})
@@ -104,11 +151,213 @@ async def upload_multiple_files(files: List[UploadFile] = File(...)):
     logger.info(f"Multiple file upload process finished. Successful: {len(successful_uploads)}, Failed: {len(failed_uploads)}")
     return MultipleFileUploadResponse(successful_uploads=successful_uploads, failed_uploads=failed_uploads)
 
-# Future: Add endpoints for listing, downloading, deleting files if needed.
-# Example:
-# @router.get("/{file_id}/{file_name}")
-# async def download_file(file_id: str, file_name: str):
-#     file_path = file_service.get_uploaded_file_path(file_id, file_name, AI_DATA_PATH)
-#     if not file_path:
-#         raise HTTPException(status_code=404, detail="File not found")
-#     return FileResponse(file_path, media_type='application/octet-stream', filename=file_name)
+@router.post("/uploads", response_model=ChunkedUploadStatus)
+async def create_chunked_upload(request: ChunkedUploadCreateRequest):
+    """
+    建立可續傳的分段上傳。之後以 `PUT /uploads/{upload_id}/chunks/{index}` 上傳各分段 (可並行、可重試)，
+    以 `GET /uploads/{upload_id}` 查詢已完成的分段，最後以 `POST /uploads/{upload_id}/complete` 完成上傳。
+    """
+    logger.info(f"API CALL: POST /api/files/uploads - file_name='{request.file_name}', size={request.size}, chunk_size={request.chunk_size}")
+    try:
+        status = await chunked_uploads.create_upload_session(
+            file_name=request.file_name,
+            size=request.size,
+            base_upload_dir=AI_DATA_PATH,
+            content_type=request.content_type,
+            chunk_size=request.chunk_size,
+            sha256=request.sha256
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating chunked upload for '{request.file_name}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="建立分段上傳時發生錯誤。")
+    return ChunkedUploadStatus(**status)
+
+@router.get("/uploads/{upload_id}", response_model=ChunkedUploadStatus)
+async def get_chunked_upload(upload_id: str):
+    """
+    查詢分段上傳的進度 (已收到與尚未收到的分段)，供中斷後續傳使用。
+    """
+    logger.info(f"API CALL: GET /api/files/uploads/{upload_id}")
+    status = await chunked_uploads.get_upload_status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"找不到分段上傳 '{upload_id}'。")
+    return ChunkedUploadStatus(**status)
+
+@router.put("/uploads/{upload_id}/chunks/{index}", response_model=ChunkedUploadStatus)
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None, description="此分段內容的 SHA-256，用於驗證傳輸是否完整")
+):
+    """
+    上傳第 `index` 個分段 (請求內容為原始位元組)。重送同一分段會覆寫先前的內容。
+    """
+    data = await request.body()
+    logger.info(f"API CALL: PUT /api/files/uploads/{upload_id}/chunks/{index} - {len(data)} bytes")
+    try:
+        status = await chunked_uploads.write_chunk(upload_id, index, data, x_chunk_sha256, AI_DATA_PATH)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error writing chunk {index} of upload {upload_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="寫入分段時發生錯誤。")
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"找不到分段上傳 '{upload_id}'。")
+    return ChunkedUploadStatus(**status)
+
+@router.post("/uploads/{upload_id}/complete", response_model=FileUploadResponse)
+async def complete_chunked_upload(upload_id: str, background_tasks: BackgroundTasks):
+    """
+    所有分段到齊後完成上傳：驗證整個檔案的雜湊值並存入檔案庫 (與單次上傳相同的去重與前處理)。
+    """
+    logger.info(f"API CALL: POST /api/files/uploads/{upload_id}/complete")
+    try:
+        saved = await chunked_uploads.complete_upload(upload_id, AI_DATA_PATH)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IOError as e:
+        logger.error(f"IOError completing upload {upload_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"儲存檔案時發生錯誤: {str(e)}")
+    if saved is None:
+        raise HTTPException(status_code=404, detail=f"找不到分段上傳 '{upload_id}'。")
+    return await _upload_response(saved, background_tasks)
+
+@router.delete("/uploads/{upload_id}")
+async def abort_chunked_upload(upload_id: str):
+    """
+    取消未完成的分段上傳並刪除已收到的內容。
+    """
+    logger.info(f"API CALL: DELETE /api/files/uploads/{upload_id}")
+    if not await chunked_uploads.abort_upload(upload_id, AI_DATA_PATH):
+        raise HTTPException(status_code=404, detail=f"找不到分段上傳 '{upload_id}'。")
+    return {"message": f"分段上傳 '{upload_id}' 已取消。"}
+
+@router.get("", response_model=FileListResponse)
+async def list_files(
+    limit: int = Query(50, ge=1, le=500, description="每頁筆數"),
+    offset: int = Query(0, ge=0, description="略過的筆數"),
+    name: Optional[str] = Query(None, description="檔名包含的文字"),
+    content_type: Optional[str] = Query(None, description="Content-Type 前綴，例如 'text/'"),
+    sha256: Optional[str] = Query(None, description="檔案內容的 SHA-256"),
+    uploaded_after: Optional[str] = Query(None, description="上傳時間下限 (ISO 8601，含)"),
+    uploaded_before: Optional[str] = Query(None, description="上傳時間上限 (ISO 8601，不含)")
+):
+    """
+    列出已上傳的檔案 (分頁)，資料來自 SQLite 檔案索引，不掃描檔案系統。
+    """
+    logger.info(f"API CALL: GET /api/files - limit={limit}, offset={offset}, name={name}, content_type={content_type}")
+    try:
+        files, total = await file_service.list_uploaded_files(
+            limit=limit,
+            offset=offset,
+            name_contains=name,
+            content_type=content_type,
+            sha256=sha256,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before
+        )
+    except Exception as e:
+        logger.error(f"Error listing uploaded files: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="讀取檔案索引時發生錯誤。")
+    return FileListResponse(files=[FileInfo(**f) for f in files], total=total, limit=limit, offset=offset)
+
+@router.get("/{file_id}/preview", response_model=FilePreviewResponse)
+async def preview_file(
+    file_id: str,
+    max_rows: int = Query(20, ge=1, le=500, description="表格預覽的列數"),
+    max_chars: int = Query(2000, ge=1, le=100000, description="文字預覽的字元數")
+):
+    """
+    預覽已上傳的檔案：讀取上傳時產生的前處理結果，不重新解析原始檔案。
+    """
+    logger.info(f"API CALL: GET /api/files/{file_id}/preview - max_rows={max_rows}, max_chars={max_chars}")
+    try:
+        preview = await upload_preprocessing.get_preview(file_id, AI_DATA_PATH, max_rows=max_rows, max_chars=max_chars)
+    except Exception as e:
+        logger.error(f"Error previewing file {file_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="讀取檔案預覽時發生錯誤。")
+    if preview is None:
+        raise HTTPException(status_code=404, detail=f"找不到檔案 ID '{file_id}'。")
+    return FilePreviewResponse(**preview)
+
+class UploadGcResponse(BaseModel):
+    files_deleted: int = Field(..., description="刪除的檔案數")
+    blobs_deleted: int = Field(..., description="刪除的實體內容 (blob) 數")
+    bytes_freed: int = Field(..., description="釋放的位元組數")
+    bytes_remaining: int = Field(..., description="剩餘上傳檔案佔用的位元組數")
+    stale_uploads_expired: int = Field(0, description="捨棄的逾時未完成分段上傳數")
+
+@router.post("/gc", response_model=UploadGcResponse)
+async def run_upload_gc():
+    """
+    立即執行一次上傳檔案的清理 (依存放期限與容量上限，優先刪除最久未使用的檔案)。
+    使用中的聊天工作階段所引用的檔案不會被刪除。平時由背景排程定期執行。
+    """
+    logger.info("API CALL: POST /api/files/gc")
+    try:
+        report = await file_service.collect_upload_garbage(AI_DATA_PATH)
+    except Exception as e:
+        logger.error(f"Error running upload GC: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="清理上傳檔案時發生錯誤。")
+    return UploadGcResponse(**report)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (a list of entity tags or '*') against `etag`."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+async def _text_charset(sha256: str, blob_path: str) -> str:
+    """The encoding preprocessing detected for a text upload, or, before it has run, UTF-8 if the first block decodes as such."""
+    artifacts = await upload_preprocessing.get_artifacts(sha256)
+    if artifacts and artifacts["summary"] and artifacts["summary"].get("encoding"):
+        return artifacts["summary"]["encoding"]
+    with open(blob_path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head) # A character cut at the block end is not an error
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+@router.api_route("/{file_id}", methods=["GET", "HEAD"])
+async def download_file(
+    file_id: str,
+    download: bool = Query(False, description="以附件方式下載 (Content-Disposition: attachment)，預設為 inline"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    下載已上傳的檔案。支援 HTTP Range (只取需要的位元組範圍)、以內容 SHA-256 作為 ETag 的
+    If-None-Match / If-Range 條件請求，檔案內容由伺服器直接從檔案庫串流，不讀入記憶體。
+    """
+    logger.info(f"API CALL: GET /api/files/{file_id} - download={download}")
+    record = await file_service.resolve_uploaded_file(file_id)
+    if not record:
+        raise HTTPException(status_code=404, detail=f"找不到檔案 ID '{file_id}'。")
+    blob_path = os.path.join(AI_DATA_PATH, record["blob_path"])
+    if not os.path.isfile(blob_path):
+        logger.error(f"Blob of file ID {file_id} is indexed but missing on disk: {blob_path}")
+        raise HTTPException(status_code=404, detail=f"找不到檔案 ID '{file_id}' 的內容。")
+
+    # Contents are content-addressed, so the hash is a strong validator that survives re-indexing and copies
+    etag = f'"{record["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = record["content_type"] or mimetypes.guess_type(record["file_name"])[0] or "application/octet-stream"
+    if media_type.startswith("text/") and "charset=" not in media_type.lower():
+        # Starlette would otherwise label every text/* response as UTF-8, which latin-1 uploads are not
+        media_type += f"; charset={await _text_charset(record['sha256'], blob_path)}"
+    return FileResponse(
+        blob_path,
+        media_type=media_type,
+        filename=record["file_name"],
+        headers=headers,
+        content_disposition_type="attachment" if download else "inline"
+    )
+
+# Future: Add endpoints for deleting files if needed.
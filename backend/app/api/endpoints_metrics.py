@@ -0,0 +1,49 @@
+import logging
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
+
+from app.services.gemini_dispatcher import get_dispatcher
+from app.services.model_router import get_routing_metrics
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class DispatchClassMetrics(BaseModel):
+    queued: int = Field(..., description="目前排隊中的請求數")
+    in_flight: int = Field(..., description="執行中的 Gemini 呼叫數")
+    dispatched: int = Field(..., description="已派發的請求總數")
+    wait_seconds_mean: float
+    wait_seconds_p50: float
+    wait_seconds_p95: float
+    wait_seconds_max: float
+
+class DispatchMetricsResponse(BaseModel):
+    classes: Dict[str, DispatchClassMetrics] = Field(..., description="各優先級類別 (interactive / batch) 的排隊等待時間指標")
+
+@router.get("/dispatch", response_model=DispatchMetricsResponse)
+async def get_dispatch_metrics():
+    '''
+    獲取 Gemini 派發佇列的指標，例如各優先級類別的排隊等待時間。
+    '''
+    logger.debug("API CALL: GET /api/metrics/dispatch")
+    return DispatchMetricsResponse(classes=get_dispatcher().get_metrics())
+
+class ModelLatencyMetrics(BaseModel):
+    tier: Optional[str] = Field(None, description="'flash' 或 'pro'")
+    calls: int = Field(..., description="統計視窗內的呼叫次數")
+    latency_ms_p50: int
+    latency_ms_p95: int
+    prompt_tokens_mean: int
+    output_tokens_mean: int
+
+class ModelMetricsResponse(BaseModel):
+    models: Dict[str, ModelLatencyMetrics] = Field(..., description="各模型最近呼叫的延遲與 token 統計，供模型路由使用")
+
+@router.get("/models", response_model=ModelMetricsResponse)
+async def get_model_metrics():
+    '''
+    獲取各模型觀測到的延遲 (p50/p95) 與 token 統計。
+    '''
+    logger.debug("API CALL: GET /api/metrics/models")
+    return ModelMetricsResponse(models=get_routing_metrics())
@@ -0,0 +1,51 @@
+import logging
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import List
+
+from app.config import settings
+from app.services.retrieval_index import get_retrieval_index
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class RetrievedPassage(BaseModel):
+    name: str = Field(..., description="相對於來源文件目錄的檔案路徑")
+    ordinal: int = Field(..., description="片段在檔案中的序號")
+    text: str
+    score: float = Field(..., description="BM25 分數")
+
+class RetrievalSearchResponse(BaseModel):
+    query: str
+    passages: List[RetrievedPassage]
+
+class RetrievalSyncResponse(BaseModel):
+    added: int
+    updated: int
+    removed: int
+    unchanged: int
+    chunks: int = Field(..., description="索引中的片段總數")
+
+@router.get("/search", response_model=RetrievalSearchResponse)
+async def search_source_documents(q: str = Query(..., min_length=1), top_k: int = Query(settings.RETRIEVAL_TOP_K, ge=1, le=50)):
+    '''
+    在來源文件索引中檢索與查詢最相關的片段。
+    '''
+    logger.info(f"API CALL: GET /api/retrieval/search with q: '{q[:50]}'")
+    if not settings.RETRIEVAL_ENABLED:
+        raise HTTPException(status_code=503, detail="檢索索引未啟用。")
+    retrieval_index = get_retrieval_index()
+    await retrieval_index.ensure_loaded()
+    return RetrievalSearchResponse(query=q, passages=retrieval_index.search(q, top_k=top_k))
+
+@router.post("/sync", response_model=RetrievalSyncResponse)
+async def sync_retrieval_index():
+    '''
+    立即以來源文件目錄更新檢索索引（僅重新索引已變更的檔案）。
+    '''
+    logger.info("API CALL: POST /api/retrieval/sync")
+    if not settings.RETRIEVAL_ENABLED:
+        raise HTTPException(status_code=503, detail="檢索索引未啟用。")
+    retrieval_index = get_retrieval_index()
+    stats = await retrieval_index.sync()
+    return RetrievalSyncResponse(**stats, chunks=retrieval_index.chunk_count)
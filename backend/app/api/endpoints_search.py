@@ -0,0 +1,63 @@
+import logging
+import time
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+from app.config import settings
+from app.services import search_index
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class SearchHit(BaseModel):
+    source: str = Field(..., description="'upload' (已上傳檔案) 或 'source_doc' (來源文件目錄)")
+    file_id: Optional[str] = Field(None, description="已上傳檔案的 ID (僅 source='upload')")
+    name: str = Field(..., description="檔名，來源文件則為相對於來源文件目錄的路徑")
+    week_start: Optional[str] = Field(None, description="檔名所指的週之週一日期 (ISO 8601)")
+    week_id: Optional[str] = Field(None, description="ISO 週，例如 '2024-W05'")
+    ordinal: int = Field(..., description="片段在檔案中的序號")
+    snippet: str = Field(..., description="符合片段的摘錄，符合的字詞以 ** 標示")
+    score: float = Field(..., description="BM25 分數 (越大越相關)")
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchHit]
+    took_ms: float
+
+class SearchSyncResponse(BaseModel):
+    added: int
+    updated: int
+    removed: int
+    unchanged: int
+
+@router.get("/search", response_model=SearchResponse)
+async def full_text_search(
+    q: str = Query(..., min_length=1, description="查詢字詞；中文以字元 n-gram 比對，所有字詞都必須出現"),
+    limit: int = Query(20, ge=1, le=100, description="最多回傳的片段數"),
+    source: Optional[Literal["upload", "source_doc"]] = Query(None, description="只搜尋已上傳檔案或來源文件")
+):
+    '''
+    全文檢索已上傳檔案與來源文件目錄 (SQLite FTS5)，依相關性回傳片段摘錄、檔案 ID 與週次。
+    '''
+    logger.info(f"API CALL: GET /api/search with q: '{q[:50]}', limit={limit}, source={source}")
+    if not settings.SEARCH_ENABLED:
+        raise HTTPException(status_code=503, detail="全文檢索未啟用。")
+    search_index.ensure_fresh()
+    started_at = time.perf_counter()
+    try:
+        results = await search_index.search(q, limit=limit, source=source)
+    except Exception as e:
+        logger.error(f"Error searching for '{q[:50]}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="全文檢索時發生錯誤。")
+    return SearchResponse(query=q, results=results, took_ms=round((time.perf_counter() - started_at) * 1000, 2))
+
+@router.post("/search/sync", response_model=SearchSyncResponse)
+async def sync_search_index():
+    '''
+    立即更新全文檢索索引（僅重新索引新增或已變更的檔案）。
+    '''
+    logger.info("API CALL: POST /api/search/sync")
+    if not settings.SEARCH_ENABLED:
+        raise HTTPException(status_code=503, detail="全文檢索未啟用。")
+    return SearchSyncResponse(**await search_index.sync_search_index())
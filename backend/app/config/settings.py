@@ -31,6 +31,9 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./AI_data/main_dat
 AI_DATA_PATH = os.getenv("AI_DATA_PATH", "./AI_data")
 BACKUP_PATH = os.getenv("BACKUP_PATH", "./AI_data/backups")
 
+# Weekly posts and other source documents (same default location as the Streamlit frontend's Wolf_Data/source_documents)
+SOURCE_DOCS_DIR = os.path.expanduser(os.getenv("SOURCE_DOCS_DIR", "~/Wolf_Data/source_documents"))
+
 # Gemini API Keys
 # Loads a comma-separated string of keys from .env and splits them into a list
 GEMINI_API_KEYS_STR = os.getenv("GEMINI_API_KEYS", "")
@@ -44,6 +47,34 @@ DEFAULT_MODEL_NAME = "models/gemini-1.5-pro-latest" # Default model for the appl
 TOKEN_SAFETY_FACTOR = 0.90 # Safety factor for calculating effective token limit for prompts
 DEFAULT_GEMINI_RPM_LIMIT = 3  # Default RPM for a single key, useful for client-side awareness or future server-side limiting
 DEFAULT_GEMINI_TPM_LIMIT = 100000 # Default TPM for a single key
+# Enforced by gemini_dispatcher when set; 0 (the default) means no server-side limit
+GEMINI_RPM_LIMIT_PER_KEY = int(os.getenv("GEMINI_RPM_LIMIT_PER_KEY", 0))
+GEMINI_TPM_LIMIT_PER_KEY = int(os.getenv("GEMINI_TPM_LIMIT_PER_KEY", 0))
+DISPATCH_INTERACTIVE_RESERVED_SHARE = float(os.getenv("DISPATCH_INTERACTIVE_RESERVED_SHARE", 0.3)) # Share of each key's RPM/TPM batch work may not use
+
+# --- Prompt Planner (per-section token budgets, see services/prompt_planner.py) ---
+PROMPT_SECTION_BUDGET_SHARES = {
+    "system": 0.05,
+    "core_docs": 0.55,
+    "external_data": 0.10,
+    "history": 0.25,
+    "retrieved_passages": 0.15,
+    "user_input": 0.05,
+}
+PROMPT_HISTORY_RECENT_TURNS_KEPT = int(os.getenv("PROMPT_HISTORY_RECENT_TURNS_KEPT", 6)) # Recent messages never compressed
+PROMPT_HISTORY_OLD_TURN_MAX_TOKENS = int(os.getenv("PROMPT_HISTORY_OLD_TURN_MAX_TOKENS", 200)) # Older messages are cut to this size
+
+# --- Chat History Compaction (rolling per-session digest of older turns) ---
+HISTORY_COMPACTION_ENABLED = os.getenv("HISTORY_COMPACTION_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_COMPACTION_THRESHOLD_TOKENS = int(os.getenv("HISTORY_COMPACTION_THRESHOLD_TOKENS", 8000)) # Compact once history passes this size
+HISTORY_COMPACTION_KEEP_RECENT_MESSAGES = int(os.getenv("HISTORY_COMPACTION_KEEP_RECENT_MESSAGES", 6)) # Always sent verbatim
+HISTORY_DIGEST_MAX_OUTPUT_TOKENS = 1024
+
+# --- Model Routing (flash vs. pro tier per request, see services/model_router.py) ---
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+MODEL_ROUTING_FLASH_MAX_PROMPT_TOKENS = int(os.getenv("MODEL_ROUTING_FLASH_MAX_PROMPT_TOKENS", 8000)) # Smaller prompts go to flash
+MODEL_ROUTING_PRO_ACTIONS = ("initial_analysis", "final_report_preview", "all_in_one_report") # Always routed to pro unless a latency target says otherwise
+MODEL_ROUTING_STATS_WINDOW = 200 # Recent calls per model used for latency estimates and metrics
 
 DEFAULT_GENERATION_CONFIG = {
     "temperature": 0.7,
@@ -52,6 +83,63 @@ DEFAULT_GENERATION_CONFIG = {
     "max_output_tokens": 8192
 }
 
+# --- Gemini Context Cache (automatic caching of large stable prompt prefixes) ---
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 32768)) # Gemini's minimum cacheable input size
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", 3600))
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 300 # Extend the TTL when a reused cache has less than this left
+
+# --- LLM Response Cache (reuse of deterministic or explicitly reusable responses) ---
+LLM_RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_BYTES", 50 * 1024 * 1024)) # Default 50MB
+
+# --- Retrieval Index (local BM25 over SOURCE_DOCS_DIR, see services/retrieval_index.py) ---
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_FILE_EXTENSIONS = (".txt", ".md")
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", 600))
+RETRIEVAL_CHUNK_OVERLAP_CHARS = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP_CHARS", 100))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 6))
+RETRIEVAL_SYNC_INTERVAL_SECONDS = int(os.getenv("RETRIEVAL_SYNC_INTERVAL_SECONDS", 300)) # Re-scan for changed files at most this often
+
+# --- Full-Text Search (SQLite FTS5 over uploads and SOURCE_DOCS_DIR, see services/search_index.py) ---
+# Source documents are the retrieval index's files and chunks; uploads are indexed from their text artifacts.
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_SYNC_INTERVAL_SECONDS = int(os.getenv("SEARCH_SYNC_INTERVAL_SECONDS", 300))
+SEARCH_MAX_DOCUMENT_BYTES = int(os.getenv("SEARCH_MAX_DOCUMENT_BYTES", 50 * 1024 * 1024)) # Larger texts are not indexed
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", 160))
+
+# --- Map-Reduce Summaries of oversized core documents (see services/document_summarizer.py) ---
+DOC_SUMMARY_ENABLED = os.getenv("DOC_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+DOC_SUMMARY_MODEL = os.getenv("DOC_SUMMARY_MODEL", "models/gemini-1.5-flash-latest") # One model for all summaries, so cached summaries serve every chat model
+DOC_SUMMARY_CHUNK_TPM_SHARE = 0.2 # A map-step chunk uses at most this share of one key's per-minute token quota
+DOC_SUMMARY_CHUNK_TOKENS = int(os.getenv(
+    "DOC_SUMMARY_CHUNK_TOKENS", int((GEMINI_TPM_LIMIT_PER_KEY or DEFAULT_GEMINI_TPM_LIMIT) * DOC_SUMMARY_CHUNK_TPM_SHARE)
+)) # Size of each chunk summarised in the map step
+DOC_SUMMARY_MAX_OUTPUT_TOKENS = int(os.getenv("DOC_SUMMARY_MAX_OUTPUT_TOKENS", 2048)) # Per chunk / reduce step
+DOC_SUMMARY_MAX_CONCURRENCY = int(os.getenv("DOC_SUMMARY_MAX_CONCURRENCY", 4)) # Chunk summaries in flight (the dispatcher still enforces RPM/TPM)
+
+# --- Upload Storage GC (see file_service.collect_upload_garbage) ---
+UPLOAD_GC_ENABLED = os.getenv("UPLOAD_GC_ENABLED", "true").lower() in ("1", "true", "yes")
+UPLOAD_GC_INTERVAL_SECONDS = int(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", 3600))
+UPLOAD_MAX_AGE_DAYS = int(os.getenv("UPLOAD_MAX_AGE_DAYS", 30)) # Uploads not accessed for this long are deleted
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_BYTES", 2 * 1024 * 1024 * 1024)) # Default 2GB of distinct blobs
+UPLOAD_GC_ACTIVE_SESSION_DAYS = int(os.getenv("UPLOAD_GC_ACTIVE_SESSION_DAYS", 7)) # Files of sessions updated this recently are kept
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", 3600)) # Never delete files accessed this recently
+UPLOAD_GC_BATCH_SIZE = 20 # Files deleted per batch
+UPLOAD_ACCESS_TIME_RESOLUTION_SECONDS = 300 # A lookup rewrites last_accessed_at only when it is older than this (keep well below the GC grace)
+
+# --- Resumable Chunked Uploads (see services/chunked_uploads.py) ---
+UPLOAD_CHUNK_SIZE_BYTES = int(os.getenv("UPLOAD_CHUNK_SIZE_BYTES", 8 * 1024 * 1024)) # Default chunk size offered to clients
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", 32 * 1024 * 1024)) # Largest chunk a client may choose
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24)) # Unfinished uploads idle this long are discarded by the GC
+
+# --- Upload Preprocessing (see services/upload_preprocessing.py) ---
+CSV_INGEST_CHUNK_ROWS = int(os.getenv("CSV_INGEST_CHUNK_ROWS", 100000)) # Rows per streamed CSV chunk (bounds peak memory)
+UPLOAD_PREVIEW_SAMPLE_ROWS = int(os.getenv("UPLOAD_PREVIEW_SAMPLE_ROWS", 100)) # Reservoir sample size kept for table previews
+CORE_DOC_LOAD_MAX_CHARS = int(os.getenv("CORE_DOC_LOAD_MAX_CHARS", 4_000_000)) # Longer chat documents are loaded as head + tail only
+DOCUMENT_TEXT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_TEXT_CACHE_MAX_BYTES", 256 * 1024 * 1024)) # In-memory LRU of decoded upload text; 0 disables it
+UPLOAD_PREPROCESS_RETRY_SECONDS = int(os.getenv("UPLOAD_PREPROCESS_RETRY_SECONDS", 600)) # Failed preprocessing is retried on use after this long (or on re-upload)
+
 # --- Prompts ---
 # PROMPTS_DIR could be relative to the app directory, e.g., 'app/prompts'
 # For use within backend services, direct path construction might be better.
@@ -71,6 +159,7 @@ DEFAULT_MAIN_GEMINI_PROMPT = """
 YFINANCE_CACHE_TTL_SECONDS = 3600
 FRED_CACHE_TTL_SECONDS = 86400
 DEFAULT_CACHE_TTL_SECONDS = 3600 # General default
+MODEL_CATALOG_REFRESH_INTERVAL_SECONDS = int(os.getenv("MODEL_CATALOG_REFRESH_INTERVAL_SECONDS", DEFAULT_CACHE_TTL_SECONDS))
 
 # --- Data Fetcher Defaults (can be used by API endpoints) ---
 DEFAULT_YFINANCE_TICKERS = "SPY, ^GSPC, BTC-USD, ETH-USD"
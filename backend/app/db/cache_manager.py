@@ -5,7 +5,7 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 
-from app.config.settings import DATABASE_URL
+from app.db.init_db import get_db_path
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +26,7 @@ async def get_cached_data(key: str) -> Optional[Any]:
     """
     Retrieves cached data from the http_cache table if it exists and has not expired.
     """
-    db_path = DATABASE_URL.split("///")[-1]
+    db_path = get_db_path()
     try:
         async with aiosqlite.connect(db_path) as db:
             async with db.execute(
@@ -59,7 +59,7 @@ async def set_cached_data(key: str, data: Any, ttl_seconds: int):
     """
     Stores data into the http_cache table with a specified time-to-live (TTL).
     """
-    db_path = DATABASE_URL.split("///")[-1]
+    db_path = get_db_path()
     expires_dt = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
     expires_str = expires_dt.isoformat()
     timestamp_str = datetime.now(timezone.utc).isoformat()
@@ -83,7 +83,7 @@ async def clear_cache(key: Optional[str] = None):
     """
     Clears a specific cache entry by key, or the entire cache if no key is provided.
     """
-    db_path = DATABASE_URL.split("///")[-1]
+    db_path = get_db_path()
     try:
         async with aiosqlite.connect(db_path) as db:
             if key:
@@ -152,7 +152,7 @@ if __name__ == '__main__':
     async def init_dummy_db_for_test():
         from app.db.init_db import create_tables as init_actual_tables
         # Ensure AI_DATA_PATH exists if db is there
-        ai_data_dir = DATABASE_URL.split("///")[-1].rsplit('/',1)[0]
+        ai_data_dir = get_db_path().rsplit('/',1)[0]
         if ai_data_dir and not os.path.exists(ai_data_dir):
             os.makedirs(ai_data_dir, exist_ok=True)
         await init_actual_tables()
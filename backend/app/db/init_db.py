@@ -3,16 +3,23 @@ import logging
 import os # For path creation
 
 # Import settings from the correct location
-from app.config.settings import DATABASE_URL, AI_DATA_PATH # Assuming settings.py is in app/config
+from app.config import settings
+from app.config.settings import AI_DATA_PATH # Assuming settings.py is in app/config
 
 logger = logging.getLogger(__name__)
 
+
+def get_db_path() -> str:
+    """Filesystem path of the SQLite database named by settings.DATABASE_URL (read at call time)."""
+    return settings.DATABASE_URL.split("///")[-1]
+
+
 async def create_tables():
     """
     Asynchronously creates database tables if they don't already exist.
     Ensures that the directory for the SQLite database exists.
     """
-    db_path = DATABASE_URL.split("///")[-1] # Gets the path part of the URL
+    db_path = get_db_path()
     db_dir = os.path.dirname(db_path)
 
     if db_dir and not os.path.exists(db_dir):
@@ -35,8 +42,169 @@ async def create_tables():
                     expires DATETIME
                 )
             """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS model_catalog_snapshot (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    models_json TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    fetched_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    response_text TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    last_accessed_at DATETIME NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_accessed ON llm_response_cache (last_accessed_at)"
+            )
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_history_digests (
+                    session_id TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    covered_messages INTEGER NOT NULL, -- Number of leading history messages the digest summarises
+                    covered_hash TEXT NOT NULL,        -- SHA-256 of those messages, to detect edited histories
+                    updated_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    system_prompt TEXT,
+                    selected_model TEXT,
+                    uploaded_file_info TEXT,  -- JSON list of {'file_id', 'file_name'}
+                    external_data TEXT,       -- JSON snapshot of the external data summaries
+                    generation_config TEXT,   -- JSON
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_session_messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    token_estimate INTEGER NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS retrieval_documents (
+                    path TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    indexed_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS retrieval_chunks (
+                    path TEXT NOT NULL,
+                    ordinal INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    term_counts TEXT NOT NULL, -- JSON {term: frequency} of the chunk's bigram/word terms
+                    length INTEGER NOT NULL,   -- Total number of terms
+                    PRIMARY KEY (path, ordinal)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS document_summaries (
+                    content_hash TEXT NOT NULL, -- SHA-256 of the summarised text (a chunk, a group of summaries or a whole document)
+                    model_name TEXT NOT NULL,
+                    level TEXT NOT NULL,        -- 'chunk', 'reduce' or 'document'
+                    summary TEXT NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    PRIMARY KEY (content_hash, model_name)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS upload_blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    blob_path TEXT NOT NULL,    -- Relative to AI_DATA_PATH: uploads/blobs/<sha[:2]>/<sha>
+                    created_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS uploaded_files (
+                    file_id TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,       -- Blob in upload_blobs holding the content
+                    file_name TEXT NOT NULL,
+                    content_type TEXT,
+                    size INTEGER NOT NULL,
+                    uploaded_at DATETIME NOT NULL,
+                    last_accessed_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_sha256 ON uploaded_files (sha256, file_name)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_uploaded_at ON uploaded_files (uploaded_at)")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS upload_artifacts (
+                    sha256 TEXT PRIMARY KEY,    -- Blob the artifacts were built from (uploads/artifacts/<sha256>/)
+                    version INTEGER NOT NULL,   -- upload_preprocessing.ARTIFACTS_VERSION
+                    status TEXT NOT NULL,       -- 'ready' or 'failed'
+                    kind TEXT,                  -- 'text', 'table' or 'binary'
+                    token_count INTEGER NOT NULL,
+                    summary TEXT,               -- JSON schema/statistics summary
+                    error TEXT,
+                    created_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    upload_id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    content_type TEXT,
+                    size INTEGER NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    expected_sha256 TEXT,       -- Checked against the assembled file on completion, if given
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS upload_session_chunks (
+                    upload_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    received_at DATETIME NOT NULL,
+                    PRIMARY KEY (upload_id, chunk_index)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS search_documents (
+                    id INTEGER PRIMARY KEY,     -- search_fts rowids of the document's chunks are (id << 24) + ordinal
+                    doc_key TEXT NOT NULL UNIQUE, -- 'upload:<file_id>' or 'source:<retrieval_documents.path>'
+                    source TEXT NOT NULL,       -- 'upload' or 'source_doc'
+                    file_id TEXT,               -- Uploads only
+                    name TEXT NOT NULL,
+                    week_start TEXT,            -- Monday of the week named in the file name (ISO date), if any
+                    content_hash TEXT NOT NULL,
+                    mtime REAL,                 -- Source documents only
+                    size INTEGER NOT NULL,
+                    indexed_at DATETIME NOT NULL
+                )
+            """)
+            # Terms are pre-tokenized by search_index: CJK runs as character bigrams in 'terms' and
+            # single characters in 'chars', Latin words/numbers lower-cased in 'terms'. 'text' is NULL for
+            # source documents, whose chunk text is read from retrieval_chunks.
+            await db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                    terms, chars, text UNINDEXED, tokenize = 'unicode61'
+                )
+            """)
             await db.commit()
-            logger.info("Table 'http_cache' checked/created successfully.")
+            logger.info("Tables 'http_cache', 'model_catalog_snapshot', 'llm_response_cache', 'chat_history_digests', 'chat_sessions', 'chat_session_messages', 'retrieval_documents', 'retrieval_chunks', 'document_summaries', 'upload_blobs', 'uploaded_files', 'upload_artifacts', 'upload_sessions', 'upload_session_chunks', 'search_documents', 'search_fts' checked/created successfully.")
     except Exception as e:
         logger.error(f"Error during database table creation: {e}")
         # Consider re-raising the exception if startup should halt on DB error
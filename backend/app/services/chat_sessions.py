@@ -0,0 +1,159 @@
+# services/chat_sessions.py
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+import aiosqlite
+
+from ..db.init_db import get_db_path
+from ..utils.token_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Session context columns that can be set on creation and updated later; values other than
+# system_prompt / selected_model are stored as JSON.
+_CONTEXT_FIELDS = ("user_id", "system_prompt", "selected_model", "uploaded_file_info", "external_data", "generation_config")
+_JSON_FIELDS = ("uploaded_file_info", "external_data", "generation_config")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _row_to_session(row: aiosqlite.Row) -> Dict[str, Any]:
+    session = dict(row)
+    for name in _JSON_FIELDS:
+        session[name] = json.loads(session[name]) if session[name] else None
+    return session
+
+
+async def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the session context (without messages), or None if it does not exist."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("SELECT * FROM chat_sessions WHERE session_id = ?", (session_id,)) as cursor:
+            row = await cursor.fetchone()
+    return _row_to_session(row) if row else None
+
+
+async def create_session(
+    session_id: Optional[str] = None,
+    initial_history: Optional[List[Dict[str, Any]]] = None,
+    **context: Any
+) -> Dict[str, Any]:
+    """
+    Creates a session with the given context (see _CONTEXT_FIELDS) and optional seed history.
+    A new UUID is used when `session_id` is not given. If a concurrent request created the same session
+    first, that session is kept: the given context is applied to it and the seed history is not added again.
+    """
+    session_id = session_id or uuid.uuid4().hex
+    values = {name: context.get(name) for name in _CONTEXT_FIELDS}
+    for name in _JSON_FIELDS:
+        values[name] = json.dumps(values[name], ensure_ascii=False) if values[name] is not None else None
+    now = _now()
+    async with aiosqlite.connect(get_db_path()) as db:
+        cursor = await db.execute(
+            f"""
+            INSERT OR IGNORE INTO chat_sessions (session_id, {', '.join(_CONTEXT_FIELDS)}, created_at, updated_at)
+            VALUES (?, {', '.join('?' for _ in _CONTEXT_FIELDS)}, ?, ?)
+            """,
+            (session_id, *[values[name] for name in _CONTEXT_FIELDS], now, now),
+        )
+        await db.commit()
+        created = cursor.rowcount > 0
+    if not created:
+        logger.info(f"Chat session '{session_id}' already exists; updating its context instead.")
+        await update_session_context(session_id, **context)
+        return await get_session(session_id)
+    logger.info(f"Chat session '{session_id}' created.")
+    if initial_history:
+        await append_messages(session_id, initial_history)
+    return await get_session(session_id)
+
+
+async def update_session_context(session_id: str, **context: Any) -> None:
+    """Updates the given context fields of a session; fields passed as None are left unchanged."""
+    updates = {name: value for name, value in context.items() if name in _CONTEXT_FIELDS and value is not None}
+    if not updates:
+        return
+    for name in _JSON_FIELDS:
+        if name in updates:
+            updates[name] = json.dumps(updates[name], ensure_ascii=False)
+    assignments = ", ".join(f"{name} = ?" for name in updates)
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            f"UPDATE chat_sessions SET {assignments}, updated_at = ? WHERE session_id = ?",
+            (*updates.values(), _now(), session_id),
+        )
+        await db.commit()
+    logger.info(f"Chat session '{session_id}' context updated: {', '.join(updates)}.")
+
+
+async def delete_session(session_id: str) -> bool:
+    async with aiosqlite.connect(get_db_path()) as db:
+        cursor = await db.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+        await db.execute("DELETE FROM chat_session_messages WHERE session_id = ?", (session_id,))
+        await db.commit()
+        return cursor.rowcount > 0
+
+
+async def get_messages(session_id: str) -> List[Dict[str, Any]]:
+    """Returns the session history in chat format: [{'role': ..., 'parts': [...]}, ...] in order."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute(
+            "SELECT role, content FROM chat_session_messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [{"role": role, "parts": [content]} for role, content in rows]
+
+
+async def get_history_token_total(session_id: str) -> int:
+    """Sum of the token estimates stored with each message (no re-estimation)."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute(
+            "SELECT COALESCE(SUM(token_estimate), 0) FROM chat_session_messages WHERE session_id = ?", (session_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+    return row[0]
+
+
+async def append_messages(session_id: str, messages: List[Dict[str, Any]]) -> None:
+    """
+    Appends messages to the session history, storing each one's token estimate once.
+    The messages get consecutive sequence numbers even when several requests append to the same session at once.
+    """
+    now = _now()
+    async with aiosqlite.connect(get_db_path()) as db:
+        # Take the write lock before reading MAX(seq), so a concurrent append cannot pick the same numbers.
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute(
+            "SELECT COALESCE(MAX(seq), -1) FROM chat_session_messages WHERE session_id = ?", (session_id,)
+        ) as cursor:
+            next_seq = (await cursor.fetchone())[0] + 1
+        rows = []
+        for offset, message in enumerate(messages):
+            content = "\n".join(str(p) for p in message.get("parts", []))
+            rows.append((session_id, next_seq + offset, message.get("role", "unknown"), content, estimate_tokens(content), now))
+        await db.executemany(
+            """
+            INSERT INTO chat_session_messages (session_id, seq, role, content, token_estimate, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        await db.execute("UPDATE chat_sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+        await db.commit()
+
+
+async def get_active_file_ids(updated_since: str) -> Set[str]:
+    """file_ids selected by sessions updated at or after `updated_since` (ISO 8601); the upload GC keeps these."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute(
+            "SELECT uploaded_file_info FROM chat_sessions WHERE updated_at >= ? AND uploaded_file_info IS NOT NULL",
+            (updated_since,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return {info["file_id"] for (value,) in rows for info in json.loads(value) or [] if info.get("file_id")}
+
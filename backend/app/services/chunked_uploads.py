@@ -0,0 +1,224 @@
+# services/chunked_uploads.py
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from . import file_service
+
+logger = logging.getLogger(__name__)
+
+# Partially received files: uploads/incoming/<upload_id>.part, preallocated to the full size
+INCOMING_DIR = os.path.join("uploads", "incoming")
+
+_completing: Set[str] = set() # upload_ids being finalised
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _part_path(upload_id: str, base_upload_dir: str) -> str:
+    return os.path.join(base_upload_dir, INCOMING_DIR, f"{upload_id}.part")
+
+
+def _total_chunks(size: int, chunk_size: int) -> int:
+    return max(1, -(-size // chunk_size)) # An empty file is one empty chunk
+
+
+def _expected_chunk_length(session: Dict[str, Any], index: int) -> int:
+    return min(session["chunk_size"], session["size"] - index * session["chunk_size"])
+
+
+def _preallocate(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _write_at(path: str, offset: int, data: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+
+async def _load_session(db: aiosqlite.Connection, upload_id: str) -> Optional[Dict[str, Any]]:
+    db.row_factory = aiosqlite.Row
+    async with db.execute("SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)) as cursor:
+        row = await cursor.fetchone()
+    return dict(row) if row else None
+
+
+async def _received_chunks(db: aiosqlite.Connection, upload_id: str) -> List[int]:
+    async with db.execute(
+        "SELECT chunk_index FROM upload_session_chunks WHERE upload_id = ? ORDER BY chunk_index", (upload_id,)
+    ) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+def _status(session: Dict[str, Any], received: List[int]) -> Dict[str, Any]:
+    total = _total_chunks(session["size"], session["chunk_size"])
+    received_set = set(received)
+    return {
+        "upload_id": session["upload_id"],
+        "file_name": session["file_name"],
+        "content_type": session["content_type"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "total_chunks": total,
+        "received_chunks": received,
+        "missing_chunks": [i for i in range(total) if i not in received_set],
+        "bytes_received": sum(_expected_chunk_length(session, i) for i in received),
+    }
+
+
+async def create_upload_session(
+    file_name: str,
+    size: int,
+    base_upload_dir: str,
+    content_type: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    sha256: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Starts a resumable upload of `size` bytes sent as numbered chunks of `chunk_size` bytes (the last one
+    may be shorter). `sha256`, if given, is checked against the assembled file on completion.
+    Returns the session status. Raises ValueError for an invalid size or chunk size.
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE_BYTES
+    if size < 0:
+        raise ValueError("File size must not be negative.")
+    if not 0 < chunk_size <= settings.UPLOAD_CHUNK_MAX_BYTES:
+        raise ValueError(f"Chunk size must be between 1 and {settings.UPLOAD_CHUNK_MAX_BYTES} bytes.")
+
+    upload_id = uuid.uuid4().hex
+    file_name = os.path.basename(file_name) or "unnamed_file"
+    await asyncio.to_thread(_preallocate, _part_path(upload_id, base_upload_dir), size)
+    now = _now()
+    session = {
+        "upload_id": upload_id, "file_name": file_name, "content_type": content_type, "size": size,
+        "chunk_size": chunk_size, "expected_sha256": sha256.lower() if sha256 else None, "created_at": now, "updated_at": now,
+    }
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            f"INSERT INTO upload_sessions ({', '.join(session)}) VALUES ({', '.join('?' for _ in session)})",
+            tuple(session.values()),
+        )
+        await db.commit()
+    logger.info(f"Chunked upload '{upload_id}' started for '{file_name}' ({size} bytes in {_total_chunks(size, chunk_size)} chunks).")
+    return _status(session, [])
+
+
+async def get_upload_status(upload_id: str) -> Optional[Dict[str, Any]]:
+    """Session status with the received and missing chunk indexes, or None if the upload is unknown."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        session = await _load_session(db, upload_id)
+        if not session:
+            return None
+        return _status(session, await _received_chunks(db, upload_id))
+
+
+async def write_chunk(upload_id: str, index: int, data: bytes, checksum: Optional[str], base_upload_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Writes chunk `index` at its offset in the partial file after checking its length and, if given, its
+    SHA-256 `checksum`. Re-sending a chunk overwrites it, so chunks can be retried in any order and in parallel.
+    Returns the session status, or None if the upload is unknown. Raises ValueError for an invalid chunk.
+    """
+    async with aiosqlite.connect(get_db_path()) as db:
+        session = await _load_session(db, upload_id)
+    if not session:
+        return None
+    total = _total_chunks(session["size"], session["chunk_size"])
+    if not 0 <= index < total:
+        raise ValueError(f"Chunk index {index} is out of range (0-{total - 1}).")
+    expected_length = _expected_chunk_length(session, index)
+    if len(data) != expected_length:
+        raise ValueError(f"Chunk {index} has {len(data)} bytes; expected {expected_length}.")
+    digest = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise ValueError(f"Chunk {index} checksum mismatch.")
+
+    await asyncio.to_thread(_write_at, _part_path(upload_id, base_upload_dir), index * session["chunk_size"], data)
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO upload_session_chunks (upload_id, chunk_index, size, sha256, received_at) VALUES (?, ?, ?, ?, ?)",
+            (upload_id, index, len(data), digest, _now()),
+        )
+        await db.execute("UPDATE upload_sessions SET updated_at = ? WHERE upload_id = ?", (_now(), upload_id))
+        await db.commit()
+        return _status(session, await _received_chunks(db, upload_id))
+
+
+async def _delete_session(upload_id: str, base_upload_dir: str) -> bool:
+    async with aiosqlite.connect(get_db_path()) as db:
+        cursor = await db.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+        await db.execute("DELETE FROM upload_session_chunks WHERE upload_id = ?", (upload_id,))
+        await db.commit()
+        deleted = cursor.rowcount > 0
+    part_path = _part_path(upload_id, base_upload_dir)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    return deleted
+
+
+async def complete_upload(upload_id: str, base_upload_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Finalises an upload whose chunks have all arrived: hashes the assembled file, checks it against the
+    expected SHA-256 if one was given, and stores it through file_service (with the same deduplication as
+    a direct upload). Returns the stored file's dict (see file_service.save_uploaded_file), or None if the
+    upload is unknown. Raises ValueError if chunks are missing or the hash does not match.
+    """
+    if upload_id in _completing:
+        raise ValueError("This upload is already being completed.")
+    _completing.add(upload_id)
+    try:
+        status = await get_upload_status(upload_id)
+        if not status:
+            return None
+        if status["missing_chunks"]:
+            raise ValueError(f"{len(status['missing_chunks'])} chunk(s) still missing: {status['missing_chunks'][:20]}")
+
+        async with aiosqlite.connect(get_db_path()) as db:
+            session = await _load_session(db, upload_id)
+        part_path = _part_path(upload_id, base_upload_dir)
+        sha256 = await asyncio.to_thread(file_service.hash_file, part_path)
+        if session["expected_sha256"] and session["expected_sha256"] != sha256:
+            raise ValueError("The assembled file does not match the expected SHA-256; re-send the upload.")
+
+        saved = await file_service.store_temp_file(
+            part_path, sha256, session["size"], session["file_name"], session["content_type"], base_upload_dir
+        )
+        await _delete_session(upload_id, base_upload_dir)
+        logger.info(f"Chunked upload '{upload_id}' completed as file ID {saved['file_id']}.")
+        return saved
+    finally:
+        _completing.discard(upload_id)
+
+
+async def abort_upload(upload_id: str, base_upload_dir: str) -> bool:
+    """Discards an unfinished upload and its partial file. Returns False if the upload is unknown."""
+    deleted = await _delete_session(upload_id, base_upload_dir)
+    if deleted:
+        logger.info(f"Chunked upload '{upload_id}' aborted.")
+    return deleted
+
+
+async def expire_stale_uploads(base_upload_dir: str, updated_before: str) -> int:
+    """Aborts uploads that have received nothing since `updated_before` (ISO 8601). Returns how many."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute("SELECT upload_id FROM upload_sessions WHERE updated_at < ?", (updated_before,)) as cursor:
+            stale = [row[0] for row in await cursor.fetchall()]
+    for upload_id in stale:
+        await _delete_session(upload_id, base_upload_dir)
+    if stale:
+        logger.info(f"Expired {len(stale)} abandoned chunked upload(s).")
+    return len(stale)
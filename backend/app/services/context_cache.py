@@ -0,0 +1,254 @@
+# services/context_cache.py
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from . import gemini_service
+from ..config import settings
+from ..utils.token_utils import estimate_tokens_for_parts
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ContextCacheEntry:
+    """A Gemini CachedContent created by this process for one stable prompt prefix."""
+    cache_name: str
+    prefix_hash: str
+    model_name: str
+    api_key_hash: str
+    estimated_tokens: int
+    expires_at: float # Unix timestamp
+    ref_count: int = 0
+    last_used_at: float = 0.0
+
+
+@dataclass
+class _PrefixLock:
+    """Serialises cache creation/refresh for one registry key; `users` counts threads holding or waiting for it."""
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    users: int = 0
+
+
+# Registry keyed by (prefix_hash, model_name, api_key_hash). Never stores raw API keys.
+_registry: Dict[Tuple[str, str, str], ContextCacheEntry] = {}
+_registry_lock = threading.Lock() # Guards _registry and _key_locks only; never held across network calls
+_key_locks: Dict[Tuple[str, str, str], _PrefixLock] = {}
+
+
+def compute_prefix_hash(prefix_parts: List[str]) -> str:
+    """Computes a stable SHA-256 hash of the prefix parts (order sensitive)."""
+    hasher = hashlib.sha256()
+    for part in prefix_parts:
+        encoded = str(part).encode("utf-8")
+        hasher.update(len(encoded).to_bytes(8, "big")) # Length prefix keeps part boundaries unambiguous
+        hasher.update(encoded)
+    return hasher.hexdigest()
+
+
+def _hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def _prefix_locked(registry_key: Tuple[str, str, str]):
+    """
+    Holds the per-prefix lock of `registry_key`. The lock is registered as in use before it is acquired, so
+    it is never forgotten while a thread waits for it (which would let a second thread create a duplicate).
+    """
+    with _registry_lock:
+        prefix_lock = _key_locks.setdefault(registry_key, _PrefixLock())
+        prefix_lock.users += 1
+    try:
+        with prefix_lock.lock:
+            yield
+    finally:
+        with _registry_lock:
+            prefix_lock.users -= 1
+            if registry_key not in _registry:
+                _drop_key_lock(registry_key)
+
+
+def _drop_key_lock(registry_key: Tuple[str, str, str]) -> None:
+    """Forgets the per-prefix lock of a removed entry unless a thread holds or waits for it. Requires _registry_lock."""
+    prefix_lock = _key_locks.get(registry_key)
+    if prefix_lock is not None and prefix_lock.users == 0:
+        del _key_locks[registry_key]
+
+
+def _normalize_model_name(model_name: str) -> str:
+    return model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+
+def acquire_prefix_cache(
+    api_key: str,
+    model_name: str,
+    system_instruction: str,
+    prefix_contents: Optional[List[str]] = None,
+    min_tokens: Optional[int] = None,
+    prefix_hash: Optional[str] = None,
+    max_tokens: Optional[int] = None
+) -> Optional[Tuple[str, str]]:
+    """
+    Returns a Gemini CachedContent covering the stable prompt prefix, creating it if needed.
+
+    The prefix (system instruction + core documents) is only cached when its estimated size is at
+    least the model's minimum cacheable size. An existing cache for the same prefix, model and key
+    is reused and its TTL refreshed when close to expiry. Every successful call increments the
+    entry's reference count and must be paired with `release_prefix_cache`.
+
+    Blocking (cache creation and TTL refresh are network calls); call it from async code via asyncio.to_thread.
+
+    Args:
+        api_key: Gemini API key the cache is bound to.
+        model_name: Model name the cache is bound to.
+        system_instruction: The system prompt part of the prefix.
+        prefix_contents: Further stable parts (e.g., core documents) following the system prompt.
+        min_tokens: Minimum estimated prefix size for caching. Defaults to settings.CONTEXT_CACHE_MIN_TOKENS.
+        prefix_hash: compute_prefix_hash of the prefix parts, if the caller has already computed it.
+        max_tokens: The model's input budget. A prefix estimated above it is not cached, so the full prompt
+                    is sent and call_gemini_api can still trim it.
+
+    Returns:
+        (cache_name, prefix_hash) if a cache can be used, otherwise None (caller sends the full prompt).
+    """
+    if not settings.CONTEXT_CACHE_ENABLED or not api_key or not system_instruction:
+        return None
+
+    prefix_parts = [system_instruction] + list(prefix_contents or [])
+    threshold = min_tokens if min_tokens is not None else settings.CONTEXT_CACHE_MIN_TOKENS
+    estimated_tokens = estimate_tokens_for_parts(prefix_parts)
+    if estimated_tokens < threshold:
+        logger.debug(f"Context cache skipped: prefix ~{estimated_tokens} tokens is below minimum {threshold}.")
+        return None
+    if max_tokens is not None and estimated_tokens > max_tokens:
+        logger.warning(f"Context cache skipped: prefix ~{estimated_tokens} tokens exceeds the input budget {max_tokens}.")
+        return None
+
+    model_key = _normalize_model_name(model_name)
+    prefix_hash = prefix_hash or compute_prefix_hash(prefix_parts)
+    registry_key = (prefix_hash, model_key, _hash_api_key(api_key))
+
+    # Network calls are made under the per-prefix lock only: concurrent turns over the same prefix wait for
+    # one creation instead of creating duplicates, while turns over other prefixes are not blocked.
+    with _prefix_locked(registry_key):
+        now = time.time()
+        with _registry_lock:
+            entry = _registry.get(registry_key)
+            if entry and entry.expires_at <= now:
+                logger.info(f"Context cache '{entry.cache_name}' expired locally. Recreating.")
+                _registry.pop(registry_key, None)
+                entry = None
+            needs_refresh = bool(entry) and entry.expires_at - now < settings.CONTEXT_CACHE_REFRESH_MARGIN_SECONDS
+
+        if needs_refresh:
+            refreshed, error_msg = gemini_service.refresh_gemini_cache_ttl(
+                api_key, entry.cache_name, settings.CONTEXT_CACHE_TTL_SECONDS
+            )
+            with _registry_lock:
+                if refreshed is None:
+                    logger.warning(f"Context cache '{entry.cache_name}' could not be refreshed ({error_msg}). Recreating.")
+                    _registry.pop(registry_key, None)
+                    entry = None
+                elif _registry.get(registry_key) is not entry:
+                    entry = None # Purged or invalidated while the refresh was in flight
+                else:
+                    entry.expires_at = now + settings.CONTEXT_CACHE_TTL_SECONDS
+
+        if entry:
+            with _registry_lock:
+                entry.ref_count += 1
+                entry.last_used_at = now
+            logger.info(f"Reusing context cache '{entry.cache_name}' (prefix {prefix_hash[:12]}, refs: {entry.ref_count}).")
+            return entry.cache_name, prefix_hash
+
+        cached_content, error_msg = gemini_service.create_gemini_cache(
+            api_key=api_key,
+            model_name=model_name,
+            cache_display_name=f"wolf-prefix-{prefix_hash[:12]}",
+            system_instruction=system_instruction,
+            ttl_seconds=settings.CONTEXT_CACHE_TTL_SECONDS,
+            contents=prefix_contents or None
+        )
+        if cached_content is None:
+            logger.warning(f"Context cache creation failed, falling back to full prompt: {error_msg}")
+            return None
+
+        entry = ContextCacheEntry(
+            cache_name=cached_content.name,
+            prefix_hash=prefix_hash,
+            model_name=model_key,
+            api_key_hash=registry_key[2],
+            estimated_tokens=estimated_tokens,
+            expires_at=now + settings.CONTEXT_CACHE_TTL_SECONDS,
+            ref_count=1,
+            last_used_at=now
+        )
+        with _registry_lock:
+            _registry[registry_key] = entry
+        logger.info(f"Created context cache '{entry.cache_name}' for prefix {prefix_hash[:12]} (~{estimated_tokens} tokens).")
+        return entry.cache_name, prefix_hash
+
+
+def release_prefix_cache(api_key: str, model_name: str, prefix_hash: str) -> None:
+    """Decrements the reference count taken by `acquire_prefix_cache`."""
+    registry_key = (prefix_hash, _normalize_model_name(model_name), _hash_api_key(api_key))
+    with _registry_lock:
+        entry = _registry.get(registry_key)
+        if entry and entry.ref_count > 0:
+            entry.ref_count -= 1
+            logger.debug(f"Released context cache '{entry.cache_name}' (refs: {entry.ref_count}).")
+
+
+def invalidate_cache_name(cache_name: str) -> None:
+    """Drops a cache from the registry, e.g., after Gemini reports it as missing."""
+    with _registry_lock:
+        for registry_key, entry in list(_registry.items()):
+            if entry.cache_name == cache_name:
+                _registry.pop(registry_key, None)
+                _drop_key_lock(registry_key)
+                logger.info(f"Context cache '{cache_name}' removed from registry.")
+
+
+def purge_context_caches(api_keys: List[str], only_expired: bool = True) -> int:
+    """
+    Removes unreferenced entries from the registry and deletes their remote caches.
+
+    Args:
+        api_keys: Configured API keys; used to find the key each cache was created with.
+        only_expired: If True, only entries past their expiry are purged (remote caches expire by
+                      themselves, so only the registry entry is dropped). If False, every unreferenced
+                      entry is deleted remotely as well (used on shutdown).
+
+    Returns:
+        Number of registry entries removed.
+    """
+    keys_by_hash = {_hash_api_key(k): k for k in api_keys}
+    now = time.time()
+    to_delete: List[Tuple[str, ContextCacheEntry]] = []
+
+    with _registry_lock:
+        for registry_key, entry in list(_registry.items()):
+            if entry.ref_count > 0:
+                continue
+            if entry.expires_at <= now or not only_expired:
+                _registry.pop(registry_key, None)
+                _drop_key_lock(registry_key)
+                to_delete.append((keys_by_hash.get(entry.api_key_hash), entry))
+
+    for api_key, entry in to_delete:
+        if api_key and entry.expires_at > now:
+            gemini_service.delete_gemini_cache(api_key, entry.cache_name)
+    if to_delete:
+        logger.info(f"Purged {len(to_delete)} context cache entries.")
+    return len(to_delete)
+
+
+def get_registry_snapshot() -> List[ContextCacheEntry]:
+    """Returns a copy of the registry entries (for diagnostics and tests)."""
+    with _registry_lock:
+        return [ContextCacheEntry(**vars(entry)) for entry in _registry.values()]
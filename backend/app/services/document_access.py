@@ -0,0 +1,152 @@
+# services/document_access.py
+import bisect
+import logging
+import mmap
+import os
+import struct
+from array import array
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Line-offset index of a UTF-8 text file (little-endian uint64 throughout):
+#   header:      step, total_lines, total_chars, n_char_checkpoints
+#   line starts: byte offset of lines 0, step, 2 * step, ...
+#   checkpoints: byte offsets, then the matching character offsets, about every CHECKPOINT_BYTES bytes
+# A line window seeks to the nearest indexed line and scans at most `step` lines; a character range
+# scans at most CHECKPOINT_BYTES bytes before its start. The index takes 8 bytes per `step` lines plus
+# 16 bytes per checkpoint (about 400 KB for a 130 MB, 3-million-line log).
+LINE_INDEX_STEP = 64
+CHECKPOINT_BYTES = 64 * 1024
+_HEADER = struct.Struct("<4Q")
+
+
+def _is_continuation(block: np.ndarray) -> np.ndarray:
+    return (block & 0xC0) == 0x80
+
+
+def build_line_index(text_path: str, index_path: str, step: int = LINE_INDEX_STEP) -> None:
+    """Writes the line-offset index of the UTF-8 file `text_path` to `index_path` in one streaming pass."""
+    line_starts = array("Q", [0])
+    checkpoint_bytes, checkpoint_chars = array("Q"), array("Q")
+    total_newlines = total_chars = offset = 0
+    last_byte = None
+    with open(text_path, "rb") as f:
+        while block := f.read(CHECKPOINT_BYTES):
+            data = np.frombuffer(block, dtype=np.uint8)
+            continuation = _is_continuation(data)
+            # Checkpoint at the first character that starts in this block
+            lead = int(np.argmin(continuation)) if not continuation.all() else None
+            if lead is not None:
+                checkpoint_bytes.append(offset + lead)
+                checkpoint_chars.append(total_chars + int(np.count_nonzero(~continuation[:lead])))
+            newlines = np.flatnonzero(data == 0x0A)
+            # Line k starts after newline k; keep every step-th one
+            line_numbers = np.arange(total_newlines + 1, total_newlines + 1 + len(newlines))
+            line_starts.extend(int(p) + offset + 1 for p in newlines[line_numbers % step == 0])
+            total_newlines += len(newlines)
+            total_chars += int(np.count_nonzero(~continuation))
+            offset += len(block)
+            last_byte = block[-1]
+
+    total_lines = total_newlines + (1 if last_byte is not None and last_byte != 0x0A else 0)
+    if line_starts and line_starts[-1] >= offset: # A trailing newline starts no line
+        line_starts.pop()
+    with open(index_path, "wb") as f:
+        f.write(_HEADER.pack(step, total_lines, total_chars, len(checkpoint_bytes)))
+        for values in (line_starts, checkpoint_bytes, checkpoint_chars):
+            f.write(values.tobytes())
+
+
+class TextDocument:
+    """
+    Read-only, memory-mapped view of a UTF-8 text file and its line-offset index (see build_line_index).
+    Byte ranges, character ranges and line windows are read without loading the whole file; each call
+    allocates the slice plus at most a checkpoint-sized scan window. Use as a context manager, or call close().
+    """
+
+    def __init__(self, text_path: str, index_path: str):
+        self.path = text_path
+        self.size = os.path.getsize(text_path)
+        with open(index_path, "rb") as f:
+            index = f.read()
+        self._step, self.line_count, self.char_count, n_checkpoints = _HEADER.unpack_from(index)
+        n_line_starts = -(-self.line_count // self._step) if self.line_count else 0
+        values = memoryview(index)[_HEADER.size:].cast("Q")
+        self._line_starts = values[:n_line_starts]
+        self._checkpoint_bytes = values[n_line_starts:n_line_starts + n_checkpoints]
+        self._checkpoint_chars = values[n_line_starts + n_checkpoints:n_line_starts + 2 * n_checkpoints]
+        self._file = open(text_path, "rb")
+        # mmap cannot map an empty file
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "TextDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def read_bytes(self, start: int, end: Optional[int] = None) -> bytes:
+        """Raw bytes [start, end) of the file."""
+        return self._mm[max(start, 0):self.size if end is None else min(end, self.size)]
+
+    def _byte_offset_of_char(self, char_index: int) -> int:
+        if char_index <= 0:
+            return 0
+        if char_index >= self.char_count:
+            return self.size
+        i = bisect.bisect_right(self._checkpoint_chars, char_index) - 1
+        byte_start, chars_before = self._checkpoint_bytes[i], self._checkpoint_chars[i]
+        window = np.frombuffer(self._mm[byte_start:byte_start + CHECKPOINT_BYTES + 4], dtype=np.uint8)
+        leads = np.flatnonzero(~_is_continuation(window))
+        return byte_start + int(leads[char_index - chars_before])
+
+    def read_chars(self, start: int, end: Optional[int] = None) -> str:
+        """Characters [start, end) of the text, like text[start:end] with non-negative indexes."""
+        end = self.char_count if end is None else min(end, self.char_count)
+        if start >= end:
+            return ""
+        return self._mm[self._byte_offset_of_char(start):self._byte_offset_of_char(end)].decode("utf-8")
+
+    def _line_start(self, line: int) -> int:
+        position = self._line_starts[line // self._step]
+        for _ in range(line % self._step):
+            position = self._mm.find(b"\n", position) + 1
+        return position
+
+    def read_lines(self, start: int, count: int) -> List[str]:
+        """Lines [start, start + count) of the text, without their line endings."""
+        start = max(start, 0)
+        count = min(count, self.line_count - start)
+        if count <= 0:
+            return []
+        begin = position = self._line_start(start)
+        for _ in range(count):
+            newline = self._mm.find(b"\n", position)
+            position = self.size if newline == -1 else newline + 1
+        lines = self._mm[begin:position].decode("utf-8").split("\n")
+        if lines[-1] == "": # The window ended with a newline
+            lines.pop()
+        return [line.removesuffix("\r") for line in lines]
+
+    def head(self, n_chars: int) -> str:
+        return self.read_chars(0, n_chars)
+
+    def tail(self, n_chars: int) -> str:
+        return self.read_chars(max(self.char_count - n_chars, 0))
+
+    def excerpt(self, max_chars: int, head_share: float = 0.7) -> str:
+        """The whole text if it has at most `max_chars` characters, otherwise its head and tail around a marker."""
+        if self.char_count <= max_chars:
+            return self.read_chars(0)
+        head_chars = int(max_chars * head_share)
+        tail_chars = max_chars - head_chars
+        omitted = self.char_count - head_chars - tail_chars
+        return self.head(head_chars) + f"\n...[中略約 {omitted} 個字元]...\n" + self.tail(tail_chars)
@@ -0,0 +1,246 @@
+# services/document_summarizer.py
+import asyncio
+import hashlib
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from ..utils.token_utils import estimate_tokens
+from . import upload_preprocessing
+from .gemini_dispatcher import get_dispatcher, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+_MAP_INSTRUCTION = (
+    "以下是文件「{name}」的第 {index}/{total} 部分。請撰寫詳盡的摘要，保留關鍵論點、數據、日期、名稱與結論，"
+    "不要加入文件中沒有的資訊。"
+)
+_REDUCE_INSTRUCTION = (
+    "以下是文件「{name}」各部分的摘要（依原文順序）。請整合成一份完整、結構清楚的摘要，"
+    "保留所有關鍵數據與結論，並去除重複內容。"
+)
+_SUMMARY_NOTE = "[本文件超過模型上下文上限，以下為分段摘要後整合的內容]\n"
+
+# Summaries being generated in the background, by document hash (one task per document however often it is asked for).
+_pending_summaries: Dict[str, asyncio.Task] = {}
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def _get_cached_summary(content_hash: str, model_name: str) -> Optional[str]:
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            async with db.execute(
+                "SELECT summary FROM document_summaries WHERE content_hash = ? AND model_name = ?", (content_hash, model_name)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error reading document summary cache: {e}")
+        return None
+
+
+async def _set_cached_summary(content_hash: str, model_name: str, level: str, summary: str) -> None:
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO document_summaries (content_hash, model_name, level, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, model_name, level, summary, datetime.now(timezone.utc).isoformat()),
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error writing document summary cache: {e}")
+
+
+def split_into_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """Splits text into chunks of at most about `chunk_tokens` (local estimate), at paragraph boundaries where possible."""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in re.split(r"(\n\s*\n)", text):
+        paragraph_tokens = estimate_tokens(paragraph)
+        if paragraph_tokens > chunk_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            # A single huge paragraph: cut it into equal slices of about chunk_tokens.
+            slice_count = -(-paragraph_tokens // chunk_tokens)
+            slice_chars = -(-len(paragraph) // slice_count)
+            chunks.extend(paragraph[i:i + slice_chars] for i in range(0, len(paragraph), slice_chars))
+            continue
+        if current and current_tokens + paragraph_tokens > chunk_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+    if current and "".join(current).strip():
+        chunks.append("".join(current))
+    return chunks
+
+
+async def _summarize_cached(
+    prompt_parts: List[str],
+    level: str,
+    model_name: str,
+    user_id: Optional[str],
+    semaphore: asyncio.Semaphore
+) -> Optional[str]:
+    """One map or reduce call, cached by the hash of its full prompt. Returns None if the call failed."""
+    content_hash = _sha256("\n".join(prompt_parts))
+    cached = await _get_cached_summary(content_hash, model_name)
+    if cached is not None:
+        return cached
+    async with semaphore:
+        summary, _ = await get_dispatcher().submit(
+            prompt_parts=prompt_parts,
+            selected_model=model_name,
+            priority=PRIORITY_BATCH, # Runs in the background; queued chat requests go first
+            user_id=user_id,
+            generation_config_dict={"temperature": 0.2, "max_output_tokens": settings.DOC_SUMMARY_MAX_OUTPUT_TOKENS}
+        )
+    if not summary or summary.startswith(("Error:", "Unexpected error")):
+        logger.warning(f"Document summary ({level}) failed: {summary[:200] if summary else 'empty response'}")
+        return None
+    await _set_cached_summary(content_hash, model_name, level, summary.strip())
+    return summary.strip()
+
+
+async def summarize_document(
+    name: str,
+    content: str,
+    user_id: Optional[str] = None,
+    model_name: Optional[str] = None
+) -> Optional[str]:
+    """
+    Map-reduce summary of a document too large for the prompt, made with DOC_SUMMARY_MODEL unless
+    `model_name` is given.
+
+    The document is split into DOC_SUMMARY_CHUNK_TOKENS chunks (a share of one key's TPM quota) that are
+    summarised concurrently through the dispatcher at batch priority; the chunk summaries are then reduced,
+    in groups if they are still too large together, into one summary. Chunk, intermediate and final
+    summaries are cached in SQLite by content hash and model, so asking about the same document again
+    needs no summarisation calls. Returns None if any step failed.
+    """
+    model_name = model_name or settings.DOC_SUMMARY_MODEL
+    document_hash = _sha256(content)
+    cached = await _get_cached_summary(document_hash, model_name)
+    if cached is not None:
+        logger.info(f"Document summary cache hit for '{name}'.")
+        return cached
+
+    chunks = split_into_chunks(content, settings.DOC_SUMMARY_CHUNK_TOKENS)
+    semaphore = asyncio.Semaphore(settings.DOC_SUMMARY_MAX_CONCURRENCY)
+    logger.info(f"Summarising '{name}' (~{estimate_tokens(content)} tokens) in {len(chunks)} chunks.")
+    summaries = await asyncio.gather(*[
+        _summarize_cached(
+            [_MAP_INSTRUCTION.format(name=name, index=i + 1, total=len(chunks)), chunk],
+            "chunk", model_name, user_id, semaphore
+        )
+        for i, chunk in enumerate(chunks)
+    ])
+
+    while len(summaries) > 1:
+        if any(summary is None for summary in summaries):
+            return None
+        # Group consecutive summaries so every reduce prompt stays within one chunk's budget.
+        groups: List[List[str]] = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            summary_tokens = estimate_tokens(summary)
+            if groups[-1] and group_tokens + summary_tokens > settings.DOC_SUMMARY_CHUNK_TOKENS:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += summary_tokens
+        if len(groups) == len(summaries): # Summaries too large to combine; keep them side by side
+            break
+        summaries = await asyncio.gather(*[
+            _summarize_cached(
+                [_REDUCE_INSTRUCTION.format(name=name), "\n\n---\n\n".join(group)],
+                "reduce", model_name, user_id, semaphore
+            )
+            for group in groups
+        ])
+
+    if not summaries or any(summary is None for summary in summaries):
+        return None
+    final_summary = "\n\n".join(summaries)
+    await _set_cached_summary(document_hash, model_name, "document", final_summary)
+    logger.info(f"Document '{name}' summarised to ~{estimate_tokens(final_summary)} tokens.")
+    return final_summary
+
+
+async def _read_full_upload_text(file_id: str, name: str) -> Optional[str]:
+    """The whole extracted text of an upload, read through its memory-mapped artifact (None if unavailable)."""
+    document = await upload_preprocessing.open_document(file_id, settings.AI_DATA_PATH, name)
+    if document is None:
+        return None
+    try:
+        return await asyncio.to_thread(document.read_chars, 0)
+    finally:
+        document.close()
+
+
+def _start_background_summary(document_hash: str, name: str, content: str, user_id: Optional[str], file_id: Optional[str] = None) -> None:
+    if document_hash in _pending_summaries:
+        return
+
+    async def _run() -> None:
+        try:
+            # Very large uploads reach the chat as their head and tail only (CORE_DOC_LOAD_MAX_CHARS): summarise the whole text
+            full_text = await _read_full_upload_text(file_id, name) if file_id else None
+            if full_text is None and file_id:
+                logger.warning(f"Full text of '{name}' is unavailable; summarising the loaded content, which may be partial.")
+            summary = await summarize_document(name, full_text or content, user_id)
+            if summary is None:
+                logger.warning(f"Background summary of '{name}' failed; it will be retried when the document is next used.")
+            elif full_text is not None and full_text != content:
+                # Stored under the hash of the excerpt too, which is what later requests look it up by
+                await _set_cached_summary(document_hash, settings.DOC_SUMMARY_MODEL, "document", summary)
+        except Exception as e:
+            logger.error(f"Background summary of '{name}' failed: {e}", exc_info=True)
+        finally:
+            _pending_summaries.pop(document_hash, None)
+
+    _pending_summaries[document_hash] = asyncio.get_running_loop().create_task(_run())
+    logger.info(f"Background summary of '{name}' started.")
+
+
+async def summarize_oversized_docs(
+    core_docs: List[Dict[str, Any]],
+    token_budget: Optional[int],
+    user_id: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+    """
+    Replaces every text document larger than the core documents' share of `token_budget` by its cached
+    map-reduce summary. Documents without a summary yet are kept as they are (the prompt planner then trims
+    them) and summarised in the background, so the request does not wait for the map-reduce calls; uploads
+    (documents with a file_id) are summarised from their whole text, not the possibly cut content given here.
+    Returns (documents, names of the summarised documents, names of the documents whose summary is pending).
+    """
+    if not settings.DOC_SUMMARY_ENABLED or not token_budget or not core_docs:
+        return core_docs, [], []
+    threshold = int(token_budget * settings.PROMPT_SECTION_BUDGET_SHARES["core_docs"])
+    prepared_docs = list(core_docs)
+    summarized_names: List[str] = []
+    pending_names: List[str] = []
+    for i, doc in enumerate(core_docs):
+        if not isinstance(doc.get("content"), str) or estimate_tokens(doc["content"]) <= threshold:
+            continue
+        name = doc.get("name", "未知文件")
+        document_hash = _sha256(doc["content"])
+        summary = await _get_cached_summary(document_hash, settings.DOC_SUMMARY_MODEL)
+        if summary is None:
+            _start_background_summary(document_hash, name, doc["content"], user_id, doc.get("file_id"))
+            pending_names.append(name)
+            continue
+        prepared_docs[i] = {**doc, "content": _SUMMARY_NOTE + summary}
+        summarized_names.append(name)
+    return prepared_docs, summarized_names, pending_names
@@ -1,9 +1,18 @@
 # services/file_processors.py
 # import streamlit as st # Removed Streamlit import
+import json
 import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import StringIO, BytesIO
 import os
+import shutil
+
+from ..utils.token_utils import estimate_tokens
 # from utils.session_state_manager import IS_COLAB # Removed IS_COLAB import, ensure_colab_drive_mount_if_needed will be removed/commented
 
 logger = logging.getLogger(__name__)
@@ -159,6 +168,209 @@ def process_uploaded_files(files_data: list[dict]) -> dict:
     logger.debug(f"Processed file names: {list(processed_file_contents.keys())}")
     return processed_file_contents
 
+# --- Streaming table ingestion (bounded memory; used for upload preprocessing artifacts) ---
+
+_DISTINCT_COUNT_CAP = 1000 # Distinct values tracked per column; beyond this only ">= cap" is reported
+
+
+def downcast_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrinks the dtypes of one chunk in place: integers to the smallest integer type, floats to float32
+    where that loses nothing, and repetitive text columns to categories.
+    """
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column):
+            continue
+        if pd.api.types.is_integer_dtype(column):
+            df[name] = pd.to_numeric(column, downcast="integer")
+        elif pd.api.types.is_float_dtype(column):
+            as_float32 = column.astype("float32")
+            if ((as_float32 == column) | column.isna()).all():
+                df[name] = as_float32
+        elif pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):
+            if len(column) and column.nunique(dropna=True) <= len(column) // 2:
+                df[name] = column.astype("category")
+    return df
+
+
+class TableStats:
+    """
+    Running per-column statistics and a uniform reservoir sample (Algorithm R) of the rows of a table
+    seen chunk by chunk, so summaries and previews need no more memory than one chunk.
+    """
+
+    def __init__(self, sample_rows: int = 100, seed: int = 0):
+        self.rows = 0
+        self.chunks = 0
+        self.sample: List[dict] = []
+        self._sample_rows = sample_rows
+        self._rng = np.random.default_rng(seed)
+        self._columns: Dict[str, Dict[str, Any]] = {}
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        for name in chunk.columns:
+            column = chunk[name]
+            stats = self._columns.setdefault(str(name), {"dtypes": [], "non_null": 0, "numeric_count": 0, "distinct": set()})
+            dtype = str(column.dtype)
+            if dtype not in stats["dtypes"]:
+                stats["dtypes"].append(dtype)
+            non_null = column.dropna()
+            stats["non_null"] += len(non_null)
+            if len(non_null) and pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+                chunk_min, chunk_max = float(non_null.min()), float(non_null.max())
+                stats["min"] = min(stats.get("min", chunk_min), chunk_min)
+                stats["max"] = max(stats.get("max", chunk_max), chunk_max)
+                stats["sum"] = stats.get("sum", 0.0) + float(non_null.astype("float64").sum())
+                stats["numeric_count"] += len(non_null)
+            # Numeric chunks count too: a later text chunk makes the whole column text (see summary)
+            if len(stats["distinct"]) < _DISTINCT_COUNT_CAP:
+                for value in non_null.unique()[:_DISTINCT_COUNT_CAP]:
+                    stats["distinct"].add(str(value))
+                    if len(stats["distinct"]) >= _DISTINCT_COUNT_CAP:
+                        break
+        self._update_sample(chunk)
+        self.rows += len(chunk)
+        self.chunks += 1
+
+    def _update_sample(self, chunk: pd.DataFrame) -> None:
+        k = self._sample_rows
+        if k <= 0 or chunk.empty:
+            return
+        fill = min(max(k - len(self.sample), 0), len(chunk))
+        if fill:
+            self.sample.extend(_records(chunk.iloc[:fill]))
+        if fill == len(chunk):
+            return
+        # Row i (0-based over the whole table) replaces a random slot with probability k / (i + 1).
+        positions = np.arange(self.rows + fill, self.rows + len(chunk))
+        slots = self._rng.integers(0, positions + 1)
+        hits = np.nonzero(slots < k)[0]
+        if len(hits):
+            replacements = _records(chunk.iloc[hits + fill])
+            for slot, record in zip(slots[hits], replacements):
+                self.sample[slot] = record
+
+    def summary(self, schema: Optional[pa.Schema] = None) -> Dict[str, Any]:
+        """
+        Per-column statistics. With `schema`, the unified type of the stored table, a column gets min/max/mean
+        only if that type is numeric, since chunks of a column that turns out to be text may have been
+        numeric on their own; without it, only if every non-null value came from a numeric chunk.
+        """
+        columns = []
+        for name, stats in self._columns.items():
+            column = {"name": name, "dtype": "/".join(stats["dtypes"]), "non_null": stats["non_null"]}
+            if schema is not None and name in schema.names:
+                column_type = schema.field(name).type
+                column["type"] = str(column_type)
+                numeric = _is_numeric_type(column_type)
+            else:
+                numeric = stats["numeric_count"] == stats["non_null"]
+            if numeric and stats["numeric_count"]:
+                column.update(min=stats["min"], max=stats["max"], mean=round(stats["sum"] / stats["numeric_count"], 6))
+            elif not numeric:
+                column["distinct"] = len(stats["distinct"])
+                if len(stats["distinct"]) >= _DISTINCT_COUNT_CAP:
+                    column["distinct_capped"] = True
+            columns.append(column)
+        return {"rows": self.rows, "columns": columns}
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+def _parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """Column names as strings and mixed-type object columns as strings, which Parquet requires."""
+    df.columns = [str(c) for c in df.columns]
+    for name in df.columns:
+        if pd.api.types.is_object_dtype(df[name]):
+            df[name] = df[name].astype("string")
+    return df
+
+
+def ingest_table_chunks(
+    chunks: Iterable[pd.DataFrame],
+    parts_dir: str,
+    text_path: Optional[str] = None,
+    sample_rows: int = 100
+) -> Dict[str, Any]:
+    """
+    Writes a table arriving as DataFrame chunks to on-disk artifacts without holding more than one chunk:
+    each chunk, with downcast dtypes, becomes `parts_dir/part-NNNNN.parquet`, and, if `text_path` is given,
+    its CSV rendering is appended there. Parts written earlier to `parts_dir` are removed first, and parts
+    whose downcast types differ are rewritten to one widened schema (see _unify_part_schemas), so the
+    directory reads back as one table. Returns the summary (rows, chunks, per-column statistics), the
+    reservoir sample of rows and the token estimate of the CSV text (0 without `text_path`).
+    """
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    part_paths: List[str] = []
+    stats = TableStats(sample_rows=sample_rows)
+    token_count = 0
+    text_file = open(text_path, "w", encoding="utf-8") if text_path else None
+    try:
+        for index, chunk in enumerate(chunks):
+            if text_file:
+                chunk_text = chunk.to_csv(index=False, header=(index == 0))
+                text_file.write(chunk_text)
+                token_count += estimate_tokens(chunk_text)
+            chunk = _parquet_safe(downcast_chunk(chunk))
+            stats.update(chunk)
+            part_paths.append(os.path.join(parts_dir, f"part-{index:05d}.parquet"))
+            chunk.to_parquet(part_paths[-1], index=False)
+    finally:
+        if text_file:
+            text_file.close()
+    summary = stats.summary(_unify_part_schemas(part_paths))
+    summary["chunks"] = stats.chunks
+    return {"summary": summary, "sample": stats.sample, "token_count": token_count}
+
+
+def _widen_types(types: List[pa.DataType]) -> pa.DataType:
+    """The narrowest type all `types` cast to without loss: the widest integer or float, float64 for mixed numbers, else string."""
+    types = [t.value_type if pa.types.is_dictionary(t) else t for t in types]
+    if all(t == types[0] for t in types):
+        return types[0]
+    for is_kind in (pa.types.is_integer, pa.types.is_floating):
+        if all(is_kind(t) for t in types):
+            return max(types, key=lambda t: t.bit_width)
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return next((t for t in types if pa.types.is_string(t) or pa.types.is_large_string(t)), pa.string())
+
+
+def _is_numeric_type(data_type: pa.DataType) -> bool:
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+
+def _unify_part_schemas(part_paths: List[str]) -> Optional[pa.Schema]:
+    """
+    Chunks are downcast one at a time, so the same column can come out as int8 in one part and int16, float
+    or category (dictionary) in another. Rewrites, one part at a time, every part whose schema differs from
+    the widened schema of all parts. Returns the schema the parts now share (None without parts).
+    """
+    schemas = [pq.read_schema(path) for path in part_paths]
+    if all(schema.equals(schemas[0]) for schema in schemas[1:]):
+        return schemas[0] if schemas else None
+    target = pa.schema([
+        pa.field(field.name, _widen_types([schema.field(field.name).type for schema in schemas]))
+        for field in schemas[0]
+    ])
+    for path, schema in zip(part_paths, schemas):
+        if not schema.equals(target):
+            pq.write_table(pq.read_table(path).select(target.names).cast(target), path)
+    logger.info(f"Rewrote table parts in {os.path.dirname(part_paths[0])} to one schema: {target}")
+    return target
+
+
+def iter_csv_chunks(path: str, chunk_rows: int, encoding: str = "utf-8") -> Iterator[pd.DataFrame]:
+    """Reads a CSV file in chunks of `chunk_rows` rows."""
+    with pd.read_csv(path, chunksize=chunk_rows, encoding=encoding) as reader:
+        yield from reader
+
 # if __name__ == "__main__":
     # Mock data for testing the backend version
     # class MockFile:
@@ -1,99 +1,373 @@
+import asyncio
+import hashlib
+import mimetypes
 import os
+import re
+import shutil
 import uuid
 import logging
-from typing import Tuple, Optional, IO, AsyncGenerator
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple, Optional, IO, AsyncGenerator
 
 import aiofiles # For async file operations
+import aiosqlite
 from fastapi import UploadFile
 
+from ..config import settings
+from ..db.init_db import get_db_path
+from . import chat_sessions
+
 logger = logging.getLogger(__name__)
 
 # Define a chunk size for reading/writing files, e.g., 1MB
 CHUNK_SIZE = 1024 * 1024
 
+# Content-addressed store: every distinct upload is kept once under uploads/blobs/<sha[:2]>/<sha>
+BLOBS_DIR = os.path.join("uploads", "blobs")
+
+# Derived data of each distinct upload (see upload_preprocessing): uploads/artifacts/<sha>/
+ARTIFACTS_DIR = os.path.join("uploads", "artifacts")
+
+# Old-layout upload directories are named by their file_id (uuid4().hex); other directories under uploads/
+# (blobs, artifacts, incoming chunked uploads) belong to the current store.
+_LEGACY_FILE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Held while a blob is placed and indexed, and while the GC deletes blobs, so neither sees the other half-done.
+_store_lock = asyncio.Lock()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def blob_relative_path(sha256: str) -> str:
+    return os.path.join(BLOBS_DIR, sha256[:2], sha256)
+
+
+def artifacts_dir_path(sha256: str, base_upload_dir: str) -> str:
+    return os.path.join(base_upload_dir, ARTIFACTS_DIR, sha256)
+
+
+async def get_file_record(file_id: str) -> Optional[Dict[str, Any]]:
+    """The uploaded_files row of `file_id` joined with its blob path, or None if the id is unknown."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            """
+            SELECT f.*, b.blob_path FROM uploaded_files f JOIN upload_blobs b ON b.sha256 = f.sha256
+            WHERE f.file_id = ?
+            """,
+            (file_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
+    return dict(row) if row else None
+
+
+async def _find_duplicate(sha256: str, file_name: str) -> Optional[Dict[str, Any]]:
+    """An earlier upload of the same content under the same name, if any."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            "SELECT * FROM uploaded_files WHERE sha256 = ? AND file_name = ? ORDER BY uploaded_at LIMIT 1",
+            (sha256, file_name),
+        ) as cursor:
+            row = await cursor.fetchone()
+    return dict(row) if row else None
+
+
+async def _record_upload(file_id: str, sha256: str, file_name: str, content_type: Optional[str], size: int) -> None:
+    now = _now()
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO upload_blobs (sha256, size, blob_path, created_at) VALUES (?, ?, ?, ?)",
+            (sha256, size, blob_relative_path(sha256), now),
+        )
+        await db.execute(
+            """
+            INSERT INTO uploaded_files (file_id, sha256, file_name, content_type, size, uploaded_at, last_accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (file_id, sha256, file_name, content_type, size, now, now),
+        )
+        await db.commit()
+
+
+async def _touch(file_id: str) -> None:
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute("UPDATE uploaded_files SET last_accessed_at = ? WHERE file_id = ?", (_now(), file_id))
+        await db.commit()
+
+
 async def save_uploaded_file(
     file: UploadFile,
     base_upload_dir: str
-) -> Tuple[str, str, Optional[str], int]:
+) -> Dict[str, Any]:
     """
-    Saves an uploaded file to a unique directory and returns file metadata.
+    Saves an uploaded file into the content-addressed store and returns its metadata.
+
+    The content is hashed (SHA-256) while it streams to a temporary file; the temporary file then becomes
+    the blob `uploads/blobs/<sha[:2]>/<sha>`, or is discarded if that blob already exists. If the same
+    content was uploaded before under the same name, the earlier file_id is returned (so everything already
+    derived from it is reused) and 'deduplicated' is True; otherwise a new file_id is mapped to the blob.
 
     Args:
         file: The UploadFile object from FastAPI.
         base_upload_dir: The base directory where 'uploads' will be created.
 
     Returns:
-        A tuple containing (file_id, original_filename, content_type, file_size).
+        A dict with file_id, file_name, content_type, size, sha256 and deduplicated.
     Raises:
         IOError: If file saving fails.
     """
-    file_id = uuid.uuid4().hex
     # Sanitize filename to prevent directory traversal or other security issues
     original_filename = os.path.basename(str(file.filename)) # Ensure filename is just the name
     if not original_filename: # Handle empty filename case
         original_filename = "unnamed_file"
 
-    upload_path_for_file_id = os.path.join(base_upload_dir, "uploads", file_id)
-
+    blobs_dir = os.path.join(base_upload_dir, BLOBS_DIR)
+    temp_path = os.path.join(blobs_dir, f".{uuid.uuid4().hex}.part")
     try:
-        os.makedirs(upload_path_for_file_id, exist_ok=True)
-        logger.info(f"Upload directory created/ensured: {upload_path_for_file_id}")
+        os.makedirs(blobs_dir, exist_ok=True)
     except OSError as e:
-        logger.error(f"Error creating upload directory {upload_path_for_file_id}: {e}")
-        raise IOError(f"Could not create upload directory for file ID {file_id}") from e
-
-    file_path = os.path.join(upload_path_for_file_id, original_filename)
+        logger.error(f"Error creating blob directory {blobs_dir}: {e}")
+        raise IOError(f"Could not create upload directory for file {original_filename}") from e
 
+    hasher = hashlib.sha256()
     file_size = 0
     try:
-        async with aiofiles.open(file_path, 'wb') as out_file:
+        async with aiofiles.open(temp_path, 'wb') as out_file:
             while content := await file.read(CHUNK_SIZE):
+                hasher.update(content)
                 await out_file.write(content)
                 file_size += len(content)
-        logger.info(f"File '{original_filename}' (ID: {file_id}) saved successfully to '{file_path}', Size: {file_size} bytes.")
     except Exception as e:
-        logger.error(f"Error saving file '{original_filename}' (ID: {file_id}) to '{file_path}': {e}", exc_info=True)
-        # Attempt to clean up partially saved file or directory if error occurs
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        # If the directory is empty after removing the file, try removing it.
-        if os.path.exists(upload_path_for_file_id) and not os.listdir(upload_path_for_file_id):
-            os.rmdir(upload_path_for_file_id)
+        logger.error(f"Error saving file '{original_filename}' to '{temp_path}': {e}", exc_info=True)
+        # Clean up the partially written temporary file
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         raise IOError(f"Could not save file {original_filename}") from e
 
     # file.size is Optional[int], so handle if it's None (though usually set for UploadFile)
     # The manual calculation of file_size during write is more reliable.
-    actual_size = file_size
-    if file.size is not None and file.size != actual_size :
-        logger.warning(f"Reported file size {file.size} differs from actual written size {actual_size} for {original_filename} (ID: {file_id}). Using actual size.")
+    if file.size is not None and file.size != file_size:
+        logger.warning(f"Reported file size {file.size} differs from actual written size {file_size} for {original_filename}. Using actual size.")
+
+    return await store_temp_file(temp_path, hasher.hexdigest(), file_size, original_filename, file.content_type, base_upload_dir)
+
+
+async def store_temp_file(
+    temp_path: str,
+    sha256: str,
+    file_size: int,
+    file_name: str,
+    content_type: Optional[str],
+    base_upload_dir: str
+) -> Dict[str, Any]:
+    """
+    Moves a fully written temporary file with known SHA-256 into the content-addressed store (or discards
+    it if the blob exists) and indexes it, reusing the file_id of an earlier upload of the same content
+    under the same name. Returns the same dict as save_uploaded_file.
+    """
+    blob_path = os.path.join(base_upload_dir, blob_relative_path(sha256))
+    # Placing the blob and indexing it happen under the store lock so the GC cannot delete the blob in between.
+    async with _store_lock:
+        placed_blob = False
+        try:
+            if os.path.exists(blob_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+                placed_blob = True
+
+            duplicate = await _find_duplicate(sha256, file_name)
+            if duplicate:
+                await _touch(duplicate["file_id"])
+                logger.info(f"File '{file_name}' is a duplicate of file ID {duplicate['file_id']} (sha256 {sha256[:12]}); reusing it.")
+                return {
+                    "file_id": duplicate["file_id"],
+                    "file_name": file_name,
+                    "content_type": duplicate["content_type"],
+                    "size": file_size,
+                    "sha256": sha256,
+                    "deduplicated": True,
+                }
+
+            file_id = uuid.uuid4().hex
+            await _record_upload(file_id, sha256, file_name, content_type, file_size)
+        except Exception as e:
+            logger.error(f"Error storing upload of '{file_name}' (sha256 {sha256}): {e}", exc_info=True)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if placed_blob:
+                # Not indexed (the blob and file rows are written in one transaction), so the GC would never find it.
+                os.remove(blob_path)
+            raise IOError(f"Could not save file {file_name}") from e
+
+    logger.info(f"File '{file_name}' (ID: {file_id}) saved as blob {sha256[:12]}, Size: {file_size} bytes.")
+    return {
+        "file_id": file_id,
+        "file_name": file_name,
+        "content_type": content_type,
+        "size": file_size,
+        "sha256": sha256,
+        "deduplicated": False,
+    }
+
+
+async def resolve_uploaded_file(file_id: str, file_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    The index record of an uploaded file (with its blob_path), looked up in the upload index only (no
+    filesystem checks). If `file_name` is given it must match the indexed name. Returns None if the file
+    is not indexed.
 
-    return file_id, original_filename, file.content_type, actual_size
+    The lookup is a read; the file's access time (for the GC) is only written when it is older than
+    UPLOAD_ACCESS_TIME_RESOLUTION_SECONDS, so repeated lookups of the same file do not each commit a write.
+    """
+    conditions, params = "f.file_id = ?", [file_id]
+    if file_name is not None:
+        conditions += " AND f.file_name = ?"
+        params.append(os.path.basename(file_name))
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                f"SELECT f.*, b.blob_path FROM uploaded_files f JOIN upload_blobs b ON b.sha256 = f.sha256 WHERE {conditions}",
+                params,
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                logger.warning(f"File not found in the upload index (ID: {file_id}, Name: {file_name})")
+                return None
+            stale_before = (datetime.now(timezone.utc) - timedelta(seconds=settings.UPLOAD_ACCESS_TIME_RESOLUTION_SECONDS)).isoformat()
+            if row["last_accessed_at"] < stale_before:
+                await db.execute("UPDATE uploaded_files SET last_accessed_at = ? WHERE file_id = ?", (_now(), file_id))
+                await db.commit()
+    except Exception as e:
+        logger.error(f"Error looking up file ID {file_id} in the upload index: {e}")
+        return None
+    return dict(row)
 
 
-def get_uploaded_file_path(
+async def resolve_uploaded_file_path(
     file_id: str,
     file_name: str,
     base_upload_dir: str
 ) -> Optional[str]:
     """
-    Constructs the path to an uploaded file given its ID and original name.
-    Checks if the file exists.
+    Path of the blob holding an uploaded file's content (see resolve_uploaded_file).
 
     Args:
         file_id: The unique ID of the file.
-        file_name: The original name of the file.
+        file_name: The original name of the file; must match the indexed name.
         base_upload_dir: The base directory where 'uploads' are stored.
 
     Returns:
-        The full path to the file if it exists, otherwise None.
+        The full path to the blob if the file is indexed under that name, otherwise None.
+    """
+    record = await resolve_uploaded_file(file_id, file_name)
+    return os.path.join(base_upload_dir, record["blob_path"]) if record else None
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def list_uploaded_files(
+    limit: int = 50,
+    offset: int = 0,
+    name_contains: Optional[str] = None,
+    content_type: Optional[str] = None,
+    sha256: Optional[str] = None,
+    uploaded_after: Optional[str] = None,
+    uploaded_before: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    One page of the upload index, newest first, and the total number of matching files.
+    `content_type` matches as a prefix (e.g. 'text/'); the dates are ISO 8601 strings compared with uploaded_at.
     """
-    # Sanitize file_name again
-    sane_file_name = os.path.basename(file_name)
-    file_path = os.path.join(base_upload_dir, "uploads", file_id, sane_file_name)
-    if os.path.exists(file_path) and os.path.isfile(file_path):
-        return file_path
-    logger.warning(f"File not found at expected path: {file_path} (ID: {file_id}, Name: {sane_file_name})")
-    return None
+    conditions, params = [], []
+    if name_contains:
+        conditions.append("file_name LIKE ? ESCAPE '\\'")
+        params.append(f"%{_like_escape(name_contains)}%")
+    if content_type:
+        conditions.append("content_type LIKE ? ESCAPE '\\'")
+        params.append(f"{_like_escape(content_type)}%")
+    if sha256:
+        conditions.append("sha256 = ?")
+        params.append(sha256)
+    if uploaded_after:
+        conditions.append("uploaded_at >= ?")
+        params.append(uploaded_after)
+    if uploaded_before:
+        conditions.append("uploaded_at < ?")
+        params.append(uploaded_before)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    async with aiosqlite.connect(get_db_path()) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(f"SELECT COUNT(*) FROM uploaded_files {where}", params) as cursor:
+            total = (await cursor.fetchone())[0]
+        async with db.execute(
+            f"""
+            SELECT file_id, file_name, content_type, size, sha256, uploaded_at, last_accessed_at
+            FROM uploaded_files {where} ORDER BY uploaded_at DESC, file_id LIMIT ? OFFSET ?
+            """,
+            (*params, limit, offset),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [dict(row) for row in rows], total
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in CHUNK_SIZE blocks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def index_legacy_uploads(base_upload_dir: str) -> int:
+    """
+    One-off migration run at startup: moves files still stored in the old `uploads/<file_id>/<file_name>`
+    layout into the content-addressed store and indexes them under their existing file_id. Only directories
+    named like a file_id are considered. Returns the number of files migrated.
+    """
+    uploads_dir = os.path.join(base_upload_dir, "uploads")
+    if not os.path.isdir(uploads_dir):
+        return 0
+    migrated = 0
+    for file_id in await asyncio.to_thread(os.listdir, uploads_dir):
+        legacy_dir = os.path.join(uploads_dir, file_id)
+        if not _LEGACY_FILE_ID_PATTERN.fullmatch(file_id) or not os.path.isdir(legacy_dir):
+            continue
+        for file_name in await asyncio.to_thread(os.listdir, legacy_dir):
+            legacy_path = os.path.join(legacy_dir, file_name)
+            if not os.path.isfile(legacy_path):
+                continue
+            try:
+                if await get_file_record(file_id):
+                    logger.warning(f"Legacy upload '{legacy_path}' has an already indexed file ID; left in place.")
+                    continue
+                sha256 = await asyncio.to_thread(hash_file, legacy_path)
+                size = os.path.getsize(legacy_path)
+                blob_path = os.path.join(base_upload_dir, blob_relative_path(sha256))
+                if os.path.exists(blob_path):
+                    os.remove(legacy_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(legacy_path, blob_path)
+                await _record_upload(file_id, sha256, file_name, mimetypes.guess_type(file_name)[0], size)
+                migrated += 1
+            except Exception as e:
+                logger.error(f"Error migrating legacy upload '{legacy_path}': {e}", exc_info=True)
+        if not os.listdir(legacy_dir):
+            os.rmdir(legacy_dir)
+    if migrated:
+        logger.info(f"Migrated {migrated} legacy upload(s) into the content-addressed store.")
+    return migrated
+
 
 async def get_uploaded_file_content(
     file_id: str,
@@ -114,7 +388,7 @@ async def get_uploaded_file_content(
         The file content as a string (for text mode) or bytes (for binary mode),
         or None if the file cannot be read.
     """
-    file_path = get_uploaded_file_path(file_id, file_name, base_upload_dir)
+    file_path = await resolve_uploaded_file_path(file_id, file_name, base_upload_dir)
     if not file_path:
         return None
 
@@ -147,7 +421,7 @@ async def get_uploaded_file_stream(
         FileNotFoundError: If the file does not exist at the constructed path.
         IOError: If there's an issue reading the file.
     """
-    file_path = get_uploaded_file_path(file_id, file_name, base_upload_dir)
+    file_path = await resolve_uploaded_file_path(file_id, file_name, base_upload_dir)
     if not file_path:
         logger.error(f"Stream: File not found for ID {file_id}, name {file_name}")
         raise FileNotFoundError(f"File {file_name} (ID: {file_id}) not found.")
@@ -160,16 +434,138 @@ async def get_uploaded_file_stream(
         logger.error(f"Error streaming file content for '{file_name}' (ID: {file_id}) from '{file_path}': {e}", exc_info=True)
         raise IOError(f"Could not stream file {file_name} (ID: {file_id}).") from e
 
-# Placeholder for future cleanup logic
-async def cleanup_old_files(base_upload_dir: str, max_age_days: int):
+def _remove_blob_files(paths: List[str], artifact_dirs: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting blob '{path}': {e}")
+    for path in artifact_dirs:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+async def _delete_files(db: aiosqlite.Connection, file_ids: List[str], base_upload_dir: str) -> Tuple[int, int]:
+    """Removes the index rows of `file_ids` and every blob (with its artifacts) left unreferenced. Returns (blobs deleted, bytes freed)."""
+    placeholders = ", ".join("?" for _ in file_ids)
+    async with db.execute(f"SELECT DISTINCT sha256 FROM uploaded_files WHERE file_id IN ({placeholders})", file_ids) as cursor:
+        candidate_blobs = [row[0] for row in await cursor.fetchall()]
+    await db.execute(f"DELETE FROM uploaded_files WHERE file_id IN ({placeholders})", file_ids)
+
+    blob_placeholders = ", ".join("?" for _ in candidate_blobs)
+    async with db.execute(
+        f"""
+        SELECT sha256, size, blob_path FROM upload_blobs
+        WHERE sha256 IN ({blob_placeholders}) AND sha256 NOT IN (SELECT sha256 FROM uploaded_files)
+        """,
+        candidate_blobs,
+    ) as cursor:
+        orphaned = await cursor.fetchall()
+    await db.executemany("DELETE FROM upload_blobs WHERE sha256 = ?", [(sha256,) for sha256, _, _ in orphaned])
+    await db.executemany("DELETE FROM upload_artifacts WHERE sha256 = ?", [(sha256,) for sha256, _, _ in orphaned])
+    await db.commit()
+    await asyncio.to_thread(
+        _remove_blob_files,
+        [os.path.join(base_upload_dir, blob_path) for _, _, blob_path in orphaned],
+        [artifacts_dir_path(sha256, base_upload_dir) for sha256, _, _ in orphaned],
+    )
+    return len(orphaned), sum(size for _, size, _ in orphaned)
+
+
+async def collect_upload_garbage(
+    base_upload_dir: str,
+    max_age_days: Optional[int] = None,
+    quota_bytes: Optional[int] = None
+) -> Dict[str, int]:
     """
-    Conceptual function to remove old uploaded files.
-    Actual implementation would require tracking file ages (e.g., from directory mtime or a database).
+    Deletes uploads that have not been accessed for `max_age_days`, then the least recently accessed
+    uploads until the blobs fit in `quota_bytes` (defaults: UPLOAD_MAX_AGE_DAYS, UPLOAD_QUOTA_BYTES).
+
+    Files referenced by chat sessions active in the last UPLOAD_GC_ACTIVE_SESSION_DAYS and files accessed
+    within UPLOAD_GC_GRACE_SECONDS are never deleted. Chunked uploads idle for UPLOAD_SESSION_TTL_HOURS
+    are discarded. Deletion runs in batches of UPLOAD_GC_BATCH_SIZE files; each batch is checked again
+    against both rules under the store lock and a write transaction, so a file used after the candidates
+    were chosen is kept. Blob files are removed in a worker thread.
+
+    Returns:
+        A dict with files_deleted, blobs_deleted, bytes_freed, bytes_remaining and stale_uploads_expired.
     """
-    logger.info(f"Conceptual cleanup: Would scan {os.path.join(base_upload_dir, 'uploads')} for files older than {max_age_days} days.")
-    # This would involve:
-    # 1. Listing all file_id directories in 'uploads'.
-    # 2. For each directory, checking its creation/modification time.
-    # 3. If older than max_age_days, remove the directory and its contents.
-    # This needs careful implementation to avoid race conditions or errors.
-    pass
+    max_age_days = max_age_days if max_age_days is not None else settings.UPLOAD_MAX_AGE_DAYS
+    quota_bytes = quota_bytes if quota_bytes is not None else settings.UPLOAD_QUOTA_BYTES
+    now = datetime.now(timezone.utc)
+    expire_before = (now - timedelta(days=max_age_days)).isoformat()
+    grace_after = (now - timedelta(seconds=settings.UPLOAD_GC_GRACE_SECONDS)).isoformat()
+    active_since = (now - timedelta(days=settings.UPLOAD_GC_ACTIVE_SESSION_DAYS)).isoformat()
+    protected = await chat_sessions.get_active_file_ids(active_since)
+
+    report = {"files_deleted": 0, "blobs_deleted": 0, "bytes_freed": 0, "bytes_remaining": 0}
+    from .chunked_uploads import expire_stale_uploads # Imported here: chunked_uploads builds on this module
+    report["stale_uploads_expired"] = await expire_stale_uploads(
+        base_upload_dir, (now - timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)).isoformat()
+    )
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute("SELECT COALESCE(SUM(size), 0) FROM upload_blobs") as cursor:
+            total_bytes = (await cursor.fetchone())[0]
+        async with db.execute(
+            "SELECT file_id, sha256, last_accessed_at FROM uploaded_files WHERE last_accessed_at < ? ORDER BY last_accessed_at",
+            (grace_after,),
+        ) as cursor:
+            candidates = [row for row in await cursor.fetchall() if row[0] not in protected]
+        async with db.execute("SELECT sha256, COUNT(*) FROM uploaded_files GROUP BY sha256") as cursor:
+            blob_refs = dict(await cursor.fetchall())
+        async with db.execute("SELECT sha256, size FROM upload_blobs") as cursor:
+            blob_sizes = dict(await cursor.fetchall())
+
+        # Walk the candidates oldest access first: expired files always go, the rest only while over quota.
+        # A blob's bytes only count as freed once the last file referencing it is deleted.
+        to_delete: List[str] = []
+        projected_bytes = total_bytes
+        for file_id, sha256, last_accessed_at in candidates:
+            if last_accessed_at >= expire_before and projected_bytes <= quota_bytes:
+                break
+            to_delete.append(file_id)
+            blob_refs[sha256] -= 1
+            if blob_refs[sha256] == 0:
+                projected_bytes -= blob_sizes.get(sha256, 0)
+
+        for start in range(0, len(to_delete), settings.UPLOAD_GC_BATCH_SIZE):
+            batch = to_delete[start:start + settings.UPLOAD_GC_BATCH_SIZE]
+            async with _store_lock:
+                # Holding the write lock, access-time updates and session changes wait until the batch is gone.
+                await db.execute("BEGIN IMMEDIATE")
+                protected = await chat_sessions.get_active_file_ids(active_since)
+                placeholders = ", ".join("?" for _ in batch)
+                async with db.execute(
+                    f"SELECT file_id FROM uploaded_files WHERE file_id IN ({placeholders}) AND last_accessed_at < ?",
+                    (*batch, grace_after),
+                ) as cursor:
+                    batch = [row[0] for row in await cursor.fetchall() if row[0] not in protected]
+                if not batch:
+                    await db.rollback()
+                    continue
+                blobs_deleted, bytes_freed = await _delete_files(db, batch, base_upload_dir)
+            report["files_deleted"] += len(batch)
+            report["blobs_deleted"] += blobs_deleted
+            report["bytes_freed"] += bytes_freed
+
+    report["bytes_remaining"] = total_bytes - report["bytes_freed"]
+    if report["files_deleted"]:
+        logger.info(
+            f"Upload GC deleted {report['files_deleted']} file(s) and {report['blobs_deleted']} blob(s), "
+            f"freed {report['bytes_freed']} bytes; {report['bytes_remaining']} bytes remain (quota {quota_bytes})."
+        )
+    if report["bytes_remaining"] > quota_bytes:
+        logger.warning(f"Uploads still use {report['bytes_remaining']} bytes, over the {quota_bytes} byte quota; the rest is in use.")
+    return report
+
+
+async def run_upload_gc_loop(base_upload_dir: str, interval_seconds: Optional[int] = None) -> None:
+    """Background task: runs collect_upload_garbage every UPLOAD_GC_INTERVAL_SECONDS."""
+    interval = interval_seconds or settings.UPLOAD_GC_INTERVAL_SECONDS
+    while True:
+        try:
+            await collect_upload_garbage(base_upload_dir)
+        except Exception as e:
+            logger.error(f"Unexpected error collecting upload garbage: {e}", exc_info=True)
+        await asyncio.sleep(interval)
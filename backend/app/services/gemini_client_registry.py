@@ -0,0 +1,151 @@
+# services/gemini_client_registry.py
+import datetime
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai import protos
+from google.protobuf import field_mask_pb2
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_model_name(model_name: str) -> str:
+    return model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+
+class GeminiKeyClient:
+    """
+    One configured set of Gemini service clients for a single API key, plus per-model handles.
+
+    `genai.configure()` mutates process-global state, so two concurrent requests on different keys
+    can overwrite each other's configuration. Each GeminiKeyClient instead owns a private client
+    manager configured with its own key; model handles are bound to that manager's generative client
+    and reused across requests.
+    """
+
+    def __init__(self, api_key: str):
+        self.key_suffix = api_key[-4:]
+        self._manager = genai_client._ClientManager()
+        self._manager.configure(api_key=api_key)
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._cached_content_models: Dict[str, genai.GenerativeModel] = {}
+        self._model_info: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    # --- Service clients (created lazily by the client manager, one per service) ---
+    @property
+    def generative_client(self):
+        return self._manager.get_default_client("generative")
+
+    @property
+    def model_client(self):
+        return self._manager.get_default_client("model")
+
+    @property
+    def cache_client(self):
+        return self._manager.get_default_client("cache")
+
+    def _bind(self, model: genai.GenerativeModel) -> genai.GenerativeModel:
+        # GenerativeModel falls back to the global default client when `_client` is unset.
+        model._client = self.generative_client
+        return model
+
+    # --- Model handles and metadata ---
+    def get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Returns the cached GenerativeModel handle for `model_name`, bound to this key."""
+        model_key = _normalize_model_name(model_name)
+        with self._lock:
+            model = self._models.get(model_key)
+            if model is None:
+                model = self._bind(genai.GenerativeModel(model_name=model_key))
+                self._models[model_key] = model
+                logger.debug(f"Created GenerativeModel handle for '{model_key}' (key ...{self.key_suffix}).")
+            return model
+
+    def get_cached_content_model(self, cached_content_name: str) -> genai.GenerativeModel:
+        """Returns a GenerativeModel handle whose context is the given CachedContent, bound to this key."""
+        with self._lock:
+            model = self._cached_content_models.get(cached_content_name)
+        if model is not None:
+            return model
+
+        cached_content = self.get_cached_content(cached_content_name)
+        model = self._bind(genai.GenerativeModel(model_name=cached_content.model))
+        model._cached_content = cached_content.name
+        with self._lock:
+            self._cached_content_models[cached_content_name] = model
+        return model
+
+    def forget_cached_content_model(self, cached_content_name: str) -> None:
+        with self._lock:
+            self._cached_content_models.pop(cached_content_name, None)
+
+    def get_model_info(self, model_name: str) -> Any:
+        """Returns the `genai.types.Model` metadata (e.g., input_token_limit) for `model_name`, fetched once."""
+        model_key = _normalize_model_name(model_name)
+        with self._lock:
+            info = self._model_info.get(model_key)
+        if info is None:
+            info = genai.get_model(model_key, client=self.model_client)
+            with self._lock:
+                self._model_info[model_key] = info
+        return info
+
+    def seed_model_info(self, models: Iterable[Any]) -> None:
+        """Stores model metadata already obtained from list_models, avoiding later get_model calls."""
+        with self._lock:
+            for model_info in models:
+                self._model_info[model_info.name] = model_info
+
+    def list_models(self) -> Iterable[Any]:
+        return genai.list_models(client=self.model_client)
+
+    # --- Cached content operations (genai.caching.CachedContent always uses the global client) ---
+    def create_cached_content(self, **kwargs) -> Any:
+        request = genai.caching.CachedContent._prepare_create_request(**kwargs)
+        response = self.cache_client.create_cached_content(request)
+        return genai.caching.CachedContent._from_obj(response)
+
+    def get_cached_content(self, cache_name: str) -> Any:
+        if "cachedContents/" not in cache_name:
+            cache_name = "cachedContents/" + cache_name
+        response = self.cache_client.get_cached_content(protos.GetCachedContentRequest(name=cache_name))
+        return genai.caching.CachedContent._from_obj(response)
+
+    def update_cached_content_ttl(self, cache_name: str, ttl_seconds: int) -> Any:
+        updates = protos.CachedContent(name=cache_name, ttl=datetime.timedelta(seconds=ttl_seconds))
+        request = protos.UpdateCachedContentRequest(
+            cached_content=updates,
+            update_mask=field_mask_pb2.FieldMask(paths=["ttl"])
+        )
+        response = self.cache_client.update_cached_content(request)
+        return genai.caching.CachedContent._from_obj(response)
+
+    def list_cached_contents(self, page_size: int = 50) -> List[Any]:
+        request = protos.ListCachedContentsRequest(page_size=page_size)
+        return [genai.caching.CachedContent._from_obj(c) for c in self.cache_client.list_cached_contents(request)]
+
+    def delete_cached_content(self, cache_name: str) -> None:
+        self.cache_client.delete_cached_content(protos.DeleteCachedContentRequest(name=cache_name))
+        self.forget_cached_content_model(cache_name)
+
+
+_clients: Dict[str, GeminiKeyClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_key_client(api_key: str) -> GeminiKeyClient:
+    """Returns the process-wide GeminiKeyClient for `api_key`, creating it on first use."""
+    registry_key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with _clients_lock:
+        key_client = _clients.get(registry_key)
+        if key_client is None:
+            key_client = GeminiKeyClient(api_key)
+            _clients[registry_key] = key_client
+            logger.info(f"Configured Gemini client for API key ...{api_key[-4:]}.")
+        return key_client
+
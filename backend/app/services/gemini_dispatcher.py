@@ -0,0 +1,298 @@
+# services/gemini_dispatcher.py
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from . import gemini_service
+from ..config import settings
+from ..utils.token_utils import estimate_tokens, estimate_tokens_for_parts
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH) # Dispatch order: interactive always goes first
+
+_WINDOW_SECONDS = 60.0
+_WAIT_SAMPLES_KEPT = 500 # Recent wait times kept per class for percentiles
+
+
+@dataclass
+class _PendingRequest:
+    priority: str
+    user_id: str
+    prompt_parts: List[str]
+    selected_model: str
+    generation_config_dict: Optional[Dict[str, Any]]
+    cached_content_name: Optional[str]
+    cached_prefix_tokens: int
+    pinned_api_key: Optional[str]
+    estimated_tokens: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class _KeyUsageWindow:
+    """Requests and tokens started on one API key within the last minute."""
+
+    def __init__(self):
+        self._events: Deque[List[float]] = deque() # [started_at, tokens]
+
+    def _purge(self, now: float) -> None:
+        while self._events and now - self._events[0][0] >= _WINDOW_SECONDS:
+            self._events.popleft()
+
+    def usage(self, now: float) -> Tuple[int, int]:
+        self._purge(now)
+        return len(self._events), int(sum(tokens for _, tokens in self._events))
+
+    def seconds_until_next_expiry(self, now: float) -> float:
+        self._purge(now)
+        return max(_WINDOW_SECONDS - (now - self._events[0][0]), 0.0) if self._events else 0.0
+
+    def record(self, now: float, tokens: int) -> List[float]:
+        event = [now, tokens]
+        self._events.append(event)
+        return event
+
+
+class GeminiDispatcher:
+    """
+    Priority-aware dispatch queue in front of gemini_service.call_gemini_api.
+
+    - Two classes: interactive and batch. Queued interactive requests are always dispatched before batch ones.
+    - Batch traffic may only use (1 - DISPATCH_INTERACTIVE_RESERVED_SHARE) of each key's RPM/TPM, so a share of
+      every key's quota stays available for interactive requests. A limit of 0 means no limit.
+    - Within a class, users are served round-robin (per-user fair share); each user's requests stay FIFO.
+    - Queue wait time per class is recorded and exposed by get_metrics().
+
+    Only calls made by this backend process go through the dispatcher (chat, history compaction, document
+    summaries). The weekly batch generator of the main API (app/services/batch_analysis_service.py) runs in
+    another process with its own key and pacer (BATCH_REQUESTS_PER_MINUTE); give it a key that is not in
+    GEMINI_API_KEYS so it cannot use up the quota of the chat keys.
+    """
+
+    def __init__(self, api_keys: List[str], rpm_limit: int, tpm_limit: int, interactive_reserved_share: float):
+        self.api_keys = list(api_keys)
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.interactive_reserved_share = interactive_reserved_share
+        self._windows: Dict[str, _KeyUsageWindow] = {key: _KeyUsageWindow() for key in self.api_keys}
+        # priority -> user_id -> FIFO of that user's requests; OrderedDict order is the round-robin order
+        self._queues: Dict[str, "OrderedDict[str, Deque[_PendingRequest]]"] = {p: OrderedDict() for p in PRIORITY_CLASSES}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self._in_flight: Dict[str, int] = {p: 0 for p in PRIORITY_CLASSES}
+        self._wait_stats: Dict[str, Dict[str, Any]] = {
+            p: {"dispatched": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0, "recent": deque(maxlen=_WAIT_SAMPLES_KEPT)}
+            for p in PRIORITY_CLASSES
+        }
+
+    # --- Quota accounting ---
+    def _class_limits(self, priority: str) -> Tuple[float, float]:
+        share = 1.0 if priority == PRIORITY_INTERACTIVE else max(1.0 - self.interactive_reserved_share, 0.0)
+        return (
+            self.rpm_limit * share if self.rpm_limit > 0 else float("inf"),
+            self.tpm_limit * share if self.tpm_limit > 0 else float("inf"),
+        )
+
+    def _has_capacity(self, api_key: str, priority: str, estimated_tokens: int, now: float) -> bool:
+        rpm_allowed, tpm_allowed = self._class_limits(priority)
+        requests, tokens = self._windows[api_key].usage(now)
+        if requests + 1 > rpm_allowed:
+            return False
+        # A single prompt larger than the class TPM share may still run on an idle key, otherwise it would never run.
+        return tokens + estimated_tokens <= tpm_allowed or requests == 0
+
+    def select_api_key(self, priority: str = PRIORITY_INTERACTIVE) -> str:
+        """Returns the key with the most remaining request capacity for `priority` (random among ties)."""
+        if not self.api_keys:
+            raise ValueError("No Gemini API keys configured.")
+        now = time.monotonic()
+        rpm_allowed, _ = self._class_limits(priority)
+        remaining = {key: rpm_allowed - self._windows[key].usage(now)[0] for key in self.api_keys}
+        best = max(remaining.values())
+        return random.choice([key for key, value in remaining.items() if value == best])
+
+    # --- Public API ---
+    async def submit(
+        self,
+        prompt_parts: List[str],
+        selected_model: str,
+        priority: str = PRIORITY_INTERACTIVE,
+        user_id: Optional[str] = None,
+        api_key: Optional[str] = None,
+        generation_config_dict: Optional[Dict[str, Any]] = None,
+        cached_content_name: Optional[str] = None,
+        cached_prefix_tokens: int = 0
+    ) -> Tuple[str, bool]:
+        """
+        Queues a Gemini call and waits for its result (same return value as call_gemini_api).
+        `api_key` pins the call to one key (required when `cached_content_name` is set, as caches are per key).
+        `cached_prefix_tokens` is the estimated size of the cached content; it counts towards the key's TPM.
+        """
+        response_text, was_truncated, _ = await self.submit_timed(
+            prompt_parts, selected_model, priority, user_id, api_key, generation_config_dict,
+            cached_content_name, cached_prefix_tokens
+        )
+        return response_text, was_truncated
+
+    async def submit_timed(
+        self,
+        prompt_parts: List[str],
+        selected_model: str,
+        priority: str = PRIORITY_INTERACTIVE,
+        user_id: Optional[str] = None,
+        api_key: Optional[str] = None,
+        generation_config_dict: Optional[Dict[str, Any]] = None,
+        cached_content_name: Optional[str] = None,
+        cached_prefix_tokens: int = 0
+    ) -> Tuple[str, bool, float]:
+        """
+        Same as submit, plus the seconds the Gemini call itself took, without the time spent queued
+        (for latency statistics that should not depend on the current load).
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{priority}'. Expected one of {PRIORITY_CLASSES}.")
+        if api_key is not None and api_key not in self._windows:
+            self._windows[api_key] = _KeyUsageWindow()
+        self._ensure_scheduler()
+
+        request = _PendingRequest(
+            priority=priority,
+            user_id=user_id or "anonymous",
+            prompt_parts=prompt_parts,
+            selected_model=selected_model,
+            generation_config_dict=generation_config_dict,
+            cached_content_name=cached_content_name,
+            cached_prefix_tokens=cached_prefix_tokens,
+            pinned_api_key=api_key,
+            estimated_tokens=estimate_tokens_for_parts(prompt_parts) + cached_prefix_tokens,
+            future=asyncio.get_running_loop().create_future()
+        )
+        self._queues[priority].setdefault(request.user_id, deque()).append(request)
+        self._wakeup.set()
+        return await request.future
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue wait time (count, mean, p50, p95, max), queue length and in-flight calls per priority class."""
+        metrics: Dict[str, Any] = {}
+        for priority in PRIORITY_CLASSES:
+            stats = self._wait_stats[priority]
+            recent = sorted(stats["recent"])
+            metrics[priority] = {
+                "queued": sum(len(q) for q in self._queues[priority].values()),
+                "in_flight": self._in_flight[priority],
+                "dispatched": stats["dispatched"],
+                "wait_seconds_mean": round(stats["total_wait_seconds"] / stats["dispatched"], 3) if stats["dispatched"] else 0.0,
+                "wait_seconds_p50": round(recent[len(recent) // 2], 3) if recent else 0.0,
+                "wait_seconds_p95": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)], 3) if recent else 0.0,
+                "wait_seconds_max": round(stats["max_wait_seconds"], 3),
+            }
+        return metrics
+
+    # --- Scheduling ---
+    def _ensure_scheduler(self) -> None:
+        if self._scheduler_task is None or self._scheduler_task.done():
+            self._wakeup = asyncio.Event()
+            self._scheduler_task = asyncio.get_running_loop().create_task(self._run_scheduler())
+
+    def _next_dispatchable(self, now: float) -> Tuple[Optional[_PendingRequest], Optional[str], float]:
+        """
+        Finds the first request, in priority then round-robin order, that some key has capacity for.
+        Returns (request, api_key, 0) or (None, None, seconds_until_capacity_may_free_up).
+        """
+        retry_after = _WINDOW_SECONDS
+        for priority in PRIORITY_CLASSES:
+            for user_queue in self._queues[priority].values():
+                request = user_queue[0]
+                candidate_keys = [request.pinned_api_key] if request.pinned_api_key else self.api_keys
+                usable = [k for k in candidate_keys if self._has_capacity(k, priority, request.estimated_tokens, now)]
+                if usable:
+                    best_key = min(usable, key=lambda k: self._windows[k].usage(now))
+                    return request, best_key, 0.0
+                for key in candidate_keys:
+                    retry_after = min(retry_after, self._windows[key].seconds_until_next_expiry(now))
+        return None, None, max(retry_after, 0.05)
+
+    async def _run_scheduler(self) -> None:
+        while True:
+            if not any(self._queues[p] for p in PRIORITY_CLASSES):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            request, api_key, retry_after = self._next_dispatchable(now)
+            if request is None:
+                # No quota right now: wait for the window to free up or for a new (possibly interactive) arrival.
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=retry_after)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            user_queues = self._queues[request.priority]
+            user_queues[request.user_id].popleft()
+            if user_queues[request.user_id]:
+                user_queues.move_to_end(request.user_id) # Next turn goes to the other users of this class
+            else:
+                del user_queues[request.user_id]
+
+            wait_seconds = now - request.enqueued_at
+            stats = self._wait_stats[request.priority]
+            stats["dispatched"] += 1
+            stats["total_wait_seconds"] += wait_seconds
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait_seconds)
+            stats["recent"].append(wait_seconds)
+            logger.info(f"Dispatching {request.priority} Gemini call for user '{request.user_id}' on key ...{api_key[-4:]} after {wait_seconds:.2f}s in queue.")
+
+            usage_event = self._windows[api_key].record(now, request.estimated_tokens)
+            self._in_flight[request.priority] += 1
+            asyncio.get_running_loop().create_task(self._execute(request, api_key, usage_event))
+
+    async def _execute(self, request: _PendingRequest, api_key: str, usage_event: List[float]) -> None:
+        try:
+            # call_gemini_api is blocking; run it in a worker thread so the event loop stays responsive.
+            started_at = time.perf_counter()
+            response_text, was_truncated = await asyncio.to_thread(
+                gemini_service.call_gemini_api,
+                prompt_parts=request.prompt_parts,
+                current_api_key=api_key,
+                selected_model=request.selected_model,
+                generation_config_dict=request.generation_config_dict,
+                cached_content_name=request.cached_content_name,
+                cached_prefix_tokens=request.cached_prefix_tokens
+            )
+            execution_seconds = time.perf_counter() - started_at
+            usage_event[1] += estimate_tokens(response_text) # Output tokens count towards TPM as well
+            if not request.future.done():
+                request.future.set_result((response_text, was_truncated, execution_seconds))
+        except Exception as e:
+            logger.error(f"Dispatched Gemini call failed: {e}", exc_info=True)
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self._in_flight[request.priority] -= 1
+            self._wakeup.set()
+
+
+_dispatcher: Optional[GeminiDispatcher] = None
+
+
+def get_dispatcher() -> GeminiDispatcher:
+    """Returns the process-wide dispatcher for the configured Gemini API keys."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = GeminiDispatcher(
+            api_keys=settings.AVAILABLE_GEMINI_API_KEYS,
+            rpm_limit=settings.GEMINI_RPM_LIMIT_PER_KEY,
+            tpm_limit=settings.GEMINI_TPM_LIMIT_PER_KEY,
+            interactive_reserved_share=settings.DISPATCH_INTERACTIVE_RESERVED_SHARE
+        )
+    return _dispatcher
@@ -7,9 +7,20 @@ import logging
 from typing import List, Dict, Optional, Any, Tuple
 # Assuming app_settings.py will be moved to backend/app/config/settings.py
 from ..config.settings import TOKEN_SAFETY_FACTOR
+from .gemini_client_registry import get_key_client
+from . import model_catalog, prompt_planner
 
 logger = logging.getLogger(__name__)
 
+
+class CachedContentNotFoundError(Exception):
+    """Raised by call_gemini_api when the CachedContent it was asked to use no longer exists remotely."""
+
+    def __init__(self, cache_name: str, details: str = ""):
+        super().__init__(f"Cached content '{cache_name}' not found. {details}".strip())
+        self.cache_name = cache_name
+
+
 def call_gemini_api(
     prompt_parts: List[str],
     current_api_key: str, # Changed from api_keys_list
@@ -17,7 +28,8 @@ def call_gemini_api(
     # global_rpm and global_tpm removed, to be handled by API router or dedicated service
     generation_config_dict: Optional[Dict[str, Any]] = None,
     cached_content_name: Optional[str] = None,
-    logger_object: Optional[logging.Logger] = None # Added logger_object
+    logger_object: Optional[logging.Logger] = None, # Added logger_object
+    cached_prefix_tokens: int = 0
 ) -> Tuple[str, bool]: # Return type remains Tuple[str, bool]
     """
     Calls the Gemini API to generate content. Logging is included.
@@ -30,10 +42,16 @@ def call_gemini_api(
         generation_config_dict: Gemini generation configuration dictionary.
         cached_content_name: Name of the cached content to use.
         logger_object: Optional logger instance. If None, uses module-level logger.
+        cached_prefix_tokens: Estimated size of the cached content; it counts against the model's input
+                              limit, so prompt_parts are fitted into what remains.
 
     Returns:
         Tuple[str, bool]: The text result from the Gemini API (or an error message)
                           and a boolean indicating if truncation occurred.
+
+    Raises:
+        CachedContentNotFoundError: If `cached_content_name` is given and Gemini reports it as missing
+                                    (expired or deleted); the caller should drop it and resend the full prompt.
     """
     effective_logger = logger_object if logger_object else logger
     effective_logger.info(f"Executing call_gemini_api. Model: {selected_model}, Using Cache: {'Yes' if cached_content_name else 'No'}, Prompt Parts Count: {len(prompt_parts)}")
@@ -49,23 +67,33 @@ def call_gemini_api(
     # Assumes current_api_key is valid and respects rate limits.
 
     try:
-        effective_logger.info(f"Configuring Gemini with API key ending in ...{current_api_key[-4:]} (Model: {selected_model})...")
-        genai.configure(api_key=current_api_key)
-        model = genai.GenerativeModel(model_name=selected_model)
-        effective_logger.debug(f"Gemini model instance created: {model}")
+        # Per-key client and model handles are reused across calls; no process-global genai.configure().
+        key_client = get_key_client(current_api_key)
+        if cached_content_name:
+            # The cached prefix (system instruction + core documents) is bound to the model instance;
+            # prompt_parts then only carry the new suffix of the conversation.
+            model = key_client.get_cached_content_model(cached_content_name)
+        else:
+            model = key_client.get_model(selected_model)
+        effective_logger.debug(f"Gemini model handle obtained (key ...{current_api_key[-4:]}): {model.model_name}")
 
         # --- Token Counting and Truncation Logic (using helper function) ---
         final_contents_for_api_call = [str(p) for p in prompt_parts]
 
         try:
-            model_token_limit = model.input_token_limit
+            # Prefer the in-memory catalog snapshot; only query the model endpoint if the model is not in it.
+            model_token_limit = model_catalog.get_model_input_token_limit(selected_model)
+            if model_token_limit is None:
+                model_token_limit = key_client.get_model_info(selected_model).input_token_limit
             #TOKEN_SAFETY_FACTOR should be imported from new location
             effective_token_limit = int(model_token_limit * TOKEN_SAFETY_FACTOR)
             effective_logger.info(f"call_gemini_api: Model '{selected_model}' input token limit: {model_token_limit}, Effective limit (x{TOKEN_SAFETY_FACTOR}): {effective_token_limit}")
 
-            final_contents_for_api_call, was_truncated = _truncate_prompt_parts(
-                prompt_parts, model, effective_token_limit, effective_logger # Pass effective_logger
-            )
+            # Callers normally plan the prompt with prompt_planner.plan_prompt already; this is a local-estimate
+            # safety net that trims (never drops) middle parts, without remote count_tokens calls.
+            if cached_prefix_tokens:
+                effective_logger.info(f"call_gemini_api: ~{cached_prefix_tokens} tokens are in the cached prefix; {effective_token_limit - cached_prefix_tokens} remain for the prompt parts.")
+            final_contents_for_api_call, was_truncated = prompt_planner.fit_prompt_parts(prompt_parts, effective_token_limit - cached_prefix_tokens)
             if was_truncated:
                 effective_logger.info("call_gemini_api: Prompt was truncated due to token limit.")
 
@@ -90,8 +118,7 @@ def call_gemini_api(
             generation_config=generation_config_obj,
             safety_settings=None,
             tools=None,
-            tool_config=None,
-            cached_content=cached_content_name
+            tool_config=None
         )
         effective_logger.info(f"Gemini API call successful (Key ...{current_api_key[-4:]}, Model {selected_model}).")
 
@@ -131,6 +158,12 @@ def call_gemini_api(
     except google.api_core.exceptions.InvalidArgument as e:
         effective_logger.error(f"Gemini API Error (InvalidArgument) with key ...{current_api_key[-4:]}, model {selected_model}: {str(e)}", exc_info=True)
         return f"Error: Invalid argument when calling Gemini API (e.g., model name '{selected_model}' incorrect or content inappropriate). Details: {str(e)}", was_truncated
+    except google.api_core.exceptions.NotFound as e:
+        if cached_content_name:
+            effective_logger.warning(f"Gemini API Error (NotFound) for cached content '{cached_content_name}' (Key ...{current_api_key[-4:]}): {str(e)}")
+            raise CachedContentNotFoundError(cached_content_name, str(e)) from e
+        effective_logger.error(f"Gemini API Error (NotFound) with key ...{current_api_key[-4:]}, model {selected_model}: {str(e)}", exc_info=True)
+        return f"Error: Model '{selected_model}' or resource not found. Details: {str(e)}", was_truncated
     except google.api_core.exceptions.ResourceExhausted as re:
         effective_logger.error(f"Gemini API Error (ResourceExhausted) with key ...{current_api_key[-4:]}, model {selected_model}: {str(re)}", exc_info=True)
         # Key rotation logic removed. Caller should handle rate limit issues.
@@ -140,87 +173,13 @@ def call_gemini_api(
         return f"Unexpected error calling Gemini API: {type(e).__name__} - {str(e)}", was_truncated
 
 
-def _truncate_prompt_parts(prompt_parts: List[str], model: Any, effective_token_limit: int, logger_object: logging.Logger) -> Tuple[List[str], bool]:
-    """
-    Intelligently truncates a list of prompt parts to fit within the token limit.
-
-    Args:
-        prompt_parts: Original list of prompt parts.
-        model: Gemini model object (for count_tokens).
-        effective_token_limit: Effective token limit after applying safety factor.
-        logger_object: Logger instance for logging.
-
-    Returns:
-        Tuple[List[str], bool]: List of truncated prompt parts and a boolean (True if truncation occurred).
-    """
-    was_truncated = False
-    # Ensure all parts are strings for token counting and processing
-    contents_for_token_count = [str(p) for p in prompt_parts]
-
-    try:
-        token_count_response = model.count_tokens(contents_for_token_count)
-        current_tokens = token_count_response.total_tokens
-        logger_object.info(f"_truncate_prompt_parts: Initial token count: {current_tokens}, Limit: {effective_token_limit}")
-    except Exception as e_count_tokens:
-        logger_object.error(f"_truncate_prompt_parts: Error counting tokens: {e_count_tokens}. Truncation cannot be performed.", exc_info=True)
-        return prompt_parts, False # Return original parts, not truncated
-
-    if current_tokens > effective_token_limit:
-        logger_object.warning(f"_truncate_prompt_parts: Token count {current_tokens} exceeds effective limit {effective_token_limit}. Starting truncation...")
-        was_truncated = True
-        num_parts_original = len(contents_for_token_count)
-
-        # Strategy: Preserve system prompt (first part) and user question (last part) if possible,
-        # truncate middle parts (e.g., context, history).
-        if num_parts_original <= 1: # Cannot truncate if only one part or empty
-            logger_object.warning(f"_truncate_prompt_parts: Cannot truncate further, only {num_parts_original} part(s). Content might still exceed limit.")
-            # Even if it exceeds, we can't do much here with this strategy.
-            # The API call might fail, or the model might truncate internally.
-            return contents_for_token_count, was_truncated
-
-        # Identify parts: system (first), user (last), middle (context/history)
-        system_prompt_part = [contents_for_token_count[0]] if num_parts_original > 0 else []
-        # Handle case where there's only one part, it becomes system_prompt, user_question is empty
-        user_question_part = [contents_for_token_count[-1]] if num_parts_original > 1 else []
-
-        # Middle parts are those between the first and the last.
-        # If num_parts_original is 2, middle_parts_to_truncate will be empty.
-        # If num_parts_original is 1, user_question_part is empty, this slice is also empty.
-        middle_parts_to_truncate = list(contents_for_token_count[len(system_prompt_part):-len(user_question_part)] if num_parts_original > 1 else [])
-
-        # Iteratively remove from the beginning of middle_parts_to_truncate
-        while current_tokens > effective_token_limit and middle_parts_to_truncate:
-            middle_parts_to_truncate.pop(0) # Remove the oldest/earliest middle part
-            temp_contents = system_prompt_part + middle_parts_to_truncate + user_question_part
-
-            try:
-                token_count_response = model.count_tokens(temp_contents)
-                current_tokens = token_count_response.total_tokens
-                logger_object.info(f"_truncate_prompt_parts: After removing a middle part, new token count: {current_tokens}")
-            except Exception as e_recount:
-                logger_object.error(f"_truncate_prompt_parts: Error re-counting tokens during truncation: {e_recount}. Stopping truncation.", exc_info=True)
-                # Return current state of truncation, even if recount failed
-                return temp_contents, was_truncated
-
-        contents_for_token_count = system_prompt_part + middle_parts_to_truncate + user_question_part
-
-        # Final check if still over limit (e.g., system + user prompt alone are too big)
-        if current_tokens > effective_token_limit:
-            logger_object.warning(f"_truncate_prompt_parts: After truncating middle parts, token count ({current_tokens}) might still be over limit. The first/last parts might be too large.")
-            # If only system and user parts remain (or just system), and it's still too long,
-            # we don't truncate them further here. The API call might fail.
-            # A more aggressive strategy could truncate the content of these parts too.
-    else:
-        logger_object.info(f"_truncate_prompt_parts: Token count {current_tokens} is within the limit. No truncation needed.")
-
-    return contents_for_token_count, was_truncated
-
 def create_gemini_cache(
     api_key: str,
     model_name: str,
     cache_display_name: str,
     system_instruction: str,
-    ttl_seconds: int
+    ttl_seconds: int,
+    contents: Optional[List[str]] = None
 ) -> Tuple[Optional[Any], Optional[str]]:
     """
     Creates or updates a Gemini content cache. Logging is included.
@@ -231,10 +190,11 @@ def create_gemini_cache(
         cache_display_name: Display name for the cache.
         system_instruction: System instruction/content to cache.
         ttl_seconds: Time-to-live for the cache in seconds.
+        contents: Optional additional content parts (e.g., core documents) to cache after the system instruction.
 
     Returns:
         Tuple[Optional[genai.CachedContent], Optional[str]]:
-            - genai.CachedContent object if successful.
+            - genai.caching.CachedContent object if successful.
             - Error message string if failed.
     """
     logger.info(f"Starting to create/update content cache. Display Name: '{cache_display_name}', Model: '{model_name}', TTL: {ttl_seconds}s")
@@ -246,23 +206,18 @@ def create_gemini_cache(
         return None, msg
 
     try:
-        logger.debug(f"Configuring genai with API key ...{api_key[-4:]} for cache operation.")
-        genai.configure(api_key=api_key)
         ttl_str = f"{ttl_seconds}s"
 
         # Ensure model name for caching API is correctly formatted
         model_for_caching_api = f"models/{model_name}" if not model_name.startswith("models/") else model_name
         logger.debug(f"Model API name for caching: {model_for_caching_api}")
 
-        logger.info(f"Calling genai.create_cached_content API. Display Name: '{cache_display_name}'")
-        # Note: The parameter for the main content might vary (e.g. `system_instruction` or `contents`)
-        # depending on the specific version of the Gemini API client library and model.
-        # Adjust if `system_instruction` is not the correct parameter name for your genai version.
-        cached_content = genai.create_cached_content(
+        logger.info(f"Calling Gemini create_cached_content API. Display Name: '{cache_display_name}', Content parts: {len(contents) if contents else 0}")
+        cached_content = get_key_client(api_key).create_cached_content(
             model=model_for_caching_api,
             display_name=cache_display_name,
             system_instruction=system_instruction,
-            # contents=[genai.types.Content(parts=[genai.types.Part(text=system_instruction)])], # Alternative if system_instruction is not direct
+            contents=[{"role": "user", "parts": [str(p) for p in contents]}] if contents else None,
             ttl=ttl_str
         )
         logger.info(f"Successfully created/updated cache. Display Name: '{cached_content.display_name}', Full Name: {cached_content.name}, Expires: {cached_content.expire_time}")
@@ -273,6 +228,37 @@ def create_gemini_cache(
         return None, f"Cache creation/update failed (Model: {model_name}): {type(e).__name__} - {str(e)}"
 
 
+def refresh_gemini_cache_ttl(api_key: str, cache_name: str, ttl_seconds: int) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Extends the time-to-live of an existing Gemini content cache. Logging is included.
+
+    Args:
+        api_key: Gemini API key for the operation.
+        cache_name: Full name of the cache to refresh (e.g., "cachedContents/...").
+        ttl_seconds: New time-to-live, counted from now, in seconds.
+
+    Returns:
+        Tuple[Optional[genai.caching.CachedContent], Optional[str]]:
+            - The refreshed CachedContent object if successful.
+            - Error message string if failed.
+    """
+    logger.info(f"Refreshing TTL of Gemini content cache '{cache_name}' to {ttl_seconds}s.")
+    if not api_key or not cache_name:
+        msg = "Refresh cache failed: API key and cache name must not be empty."
+        logger.error(msg)
+        return None, msg
+    try:
+        cached_content = get_key_client(api_key).update_cached_content_ttl(cache_name, ttl_seconds)
+        logger.info(f"Successfully refreshed cache '{cache_name}'. New expire time: {cached_content.expire_time}")
+        return cached_content, None
+    except google.api_core.exceptions.NotFound:
+        logger.warning(f"Cache to refresh not found (probably expired): {cache_name}")
+        return None, f"Refresh failed: Cache '{cache_name}' not found."
+    except Exception as e:
+        logger.error(f"Error refreshing content cache '{cache_name}': {type(e).__name__} - {str(e)}", exc_info=True)
+        return None, f"Refresh cache '{cache_name}' failed: {type(e).__name__} - {str(e)}"
+
+
 def list_gemini_caches(api_key: str) -> Tuple[List[Any], Optional[str]]:
     """
     Lists available Gemini content caches. Logging is included.
@@ -291,9 +277,7 @@ def list_gemini_caches(api_key: str) -> Tuple[List[Any], Optional[str]]:
         logger.error(msg)
         return [], msg
     try:
-        logger.debug(f"Configuring genai with API key ...{api_key[-4:]} to list caches.")
-        genai.configure(api_key=api_key)
-        caches = list(genai.list_cached_contents()) # list_cached_contents() returns an iterator
+        caches = get_key_client(api_key).list_cached_contents()
         logger.info(f"Successfully listed {len(caches)} content caches.")
         if caches:
             for i, c in enumerate(caches):
@@ -322,9 +306,7 @@ def delete_gemini_cache(api_key: str, cache_name: str) -> Tuple[bool, Optional[s
         logger.error(msg)
         return False, msg
     try:
-        logger.debug(f"Configuring genai with API key ...{api_key[-4:]} to delete cache '{cache_name}'.")
-        genai.configure(api_key=api_key)
-        genai.delete_cached_content(name=cache_name)
+        get_key_client(api_key).delete_cached_content(cache_name)
         logger.info(f"Successfully deleted content cache: {cache_name}")
         return True, None
     except google.api_core.exceptions.NotFound:
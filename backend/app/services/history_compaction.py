@@ -0,0 +1,155 @@
+# services/history_compaction.py
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from ..utils.token_utils import estimate_tokens
+from .gemini_dispatcher import get_dispatcher, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+DIGEST_ROLE = "summary"
+_DIGEST_HEADER = "**先前對話摘要 (Digest of earlier conversation):**\n"
+
+_DIGEST_INSTRUCTION = """
+請將以下對話整理成一份精簡的摘要，供後續對話作為上下文使用。
+- 保留使用者的目標、偏好、已確認的結論、提到的數據與數字、尚未解決的問題。
+- 省略寒暄與重複內容，不要加入對話中沒有的資訊。
+- 如果提供了先前的摘要，請把新的對話內容整合進去，輸出一份完整的新摘要。
+"""
+
+_compactions_in_progress: Set[str] = set()
+
+
+def _hash_messages(messages: List[Dict[str, Any]]) -> str:
+    canonical = json.dumps(
+        [{"role": m.get("role"), "parts": [str(p) for p in m.get("parts", [])]} for m in messages],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _estimate_history_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(str(p)) for m in messages for p in m.get("parts", []))
+
+
+async def _load_digest(session_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT digest, covered_messages, covered_hash FROM chat_history_digests WHERE session_id = ?", (session_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error loading history digest for session '{session_id}': {e}")
+        return None
+
+
+async def _save_digest(session_id: str, digest: str, covered_messages: int, covered_hash: str) -> None:
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            """
+            INSERT OR REPLACE INTO chat_history_digests (session_id, digest, covered_messages, covered_hash, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (session_id, digest, covered_messages, covered_hash, datetime.now(timezone.utc).isoformat()),
+        )
+        await db.commit()
+
+
+def _usable_digest(digest_row: Optional[Dict[str, Any]], history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The stored digest applies only if the history still starts with exactly the messages it summarises."""
+    if not digest_row or digest_row["covered_messages"] > len(history):
+        return None
+    if _hash_messages(history[:digest_row["covered_messages"]]) != digest_row["covered_hash"]:
+        return None
+    return digest_row
+
+
+async def compact_history_for_prompt(
+    session_id: Optional[str],
+    history: Optional[List[Dict[str, Any]]]
+) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+    """
+    Replaces the older part of a long chat history by the session's cached digest.
+
+    Returns (history for the prompt, whether a digest was used). The history is returned unchanged when
+    compaction is disabled, there is no session id, the history is below HISTORY_COMPACTION_THRESHOLD_TOKENS,
+    or no digest matching this history has been generated yet. This never calls the model.
+    """
+    if not settings.HISTORY_COMPACTION_ENABLED or not session_id or not history:
+        return history, False
+    if _estimate_history_tokens(history) <= settings.HISTORY_COMPACTION_THRESHOLD_TOKENS:
+        return history, False
+
+    digest_row = _usable_digest(await _load_digest(session_id), history)
+    if not digest_row:
+        logger.info(f"No usable history digest for session '{session_id}' yet; sending the full history.")
+        return history, False
+
+    digest_message = {"role": DIGEST_ROLE, "parts": [_DIGEST_HEADER + digest_row["digest"]]}
+    compacted = [digest_message] + history[digest_row["covered_messages"]:]
+    logger.info(f"History of session '{session_id}' compacted: {digest_row['covered_messages']} messages replaced by digest, {len(compacted) - 1} sent verbatim.")
+    return compacted, True
+
+
+async def refresh_history_digest(session_id: Optional[str], history: Optional[List[Dict[str, Any]]], model_name: str) -> None:
+    """
+    Background job run after a chat response is returned: when the part of the history not covered by the
+    digest has grown past the threshold, summarises everything except the last HISTORY_COMPACTION_KEEP_RECENT_MESSAGES
+    (starting from the previous digest) and stores the new digest. Runs at batch priority in the dispatcher.
+    """
+    if not settings.HISTORY_COMPACTION_ENABLED or not session_id or not history:
+        return
+    if session_id in _compactions_in_progress:
+        logger.debug(f"History compaction for session '{session_id}' already running; skipped.")
+        return
+
+    _compactions_in_progress.add(session_id)
+    try:
+        digest_row = _usable_digest(await _load_digest(session_id), history)
+        covered = digest_row["covered_messages"] if digest_row else 0
+        prompt_tokens = _estimate_history_tokens(history[covered:]) + (estimate_tokens(digest_row["digest"]) if digest_row else 0)
+        if prompt_tokens <= settings.HISTORY_COMPACTION_THRESHOLD_TOKENS:
+            return
+
+        target_covered = len(history) - settings.HISTORY_COMPACTION_KEEP_RECENT_MESSAGES
+        if target_covered <= covered:
+            return
+
+        prompt_parts = [_DIGEST_INSTRUCTION]
+        if digest_row:
+            prompt_parts.append(f"**先前的摘要:**\n{digest_row['digest']}")
+        new_turns = "\n".join(
+            f"{m.get('role', 'unknown').capitalize()}: {m.get('parts', [''])[0] if m.get('parts') else ''}"
+            for m in history[covered:target_covered]
+        )
+        prompt_parts.append(f"**需要整合的對話:**\n{new_turns}")
+
+        logger.info(f"Compacting history of session '{session_id}': messages {covered}-{target_covered} into a new digest.")
+        digest_text, _ = await get_dispatcher().submit(
+            prompt_parts=prompt_parts,
+            selected_model=model_name,
+            priority=PRIORITY_BATCH,
+            user_id=session_id,
+            generation_config_dict={"temperature": 0.2, "max_output_tokens": settings.HISTORY_DIGEST_MAX_OUTPUT_TOKENS}
+        )
+        if not digest_text or digest_text.startswith(("Error:", "Unexpected error")):
+            logger.warning(f"History compaction for session '{session_id}' failed: {digest_text[:200] if digest_text else 'empty response'}")
+            return
+
+        await _save_digest(session_id, digest_text.strip(), target_covered, _hash_messages(history[:target_covered]))
+        logger.info(f"History digest for session '{session_id}' stored (covers {target_covered} messages, ~{estimate_tokens(digest_text)} tokens).")
+    except Exception as e:
+        logger.error(f"Error compacting history of session '{session_id}': {e}", exc_info=True)
+    finally:
+        _compactions_in_progress.discard(session_id)
@@ -1,8 +1,19 @@
 # services/model_catalog.py
 # import streamlit as st # Removed Streamlit import
-import google.generativeai as genai
+import asyncio
+import hashlib
+import json
 import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
 from ..config import settings # Changed import path
+from ..db.init_db import get_db_path
+from .gemini_client_registry import get_key_client
 
 logger = logging.getLogger(__name__)
 
@@ -49,7 +60,8 @@ def get_available_models(api_key: str = None): # Made api_key optional
     """
     Fetches available generative models from the Google AI API, filters and sorts them.
     Returns a list of model objects. If api_key is not provided, it attempts to use one from settings.
-    # TODO: Implement caching for this function in the API layer or via a dedicated caching library.
+    This is a live network call; request handlers should read the in-memory snapshot
+    (get_catalog_snapshot) which is refreshed in the background by run_catalog_refresh_loop.
     """
     used_api_key = api_key
     if not used_api_key:
@@ -61,8 +73,9 @@ def get_available_models(api_key: str = None): # Made api_key optional
             return []
 
     try:
-        genai.configure(api_key=used_api_key)
-        models = genai.list_models()
+        key_client = get_key_client(used_api_key)
+        models = list(key_client.list_models())
+        key_client.seed_model_info(models) # Token limits are then known without a per-model get_model call
 
         filtered_models = []
         for model in models:
@@ -80,6 +93,130 @@ def get_available_models(api_key: str = None): # Made api_key optional
         # st.error call removed
         return [] # Return empty list on error
 
+# --- In-memory catalog snapshot (persisted to the DB, refreshed in the background) ---
+_catalog_snapshot: Dict[str, Any] = {"models": [], "etag": None, "fetched_at": None}
+_catalog_lock = threading.Lock()
+
+
+def _model_to_dict(model_obj) -> Dict[str, Any]:
+    """Keeps the JSON-serialisable model fields the API and chat path need."""
+    return {
+        "name": getattr(model_obj, "name", "Unknown Name"),
+        "display_name": getattr(model_obj, "display_name", None) or getattr(model_obj, "name", "Unknown Name"),
+        "input_token_limit": getattr(model_obj, "input_token_limit", None),
+        "output_token_limit": getattr(model_obj, "output_token_limit", None),
+    }
+
+
+def _compute_etag(models: List[Dict[str, Any]]) -> str:
+    payload = json.dumps(models, sort_keys=True, ensure_ascii=False)
+    return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _set_snapshot(models: List[Dict[str, Any]], fetched_at: float) -> None:
+    with _catalog_lock:
+        _catalog_snapshot["models"] = models
+        _catalog_snapshot["etag"] = _compute_etag(models)
+        _catalog_snapshot["fetched_at"] = fetched_at
+
+
+def get_catalog_snapshot() -> Dict[str, Any]:
+    """Returns the current catalog snapshot: {'models': [dict], 'etag': str | None, 'fetched_at': float | None}."""
+    with _catalog_lock:
+        return {
+            "models": list(_catalog_snapshot["models"]),
+            "etag": _catalog_snapshot["etag"],
+            "fetched_at": _catalog_snapshot["fetched_at"],
+        }
+
+
+def get_default_model() -> str:
+    """
+    Returns the default model name, validated against the catalog snapshot.
+    Falls back to the first model in the snapshot if the configured default is unavailable,
+    and to settings.DEFAULT_MODEL_NAME if the snapshot is empty.
+    """
+    models = get_catalog_snapshot()["models"]
+    default_name = settings.DEFAULT_MODEL_NAME
+    if not models or any(m["name"] == default_name for m in models):
+        return default_name
+    logger.warning(f"Default model '{default_name}' not in model catalog; using '{models[0]['name']}'.")
+    return models[0]["name"]
+
+
+def get_model_input_token_limit(model_name: str) -> Optional[int]:
+    """Returns the input token limit for `model_name` from the snapshot, or None if unknown."""
+    normalized = model_name if model_name.startswith("models/") else f"models/{model_name}"
+    for model in get_catalog_snapshot()["models"]:
+        if model["name"] == normalized:
+            return model.get("input_token_limit")
+    return None
+
+
+async def load_catalog_snapshot_from_db() -> bool:
+    """Loads the last persisted snapshot so a cold start can serve /api/config without a network call."""
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            async with db.execute("SELECT models_json, fetched_at FROM model_catalog_snapshot WHERE id = 1") as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            logger.info("No persisted model catalog snapshot found.")
+            return False
+        models = json.loads(row[0])
+        fetched_at = datetime.fromisoformat(row[1]).timestamp()
+        _set_snapshot(models, fetched_at)
+        logger.info(f"Loaded model catalog snapshot from DB: {len(models)} models, fetched at {row[1]}.")
+        return True
+    except Exception as e:
+        logger.error(f"Error loading model catalog snapshot from DB: {e}", exc_info=True)
+        return False
+
+
+async def _save_catalog_snapshot_to_db() -> None:
+    snapshot = get_catalog_snapshot()
+    fetched_at_str = datetime.fromtimestamp(snapshot["fetched_at"], tz=timezone.utc).isoformat()
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO model_catalog_snapshot (id, models_json, etag, fetched_at)
+                VALUES (1, ?, ?, ?)
+                """,
+                (json.dumps(snapshot["models"], ensure_ascii=False), snapshot["etag"], fetched_at_str),
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error saving model catalog snapshot to DB: {e}", exc_info=True)
+
+
+async def refresh_model_catalog() -> bool:
+    """Fetches the live model list (off the event loop) and replaces the snapshot if the fetch succeeded."""
+    models = await asyncio.to_thread(get_available_models)
+    if not models:
+        logger.warning("Model catalog refresh returned no models; keeping the previous snapshot.")
+        return False
+    _set_snapshot([_model_to_dict(m) for m in models], time.time())
+    await _save_catalog_snapshot_to_db()
+    logger.info(f"Model catalog refreshed: {len(models)} models.")
+    return True
+
+
+async def run_catalog_refresh_loop(interval_seconds: Optional[int] = None) -> None:
+    """Background task: refreshes the catalog whenever the snapshot is older than the TTL."""
+    interval = interval_seconds or settings.MODEL_CATALOG_REFRESH_INTERVAL_SECONDS
+    while True:
+        fetched_at = get_catalog_snapshot()["fetched_at"]
+        age = time.time() - fetched_at if fetched_at else None
+        if age is None or age >= interval:
+            try:
+                await refresh_model_catalog()
+            except Exception as e:
+                logger.error(f"Unexpected error refreshing model catalog: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.sleep(interval - age)
+
+
 def format_model_display_name(model_obj) -> str:
     """
     Formats a model object for display (e.g., in logs or API responses).
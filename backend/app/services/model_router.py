@@ -0,0 +1,151 @@
+# services/model_router.py
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from ..config import settings
+from . import model_catalog
+
+logger = logging.getLogger(__name__)
+
+TIER_FLASH = "flash"
+TIER_PRO = "pro"
+
+# Latency priors (base seconds, seconds per 1k prompt tokens) used until a model has enough observations.
+_LATENCY_PRIORS = {TIER_FLASH: (1.5, 0.02), TIER_PRO: (4.0, 0.06)}
+_MIN_OBSERVATIONS_FOR_FIT = 5
+
+
+def get_model_tier(model_name: str) -> Optional[str]:
+    name_lower = model_name.lower()
+    if "flash" in name_lower:
+        return TIER_FLASH
+    if "pro" in name_lower:
+        return TIER_PRO
+    return None
+
+
+@dataclass
+class RoutingDecision:
+    model_name: str
+    tier: Optional[str]
+    reason: str # 'pinned', 'latency_target', 'trigger_action', 'small_prompt', 'large_prompt', 'no_catalog'
+    prompt_tokens: int
+    estimated_latency_ms: Optional[int] = None
+
+
+class ModelLatencyStats:
+    """Recent (latency, prompt tokens, output tokens) observations per model, with a per-model linear latency fit."""
+
+    def __init__(self, window: int):
+        self._window = window
+        self._observations: Dict[str, Deque[Tuple[float, int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, latency_seconds: float, prompt_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            self._observations.setdefault(model_name, deque(maxlen=self._window)).append(
+                (latency_seconds, prompt_tokens, output_tokens)
+            )
+
+    def estimate_latency_seconds(self, model_name: str, prompt_tokens: int) -> float:
+        """Least-squares fit latency = a + b * prompt_tokens over recent calls; tier priors until enough data."""
+        with self._lock:
+            observations = list(self._observations.get(model_name, ()))
+        if len(observations) < _MIN_OBSERVATIONS_FOR_FIT:
+            base, per_1k = _LATENCY_PRIORS.get(get_model_tier(model_name) or TIER_PRO)
+            return base + per_1k * prompt_tokens / 1000
+        xs = [tokens for _, tokens, _ in observations]
+        ys = [latency for latency, _, _ in observations]
+        mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        slope = max(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance, 0.0) if variance else 0.0
+        return max(mean_y + slope * (prompt_tokens - mean_x), 0.0)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per model: call count, latency p50/p95 (ms) and mean prompt/output tokens over the recent window."""
+        with self._lock:
+            snapshot = {name: list(obs) for name, obs in self._observations.items()}
+        result = {}
+        for model_name, observations in snapshot.items():
+            latencies = sorted(latency for latency, _, _ in observations)
+            result[model_name] = {
+                "tier": get_model_tier(model_name),
+                "calls": len(observations),
+                "latency_ms_p50": int(latencies[len(latencies) // 2] * 1000),
+                "latency_ms_p95": int(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000),
+                "prompt_tokens_mean": int(sum(t for _, t, _ in observations) / len(observations)),
+                "output_tokens_mean": int(sum(t for _, _, t in observations) / len(observations)),
+            }
+        return result
+
+
+latency_stats = ModelLatencyStats(settings.MODEL_ROUTING_STATS_WINDOW)
+
+
+def _tier_candidates() -> Dict[str, str]:
+    """Best catalog model per tier (the catalog snapshot is already sorted with '-latest' first)."""
+    candidates: Dict[str, str] = {}
+    for model in model_catalog.get_catalog_snapshot()["models"]:
+        tier = get_model_tier(model["name"])
+        if tier and tier not in candidates:
+            candidates[tier] = model["name"]
+    return candidates
+
+
+def route_model(
+    prompt_tokens: int,
+    requested_model: Optional[str] = None,
+    trigger_action: Optional[str] = None,
+    latency_target_ms: Optional[int] = None
+) -> RoutingDecision:
+    """
+    Chooses between the flash-class and pro-class model of the catalog for one request.
+
+    Order of precedence: an explicitly requested model (or routing disabled) is used as is, so routing only
+    applies when the client left the choice to the server; a latency target
+    picks pro only if its estimated latency meets the target; heavy trigger actions go to pro; otherwise
+    prompts up to MODEL_ROUTING_FLASH_MAX_PROMPT_TOKENS go to flash and larger ones to pro. Estimates come
+    from observed per-model latency (see record_model_call).
+    """
+    fallback_model = requested_model or model_catalog.get_default_model()
+    if requested_model or not settings.MODEL_ROUTING_ENABLED:
+        decision = RoutingDecision(fallback_model, get_model_tier(fallback_model), "pinned", prompt_tokens)
+    else:
+        candidates = _tier_candidates()
+        if TIER_FLASH not in candidates or TIER_PRO not in candidates:
+            decision = RoutingDecision(fallback_model, get_model_tier(fallback_model), "no_catalog", prompt_tokens)
+        elif latency_target_ms is not None:
+            pro_estimate = latency_stats.estimate_latency_seconds(candidates[TIER_PRO], prompt_tokens) * 1000
+            tier = TIER_PRO if pro_estimate <= latency_target_ms else TIER_FLASH
+            decision = RoutingDecision(candidates[tier], tier, "latency_target", prompt_tokens)
+        elif trigger_action in settings.MODEL_ROUTING_PRO_ACTIONS:
+            decision = RoutingDecision(candidates[TIER_PRO], TIER_PRO, "trigger_action", prompt_tokens)
+        elif prompt_tokens <= settings.MODEL_ROUTING_FLASH_MAX_PROMPT_TOKENS:
+            decision = RoutingDecision(candidates[TIER_FLASH], TIER_FLASH, "small_prompt", prompt_tokens)
+        else:
+            decision = RoutingDecision(candidates[TIER_PRO], TIER_PRO, "large_prompt", prompt_tokens)
+
+    decision.estimated_latency_ms = int(latency_stats.estimate_latency_seconds(decision.model_name, prompt_tokens) * 1000)
+    logger.info(
+        f"Model routing decision: model={decision.model_name} tier={decision.tier} reason={decision.reason} "
+        f"prompt_tokens={prompt_tokens} trigger_action={trigger_action} latency_target_ms={latency_target_ms} "
+        f"estimated_latency_ms={decision.estimated_latency_ms}"
+    )
+    return decision
+
+
+def record_model_call(decision: RoutingDecision, latency_seconds: float, output_tokens: int) -> None:
+    """Feeds an observed call back into the latency estimates and logs it next to its routing decision."""
+    latency_stats.record(decision.model_name, latency_seconds, decision.prompt_tokens, output_tokens)
+    logger.info(
+        f"Model call observed: model={decision.model_name} tier={decision.tier} reason={decision.reason} "
+        f"latency_ms={int(latency_seconds * 1000)} estimated_latency_ms={decision.estimated_latency_ms} "
+        f"prompt_tokens={decision.prompt_tokens} output_tokens={output_tokens}"
+    )
+
+
+def get_routing_metrics() -> Dict[str, Dict[str, Any]]:
+    return latency_stats.summary()
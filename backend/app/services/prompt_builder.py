@@ -1,16 +1,21 @@
 # services/prompt_builder.py
 import logging
 import pandas as pd
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 
 logger = logging.getLogger(__name__)
 
+_CORE_DOCS_HEADER = "\n**核心分析文件內容 (Core Analysis Documents Content):**"
+_HISTORY_HEADER = "\n**相關對話歷史 (Relevant Conversation History):**"
+_RETRIEVED_PASSAGES_HEADER = "\n**與問題相關的來源文件片段 (Retrieved Source Passages):**"
+
 def build_gemini_request_contents(
     main_system_prompt: Optional[str],
     core_docs_contents: Optional[List[Dict[str, str]]], # Expecting [{'name': str, 'content': str}]
     external_data_summaries: Optional[Dict[str, Any]], # Expecting {'source_name': data}
     chat_history_for_prompt: Optional[List[Dict[str, Any]]], # Expecting chat history format
-    current_user_input: str
+    current_user_input: str,
+    retrieved_passages: Optional[List[Dict[str, Any]]] = None # Expecting [{'name': str, 'ordinal': int, 'text': str}]
 ) -> List[str]: # Returns a list of strings, to be passed to call_gemini_api's prompt_parts
     """
     Constructs the list of content parts for the Gemini API request.
@@ -21,6 +26,7 @@ def build_gemini_request_contents(
         external_data_summaries: A dictionary where keys are source names and values are data (e.g., DataFrames or strings).
         chat_history_for_prompt: The recent chat history to include.
         current_user_input: The latest user input/question.
+        retrieved_passages: Source document passages retrieved for the current question (see retrieval_index).
 
     Returns:
         A list of strings, where each string is a part of the prompt to be sent to Gemini.
@@ -30,46 +36,24 @@ def build_gemini_request_contents(
     context_summary_log = [] # For logging what context was added
 
     # 1. Main System Prompt
-    if main_system_prompt:
-        prompt_parts.append(f"**主要指示 (System Prompt):**\n{main_system_prompt}")
+    system_part = _format_system_prompt_part(main_system_prompt)
+    if system_part:
+        prompt_parts.append(system_part)
         context_summary_log.append("系統提示詞")
 
     # 2. Core Documents Content
     if core_docs_contents:
-        core_docs_text_parts = ["\n**核心分析文件內容 (Core Analysis Documents Content):**"]
-        files_included_count = 0
-        for doc in core_docs_contents:
-            doc_name = doc.get("name", "未知文件")
-            doc_content = doc.get("content", "")
-            if isinstance(doc_content, str):
-                core_docs_text_parts.append(f"--- Document Start: {doc_name} ---\n{doc_content}\n--- Document End: {doc_name} ---\n")
-                files_included_count += 1
-            elif isinstance(doc_content, pd.DataFrame):
-                core_docs_text_parts.append(f"--- Document Start (Table): {doc_name} ---\n欄位: {', '.join(doc_content.columns)}\n數據 (前5行):\n{doc_content.head(5).to_string()}\n--- Document End (Table): {doc_name} ---\n")
-                files_included_count += 1
-            else: # bytes or other
-                core_docs_text_parts.append(f"--- Document: {doc_name} (二進制或其他格式，長度: {len(doc_content) if hasattr(doc_content, '__len__') else 'N/A'}) ---\n")
-                files_included_count += 1
-
-        if files_included_count > 0:
-            prompt_parts.append("\n".join(core_docs_text_parts))
+        core_docs_part, files_included_count = _format_core_docs_part(core_docs_contents)
+        if core_docs_part:
+            prompt_parts.append(core_docs_part)
             context_summary_log.append(f"{files_included_count}個核心文件")
         logger.debug(f"PromptBuilder: Added {files_included_count} core documents.")
 
     # 3. External Data Summaries
     if external_data_summaries:
-        num_ext_sources = len(external_data_summaries)
-        if num_ext_sources > 0:
-            external_data_str = "\n**已引入的外部市場與總經數據摘要:**"
-            for source, data_items in external_data_summaries.items():
-                external_data_str += f"\n來源: {source.upper()}\n"
-                if isinstance(data_items, dict): # e.g., yfinance returns a dict of DataFrames
-                    for item_name, df_item in data_items.items():
-                        if isinstance(df_item, pd.DataFrame):
-                            external_data_str += f"  {item_name} (最近3筆):\n{df_item.tail(3).to_string(index=False)}\n"
-                elif isinstance(data_items, pd.DataFrame): # e.g., FRED or NY Fed might return a single DataFrame
-                     external_data_str += f"  {source}數據 (最近3筆):\n{data_items.tail(3).to_string(index=False)}\n"
-            prompt_parts.append(external_data_str)
+        external_data_part, num_ext_sources = _format_external_data_part(external_data_summaries)
+        if external_data_part:
+            prompt_parts.append(external_data_part)
             context_summary_log.append(f"{num_ext_sources}個外部數據源")
         logger.debug(f"PromptBuilder: Added {num_ext_sources} external data sources.")
 
@@ -82,19 +66,21 @@ def build_gemini_request_contents(
     # So, this builder might not need to explicitly handle chat_history separately if the caller passes it as part of other contexts.
     # For now, we assume `chat_history_for_prompt` is NOT the main st.session_state.chat_history, but a pre-formatted part.
     if chat_history_for_prompt:
-        history_str_parts = ["\n**相關對話歷史 (Relevant Conversation History):**"]
-        for msg in chat_history_for_prompt: # Assuming it's already filtered/summarized
-            role = msg.get("role", "unknown")
-            content = msg.get("parts", [""])[0] if msg.get("parts") else ""
-            history_str_parts.append(f"{role.capitalize()}: {content}")
-        if len(history_str_parts) > 1: # More than just the header
-            prompt_parts.append("\n".join(history_str_parts))
+        history_part, num_turns = _format_history_part(chat_history_for_prompt)
+        if history_part:
+            prompt_parts.append(history_part)
             context_summary_log.append("相關對話歷史")
-        logger.debug(f"PromptBuilder: Added {len(history_str_parts)-1} relevant history turns.")
+        logger.debug(f"PromptBuilder: Added {num_turns} relevant history turns.")
+
 
+    # 4a. Retrieved passages (per question, so they follow the history rather than the cacheable prefix)
+    if retrieved_passages:
+        prompt_parts.append(_format_retrieved_passages_part(retrieved_passages))
+        context_summary_log.append(f"{len(retrieved_passages)}段檢索文件片段")
+        logger.debug(f"PromptBuilder: Added {len(retrieved_passages)} retrieved passages.")
 
     # 5. Current User Input (this should always be the last part for clarity to the model)
-    prompt_parts.append(f"\n**使用者當前問題/指令:**\n{current_user_input}")
+    prompt_parts.append(_format_user_input_part(current_user_input))
     context_summary_log.append("用戶當前問題")
 
     logger.info(f"PromptBuilder: Contents built. Context included: {', '.join(context_summary_log)}")
@@ -102,3 +88,91 @@ def build_gemini_request_contents(
     logger.debug(f"PromptBuilder: Final assembled prompt parts (joined for logging, total length {len(final_prompt_str_for_logging)}):\n{final_prompt_str_for_logging[:500]}...\n...{final_prompt_str_for_logging[-200:]}")
 
     return prompt_parts
+
+
+def _format_system_prompt_part(main_system_prompt: Optional[str]) -> Optional[str]:
+    """Formats the system prompt as the first prompt part."""
+    if not main_system_prompt:
+        return None
+    return f"**主要指示 (System Prompt):**\n{main_system_prompt}"
+
+def _format_core_docs_part(core_docs_contents: List[Dict[str, Any]]) -> Tuple[Optional[str], int]:
+    """Formats core documents into a single prompt part. Returns (part or None, number of documents included)."""
+    core_docs_text_parts = [_CORE_DOCS_HEADER]
+    files_included_count = 0
+    for doc in core_docs_contents:
+        doc_name = doc.get("name", "未知文件")
+        doc_content = doc.get("content", "")
+        if isinstance(doc_content, str):
+            core_docs_text_parts.append(f"--- Document Start: {doc_name} ---\n{doc_content}\n--- Document End: {doc_name} ---\n")
+            files_included_count += 1
+        elif isinstance(doc_content, pd.DataFrame):
+            core_docs_text_parts.append(f"--- Document Start (Table): {doc_name} ---\n欄位: {', '.join(doc_content.columns)}\n數據 (前5行):\n{doc_content.head(5).to_string()}\n--- Document End (Table): {doc_name} ---\n")
+            files_included_count += 1
+        else: # bytes or other
+            core_docs_text_parts.append(f"--- Document: {doc_name} (二進制或其他格式，長度: {len(doc_content) if hasattr(doc_content, '__len__') else 'N/A'}) ---\n")
+            files_included_count += 1
+
+    if files_included_count == 0:
+        return None, 0
+    return "\n".join(core_docs_text_parts), files_included_count
+
+def _format_external_data_part(external_data_summaries: Dict[str, Any]) -> Tuple[Optional[str], int]:
+    """Formats external data (last 3 rows of each DataFrame) into one prompt part. Returns (part or None, number of sources)."""
+    num_ext_sources = len(external_data_summaries)
+    if num_ext_sources == 0:
+        return None, 0
+    external_data_str = "\n**已引入的外部市場與總經數據摘要:**"
+    for source, data_items in external_data_summaries.items():
+        external_data_str += f"\n來源: {source.upper()}\n"
+        if isinstance(data_items, dict): # e.g., yfinance returns a dict of DataFrames
+            for item_name, df_item in data_items.items():
+                if isinstance(df_item, pd.DataFrame):
+                    external_data_str += f"  {item_name} (最近3筆):\n{df_item.tail(3).to_string(index=False)}\n"
+        elif isinstance(data_items, pd.DataFrame): # e.g., FRED or NY Fed might return a single DataFrame
+             external_data_str += f"  {source}數據 (最近3筆):\n{data_items.tail(3).to_string(index=False)}\n"
+    return external_data_str, num_ext_sources
+
+def _format_history_part(chat_history_for_prompt: List[Dict[str, Any]]) -> Tuple[Optional[str], int]:
+    """Formats chat history messages into one prompt part. Returns (part or None, number of turns)."""
+    history_str_parts = [_HISTORY_HEADER]
+    for msg in chat_history_for_prompt: # Assuming it's already filtered/summarized
+        role = msg.get("role", "unknown")
+        content = msg.get("parts", [""])[0] if msg.get("parts") else ""
+        history_str_parts.append(f"{role.capitalize()}: {content}")
+    if len(history_str_parts) == 1: # Only the header
+        return None, 0
+    return "\n".join(history_str_parts), len(history_str_parts) - 1
+
+def _format_retrieved_passages_part(retrieved_passages: List[Dict[str, Any]]) -> str:
+    """Formats retrieved passages, most relevant first, into one prompt part."""
+    passage_parts = [_RETRIEVED_PASSAGES_HEADER]
+    for passage in retrieved_passages:
+        passage_parts.append(f"--- 片段: {passage.get('name', '未知文件')} #{passage.get('ordinal', 0)} ---\n{passage.get('text', '')}\n")
+    return "\n".join(passage_parts)
+
+def _format_user_input_part(current_user_input: str) -> str:
+    return f"\n**使用者當前問題/指令:**\n{current_user_input}"
+
+def build_stable_prefix_parts(
+    main_system_prompt: Optional[str],
+    core_docs_contents: Optional[List[Dict[str, Any]]]
+) -> List[str]:
+    """
+    Builds the stable prefix of a chat prompt: the system prompt part followed by the core documents part.
+    These parts are identical across turns of a session and are what the Gemini context cache stores.
+    They are formatted exactly as in build_gemini_request_contents, so a cached prefix plus the
+    suffix built with main_system_prompt=None and core_docs_contents=None equals the full prompt.
+
+    Returns:
+        A list with up to two strings: [system_part, core_docs_part].
+    """
+    prefix_parts = []
+    system_part = _format_system_prompt_part(main_system_prompt)
+    if system_part:
+        prefix_parts.append(system_part)
+    if core_docs_contents:
+        core_docs_part, _ = _format_core_docs_part(core_docs_contents)
+        if core_docs_part:
+            prefix_parts.append(core_docs_part)
+    return prefix_parts
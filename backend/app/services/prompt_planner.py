@@ -0,0 +1,333 @@
+# services/prompt_planner.py
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from ..config import settings
+from ..utils.token_utils import CHARS_PER_TOKEN, estimate_tokens, estimate_tokens_for_parts
+from .prompt_builder import (
+    _CORE_DOCS_HEADER,
+    _HISTORY_HEADER,
+    _format_core_docs_part,
+    _format_external_data_part,
+    _format_history_part,
+    _format_retrieved_passages_part,
+    _format_system_prompt_part,
+    _format_user_input_part,
+)
+
+logger = logging.getLogger(__name__)
+
+SECTION_SYSTEM = "system"
+SECTION_CORE_DOCS = "core_docs"
+SECTION_EXTERNAL_DATA = "external_data"
+SECTION_HISTORY = "history"
+SECTION_RETRIEVED_PASSAGES = "retrieved_passages"
+SECTION_USER_INPUT = "user_input"
+
+_OMISSION_MARKER = "\n...[中略約 {omitted} tokens]...\n"
+_OLD_TURN_MARKER = " ...[已壓縮]"
+
+
+@dataclass
+class PromptPlan:
+    """Inputs for prompt_builder, trimmed so the built prompt fits the token budget."""
+    main_system_prompt: Optional[str]
+    core_docs_contents: Optional[List[Dict[str, Any]]]
+    external_data_summaries: Optional[Dict[str, Any]]
+    chat_history_for_prompt: Optional[List[Dict[str, Any]]]
+    current_user_input: str
+    retrieved_passages: Optional[List[Dict[str, Any]]] = None
+    was_trimmed: bool = False
+    section_tokens: Dict[str, int] = field(default_factory=dict) # Estimated tokens per section after planning
+
+
+def allocate_budget(needs: Dict[str, int], weights: Dict[str, float], budget: int) -> Dict[str, int]:
+    """
+    Weighted max-min fair split of `budget` over `needs`.
+    A section needing less than its weighted share gets exactly what it needs; the unused remainder
+    is shared among the larger sections in proportion to their weights.
+    """
+    allocation = {name: 0 for name in needs}
+    active = {name for name, need in needs.items() if need > 0}
+    remaining = max(budget, 0)
+    while active:
+        total_weight = sum(weights[name] for name in active)
+        fitting = {name for name in active if needs[name] <= remaining * weights[name] / total_weight}
+        if not fitting:
+            for name in active:
+                allocation[name] = int(remaining * weights[name] / total_weight)
+            break
+        for name in fitting:
+            allocation[name] = needs[name]
+            remaining -= needs[name]
+        active -= fitting
+    return allocation
+
+
+def _chars_for_tokens(text: str, max_tokens: int) -> int:
+    """Largest number of leading characters of `text` whose estimated size is at most `max_tokens`."""
+    if max_tokens <= 0:
+        return 0
+    if estimate_tokens(text) <= max_tokens:
+        return len(text)
+    # Every character is at most one token and at least 1 / CHARS_PER_TOKEN of one, which bounds the search.
+    low, high = min(max_tokens, len(text)), min(max_tokens * CHARS_PER_TOKEN + CHARS_PER_TOKEN - 1, len(text))
+    while low < high: # Binary search on the measured size of the prefix, so mixed CJK/Latin text is cut exactly
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _tail_chars_for_tokens(text: str, max_tokens: int) -> int:
+    """Largest number of trailing characters of `text` whose estimated size is at most `max_tokens`."""
+    return _chars_for_tokens(text[::-1], max_tokens)
+
+
+def trim_text_head_tail(text: str, max_tokens: int, head_share: float = 0.7) -> str:
+    """
+    Shortens `text` to at most `max_tokens` (local estimate), keeping its head and tail and marking the cut.
+    Both cuts are chosen by measuring the kept text, not by assuming a uniform token density.
+    """
+    current_tokens = estimate_tokens(text)
+    if current_tokens <= max_tokens:
+        return text
+    marker_tokens = estimate_tokens(_OMISSION_MARKER.format(omitted=current_tokens))
+    keep_tokens = max_tokens - marker_tokens
+    if keep_tokens <= 0:
+        return ""
+    head_chars = _chars_for_tokens(text, int(keep_tokens * head_share))
+    rest = text[head_chars:]
+    tail_chars = _tail_chars_for_tokens(rest, keep_tokens - estimate_tokens(text[:head_chars]))
+    head, tail = text[:head_chars], rest[len(rest) - tail_chars:]
+    marker = _OMISSION_MARKER.format(omitted=max(current_tokens - estimate_tokens(head) - estimate_tokens(tail), 0))
+    return head + marker + tail
+
+
+def _plan_core_docs(core_docs: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """Splits the core docs budget fairly over text documents and trims each large one to its head and tail."""
+    text_needs: Dict[str, int] = {}
+    header_tokens = estimate_tokens(_CORE_DOCS_HEADER)
+    fixed_tokens = header_tokens
+    for index, doc in enumerate(core_docs):
+        single_part, _ = _format_core_docs_part([doc])
+        doc_tokens = estimate_tokens(single_part or "") - header_tokens
+        if isinstance(doc.get("content"), str):
+            text_needs[str(index)] = doc_tokens
+        else:
+            fixed_tokens += doc_tokens # Tables are already shown as 5 rows; binary docs as one line
+    allocation = allocate_budget(text_needs, {name: 1.0 for name in text_needs}, budget - fixed_tokens)
+
+    planned_docs = []
+    for index, doc in enumerate(core_docs):
+        key = str(index)
+        if key not in text_needs or allocation[key] >= text_needs[key]:
+            planned_docs.append(doc)
+            continue
+        overhead = text_needs[key] - estimate_tokens(doc["content"])
+        trimmed = trim_text_head_tail(doc["content"], max(allocation[key] - overhead, 0))
+        logger.info(f"PromptPlanner: Core document '{doc.get('name')}' trimmed from ~{text_needs[key]} to ~{allocation[key]} tokens.")
+        planned_docs.append({**doc, "content": trimmed})
+    return planned_docs
+
+
+def _shrink_table(df: pd.DataFrame, max_columns: Optional[int]) -> pd.DataFrame:
+    shrunk = df.tail(1)
+    return shrunk.iloc[:, :max_columns] if max_columns is not None else shrunk
+
+
+def _plan_external_data(external_data: Dict[str, Any], budget: int) -> Dict[str, Any]:
+    """Shrinks tables (latest row only, then fewer columns) and drops the trailing sources that still do not fit."""
+    for max_columns in (None, 4, 2):
+        shrunk: Dict[str, Any] = {}
+        for source, data_items in external_data.items():
+            if isinstance(data_items, dict):
+                shrunk[source] = {
+                    name: _shrink_table(item, max_columns) if isinstance(item, pd.DataFrame) else item
+                    for name, item in data_items.items()
+                }
+            elif isinstance(data_items, pd.DataFrame):
+                shrunk[source] = _shrink_table(data_items, max_columns)
+            else:
+                shrunk[source] = data_items
+        part, _ = _format_external_data_part(shrunk)
+        if estimate_tokens(part or "") <= budget:
+            return shrunk
+
+    kept: Dict[str, Any] = {}
+    for source, data_items in shrunk.items():
+        part, _ = _format_external_data_part({**kept, source: data_items})
+        if estimate_tokens(part or "") > budget:
+            break
+        kept[source] = data_items
+    logger.info(f"PromptPlanner: External data reduced to {len(kept)} of {len(external_data)} sources.")
+    return kept
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    return message.get("parts", [""])[0] if message.get("parts") else ""
+
+
+def _plan_history(history: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """
+    Keeps the most recent PROMPT_HISTORY_RECENT_TURNS_KEPT messages verbatim, compresses older messages to
+    their opening lines, and drops the oldest compressed messages that still do not fit.
+    """
+    recent_count = max(settings.PROMPT_HISTORY_RECENT_TURNS_KEPT, 1)
+    older, recent = history[:-recent_count], history[-recent_count:]
+    compressed_older = []
+    for message in older:
+        text = _message_text(message)
+        if estimate_tokens(text) > settings.PROMPT_HISTORY_OLD_TURN_MAX_TOKENS:
+            text = text[:_chars_for_tokens(text, settings.PROMPT_HISTORY_OLD_TURN_MAX_TOKENS)] + _OLD_TURN_MARKER
+        compressed_older.append({**message, "parts": [text]})
+
+    header_tokens = estimate_tokens(_HISTORY_HEADER)
+    recent_tokens = sum(estimate_tokens(f"{m.get('role', 'unknown').capitalize()}: {_message_text(m)}\n") for m in recent)
+    if header_tokens + recent_tokens > budget:
+        # Even the recent turns do not fit: keep the newest ones whole, trim the first one kept.
+        kept: List[Dict[str, Any]] = []
+        remaining = budget - header_tokens
+        for message in reversed(recent):
+            line_tokens = estimate_tokens(f"{message.get('role', 'unknown').capitalize()}: {_message_text(message)}\n")
+            if line_tokens > remaining:
+                if remaining > 0:
+                    kept.insert(0, {**message, "parts": [trim_text_head_tail(_message_text(message), remaining)]})
+                break
+            kept.insert(0, message)
+            remaining -= line_tokens
+        return kept
+
+    remaining = budget - header_tokens - recent_tokens
+    kept_older: List[Dict[str, Any]] = []
+    for message in reversed(compressed_older): # Newest older messages are the most relevant
+        line_tokens = estimate_tokens(f"{message.get('role', 'unknown').capitalize()}: {_message_text(message)}\n")
+        if line_tokens > remaining:
+            break
+        kept_older.insert(0, message)
+        remaining -= line_tokens
+    if len(kept_older) < len(older):
+        logger.info(f"PromptPlanner: Dropped {len(older) - len(kept_older)} oldest history messages.")
+    return kept_older + recent
+
+
+def _plan_retrieved_passages(passages: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """Keeps the highest-ranked passages that fit (passages are ordered by relevance)."""
+    kept: List[Dict[str, Any]] = []
+    for passage in passages:
+        if estimate_tokens(_format_retrieved_passages_part(kept + [passage])) > budget:
+            break
+        kept.append(passage)
+    logger.info(f"PromptPlanner: Kept {len(kept)} of {len(passages)} retrieved passages.")
+    return kept
+
+
+def _estimate_sections(plan: PromptPlan) -> Dict[str, int]:
+    return {
+        SECTION_SYSTEM: estimate_tokens(_format_system_prompt_part(plan.main_system_prompt) or ""),
+        SECTION_CORE_DOCS: estimate_tokens(_format_core_docs_part(plan.core_docs_contents)[0] or "") if plan.core_docs_contents else 0,
+        SECTION_EXTERNAL_DATA: estimate_tokens(_format_external_data_part(plan.external_data_summaries)[0] or "") if plan.external_data_summaries else 0,
+        SECTION_HISTORY: estimate_tokens(_format_history_part(plan.chat_history_for_prompt)[0] or "") if plan.chat_history_for_prompt else 0,
+        SECTION_RETRIEVED_PASSAGES: estimate_tokens(_format_retrieved_passages_part(plan.retrieved_passages)) if plan.retrieved_passages else 0,
+        SECTION_USER_INPUT: estimate_tokens(_format_user_input_part(plan.current_user_input)),
+    }
+
+
+def estimate_prompt_tokens(
+    main_system_prompt: Optional[str],
+    core_docs_contents: Optional[List[Dict[str, Any]]],
+    external_data_summaries: Optional[Dict[str, Any]],
+    chat_history_for_prompt: Optional[List[Dict[str, Any]]],
+    current_user_input: str,
+    retrieved_passages: Optional[List[Dict[str, Any]]] = None
+) -> int:
+    """Local estimate of the full prompt size before planning (e.g., for model routing)."""
+    return sum(_estimate_sections(PromptPlan(
+        main_system_prompt=main_system_prompt,
+        core_docs_contents=core_docs_contents,
+        external_data_summaries=external_data_summaries,
+        chat_history_for_prompt=chat_history_for_prompt,
+        current_user_input=current_user_input,
+        retrieved_passages=retrieved_passages
+    )).values())
+
+
+def plan_prompt(
+    main_system_prompt: Optional[str],
+    core_docs_contents: Optional[List[Dict[str, Any]]],
+    external_data_summaries: Optional[Dict[str, Any]],
+    chat_history_for_prompt: Optional[List[Dict[str, Any]]],
+    current_user_input: str,
+    token_budget: Optional[int],
+    retrieved_passages: Optional[List[Dict[str, Any]]] = None
+) -> PromptPlan:
+    """
+    Fits the inputs of prompt_builder.build_gemini_request_contents into `token_budget` in a single pass.
+
+    Every section (system, core docs, external data, history, retrieved passages, user input) is measured
+    with the local token estimate and receives a share of the budget (PROMPT_SECTION_BUDGET_SHARES); budget
+    a section does not need goes to the others. Oversized sections are trimmed within themselves: documents
+    keep their head and tail, older history turns are compressed, tables are shrunk, the lowest-ranked
+    passages are dropped. No remote count_tokens calls are made.
+    With `token_budget=None` the inputs are returned unchanged.
+    """
+    plan = PromptPlan(
+        main_system_prompt=main_system_prompt,
+        core_docs_contents=core_docs_contents,
+        external_data_summaries=external_data_summaries,
+        chat_history_for_prompt=chat_history_for_prompt,
+        current_user_input=current_user_input,
+        retrieved_passages=retrieved_passages
+    )
+    needs = _estimate_sections(plan)
+    plan.section_tokens = dict(needs)
+    total_need = sum(needs.values())
+    if token_budget is None or total_need <= token_budget:
+        return plan
+
+    allocation = allocate_budget(needs, settings.PROMPT_SECTION_BUDGET_SHARES, token_budget)
+    logger.warning(f"PromptPlanner: Estimated prompt size {total_need} exceeds budget {token_budget}. Section needs: {needs}, allocation: {allocation}")
+    plan.was_trimmed = True
+
+    if needs[SECTION_SYSTEM] > allocation[SECTION_SYSTEM]:
+        plan.main_system_prompt = trim_text_head_tail(main_system_prompt, allocation[SECTION_SYSTEM])
+    if needs[SECTION_CORE_DOCS] > allocation[SECTION_CORE_DOCS]:
+        plan.core_docs_contents = _plan_core_docs(core_docs_contents, allocation[SECTION_CORE_DOCS])
+    if needs[SECTION_EXTERNAL_DATA] > allocation[SECTION_EXTERNAL_DATA]:
+        plan.external_data_summaries = _plan_external_data(external_data_summaries, allocation[SECTION_EXTERNAL_DATA])
+    if needs[SECTION_HISTORY] > allocation[SECTION_HISTORY]:
+        plan.chat_history_for_prompt = _plan_history(chat_history_for_prompt, allocation[SECTION_HISTORY])
+    if needs[SECTION_RETRIEVED_PASSAGES] > allocation[SECTION_RETRIEVED_PASSAGES]:
+        plan.retrieved_passages = _plan_retrieved_passages(retrieved_passages, allocation[SECTION_RETRIEVED_PASSAGES])
+    if needs[SECTION_USER_INPUT] > allocation[SECTION_USER_INPUT]:
+        plan.current_user_input = trim_text_head_tail(current_user_input, allocation[SECTION_USER_INPUT])
+
+    plan.section_tokens = _estimate_sections(plan)
+    logger.info(f"PromptPlanner: Planned prompt size ~{sum(plan.section_tokens.values())} tokens: {plan.section_tokens}")
+    return plan
+
+
+def fit_prompt_parts(prompt_parts: List[str], token_budget: int) -> Tuple[List[str], bool]:
+    """
+    Fallback for already-built prompts: keeps the first and last parts whole and trims every middle part
+    to its head and tail, in proportion to its size, so no part is dropped entirely. Local estimates only.
+    """
+    parts = [str(p) for p in prompt_parts]
+    current_tokens = estimate_tokens_for_parts(parts)
+    if current_tokens <= token_budget or len(parts) <= 2:
+        if current_tokens > token_budget:
+            logger.warning(f"fit_prompt_parts: ~{current_tokens} tokens exceed the budget {token_budget}, but there are no middle parts to trim.")
+        return parts, False
+
+    middle = parts[1:-1]
+    needs = {str(i): estimate_tokens(p) for i, p in enumerate(middle)}
+    middle_budget = token_budget - estimate_tokens(parts[0]) - estimate_tokens(parts[-1])
+    allocation = allocate_budget(needs, {name: 1.0 for name in needs}, middle_budget)
+    trimmed_middle = [trim_text_head_tail(p, allocation[str(i)]) for i, p in enumerate(middle)]
+    logger.warning(f"fit_prompt_parts: Trimmed middle parts from ~{current_tokens} to ~{estimate_tokens_for_parts([parts[0], *trimmed_middle, parts[-1]])} tokens (budget {token_budget}).")
+    return [parts[0], *trimmed_middle, parts[-1]], True
@@ -0,0 +1,128 @@
+# services/response_cache.py
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+
+logger = logging.getLogger(__name__)
+
+
+def compute_response_cache_key(
+    model_name: str,
+    generation_config: Optional[Dict[str, Any]],
+    prompt_parts: List[str],
+    prefix_hash: Optional[str] = None
+) -> str:
+    """
+    Computes a canonical SHA-256 key for a Gemini request.
+    Dict keys are sorted and the model name is normalized, so equivalent requests map to the same key.
+    `prefix_hash` (context_cache.compute_prefix_hash) stands for the stable prefix, with `prompt_parts`
+    then being the suffix only; the key depends on content only, not on whether or under which name
+    the prefix is held in a Gemini context cache.
+    """
+    canonical = json.dumps(
+        {
+            "model": model_name if model_name.startswith("models/") else f"models/{model_name}",
+            "generation_config": generation_config or {},
+            "prompt_parts": [str(p) for p in prompt_parts],
+            "prefix_hash": prefix_hash,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_cacheable_request(generation_config: Optional[Dict[str, Any]], reuse: bool = False) -> bool:
+    """
+    A response may be served from (and stored in) the cache only when generation is deterministic
+    (temperature 0) or the caller explicitly accepts a previously generated answer via `reuse`.
+    """
+    if not settings.LLM_RESPONSE_CACHE_ENABLED:
+        return False
+    if reuse:
+        return True
+    temperature = (generation_config or {}).get("temperature")
+    return temperature is not None and float(temperature) == 0.0
+
+
+async def get_cached_response(key: str) -> Optional[str]:
+    """Returns the cached response text for `key` and updates its access statistics, or None on a miss."""
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            async with db.execute("SELECT response_text FROM llm_response_cache WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                logger.debug(f"LLM response cache miss for key: {key[:12]}")
+                return None
+            await db.execute(
+                "UPDATE llm_response_cache SET last_accessed_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (datetime.now(timezone.utc).isoformat(), key),
+            )
+            await db.commit()
+        logger.info(f"LLM response cache hit for key: {key[:12]}")
+        return row[0]
+    except Exception as e:
+        logger.error(f"Error reading LLM response cache for key {key[:12]}: {e}")
+        return None
+
+
+async def set_cached_response(key: str, model_name: str, response_text: str) -> None:
+    """Stores a response and evicts least-recently-used entries beyond LLM_RESPONSE_CACHE_MAX_BYTES."""
+    size_bytes = len(response_text.encode("utf-8"))
+    if size_bytes > settings.LLM_RESPONSE_CACHE_MAX_BYTES:
+        logger.warning(f"Response of {size_bytes} bytes exceeds the LLM response cache size bound; not cached.")
+        return
+    now_str = datetime.now(timezone.utc).isoformat()
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO llm_response_cache
+                    (key, model_name, response_text, size_bytes, created_at, last_accessed_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, model_name, response_text, size_bytes, now_str, now_str),
+            )
+            await _evict_over_budget(db, settings.LLM_RESPONSE_CACHE_MAX_BYTES)
+            await db.commit()
+        logger.debug(f"LLM response cached for key: {key[:12]} ({size_bytes} bytes)")
+    except Exception as e:
+        logger.error(f"Error writing LLM response cache for key {key[:12]}: {e}")
+
+
+async def _evict_over_budget(db: aiosqlite.Connection, max_bytes: int) -> int:
+    async with db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_response_cache") as cursor:
+        total_bytes = (await cursor.fetchone())[0]
+    if total_bytes <= max_bytes:
+        return 0
+
+    evicted = 0
+    async with db.execute("SELECT key, size_bytes FROM llm_response_cache ORDER BY last_accessed_at ASC") as cursor:
+        rows = await cursor.fetchall()
+    for key, size_bytes in rows:
+        if total_bytes <= max_bytes:
+            break
+        await db.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+        total_bytes -= size_bytes
+        evicted += 1
+    logger.info(f"Evicted {evicted} LLM response cache entries (now {total_bytes} bytes).")
+    return evicted
+
+
+async def clear_response_cache() -> None:
+    """Removes every cached LLM response."""
+    try:
+        async with aiosqlite.connect(get_db_path()) as db:
+            await db.execute("DELETE FROM llm_response_cache")
+            await db.commit()
+        logger.info("LLM response cache cleared.")
+    except Exception as e:
+        logger.error(f"Error clearing LLM response cache: {e}")
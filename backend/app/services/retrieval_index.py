@@ -0,0 +1,177 @@
+# services/retrieval_index.py
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from ..utils.text_index_utils import chunk_text, scan_files, tokenize
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Part of every stored content hash: bumping it re-indexes all files after a tokenizer or chunking change.
+INDEX_VERSION = 2
+
+
+def _read_and_chunk(path: str) -> Tuple[str, List[Tuple[str, Dict[str, int], int]]]:
+    """Reads a file and returns (content hash, [(chunk text, term counts, term total), ...])."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    content_hash = f"{INDEX_VERSION}:{hashlib.sha256(raw).hexdigest()}"
+    text = raw.decode("utf-8", errors="replace")
+    chunks = []
+    for chunk in chunk_text(text, settings.RETRIEVAL_CHUNK_CHARS, settings.RETRIEVAL_CHUNK_OVERLAP_CHARS):
+        terms = tokenize(chunk)
+        chunks.append((chunk, dict(Counter(terms)), len(terms)))
+    return content_hash, chunks
+
+
+class RetrievalIndex:
+    """
+    BM25 index over the chunked source documents.
+
+    The index is persisted in SQLite (retrieval_documents, retrieval_chunks) and kept in memory as
+    term -> postings for querying. sync() re-indexes only files whose size/mtime and content hash changed
+    and removes deleted files, so refreshing after a new weekly post touches one file.
+    """
+
+    def __init__(self, source_dir: str):
+        self.source_dir = source_dir
+        self._chunks: List[Dict[str, Any]] = [] # {'path', 'ordinal', 'text', 'length'}
+        self._postings: Dict[str, List[Tuple[int, int]]] = {} # term -> [(chunk index, term frequency)]
+        self._avg_length = 0.0
+        self._loaded = False
+        self._last_sync = 0.0
+        self._sync_lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self._chunks)
+
+    async def sync(self) -> Dict[str, int]:
+        """Brings the persisted index up to date with SOURCE_DOCS_DIR. Returns counts of added/updated/removed/unchanged files."""
+        async with self._sync_lock:
+            started_at = time.perf_counter()
+            files = await asyncio.to_thread(scan_files, self.source_dir, settings.RETRIEVAL_FILE_EXTENSIONS)
+            stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+            async with aiosqlite.connect(get_db_path()) as db:
+                async with db.execute("SELECT path, content_hash, mtime, size FROM retrieval_documents") as cursor:
+                    stored = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+                for path in set(stored) - set(files):
+                    await db.execute("DELETE FROM retrieval_chunks WHERE path = ?", (path,))
+                    await db.execute("DELETE FROM retrieval_documents WHERE path = ?", (path,))
+                    stats["removed"] += 1
+
+                now = datetime.now(timezone.utc).isoformat()
+                for path, (mtime, size) in files.items():
+                    previous = stored.get(path)
+                    if previous and previous[1] == mtime and previous[2] == size and previous[0].startswith(f"{INDEX_VERSION}:"):
+                        stats["unchanged"] += 1
+                        continue
+                    try:
+                        content_hash, chunks = await asyncio.to_thread(_read_and_chunk, path)
+                    except OSError as e:
+                        logger.warning(f"RetrievalIndex: Could not read '{path}': {e}")
+                        continue
+                    if previous and previous[0] == content_hash: # Touched but not modified
+                        await db.execute("UPDATE retrieval_documents SET mtime = ?, size = ? WHERE path = ?", (mtime, size, path))
+                        stats["unchanged"] += 1
+                        continue
+                    await db.execute("DELETE FROM retrieval_chunks WHERE path = ?", (path,))
+                    await db.executemany(
+                        "INSERT INTO retrieval_chunks (path, ordinal, text, term_counts, length) VALUES (?, ?, ?, ?, ?)",
+                        [(path, ordinal, text, json.dumps(counts, ensure_ascii=False), length)
+                         for ordinal, (text, counts, length) in enumerate(chunks)]
+                    )
+                    await db.execute(
+                        "INSERT OR REPLACE INTO retrieval_documents (path, content_hash, mtime, size, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                        (path, content_hash, mtime, size, now)
+                    )
+                    stats["updated" if previous else "added"] += 1
+                await db.commit()
+
+            self._last_sync = time.monotonic()
+            if stats["added"] or stats["updated"] or stats["removed"] or not self._loaded:
+                await self._load()
+            logger.info(f"RetrievalIndex: Synced '{self.source_dir}' in {time.perf_counter() - started_at:.2f}s: {stats}, {self.chunk_count} chunks indexed.")
+            return stats
+
+    async def _load(self) -> None:
+        """Rebuilds the in-memory postings from the persisted chunks."""
+        async with aiosqlite.connect(get_db_path()) as db:
+            async with db.execute("SELECT path, ordinal, text, term_counts, length FROM retrieval_chunks ORDER BY path, ordinal") as cursor:
+                rows = await cursor.fetchall()
+        chunks: List[Dict[str, Any]] = []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for index, (path, ordinal, text, term_counts, length) in enumerate(rows):
+            chunks.append({"path": path, "ordinal": ordinal, "text": text, "length": length})
+            for term, frequency in json.loads(term_counts).items():
+                postings.setdefault(term, []).append((index, frequency))
+        self._chunks = chunks
+        self._postings = postings
+        self._avg_length = (sum(c["length"] for c in chunks) / len(chunks)) if chunks else 0.0
+        self._loaded = True
+
+    async def ensure_loaded(self) -> None:
+        """Loads the persisted index on first use and schedules a background sync when the last one is stale."""
+        if not self._loaded:
+            await self._load()
+        if time.monotonic() - self._last_sync > settings.RETRIEVAL_SYNC_INTERVAL_SECONDS and (self._sync_task is None or self._sync_task.done()):
+            self._sync_task = asyncio.get_running_loop().create_task(self.sync())
+
+    def search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """Returns the `top_k` chunks with the highest BM25 score for `query` (highest first)."""
+        started_at = time.perf_counter()
+        query_terms = set(tokenize(query))
+        total_chunks = len(self._chunks)
+        if not query_terms or total_chunks == 0:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in query_terms:
+            term_postings = self._postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (total_chunks - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for chunk_index, frequency in term_postings:
+                length_norm = 1 - BM25_B + BM25_B * self._chunks[chunk_index]["length"] / self._avg_length
+                scores[chunk_index] = scores.get(chunk_index, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        results = [
+            {
+                "path": self._chunks[i]["path"],
+                "name": os.path.relpath(self._chunks[i]["path"], self.source_dir),
+                "ordinal": self._chunks[i]["ordinal"],
+                "text": self._chunks[i]["text"],
+                "score": round(score, 4),
+            }
+            for i, score in best
+        ]
+        logger.info(f"RetrievalIndex: Query matched {len(scores)} chunks, returned {len(results)} in {(time.perf_counter() - started_at) * 1000:.1f} ms.")
+        return results
+
+
+_retrieval_index: Optional[RetrievalIndex] = None
+
+
+def get_retrieval_index() -> RetrievalIndex:
+    """Returns the process-wide retrieval index over SOURCE_DOCS_DIR."""
+    global _retrieval_index
+    if _retrieval_index is None:
+        _retrieval_index = RetrievalIndex(settings.SOURCE_DOCS_DIR)
+    return _retrieval_index
@@ -0,0 +1,341 @@
+# services/search_index.py
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import aiosqlite
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from ..utils.text_index_utils import TERM_PATTERN, chunk_text, cjk_bigrams
+from . import file_service
+from .retrieval_index import RetrievalIndex, get_retrieval_index
+from .upload_preprocessing import ARTIFACTS_VERSION, TEXT_ARTIFACT
+
+logger = logging.getLogger(__name__)
+
+# search_fts rowid = (search_documents.id << _ORDINAL_BITS) + chunk ordinal, so a document's chunks are
+# one rowid range that can be deleted without scanning the FTS table.
+_ORDINAL_BITS = 24
+_INSERT_BATCH_SIZE = 500
+_TEXT_BLOCK_CHARS = 1024 * 1024 # Text read per step when chunking a document
+# Source documents are keyed by their path as stored in retrieval_documents, whose chunks they share.
+_SOURCE_KEY_PREFIX = "source:"
+
+# Week markers recognised in file names: ISO week ("2023-W40") or a date ("2023-10-02", "20231002"),
+# as in the frontend's batch analysis of weekly posts.
+_ISO_WEEK_PATTERN = re.compile(r"(\d{4})-?W(\d{1,2})", re.IGNORECASE)
+_DATE_PATTERN = re.compile(r"(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})")
+
+_sync_lock = asyncio.Lock()
+_sync_task: Optional[asyncio.Task] = None
+_last_sync = 0.0
+
+
+def parse_week_start(file_name: str) -> Optional[date]:
+    """Monday of the week named in a file name, or None if it has no week marker."""
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    iso_match = _ISO_WEEK_PATTERN.search(stem)
+    if iso_match:
+        try:
+            return date.fromisocalendar(int(iso_match.group(1)), int(iso_match.group(2)), 1)
+        except ValueError:
+            pass
+    date_match = _DATE_PATTERN.search(stem)
+    if date_match:
+        try:
+            day = date(int(date_match.group(1)), int(date_match.group(2)), int(date_match.group(3)))
+            return day - timedelta(days=day.weekday())
+        except ValueError:
+            pass
+    return None
+
+
+def index_columns(text: str) -> Tuple[str, str]:
+    """
+    FTS column values of a text: ('terms', 'chars'). CJK runs become space-separated character bigrams in
+    'terms' (so a multi-character query is a bigram phrase) and single characters in 'chars'; Latin
+    words and numbers go to 'terms' lower-cased.
+    """
+    terms: List[str] = []
+    chars: List[str] = []
+    for match in TERM_PATTERN.finditer(text.lower()):
+        cjk_run, word = match.groups()
+        if cjk_run:
+            chars.extend(cjk_run)
+            terms.extend(cjk_bigrams(cjk_run))
+        else:
+            terms.append(word)
+    return " ".join(terms), " ".join(chars)
+
+
+def _parse_query(query: str) -> Tuple[Optional[str], List[str]]:
+    """FTS5 MATCH expression for `query` (all of its words/CJK runs must occur) and the strings to highlight."""
+    clauses: List[str] = []
+    needles: List[str] = []
+    for match in TERM_PATTERN.finditer(query.lower()):
+        cjk_run, word = match.groups()
+        needle = cjk_run or word
+        if needle in needles:
+            continue
+        needles.append(needle)
+        if cjk_run and len(cjk_run) == 1:
+            clauses.append(f'chars : "{cjk_run}"')
+        elif cjk_run:
+            clauses.append(f'terms : "{" ".join(cjk_bigrams(cjk_run))}"')
+        else:
+            clauses.append(f'terms : "{word}"')
+    return (" AND ".join(clauses) if clauses else None), needles
+
+
+def make_snippet(text: str, needles: List[str], width: int, mark: str = "**") -> str:
+    """About `width` characters of `text` around the first match of any needle, with matches wrapped in `mark`."""
+    text = re.sub(r"\s+", " ", text).strip()
+    lowered = text.lower()
+    positions = [p for p in (lowered.find(n) for n in needles) if p >= 0]
+    start = max(min(positions) - width // 3, 0) if positions else 0
+    end = min(start + width, len(text))
+    piece = text[start:end]
+    if needles:
+        pattern = re.compile("|".join(re.escape(n) for n in sorted(needles, key=len, reverse=True)), re.IGNORECASE)
+        piece = pattern.sub(lambda m: f"{mark}{m.group(0)}{mark}", piece)
+    return ("…" if start > 0 else "") + piece + ("…" if end < len(text) else "")
+
+
+def _iter_text_chunks(path: str) -> Iterator[str]:
+    """Chunks of a UTF-8 text file (see retrieval_index.chunk_text), reading about one block at a time."""
+    carry = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while block := f.read(_TEXT_BLOCK_CHARS):
+            text = carry + block
+            cut = text.rfind("\n\n") # Keep the last, possibly incomplete paragraph for the next block
+            if cut <= 0:
+                cut = len(text)
+            carry = text[cut:]
+            yield from chunk_text(text[:cut], settings.RETRIEVAL_CHUNK_CHARS, settings.RETRIEVAL_CHUNK_OVERLAP_CHARS)
+    yield from chunk_text(carry, settings.RETRIEVAL_CHUNK_CHARS, settings.RETRIEVAL_CHUNK_OVERLAP_CHARS)
+
+
+def _next_rows(chunks: Iterator[str], first_ordinal: int, store_text: bool) -> List[Tuple[int, str, str, Optional[str]]]:
+    rows = []
+    for ordinal, chunk in enumerate(chunks, start=first_ordinal):
+        rows.append((ordinal, *index_columns(chunk), chunk if store_text else None))
+        if len(rows) == _INSERT_BATCH_SIZE:
+            break
+    return rows
+
+
+async def _delete_document(db: aiosqlite.Connection, doc_id: int) -> None:
+    await db.execute(
+        "DELETE FROM search_fts WHERE rowid >= ? AND rowid < ?",
+        (doc_id << _ORDINAL_BITS, (doc_id + 1) << _ORDINAL_BITS),
+    )
+    await db.execute("DELETE FROM search_documents WHERE id = ?", (doc_id,))
+
+
+async def _index_document(
+    db: aiosqlite.Connection,
+    chunks: Iterator[str],
+    document: Dict[str, Any],
+    store_text: bool = True
+) -> int:
+    """
+    (Re)indexes one document from its chunks; `document` holds the search_documents columns. Without
+    `store_text` the chunk text is left out of search_fts (source documents: it is in retrieval_chunks).
+    Returns the chunk count.
+    """
+    async with db.execute("SELECT id FROM search_documents WHERE doc_key = ?", (document["doc_key"],)) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        await _delete_document(db, row[0])
+    document = {**document, "indexed_at": datetime.now(timezone.utc).isoformat()}
+    cursor = await db.execute(
+        f"INSERT INTO search_documents ({', '.join(document)}) VALUES ({', '.join('?' for _ in document)})",
+        tuple(document.values()),
+    )
+    doc_id = cursor.lastrowid
+
+    count = 0
+    while rows := await asyncio.to_thread(_next_rows, chunks, count, store_text):
+        await db.executemany(
+            "INSERT INTO search_fts (rowid, terms, chars, text) VALUES (?, ?, ?, ?)",
+            [((doc_id << _ORDINAL_BITS) + ordinal, terms, chars, text) for ordinal, terms, chars, text in rows],
+        )
+        count += len(rows)
+    return count
+
+
+async def _sync_source_documents(db: aiosqlite.Connection, source_dir: str, stats: Dict[str, int]) -> None:
+    """
+    Indexes the source documents from the retrieval index's chunk store (see RetrievalIndex.sync, run
+    just before), so they are scanned, read and chunked once for both indexes and their text is stored once.
+    """
+    async with db.execute("SELECT path, content_hash, mtime, size FROM retrieval_documents") as cursor:
+        files = {f"{_SOURCE_KEY_PREFIX}{row[0]}": tuple(row) for row in await cursor.fetchall()}
+    async with db.execute("SELECT doc_key, id, content_hash FROM search_documents WHERE source = 'source_doc'") as cursor:
+        stored = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+    for doc_key in set(stored) - set(files):
+        await _delete_document(db, stored[doc_key][0])
+        stats["removed"] += 1
+
+    for doc_key, (path, content_hash, mtime, size) in files.items():
+        previous = stored.get(doc_key)
+        if previous and previous[1] == content_hash:
+            stats["unchanged"] += 1
+            continue
+        if size > settings.SEARCH_MAX_DOCUMENT_BYTES:
+            logger.warning(f"SearchIndex: Skipping '{path}' ({size} bytes, over SEARCH_MAX_DOCUMENT_BYTES).")
+            continue
+        async with db.execute("SELECT text FROM retrieval_chunks WHERE path = ? ORDER BY ordinal", (path,)) as cursor:
+            chunks = [row[0] for row in await cursor.fetchall()]
+        name = os.path.relpath(path, source_dir)
+        week_start = parse_week_start(name)
+        await _index_document(db, iter(chunks), {
+            "doc_key": doc_key, "source": "source_doc", "file_id": None, "name": name,
+            "week_start": week_start.isoformat() if week_start else None,
+            "content_hash": content_hash, "mtime": mtime, "size": size,
+        }, store_text=False)
+        stats["updated" if previous else "added"] += 1
+
+
+async def _ready_uploads(db: aiosqlite.Connection, file_id: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    """(file_id, file_name, sha256) of uploads whose current text artifacts are ready."""
+    query = """
+        SELECT f.file_id, f.file_name, f.sha256 FROM uploaded_files f
+        JOIN upload_artifacts a ON a.sha256 = f.sha256
+        WHERE a.status = 'ready' AND a.version = ? AND a.kind IN ('text', 'table')
+    """
+    params: Tuple[Any, ...] = (ARTIFACTS_VERSION,)
+    if file_id is not None:
+        query += " AND f.file_id = ?"
+        params += (file_id,)
+    async with db.execute(query, params) as cursor:
+        return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def _index_upload(db: aiosqlite.Connection, file_id: str, file_name: str, sha256: str, base_upload_dir: str) -> bool:
+    text_path = os.path.join(file_service.artifacts_dir_path(sha256, base_upload_dir), TEXT_ARTIFACT)
+    try:
+        size = os.path.getsize(text_path)
+        if size > settings.SEARCH_MAX_DOCUMENT_BYTES:
+            logger.warning(f"SearchIndex: Skipping upload '{file_name}' (ID: {file_id}); its text has {size} bytes.")
+            return False
+        week_start = parse_week_start(file_name)
+        await _index_document(db, _iter_text_chunks(text_path), {
+            "doc_key": f"upload:{file_id}", "source": "upload", "file_id": file_id, "name": file_name,
+            "week_start": week_start.isoformat() if week_start else None,
+            "content_hash": sha256, "mtime": None, "size": size,
+        })
+    except OSError as e:
+        logger.warning(f"SearchIndex: Could not index upload '{file_name}' (ID: {file_id}): {e}")
+        return False
+    return True
+
+
+async def _sync_uploads(db: aiosqlite.Connection, base_upload_dir: str, stats: Dict[str, int]) -> None:
+    ready = {file_id: (file_name, sha256) for file_id, file_name, sha256 in await _ready_uploads(db)}
+    async with db.execute("SELECT file_id, id FROM search_documents WHERE source = 'upload'") as cursor:
+        stored = {row[0]: row[1] for row in await cursor.fetchall()}
+
+    for file_id in set(stored) - set(ready): # Deleted by the upload GC
+        await _delete_document(db, stored[file_id])
+        stats["removed"] += 1
+    for file_id, (file_name, sha256) in ready.items():
+        if file_id in stored: # Upload contents never change
+            stats["unchanged"] += 1
+        elif await _index_upload(db, file_id, file_name, sha256, base_upload_dir):
+            stats["added"] += 1
+
+
+async def sync_search_index(source_dir: Optional[str] = None, base_upload_dir: Optional[str] = None) -> Dict[str, int]:
+    """
+    Brings the full-text index up to date with SOURCE_DOCS_DIR (or `source_dir`) and the preprocessed
+    uploads. The source documents are synced through the retrieval index first, whose chunks are reused.
+    Only new or changed files are (re)indexed and deleted ones are dropped. Returns counts of
+    added/updated/removed/unchanged documents.
+    """
+    global _last_sync
+    async with _sync_lock:
+        started_at = time.perf_counter()
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        source_index = get_retrieval_index() if source_dir is None else RetrievalIndex(source_dir)
+        await source_index.sync()
+        async with aiosqlite.connect(get_db_path()) as db:
+            await _sync_source_documents(db, source_index.source_dir, stats)
+            await _sync_uploads(db, base_upload_dir or settings.AI_DATA_PATH, stats)
+            await db.commit()
+        _last_sync = time.monotonic()
+        logger.info(f"SearchIndex: Synced in {time.perf_counter() - started_at:.2f}s: {stats}.")
+        return stats
+
+
+async def index_upload(file_id: str, base_upload_dir: str) -> None:
+    """Indexes one upload right after its preprocessing, without waiting for the next sync."""
+    async with _sync_lock:
+        async with aiosqlite.connect(get_db_path()) as db:
+            async with db.execute("SELECT 1 FROM search_documents WHERE doc_key = ?", (f"upload:{file_id}",)) as cursor:
+                if await cursor.fetchone():
+                    return
+            for _, file_name, sha256 in await _ready_uploads(db, file_id):
+                if await _index_upload(db, file_id, file_name, sha256, base_upload_dir):
+                    logger.info(f"SearchIndex: Indexed upload '{file_name}' (ID: {file_id}).")
+            await db.commit()
+
+
+def ensure_fresh() -> None:
+    """Schedules a background sync when the last one is older than SEARCH_SYNC_INTERVAL_SECONDS."""
+    global _sync_task
+    if time.monotonic() - _last_sync > settings.SEARCH_SYNC_INTERVAL_SECONDS and (_sync_task is None or _sync_task.done()):
+        _sync_task = asyncio.get_running_loop().create_task(sync_search_index())
+
+
+async def search(query: str, limit: int = 20, source: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Chunks matching every word / CJK run of `query`, best BM25 rank first, each with a highlighted snippet,
+    the document name, the upload's file_id (uploads only) and the week the file name refers to.
+    `source` restricts results to 'upload' or 'source_doc'.
+    """
+    started_at = time.perf_counter()
+    match_expression, needles = _parse_query(query)
+    if match_expression is None:
+        return []
+    sql = f"""
+        SELECT d.source, d.file_id, d.name, d.week_start, s.rowid, COALESCE(s.text, c.text), bm25(search_fts) AS rank
+        FROM search_fts s
+        JOIN search_documents d ON d.id = (s.rowid >> {_ORDINAL_BITS})
+        LEFT JOIN uploaded_files f ON f.file_id = d.file_id
+        LEFT JOIN retrieval_documents r ON d.source = 'source_doc' AND r.path = substr(d.doc_key, {len(_SOURCE_KEY_PREFIX) + 1})
+        LEFT JOIN retrieval_chunks c ON c.path = r.path AND c.ordinal = (s.rowid & {(1 << _ORDINAL_BITS) - 1})
+        WHERE search_fts MATCH ? AND (d.source != 'upload' OR f.file_id IS NOT NULL)
+            AND (d.source != 'source_doc' OR r.content_hash = d.content_hash)
+    """
+    params: List[Any] = [match_expression]
+    if source:
+        sql += " AND d.source = ?"
+        params.append(source)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    async with aiosqlite.connect(get_db_path()) as db:
+        async with db.execute(sql, params) as cursor:
+            rows = await cursor.fetchall()
+
+    results = []
+    for source_name, file_id, name, week_start, rowid, text, rank in rows:
+        week = date.fromisoformat(week_start) if week_start else None
+        results.append({
+            "source": source_name,
+            "file_id": file_id,
+            "name": name,
+            "week_start": week_start,
+            "week_id": f"{week.isocalendar()[0]}-W{week.isocalendar()[1]:02d}" if week else None,
+            "ordinal": rowid & ((1 << _ORDINAL_BITS) - 1),
+            "snippet": make_snippet(text, needles, settings.SEARCH_SNIPPET_CHARS),
+            "score": round(-rank, 4),
+        })
+    logger.info(f"SearchIndex: '{query[:50]}' returned {len(results)} result(s) in {(time.perf_counter() - started_at) * 1000:.1f} ms.")
+    return results
@@ -0,0 +1,358 @@
+# services/upload_preprocessing.py
+import asyncio
+import codecs
+import json
+import logging
+import os
+import shutil
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+import pandas as pd
+import pyarrow.parquet as pq
+
+from ..config import settings
+from ..db.init_db import get_db_path
+from ..utils.token_utils import estimate_tokens
+from . import file_service
+from .document_access import TextDocument, build_line_index
+from .file_processors import ingest_table_chunks, iter_csv_chunks, process_uploaded_files
+
+logger = logging.getLogger(__name__)
+
+# Bump when the artifacts produced for the same content change, so stale artifacts are rebuilt.
+ARTIFACTS_VERSION = 4
+
+TEXT_ARTIFACT = "text.txt"
+TABLE_ARTIFACT = "table" # Directory of Parquet parts, one per ingested chunk
+SAMPLE_ARTIFACT = "sample.json" # Reservoir sample of table rows
+LINE_INDEX_ARTIFACT = "text.idx" # Line-offset index of the text artifact (document_access.build_line_index)
+
+_preprocessing_tasks: Dict[str, "asyncio.Task"] = {} # sha256 -> running preprocessing
+
+# Decoded text artifacts, shared by every file ID with the same content, bounded by DOCUMENT_TEXT_CACHE_MAX_BYTES
+_text_cache: "OrderedDict[str, str]" = OrderedDict() # sha256 -> text, least recently used first
+_text_cache_bytes = 0
+
+
+def _copy_as_text(blob_path: str, text_path: str) -> Dict[str, Any]:
+    """Streams a file into `text_path` as UTF-8 text (decoded as UTF-8, or latin-1 if that fails)."""
+    for encoding in ("utf-8", "latin-1"):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        chars = lines = token_count = 0
+        try:
+            with open(blob_path, "rb") as source, open(text_path, "w", encoding="utf-8") as target:
+                while block := source.read(file_service.CHUNK_SIZE):
+                    text = decoder.decode(block)
+                    target.write(text)
+                    chars += len(text)
+                    lines += text.count("\n")
+                    token_count += estimate_tokens(text)
+                text = decoder.decode(b"", final=True)
+                target.write(text)
+                chars += len(text)
+                token_count += estimate_tokens(text)
+        except UnicodeDecodeError:
+            logger.warning(f"'{blob_path}' is not valid {encoding}; retrying with the next encoding.")
+            continue
+        return {"kind": "text", "token_count": token_count, "summary": {"chars": chars, "lines": lines + 1, "encoding": encoding}}
+    raise ValueError(f"Could not decode {blob_path}")
+
+
+def _build_artifacts(blob_path: str, file_name: str, content_type: Optional[str], artifacts_dir: str) -> Dict[str, Any]:
+    """
+    Parses one upload and writes its artifacts into `artifacts_dir`. Runs in a worker thread.
+    CSV files are streamed in chunks (memory stays at about one chunk whatever the file size); other
+    types are parsed whole by file_processors. Text artifacts also get a line-offset index for
+    TextDocument. Returns the artifact metadata (kind, token_count, summary).
+    """
+    result = _parse_upload(blob_path, file_name, content_type, artifacts_dir)
+    text_path = os.path.join(artifacts_dir, TEXT_ARTIFACT)
+    if os.path.exists(text_path):
+        build_line_index(text_path, os.path.join(artifacts_dir, LINE_INDEX_ARTIFACT))
+    return result
+
+
+def _parse_upload(blob_path: str, file_name: str, content_type: Optional[str], artifacts_dir: str) -> Dict[str, Any]:
+    os.makedirs(artifacts_dir, exist_ok=True)
+    size = os.path.getsize(blob_path)
+    text_path = os.path.join(artifacts_dir, TEXT_ARTIFACT)
+
+    if file_name.lower().endswith(".csv"):
+        # The text artifact is the CSV itself, copied as it is rather than re-rendered from the parsed chunks
+        text_result = _copy_as_text(blob_path, text_path)
+        text_result["summary"]["size"] = size
+        encoding = text_result["summary"]["encoding"]
+        try:
+            result = ingest_table_chunks(
+                iter_csv_chunks(blob_path, settings.CSV_INGEST_CHUNK_ROWS, encoding=encoding),
+                os.path.join(artifacts_dir, TABLE_ARTIFACT),
+                sample_rows=settings.UPLOAD_PREVIEW_SAMPLE_ROWS,
+            )
+        except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            logger.warning(f"CSV '{file_name}' could not be parsed as a table ({e}); keeping it as text.")
+            shutil.rmtree(os.path.join(artifacts_dir, TABLE_ARTIFACT), ignore_errors=True)
+            return text_result
+        _write_sample(artifacts_dir, result["sample"])
+        return {
+            "kind": "table",
+            "token_count": text_result["token_count"],
+            "summary": {"size": size, "encoding": encoding, **result["summary"]},
+        }
+
+    with open(blob_path, "rb") as f:
+        content_bytes = f.read()
+    parsed = process_uploaded_files([
+        {"filename": file_name, "file_bytes": content_bytes, "size": size, "type": content_type}
+    ]).get(file_name)
+    if isinstance(parsed, str) and parsed.startswith("Error processing file:"):
+        raise ValueError(parsed)
+
+    if isinstance(parsed, pd.DataFrame):
+        del content_bytes
+        result = ingest_table_chunks([parsed], os.path.join(artifacts_dir, TABLE_ARTIFACT), text_path, sample_rows=settings.UPLOAD_PREVIEW_SAMPLE_ROWS)
+        _write_sample(artifacts_dir, result["sample"])
+        return {"kind": "table", "token_count": result["token_count"], "summary": {"size": size, **result["summary"]}}
+
+    summary: Dict[str, Any] = {"size": size}
+    if isinstance(parsed, str):
+        kind = "text"
+        text = parsed
+        summary.update(chars=len(text), lines=text.count("\n") + 1)
+        # Plain text files are decoded as UTF-8 or latin-1 by file_processors; record which, for downloads
+        for encoding in ("utf-8", "latin-1"):
+            try:
+                if content_bytes.decode(encoding) == text:
+                    summary["encoding"] = encoding
+                break
+            except UnicodeDecodeError:
+                continue
+    else:
+        # Unrecognised extension: still usable as a document if it is valid UTF-8 text, as the chat path read it before
+        try:
+            text = content_bytes.decode("utf-8")
+            kind = "text"
+            summary.update(chars=len(text), lines=text.count("\n") + 1, encoding="utf-8")
+        except UnicodeDecodeError:
+            kind = "binary"
+            text = None
+
+    token_count = 0
+    if text is not None:
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        token_count = estimate_tokens(text)
+    return {"kind": kind, "token_count": token_count, "summary": summary}
+
+
+def _write_sample(artifacts_dir: str, sample: List[dict]) -> None:
+    with open(os.path.join(artifacts_dir, SAMPLE_ARTIFACT), "w", encoding="utf-8") as f:
+        json.dump(sample, f, ensure_ascii=False)
+
+
+async def get_artifacts(sha256: str) -> Optional[Dict[str, Any]]:
+    """The stored artifact metadata of a blob, or None if it has not been preprocessed with the current version."""
+    async with aiosqlite.connect(get_db_path()) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            "SELECT * FROM upload_artifacts WHERE sha256 = ? AND version = ?", (sha256, ARTIFACTS_VERSION)
+        ) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return None
+    artifacts = dict(row)
+    artifacts["summary"] = json.loads(artifacts["summary"]) if artifacts["summary"] else None
+    return artifacts
+
+
+async def _save_artifacts(sha256: str, status: str, kind: Optional[str], token_count: int, summary: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+    async with aiosqlite.connect(get_db_path()) as db:
+        await db.execute(
+            """
+            INSERT OR REPLACE INTO upload_artifacts (sha256, version, status, kind, token_count, summary, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                sha256, ARTIFACTS_VERSION, status, kind, token_count,
+                json.dumps(summary, ensure_ascii=False) if summary is not None else None,
+                error, datetime.now(timezone.utc).isoformat(),
+            ),
+        )
+        await db.commit()
+
+
+async def _preprocess(record: Dict[str, Any], base_upload_dir: str) -> Optional[Dict[str, Any]]:
+    sha256 = record["sha256"]
+    blob_path = os.path.join(base_upload_dir, record["blob_path"])
+    artifacts_dir = file_service.artifacts_dir_path(sha256, base_upload_dir)
+    logger.info(f"Preprocessing upload '{record['file_name']}' (sha256 {sha256[:12]}).")
+    try:
+        result = await asyncio.to_thread(_build_artifacts, blob_path, record["file_name"], record.get("content_type"), artifacts_dir)
+    except Exception as e:
+        logger.error(f"Error preprocessing upload '{record['file_name']}' (sha256 {sha256[:12]}): {e}", exc_info=True)
+        await _save_artifacts(sha256, "failed", None, 0, None, str(e)[:500])
+        return None
+    await _save_artifacts(sha256, "ready", result["kind"], result["token_count"], result["summary"], None)
+    logger.info(f"Upload '{record['file_name']}' preprocessed: {result['kind']}, ~{result['token_count']} tokens.")
+    return await get_artifacts(sha256)
+
+
+def _retry_due(artifacts: Dict[str, Any]) -> bool:
+    """Whether failed artifacts are old enough to try preprocessing the content again."""
+    failed_at = datetime.fromisoformat(artifacts["created_at"])
+    return (datetime.now(timezone.utc) - failed_at).total_seconds() >= settings.UPLOAD_PREPROCESS_RETRY_SECONDS
+
+
+async def ensure_artifacts(record: Dict[str, Any], base_upload_dir: str, retry_failed: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Artifacts of the blob of `record` (an uploaded_files row with blob_path), building them first if needed.
+    Concurrent callers for the same content share one preprocessing run. Returns None if preprocessing failed.
+    A failed run is tried again once UPLOAD_PREPROCESS_RETRY_SECONDS have passed, or at once with
+    `retry_failed` (the same content was uploaded again).
+    """
+    sha256 = record["sha256"]
+    artifacts = await get_artifacts(sha256)
+    if artifacts is not None and (artifacts["status"] == "ready" or not (retry_failed or _retry_due(artifacts))):
+        return artifacts if artifacts["status"] == "ready" else None
+    if artifacts is not None:
+        logger.info(f"Retrying the preprocessing of '{record['file_name']}' (sha256 {sha256[:12]}), which failed: {artifacts['error']}")
+
+    task = _preprocessing_tasks.get(sha256)
+    if task is None:
+        task = asyncio.create_task(_preprocess(record, base_upload_dir))
+        _preprocessing_tasks[sha256] = task
+        task.add_done_callback(lambda _: _preprocessing_tasks.pop(sha256, None))
+    return await task
+
+
+async def preprocess_upload(file_id: str, base_upload_dir: str) -> None:
+    """
+    Background task run after an upload completes: builds the file's artifacts unless they already exist
+    (retrying them if an earlier upload of the same content failed to preprocess), then adds its text to
+    the full-text search index.
+    """
+    record = await file_service.get_file_record(file_id)
+    if record and await ensure_artifacts(record, base_upload_dir, retry_failed=True) and settings.SEARCH_ENABLED:
+        from .search_index import index_upload # search_index depends on this module
+        await index_upload(file_id, base_upload_dir)
+
+
+def _cache_text(sha256: str, text: str) -> None:
+    global _text_cache_bytes
+    size = sys.getsizeof(text)
+    if size > settings.DOCUMENT_TEXT_CACHE_MAX_BYTES:
+        return
+    previous = _text_cache.pop(sha256, None)
+    if previous is not None:
+        _text_cache_bytes -= sys.getsizeof(previous)
+    _text_cache[sha256] = text
+    _text_cache_bytes += size
+    while _text_cache_bytes > settings.DOCUMENT_TEXT_CACHE_MAX_BYTES:
+        _, evicted = _text_cache.popitem(last=False)
+        _text_cache_bytes -= sys.getsizeof(evicted)
+
+
+async def open_document(file_id: str, base_upload_dir: str, file_name: Optional[str] = None) -> Optional[TextDocument]:
+    """
+    Memory-mapped TextDocument over the text artifact of an uploaded file, for reading byte or character
+    ranges and line windows without loading the whole text. The caller must close it.
+    Returns None if the file is unknown, could not be parsed or has no text form (binary files).
+    """
+    record = await file_service.resolve_uploaded_file(file_id, file_name)
+    return await _open_record_document(record, base_upload_dir) if record else None
+
+
+async def _open_record_document(record: Dict[str, Any], base_upload_dir: str) -> Optional[TextDocument]:
+    artifacts = await ensure_artifacts(record, base_upload_dir)
+    if not artifacts or artifacts["kind"] == "binary":
+        return None
+    artifacts_dir = file_service.artifacts_dir_path(record["sha256"], base_upload_dir)
+    try:
+        return await asyncio.to_thread(
+            TextDocument, os.path.join(artifacts_dir, TEXT_ARTIFACT), os.path.join(artifacts_dir, LINE_INDEX_ARTIFACT)
+        )
+    except OSError as e:
+        logger.error(f"Error opening text artifact of file ID {record['file_id']}: {e}")
+        return None
+
+
+async def load_document_text(file_id: str, file_name: str, base_upload_dir: str, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Extracted text of an uploaded file (tables rendered as CSV), read from its artifacts and kept in an
+    in-memory LRU keyed by content hash, so repeated chat turns over the same files do not re-read them.
+    Texts longer than `max_chars` are returned as their head and tail (see TextDocument.excerpt), read from
+    the memory-mapped artifact without loading the rest; these excerpts are not cached.
+    Returns None if the file is unknown, could not be parsed or has no text form (binary files).
+    """
+    record = await file_service.resolve_uploaded_file(file_id, file_name)
+    if not record:
+        return None
+    sha256 = record["sha256"]
+    text = _text_cache.get(sha256)
+    if text is not None and (max_chars is None or len(text) <= max_chars):
+        _text_cache.move_to_end(sha256)
+        logger.debug(f"Text of '{file_name}' (ID: {file_id}) served from the in-memory cache.")
+        return text
+
+    document = await _open_record_document(record, base_upload_dir)
+    if document is None:
+        return None
+    try:
+        if max_chars is not None and document.char_count > max_chars:
+            logger.info(f"'{file_name}' (ID: {file_id}) has {document.char_count} characters; loading its head and tail only.")
+            return await asyncio.to_thread(document.excerpt, max_chars)
+        text = await asyncio.to_thread(document.read_chars, 0)
+    finally:
+        document.close()
+    _cache_text(sha256, text)
+    return text
+
+
+def _read_preview(artifacts_dir: str, kind: str, max_rows: int, max_chars: int) -> Dict[str, Any]:
+    preview: Dict[str, Any] = {"rows": None, "sample": None, "text": None}
+    if kind == "table":
+        rows: List[dict] = []
+        for part_name in sorted(os.listdir(os.path.join(artifacts_dir, TABLE_ARTIFACT))):
+            parquet_file = pq.ParquetFile(os.path.join(artifacts_dir, TABLE_ARTIFACT, part_name))
+            batch = next(parquet_file.iter_batches(batch_size=max_rows - len(rows)), None)
+            if batch is not None:
+                rows.extend(json.loads(batch.to_pandas().to_json(orient="records", date_format="iso", force_ascii=False)))
+            if len(rows) >= max_rows:
+                break
+        preview["rows"] = rows
+        with open(os.path.join(artifacts_dir, SAMPLE_ARTIFACT), "r", encoding="utf-8") as f:
+            preview["sample"] = json.load(f)[:max_rows]
+    elif kind == "text":
+        with open(os.path.join(artifacts_dir, TEXT_ARTIFACT), "r", encoding="utf-8") as f:
+            preview["text"] = f.read(max_chars)
+    return preview
+
+
+async def get_preview(file_id: str, base_upload_dir: str, max_rows: int = 20, max_chars: int = 2000) -> Optional[Dict[str, Any]]:
+    """
+    Preview of an uploaded file from its artifacts: kind, token count, summary, and the first `max_rows`
+    table rows plus up to `max_rows` uniformly sampled rows, or the first `max_chars` characters of text.
+    Returns None if the file is unknown.
+    """
+    record = await file_service.resolve_uploaded_file(file_id)
+    if not record:
+        return None
+    artifacts = await ensure_artifacts(record, base_upload_dir)
+    preview: Dict[str, Any] = {
+        "file_id": file_id,
+        "file_name": record["file_name"],
+        "status": "ready" if artifacts else "failed",
+        "kind": artifacts["kind"] if artifacts else None,
+        "token_count": artifacts["token_count"] if artifacts else None,
+        "summary": artifacts["summary"] if artifacts else None,
+        "rows": None,
+        "sample": None,
+        "text": None,
+    }
+    if artifacts:
+        artifacts_dir = file_service.artifacts_dir_path(record["sha256"], base_upload_dir)
+        preview.update(await asyncio.to_thread(_read_preview, artifacts_dir, artifacts["kind"], max_rows, max_chars))
+    return preview
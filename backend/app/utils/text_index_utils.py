@@ -0,0 +1,74 @@
+# backend/app/utils/text_index_utils.py
+import os
+import re
+from typing import Dict, List, Tuple
+
+# Shared by the BM25 retrieval index and the FTS5 search index. CJK runs are indexed by character (and
+# character bigrams) since Chinese has no word boundaries; Latin words and numbers as lower-cased tokens.
+_CJK_RUN_PATTERN = r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+"
+
+# Matches one CJK run (group 1) or one Latin word / number (group 2) of lower-cased text.
+TERM_PATTERN = re.compile(rf"({_CJK_RUN_PATTERN})|([a-z0-9]+(?:\.[0-9]+)?)")
+
+
+def cjk_bigrams(cjk_run: str) -> List[str]:
+    """The overlapping character bigrams of a CJK run (none for a single character)."""
+    return [cjk_run[i:i + 2] for i in range(len(cjk_run) - 1)]
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into index terms: CJK characters and character bigrams plus Latin/number words."""
+    terms: List[str] = []
+    for match in TERM_PATTERN.finditer(text.lower()):
+        cjk_run, word = match.groups()
+        if cjk_run:
+            terms.extend(cjk_run)
+            terms.extend(cjk_bigrams(cjk_run))
+        else:
+            terms.append(word)
+    return terms
+
+
+def chunk_text(text: str, chunk_chars: int, overlap_chars: int) -> List[str]:
+    """
+    Splits text into chunks of about `chunk_chars` characters, packing whole paragraphs where possible.
+    Paragraphs longer than a chunk are cut with `overlap_chars` of overlap so no sentence is lost at the seam;
+    a last cut that would add fewer than `overlap_chars` new characters is merged into the one before it.
+    """
+    chunks: List[str] = []
+    current = ""
+    for paragraph in (p.strip() for p in re.split(r"\n\s*\n", text)):
+        if not paragraph:
+            continue
+        if len(paragraph) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            step = max(chunk_chars - overlap_chars, 1)
+            starts = list(range(0, len(paragraph) - overlap_chars, step))
+            if len(starts) > 1 and len(paragraph) - (starts[-1] + overlap_chars) < overlap_chars:
+                starts.pop() # The previous cut then runs to the end of the paragraph
+            chunks.extend(paragraph[i:i + chunk_chars] for i in starts[:-1])
+            chunks.append(paragraph[starts[-1]:])
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def scan_files(directory: str, extensions: Tuple[str, ...]) -> Dict[str, Tuple[float, int]]:
+    """Returns {path: (mtime, size)} of the files under `directory` whose names end with one of `extensions`."""
+    found: Dict[str, Tuple[float, int]] = {}
+    if not os.path.isdir(directory):
+        return found
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            if file_name.lower().endswith(extensions):
+                path = os.path.join(root, file_name)
+                stat = os.stat(path)
+                found[path] = (stat.st_mtime, stat.st_size)
+    return found
@@ -0,0 +1,33 @@
+# backend/app/utils/token_utils.py
+import re
+from typing import Iterable
+
+# CJK Unified Ideographs, CJK punctuation and full-width forms are counted one token per character.
+_CJK_CHAR_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# Average number of non-CJK characters per token (English text, numbers, Markdown).
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the token count of a string locally, without calling the Gemini count_tokens API.
+    CJK characters are counted as one token each; other characters at CHARS_PER_TOKEN per token.
+    The estimate is intentionally conservative (slightly high) for mixed Chinese/English text.
+
+    Args:
+        text: The text to estimate.
+
+    Returns:
+        Estimated number of tokens (0 for empty input).
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_CHAR_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_tokens_for_parts(parts: Iterable[str]) -> int:
+    """Estimates the total token count of a list of prompt parts."""
+    return sum(estimate_tokens(str(p)) for p in parts)
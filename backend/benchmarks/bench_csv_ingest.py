@@ -0,0 +1,110 @@
+"""
+Benchmark: streaming CSV upload preprocessing (upload_preprocessing._build_artifacts) on a large synthetic CSV.
+
+Generates a CSV of the requested size (default 1 GB) shaped like a market data export, ingests it in a
+child process and reports throughput and the child's peak RSS. Peak memory should stay roughly the same
+whatever --size-mb is; compare e.g. --size-mb 100 and --size-mb 1024. --eager also runs the previous
+in-memory path (bytes + pd.read_csv(BytesIO(...))) for comparison; avoid it on machines with little RAM.
+
+Run from the backend directory:
+    python -m benchmarks.bench_csv_ingest --size-mb 1024
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.services.upload_preprocessing import _build_artifacts
+
+_TICKERS = np.array(["SPY", "QQQ", "TLT", "GLD", "BTC-USD", "ETH-USD", "^GSPC", "^VIX", "2330.TW", "0050.TW"])
+
+
+def generate_csv(path: str, size_mb: int, rows_per_block: int = 200_000, seed: int = 0) -> int:
+    """Appends blocks of synthetic rows to `path` until it reaches `size_mb`. Returns the number of rows."""
+    rng = np.random.default_rng(seed)
+    target_bytes = size_mb * 1024 * 1024
+    rows = 0
+    start_date = np.datetime64("2000-01-01")
+    with open(path, "w", encoding="utf-8") as f:
+        while f.tell() < target_bytes:
+            block = pd.DataFrame({
+                "date": (start_date + rng.integers(0, 9000, rows_per_block)).astype(str),
+                "ticker": _TICKERS[rng.integers(0, len(_TICKERS), rows_per_block)],
+                "open": rng.normal(100, 20, rows_per_block).round(4),
+                "close": rng.normal(100, 20, rows_per_block).round(4),
+                "volume": rng.integers(0, 50_000_000, rows_per_block),
+                "week": rng.integers(1, 151, rows_per_block),
+                "note": np.where(rng.random(rows_per_block) < 0.01, "財報公布", ""),
+            })
+            block.to_csv(f, index=False, header=(rows == 0))
+            rows += rows_per_block
+    return rows
+
+
+def _peak_rss_mb(usage: resource.struct_rusage) -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _run_streaming(csv_path: str, out_dir: str, chunk_rows: int, queue: multiprocessing.Queue) -> None:
+    settings.CSV_INGEST_CHUNK_ROWS = chunk_rows
+    started = time.perf_counter()
+    result = _build_artifacts(csv_path, "synthetic.csv", "text/csv", out_dir)
+    queue.put((time.perf_counter() - started, result["summary"]["rows"], result["summary"]["chunks"]))
+
+
+def _run_eager(csv_path: str, queue: multiprocessing.Queue) -> None:
+    started = time.perf_counter()
+    with open(csv_path, "rb") as f:
+        content_bytes = f.read()
+    df = pd.read_csv(BytesIO(content_bytes))
+    queue.put((time.perf_counter() - started, len(df), 1))
+
+
+def _measure(target, args) -> tuple:
+    """Runs `target` in a fresh child process; returns (seconds, rows, chunks, peak RSS in MB of that child)."""
+    queue: multiprocessing.Queue = multiprocessing.Queue()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    process = multiprocessing.get_context("fork").Process(target=target, args=(*args, queue))
+    process.start()
+    seconds, rows, chunks = queue.get()
+    process.join()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if usage.ru_maxrss == before:
+        print("  (peak RSS not above an earlier run's; run modes separately for an exact figure)")
+    return seconds, rows, chunks, _peak_rss_mb(usage)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of the synthetic CSV (default 1024)")
+    parser.add_argument("--chunk-rows", type=int, default=100_000, help="Rows per ingested chunk (CSV_INGEST_CHUNK_ROWS)")
+    parser.add_argument("--eager", action="store_true", help="Also run the in-memory pd.read_csv path")
+    parser.add_argument("--workdir", default=None, help="Directory for the CSV and artifacts (default: a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        csv_path = os.path.join(workdir, "synthetic.csv")
+        started = time.perf_counter()
+        generate_csv(csv_path, args.size_mb)
+        csv_mb = os.path.getsize(csv_path) / (1024 * 1024)
+        print(f"Generated {csv_mb:.0f} MB CSV in {time.perf_counter() - started:.1f}s")
+
+        seconds, rows, chunks, peak_mb = _measure(_run_streaming, (csv_path, os.path.join(workdir, "artifacts"), args.chunk_rows))
+        print(f"streaming: {rows} rows in {chunks} chunks, {seconds:.1f}s ({csv_mb / seconds:.1f} MB/s), peak RSS {peak_mb:.0f} MB")
+
+        if args.eager:
+            seconds, rows, _, peak_mb = _measure(_run_eager, (csv_path,))
+            print(f"eager:     {rows} rows, {seconds:.1f}s ({csv_mb / seconds:.1f} MB/s), peak RSS {peak_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os # For path creation
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware # Added for CORS
 import uvicorn
@@ -71,7 +72,39 @@ async def startup_event():
         # Depending on the criticality, you might want to raise an exception or exit
         raise
 
-    # You can add other startup logic here, e.g., loading models
+    # Uploads: move files still in the old uploads/<file_id>/<name> layout into the indexed blob store,
+    # then enforce the age limit and byte quota periodically
+    from app.services import file_service
+    await file_service.index_legacy_uploads(settings.AI_DATA_PATH)
+    if settings.UPLOAD_GC_ENABLED:
+        app.state.upload_gc_task = asyncio.create_task(file_service.run_upload_gc_loop(settings.AI_DATA_PATH))
+
+    # Model catalog: serve the last persisted snapshot immediately, refresh it in the background
+    from app.services import model_catalog
+    await model_catalog.load_catalog_snapshot_from_db()
+    app.state.catalog_refresh_task = asyncio.create_task(model_catalog.run_catalog_refresh_loop())
+
+    # Retrieval index: bring the persisted index up to date with SOURCE_DOCS_DIR in the background
+    if settings.RETRIEVAL_ENABLED:
+        from app.services.retrieval_index import get_retrieval_index
+        app.state.retrieval_sync_task = asyncio.create_task(get_retrieval_index().sync())
+
+    # Full-text search: index new or changed source documents and preprocessed uploads in the background
+    if settings.SEARCH_ENABLED:
+        from app.services import search_index
+        app.state.search_sync_task = asyncio.create_task(search_index.sync_search_index())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task_name in ("catalog_refresh_task", "retrieval_sync_task", "upload_gc_task", "search_sync_task"):
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
+
+    # Delete the Gemini context caches created by this process; the in-memory registry does not survive restarts.
+    from app.services import context_cache
+    purged_count = context_cache.purge_context_caches(settings.AVAILABLE_GEMINI_API_KEYS, only_expired=False)
+    logger.info(f"應用程式關閉。已清理 {purged_count} 個 Gemini 上下文快取。")
 
 # Include API routers
 app.include_router(endpoints_config.router, prefix="/api", tags=["Configuration"])
@@ -83,6 +116,12 @@ from app.api import endpoints_files # Import the files router
 app.include_router(endpoints_files.router, prefix="/api/files", tags=["Files"]) # Mount at /api/files
 from app.api import endpoints_db # Import the database router
 app.include_router(endpoints_db.router, prefix="/api/db", tags=["Database"]) # Mount at /api/db
+from app.api import endpoints_metrics # Import the metrics router
+app.include_router(endpoints_metrics.router, prefix="/api/metrics", tags=["Metrics"]) # Mount at /api/metrics
+from app.api import endpoints_retrieval # Import the retrieval router
+app.include_router(endpoints_retrieval.router, prefix="/api/retrieval", tags=["Retrieval"]) # Mount at /api/retrieval
+from app.api import endpoints_search # Import the full-text search router
+app.include_router(endpoints_search.router, prefix="/api", tags=["Search"]) # Mount at /api
 
 @app.get("/")
 async def read_root():
@@ -0,0 +1,22 @@
+import asyncio
+import os
+import tempfile
+
+# Settings are read from the environment at import time: point the backend at a throwaway data directory
+# before any app module is imported.
+_TEST_DATA_DIR = tempfile.mkdtemp(prefix="wolf_backend_tests_")
+os.environ["AI_DATA_PATH"] = _TEST_DATA_DIR
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TEST_DATA_DIR, 'main_database.db')}"
+
+import pytest
+
+from app.config import settings
+from app.db.init_db import create_tables
+
+
+@pytest.fixture
+def test_db(tmp_path, monkeypatch):
+    """Points the backend at a fresh SQLite file with all tables created; yields the data directory."""
+    monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'main_database.db'}")
+    asyncio.run(create_tables())
+    return tmp_path
@@ -0,0 +1,34 @@
+import asyncio
+
+from app.services import chat_sessions
+
+
+def _turn(i):
+    return [{"role": "user", "parts": [f"問題 {i}"]}, {"role": "model", "parts": [f"回答 {i}"]}]
+
+
+def test_concurrent_appends_keep_each_turn_contiguous(test_db):
+    async def _main():
+        await chat_sessions.create_session(session_id="s1")
+        await asyncio.gather(*[chat_sessions.append_messages("s1", _turn(i)) for i in range(20)])
+        return await chat_sessions.get_messages("s1")
+
+    messages = asyncio.run(_main())
+
+    assert len(messages) == 40
+    for user_message, model_message in zip(messages[::2], messages[1::2]):
+        assert user_message["parts"][0].replace("問題", "回答") == model_message["parts"][0]
+
+
+def test_concurrent_creates_of_one_session_seed_history_once(test_db):
+    async def _main():
+        sessions = await asyncio.gather(*[
+            chat_sessions.create_session(session_id="s2", initial_history=_turn(0), user_id="alice")
+            for _ in range(5)
+        ])
+        return sessions, await chat_sessions.get_messages("s2")
+
+    sessions, messages = asyncio.run(_main())
+
+    assert all(session["session_id"] == "s2" and session["user_id"] == "alice" for session in sessions)
+    assert messages == _turn(0)
@@ -0,0 +1,36 @@
+import asyncio
+import hashlib
+
+from app.services import chunked_uploads, file_service
+
+
+def test_upload_survives_a_restart_between_chunks(test_db, tmp_path):
+    base_upload_dir = str(tmp_path)
+    data = b"0123456789" * 3
+
+    async def _main():
+        status = await chunked_uploads.create_upload_session("report.csv", len(data), base_upload_dir, chunk_size=10)
+        upload_id = status["upload_id"]
+        await chunked_uploads.write_chunk(upload_id, 0, data[:10], None, base_upload_dir)
+        migrated = await file_service.index_legacy_uploads(base_upload_dir) # Startup migration after a restart
+        await chunked_uploads.write_chunk(upload_id, 1, data[10:20], None, base_upload_dir)
+        await chunked_uploads.write_chunk(upload_id, 2, data[20:], None, base_upload_dir)
+        return migrated, await chunked_uploads.complete_upload(upload_id, base_upload_dir)
+
+    migrated, saved = asyncio.run(_main())
+
+    assert migrated == 0
+    assert asyncio.run(file_service.get_file_record("incoming")) is None
+    assert saved["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_legacy_uploads_are_migrated_under_their_file_id(test_db, tmp_path):
+    legacy_dir = tmp_path / "uploads" / ("a" * 32)
+    legacy_dir.mkdir(parents=True)
+    (legacy_dir / "notes.txt").write_bytes(b"notes")
+
+    assert asyncio.run(file_service.index_legacy_uploads(str(tmp_path))) == 1
+
+    record = asyncio.run(file_service.get_file_record("a" * 32))
+    assert (record["file_name"], record["sha256"]) == ("notes.txt", hashlib.sha256(b"notes").hexdigest())
+    assert not legacy_dir.exists()
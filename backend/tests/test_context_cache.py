@@ -0,0 +1,129 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import context_cache
+
+
+class _FakeGemini:
+    """Records cache calls; creation blocks on `create_gate` so tests can line up concurrent callers."""
+
+    def __init__(self):
+        self.created, self.refreshed, self.deleted = [], [], []
+        self.create_gate = threading.Event()
+        self.create_gate.set()
+
+    def create_gemini_cache(self, api_key, model_name, cache_display_name, system_instruction, ttl_seconds, contents):
+        self.create_gate.wait(5)
+        name = f"cachedContents/{len(self.created)}"
+        self.created.append(name)
+        return SimpleNamespace(name=name), None
+
+    def refresh_gemini_cache_ttl(self, api_key, cache_name, ttl_seconds):
+        self.refreshed.append(cache_name)
+        return object(), None
+
+    def delete_gemini_cache(self, api_key, cache_name):
+        self.deleted.append(cache_name)
+        return True, None
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    fake = _FakeGemini()
+    monkeypatch.setattr(context_cache, "gemini_service", fake)
+    monkeypatch.setattr(context_cache.settings, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(context_cache.settings, "CONTEXT_CACHE_TTL_SECONDS", 600)
+    monkeypatch.setattr(context_cache.settings, "CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", 60)
+    monkeypatch.setattr(context_cache, "_registry", {})
+    monkeypatch.setattr(context_cache, "_key_locks", {})
+    return fake
+
+
+def _acquire(prefix="文件" * 10):
+    return context_cache.acquire_prefix_cache("key-1", "gemini-2.5-pro", "系統", [prefix], min_tokens=1)
+
+
+def test_reuse_counts_references_and_release_decrements(fake_gemini):
+    first, second = _acquire(), _acquire()
+
+    assert first == second and fake_gemini.created == [first[0]]
+    assert context_cache.get_registry_snapshot()[0].ref_count == 2
+    context_cache.release_prefix_cache("key-1", "gemini-2.5-pro", first[1])
+    context_cache.release_prefix_cache("key-1", "gemini-2.5-pro", first[1])
+    context_cache.release_prefix_cache("key-1", "gemini-2.5-pro", first[1]) # Never below zero
+    assert context_cache.get_registry_snapshot()[0].ref_count == 0
+
+
+def test_ttl_is_refreshed_only_near_expiry(fake_gemini):
+    cache_name, _ = _acquire()
+    _acquire()
+    assert fake_gemini.refreshed == []
+
+    entry = next(iter(context_cache._registry.values()))
+    entry.expires_at = time.time() + 30 # Inside the refresh margin
+    _acquire()
+
+    assert fake_gemini.refreshed == [cache_name]
+    assert entry.expires_at > time.time() + 500
+
+
+def test_invalidated_cache_is_recreated(fake_gemini):
+    cache_name, _ = _acquire()
+
+    context_cache.invalidate_cache_name(cache_name)
+
+    assert context_cache.get_registry_snapshot() == [] and context_cache._key_locks == {}
+    assert _acquire()[0] != cache_name and len(fake_gemini.created) == 2
+
+
+def test_purge_keeps_referenced_entries_and_deletes_the_rest_remotely(fake_gemini):
+    used, _ = _acquire("甲" * 20)
+    unused, unused_hash = _acquire("乙" * 20)
+    context_cache.release_prefix_cache("key-1", "gemini-2.5-pro", unused_hash)
+
+    assert context_cache.purge_context_caches(["key-1"], only_expired=True) == 0
+    assert context_cache.purge_context_caches(["key-1"], only_expired=False) == 1
+
+    assert [e.cache_name for e in context_cache.get_registry_snapshot()] == [used]
+    assert fake_gemini.deleted == [unused]
+
+
+def test_concurrent_callers_of_one_prefix_create_one_cache(fake_gemini):
+    fake_gemini.create_gate.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(_acquire())) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1) # One caller is creating, the others wait for the per-prefix lock
+    fake_gemini.create_gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(fake_gemini.created) == 1 and len(set(results)) == 1
+    assert context_cache.get_registry_snapshot()[0].ref_count == 3
+
+
+def test_lock_fetched_by_a_caller_survives_invalidation(fake_gemini):
+    cache_name, prefix_hash = _acquire()
+    registry_key = next(iter(context_cache._registry))
+    lock_before = context_cache._key_locks[registry_key]
+    holder_inside, release_holder = threading.Event(), threading.Event()
+
+    def _holder():
+        with context_cache._prefix_locked(registry_key):
+            holder_inside.set()
+            release_holder.wait(5)
+
+    holder = threading.Thread(target=_holder)
+    holder.start()
+    holder_inside.wait(5)
+
+    context_cache.invalidate_cache_name(cache_name) # The lock is in use: it must be kept
+    assert context_cache._key_locks.get(registry_key) is lock_before
+
+    release_holder.set()
+    holder.join(5)
+    assert registry_key not in context_cache._key_locks # Dropped once the last user left
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from app.services import document_access
+from app.services.document_access import TextDocument, build_line_index
+
+_ALPHABET = "ab \n\r\né中文🙂"
+
+
+def _open(tmp_path, text, step=4):
+    text_path, index_path = tmp_path / "text.txt", tmp_path / "text.idx"
+    text_path.write_bytes(text.encode("utf-8"))
+    build_line_index(str(text_path), str(index_path), step=step)
+    return TextDocument(str(text_path), str(index_path))
+
+
+def _expected_lines(text):
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line.removesuffix("\r") for line in lines]
+
+
+@pytest.fixture
+def small_checkpoints(monkeypatch):
+    """Checkpoints every 64 bytes, so short texts cross many of them (and characters straddle block ends)."""
+    monkeypatch.setattr(document_access, "CHECKPOINT_BYTES", 64)
+
+
+def test_counts_and_checkpoints_of_a_multibyte_text(tmp_path, small_checkpoints):
+    text = "第一行 line\r\n" * 40 + "🙂 last line without newline"
+
+    with _open(tmp_path, text) as document:
+        assert (document.char_count, document.line_count, document.size) == (len(text), 41, len(text.encode("utf-8")))
+        assert len(document._checkpoint_bytes) == -(-document.size // 64)
+        for byte_offset, char_offset in zip(document._checkpoint_bytes, document._checkpoint_chars):
+            assert text.encode("utf-8")[:byte_offset].decode("utf-8") == text[:char_offset]
+
+
+def test_line_windows_cross_the_index_stride(tmp_path, small_checkpoints):
+    lines = [f"行 {i}" for i in range(30)]
+
+    with _open(tmp_path, "\n".join(lines) + "\n", step=4) as document:
+        assert document.line_count == 30
+        assert document.read_lines(3, 6) == lines[3:9]
+        assert document.read_lines(28, 10) == lines[28:]
+        assert document.read_lines(30, 1) == []
+
+
+def test_empty_text(tmp_path):
+    with _open(tmp_path, "") as document:
+        assert (document.char_count, document.line_count) == (0, 0)
+        assert document.read_chars(0) == "" and document.read_lines(0, 5) == []
+
+
+def test_excerpt_keeps_the_head_and_tail(tmp_path):
+    text = "".join(chr(0x4e00 + i % 500) for i in range(1000))
+
+    with _open(tmp_path, text) as document:
+        assert document.excerpt(2000) == text
+        excerpt = document.excerpt(100)
+    assert excerpt.startswith(text[:70]) and excerpt.endswith(text[-30:])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_reads_match_string_slicing(tmp_path, small_checkpoints, seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 600)))
+    expected_lines = _expected_lines(text) if text else []
+
+    with _open(tmp_path, text, step=rng.choice([1, 2, 3, 8])) as document:
+        assert document.char_count == len(text) and document.line_count == len(expected_lines)
+        assert document.read_chars(0) == text
+        for _ in range(50):
+            start, end = sorted(rng.randint(0, len(text) + 2) for _ in range(2))
+            assert document.read_chars(start, end) == text[start:end]
+            line, count = rng.randint(0, len(expected_lines) + 1), rng.randint(0, 10)
+            assert document.read_lines(line, count) == expected_lines[line:line + count]
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+
+from app.services import document_summarizer, file_service, upload_preprocessing
+
+
+class _FakeDispatcher:
+    def __init__(self):
+        self.calls = []
+        self.prompts = []
+
+    async def submit(self, prompt_parts, selected_model, priority, user_id=None, generation_config_dict=None):
+        self.calls.append((selected_model, priority))
+        self.prompts.append("\n".join(prompt_parts))
+        return f"摘要 {len(self.calls)}", False
+
+
+def _setup(monkeypatch, chunk_tokens=50):
+    dispatcher = _FakeDispatcher()
+    monkeypatch.setattr(document_summarizer, "get_dispatcher", lambda: dispatcher)
+    monkeypatch.setattr(document_summarizer.settings, "DOC_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(document_summarizer.settings, "DOC_SUMMARY_MODEL", "summary-model")
+    monkeypatch.setattr(document_summarizer.settings, "DOC_SUMMARY_CHUNK_TOKENS", chunk_tokens)
+    return dispatcher
+
+
+def test_oversized_document_is_summarised_in_the_background_then_served_from_cache(test_db, monkeypatch):
+    dispatcher = _setup(monkeypatch)
+    docs = [{"name": "週報.txt", "content": "\n\n".join(["市場分析" * 40] * 5)}, {"name": "短.txt", "content": "短"}]
+
+    async def _main():
+        first = await document_summarizer.summarize_oversized_docs(docs, 200, user_id="alice")
+        await asyncio.gather(*document_summarizer._pending_summaries.values())
+        second = await document_summarizer.summarize_oversized_docs(docs, 200, user_id="bob")
+        return first, second
+
+    (first_docs, first_summarized, first_pending), (second_docs, second_summarized, second_pending) = asyncio.run(_main())
+
+    assert first_docs == docs and first_summarized == [] and first_pending == ["週報.txt"]
+    assert second_summarized == ["週報.txt"] and second_pending == []
+    assert second_docs[0]["content"].startswith(document_summarizer._SUMMARY_NOTE)
+    assert second_docs[1] == docs[1]
+    assert dispatcher.calls and all(call == ("summary-model", document_summarizer.PRIORITY_BATCH) for call in dispatcher.calls)
+
+
+def test_a_document_is_summarised_once_however_often_it_is_requested(test_db, monkeypatch):
+    dispatcher = _setup(monkeypatch, chunk_tokens=10000)
+    docs = [{"name": "週報.txt", "content": "市場分析" * 200}]
+
+    async def _main():
+        for _ in range(3):
+            await document_summarizer.summarize_oversized_docs(docs, 200)
+        assert len(document_summarizer._pending_summaries) == 1
+        await asyncio.gather(*document_summarizer._pending_summaries.values())
+
+    asyncio.run(_main())
+
+    assert len(dispatcher.calls) == 1
+    assert document_summarizer._pending_summaries == {}
+
+
+def test_an_upload_cut_to_head_and_tail_is_summarised_from_its_whole_text(test_db, tmp_path, monkeypatch):
+    dispatcher = _setup(monkeypatch)
+    monkeypatch.setattr(document_summarizer.settings, "AI_DATA_PATH", str(tmp_path))
+    content = "\n\n".join(f"第 {i} 段：" + "市場分析" * 30 for i in range(12)).encode("utf-8")
+    temp_path = tmp_path / "report.tmp"
+    temp_path.write_bytes(content)
+    saved = asyncio.run(file_service.store_temp_file(
+        str(temp_path), hashlib.sha256(content).hexdigest(), len(content), "report.txt", "text/plain", str(tmp_path)
+    ))
+
+    async def _main():
+        excerpt = await upload_preprocessing.load_document_text(saved["file_id"], "report.txt", str(tmp_path), max_chars=300)
+        docs = [{"name": "report.txt", "content": excerpt, "file_id": saved["file_id"]}]
+        await document_summarizer.summarize_oversized_docs(docs, 200)
+        await asyncio.gather(*document_summarizer._pending_summaries.values())
+        return excerpt, await document_summarizer.summarize_oversized_docs(docs, 200)
+
+    excerpt, (_, summarized, pending) = asyncio.run(_main())
+
+    assert "第 6 段" not in excerpt # Only in the omitted middle
+    assert any("第 6 段" in prompt for prompt in dispatcher.prompts)
+    assert summarized == ["report.txt"] and pending == []
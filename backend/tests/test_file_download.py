@@ -0,0 +1,73 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints_files
+
+CONTENT = "café,prix\nthé,2\n".encode("latin-1")
+
+
+@pytest.fixture
+def client(test_db, monkeypatch):
+    monkeypatch.setattr(endpoints_files, "AI_DATA_PATH", str(test_db))
+    app = FastAPI()
+    app.include_router(endpoints_files.router, prefix="/api/files")
+    return TestClient(app)
+
+
+def _upload(client, name="prix.csv", content=CONTENT, content_type="text/csv"):
+    return client.post("/api/files/upload", files={"file": (name, content, content_type)}).json()
+
+
+def test_text_download_is_labelled_with_the_detected_charset(client):
+    file_id = _upload(client)["file_id"]
+
+    response = client.get(f"/api/files/{file_id}")
+
+    assert response.headers["content-type"] == "text/csv; charset=latin-1"
+    assert response.text == "café,prix\nthé,2\n"
+    utf8_id = _upload(client, "notes.txt", "第一行".encode("utf-8"), "text/plain")["file_id"]
+    assert client.get(f"/api/files/{utf8_id}").headers["content-type"] == "text/plain; charset=utf-8"
+
+
+def test_range_request_returns_the_requested_bytes(client):
+    file_id = _upload(client)["file_id"]
+
+    response = client.get(f"/api/files/{file_id}", headers={"Range": "bytes=2-5"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[2:6]
+    assert response.headers["content-range"] == f"bytes 2-5/{len(CONTENT)}"
+
+
+def test_if_none_match_with_the_content_hash_is_not_modified(client):
+    uploaded = _upload(client)
+    etag = f'"{uploaded["sha256"]}"'
+
+    response = client.get(f"/api/files/{uploaded['file_id']}", headers={"If-None-Match": f'"other", W/{etag}'})
+
+    assert response.status_code == 304 and response.content == b""
+    assert response.headers["etag"] == etag
+    assert client.get(f"/api/files/{uploaded['file_id']}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_if_range_serves_the_range_only_while_the_etag_matches(client):
+    uploaded = _upload(client)
+    url = f"/api/files/{uploaded['file_id']}"
+
+    matching = client.get(url, headers={"Range": "bytes=0-3", "If-Range": f'"{uploaded["sha256"]}"'})
+    stale = client.get(url, headers={"Range": "bytes=0-3", "If-Range": '"stale"'})
+
+    assert matching.status_code == 206 and matching.content == CONTENT[:4]
+    assert stale.status_code == 200 and stale.content == CONTENT
+
+
+def test_head_returns_the_headers_without_a_body(client):
+    file_id = _upload(client)["file_id"]
+
+    response = client.head(f"/api/files/{file_id}")
+
+    assert response.status_code == 200 and response.content == b""
+    assert response.headers["content-length"] == str(len(CONTENT))
+    assert response.headers["accept-ranges"] == "bytes"
+    assert client.head("/api/files/unknown").status_code == 404
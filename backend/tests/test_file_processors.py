@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from app.services.file_processors import ingest_table_chunks
+
+
+def test_chunks_downcast_differently_read_back_as_one_table(tmp_path):
+    chunks = [
+        pd.DataFrame({"a": [1, 2, 3, 4], "b": [np.nan] * 4, "c": ["x", "x", "x", "y"]}), # int8, float, category
+        pd.DataFrame({"a": [1000, 2, 3, 4], "b": ["p", "q", "r", "s"], "c": ["u", "v", "w", "z"]}), # int16, text, text
+        pd.DataFrame({"a": [1.5, 2, 3, 4], "b": ["p"] * 4, "c": ["u"] * 4}), # float32, category, category
+    ]
+
+    result = ingest_table_chunks(chunks, str(tmp_path / "table"))
+
+    table = pd.read_parquet(tmp_path / "table")
+    assert result["summary"]["rows"] == len(table) == 12
+    assert table["a"].tolist() == [1, 2, 3, 4, 1000, 2, 3, 4, 1.5, 2, 3, 4]
+    assert table["b"].iloc[4:8].tolist() == ["p", "q", "r", "s"] and table["b"].iloc[:4].isna().all()
+    assert table["c"].tolist() == ["x", "x", "x", "y", "u", "v", "w", "z"] + ["u"] * 4
+
+
+def test_parts_of_an_earlier_run_are_removed(tmp_path):
+    parts_dir = tmp_path / "table"
+    ingest_table_chunks([pd.DataFrame({"a": [1]})] * 3, str(parts_dir))
+
+    ingest_table_chunks([pd.DataFrame({"a": [2]})], str(parts_dir))
+
+    assert [p.name for p in parts_dir.iterdir()] == ["part-00000.parquet"]
+    assert pd.read_parquet(parts_dir)["a"].tolist() == [2]
+
+
+def test_column_that_turns_into_text_has_no_numeric_statistics(tmp_path):
+    chunks = [
+        pd.DataFrame({"a": [1, 2], "b": ["x", "x"]}), # b: category
+        pd.DataFrame({"a": [3, 4], "b": ["y", "z"]}), # b: text
+        pd.DataFrame({"a": [5, 6], "b": [120.5, 118.0]}), # b: float32
+    ]
+
+    columns = {c["name"]: c for c in ingest_table_chunks(chunks, str(tmp_path / "table"))["summary"]["columns"]}
+
+    assert columns["a"]["type"] == "int8"
+    assert (columns["a"]["min"], columns["a"]["max"], columns["a"]["mean"]) == (1.0, 6.0, 3.5)
+    assert columns["b"]["type"] == "string"
+    assert "mean" not in columns["b"] and "min" not in columns["b"]
+    assert columns["b"]["distinct"] == 5
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.db.init_db import get_db_path
+from app.services import file_service
+
+
+def _store(tmp_path, content, file_name):
+    temp_path = tmp_path / f"{file_name}.tmp"
+    temp_path.write_bytes(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    return asyncio.run(file_service.store_temp_file(str(temp_path), sha256, len(content), file_name, "text/plain", str(tmp_path)))
+
+
+def test_same_content_and_name_is_deduplicated(test_db, tmp_path):
+    first = _store(tmp_path, b"weekly post", "post.txt")
+    second = _store(tmp_path, b"weekly post", "post.txt")
+
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert second["file_id"] == first["file_id"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_same_content_under_another_name_shares_the_blob(test_db, tmp_path):
+    first = _store(tmp_path, b"weekly post", "post.txt")
+    renamed = _store(tmp_path, b"weekly post", "copy.txt")
+
+    assert not renamed["deduplicated"] and renamed["file_id"] != first["file_id"]
+    first_record = asyncio.run(file_service.resolve_uploaded_file(first["file_id"]))
+    renamed_record = asyncio.run(file_service.resolve_uploaded_file(renamed["file_id"]))
+    assert first_record["blob_path"] == renamed_record["blob_path"]
+    assert len(list((tmp_path / "uploads" / "blobs").rglob("*"))) == 2 # One prefix directory, one blob
+
+
+def test_blob_is_removed_when_indexing_fails(test_db, tmp_path, monkeypatch):
+    async def _failing_record(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(file_service, "_record_upload", _failing_record)
+
+    with pytest.raises(IOError):
+        _store(tmp_path, b"weekly post", "post.txt")
+
+    blob_path = tmp_path / file_service.blob_relative_path(hashlib.sha256(b"weekly post").hexdigest())
+    assert not os.path.exists(blob_path)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def _last_accessed_at(file_id):
+    with sqlite3.connect(get_db_path()) as db:
+        return db.execute("SELECT last_accessed_at FROM uploaded_files WHERE file_id = ?", (file_id,)).fetchone()[0]
+
+
+def test_lookup_writes_the_access_time_only_when_it_is_stale(test_db, tmp_path):
+    file_id = _store(tmp_path, b"weekly post", "post.txt")["file_id"]
+    stored_at = _last_accessed_at(file_id)
+
+    assert asyncio.run(file_service.resolve_uploaded_file(file_id, "post.txt"))["file_id"] == file_id
+    assert _last_accessed_at(file_id) == stored_at # Recent enough: no write
+
+    stale = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    with sqlite3.connect(get_db_path()) as db:
+        db.execute("UPDATE uploaded_files SET last_accessed_at = ? WHERE file_id = ?", (stale, file_id))
+    asyncio.run(file_service.resolve_uploaded_file(file_id))
+
+    assert _last_accessed_at(file_id) > stored_at
+    assert asyncio.run(file_service.resolve_uploaded_file(file_id, "other.txt")) is None
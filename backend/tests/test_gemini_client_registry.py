@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+
+from app.services import gemini_client_registry
+from app.services.gemini_client_registry import genai, get_key_client, protos
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(monkeypatch):
+    monkeypatch.setattr(gemini_client_registry, "_clients", {})
+
+
+def test_each_key_gets_its_own_clients_and_model_handles():
+    first, second = get_key_client("key-aaaa"), get_key_client("key-bbbb")
+
+    assert first is not second
+    assert first.generative_client is not second.generative_client
+    assert first.generative_client._transport._credentials.token == "key-aaaa"
+    assert second.generative_client._transport._credentials.token == "key-bbbb"
+    first_model, second_model = first.get_model("gemini-2.5-flash"), second.get_model("gemini-2.5-flash")
+    assert first_model is not second_model
+    assert first_model._client is first.generative_client and second_model._client is second.generative_client
+
+
+def test_clients_and_model_handles_are_reused():
+    key_client = get_key_client("key-aaaa")
+
+    assert get_key_client("key-aaaa") is key_client
+    assert key_client.generative_client is key_client.generative_client
+    assert key_client.get_model("gemini-2.5-flash") is key_client.get_model("models/gemini-2.5-flash")
+
+
+def test_private_caching_helpers_used_by_the_registry_still_exist():
+    # create_cached_content / get_cached_content rely on these private SDK helpers; they are pinned in requirements.txt.
+    request = genai.caching.CachedContent._prepare_create_request(
+        model="gemini-2.5-flash", system_instruction="系統", contents=["文件"], ttl=datetime.timedelta(seconds=60)
+    )
+    cached_content = genai.caching.CachedContent._from_obj(
+        protos.CachedContent(name="cachedContents/abc", model="models/gemini-2.5-flash")
+    )
+
+    assert isinstance(request, protos.CreateCachedContentRequest)
+    assert request.cached_content.model == "models/gemini-2.5-flash"
+    assert (cached_content.name, cached_content.model) == ("cachedContents/abc", "models/gemini-2.5-flash")
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import gemini_dispatcher
+from app.services.gemini_dispatcher import GeminiDispatcher, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    def _call(prompt_parts, **kwargs):
+        return f"answer to {prompt_parts[0]}", False
+
+    monkeypatch.setattr(gemini_dispatcher.gemini_service, "call_gemini_api", _call)
+
+
+def _run_in_dispatch_order(dispatcher, submissions):
+    """Submits (prompt, priority, user_id) tuples together and returns the prompts in the order they were dispatched."""
+    dispatched = []
+    execute = dispatcher._execute
+
+    async def _recording_execute(request, api_key, usage_event):
+        dispatched.append(request.prompt_parts[0])
+        await execute(request, api_key, usage_event)
+
+    dispatcher._execute = _recording_execute
+
+    async def _main():
+        # All submissions are queued before the scheduler task gets to run.
+        return await asyncio.gather(*[
+            dispatcher.submit([prompt], "gemini-2.5-flash", priority=priority, user_id=user_id)
+            for prompt, priority, user_id in submissions
+        ])
+
+    results = asyncio.run(_main())
+    assert [text for text, _ in results] == [f"answer to {prompt}" for prompt, _, _ in submissions]
+    return dispatched
+
+
+def test_interactive_requests_are_dispatched_before_queued_batch_requests(fake_gemini):
+    dispatcher = GeminiDispatcher(["key-1"], rpm_limit=0, tpm_limit=0, interactive_reserved_share=0.3)
+
+    order = _run_in_dispatch_order(dispatcher, [
+        ("b1", PRIORITY_BATCH, "worker"),
+        ("b2", PRIORITY_BATCH, "worker"),
+        ("i1", PRIORITY_INTERACTIVE, "alice"),
+    ])
+
+    assert order == ["i1", "b1", "b2"]
+
+
+def test_users_of_a_class_are_served_round_robin(fake_gemini):
+    dispatcher = GeminiDispatcher(["key-1"], rpm_limit=0, tpm_limit=0, interactive_reserved_share=0.3)
+
+    order = _run_in_dispatch_order(dispatcher, [
+        ("a1", PRIORITY_INTERACTIVE, "alice"),
+        ("a2", PRIORITY_INTERACTIVE, "alice"),
+        ("a3", PRIORITY_INTERACTIVE, "alice"),
+        ("b1", PRIORITY_INTERACTIVE, "bob"),
+        ("c1", PRIORITY_INTERACTIVE, "carol"),
+        ("c2", PRIORITY_INTERACTIVE, "carol"),
+    ])
+
+    assert order == ["a1", "b1", "c1", "a2", "c2", "a3"]
+
+
+def test_batch_may_not_use_the_interactive_reserved_share():
+    dispatcher = GeminiDispatcher(["key-1"], rpm_limit=10, tpm_limit=1000, interactive_reserved_share=0.3)
+    now = time.monotonic()
+    for _ in range(7):
+        dispatcher._windows["key-1"].record(now, 10)
+
+    # 7 of 10 requests used: batch has reached its 70% share, interactive may still use the rest.
+    assert not dispatcher._has_capacity("key-1", PRIORITY_BATCH, 10, now)
+    assert dispatcher._has_capacity("key-1", PRIORITY_INTERACTIVE, 10, now)
+
+    # Tokens are shared the same way: 100 used + 601 exceeds the batch share of 700 tokens.
+    dispatcher._windows["key-1"] = gemini_dispatcher._KeyUsageWindow()
+    dispatcher._windows["key-1"].record(now, 100)
+    assert not dispatcher._has_capacity("key-1", PRIORITY_BATCH, 601, now)
+    assert dispatcher._has_capacity("key-1", PRIORITY_INTERACTIVE, 601, now)
+
+
+def test_no_limit_is_applied_unless_configured():
+    dispatcher = GeminiDispatcher(["key-1"], rpm_limit=0, tpm_limit=0, interactive_reserved_share=0.3)
+    now = time.monotonic()
+    for _ in range(100):
+        dispatcher._windows["key-1"].record(now, 100000)
+
+    assert dispatcher._has_capacity("key-1", PRIORITY_INTERACTIVE, 100000, now)
+    assert dispatcher._has_capacity("key-1", PRIORITY_BATCH, 100000, now)
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.services import history_compaction
+from app.services.gemini_dispatcher import PRIORITY_BATCH
+
+
+class _FakeDispatcher:
+    def __init__(self):
+        self.calls = []
+
+    async def submit(self, prompt_parts, selected_model, priority, user_id=None, generation_config_dict=None):
+        self.calls.append({"prompt_parts": prompt_parts, "priority": priority})
+        await asyncio.sleep(0.01)
+        return f"摘要 {len(self.calls)}", False
+
+
+@pytest.fixture
+def dispatcher(test_db, monkeypatch):
+    fake = _FakeDispatcher()
+    monkeypatch.setattr(history_compaction, "get_dispatcher", lambda: fake)
+    monkeypatch.setattr(history_compaction.settings, "HISTORY_COMPACTION_ENABLED", True)
+    monkeypatch.setattr(history_compaction.settings, "HISTORY_COMPACTION_THRESHOLD_TOKENS", 50)
+    monkeypatch.setattr(history_compaction.settings, "HISTORY_COMPACTION_KEEP_RECENT_MESSAGES", 2)
+    return fake
+
+
+def _history(turns, text="市場分析" * 5):
+    history = []
+    for i in range(turns):
+        history += [{"role": "user", "parts": [f"問題{i} {text}"]}, {"role": "model", "parts": [f"回答{i} {text}"]}]
+    return history
+
+
+def test_history_below_threshold_is_neither_compacted_nor_summarised(dispatcher):
+    history = _history(1)
+
+    asyncio.run(history_compaction.refresh_history_digest("s1", history, "gemini-2.5-flash"))
+
+    assert asyncio.run(history_compaction.compact_history_for_prompt("s1", history)) == (history, False)
+    assert dispatcher.calls == []
+
+
+def test_digest_is_generated_at_batch_priority_and_replaces_older_messages(dispatcher):
+    history = _history(4)
+    assert asyncio.run(history_compaction.compact_history_for_prompt("s1", history)) == (history, False) # No digest yet
+
+    asyncio.run(history_compaction.refresh_history_digest("s1", history, "gemini-2.5-flash"))
+    compacted, used_digest = asyncio.run(history_compaction.compact_history_for_prompt("s1", history))
+
+    assert [call["priority"] for call in dispatcher.calls] == [PRIORITY_BATCH]
+    assert used_digest
+    assert compacted[0]["role"] == history_compaction.DIGEST_ROLE and compacted[0]["parts"][0].endswith("摘要 1")
+    assert compacted[1:] == history[-2:]
+
+
+def test_digest_is_regenerated_when_the_covered_messages_changed(dispatcher):
+    history = _history(4)
+    asyncio.run(history_compaction.refresh_history_digest("s1", history, "gemini-2.5-flash"))
+
+    edited = [{"role": "user", "parts": ["改過的第一個問題 " + "市場分析" * 5]}] + history[1:]
+
+    assert asyncio.run(history_compaction.compact_history_for_prompt("s1", edited)) == (edited, False)
+    asyncio.run(history_compaction.refresh_history_digest("s1", edited, "gemini-2.5-flash"))
+    compacted, used_digest = asyncio.run(history_compaction.compact_history_for_prompt("s1", edited))
+
+    assert len(dispatcher.calls) == 2
+    assert not any(part.startswith("**先前的摘要:**") for part in dispatcher.calls[1]["prompt_parts"]) # Started over, not from the stale digest
+    assert used_digest and compacted[0]["parts"][0].endswith("摘要 2")
+
+
+def test_one_background_refresh_per_session_at_a_time(dispatcher):
+    history = _history(4)
+
+    async def _main():
+        await asyncio.gather(*[history_compaction.refresh_history_digest("s1", history, "gemini-2.5-flash") for _ in range(3)])
+
+    asyncio.run(_main())
+
+    assert len(dispatcher.calls) == 1
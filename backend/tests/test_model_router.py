@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import gemini_dispatcher, model_router
+from app.services.gemini_dispatcher import GeminiDispatcher
+from app.services.model_router import ModelLatencyStats, TIER_FLASH, TIER_PRO, route_model
+
+FLASH = "models/gemini-2.5-flash"
+PRO = "models/gemini-2.5-pro"
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(model_router.settings, "MODEL_ROUTING_ENABLED", True)
+    monkeypatch.setattr(model_router.model_catalog, "get_catalog_snapshot", lambda: {"models": [{"name": PRO}, {"name": FLASH}]})
+    monkeypatch.setattr(model_router.model_catalog, "get_default_model", lambda: PRO)
+    monkeypatch.setattr(model_router, "latency_stats", ModelLatencyStats(window=50))
+
+
+def test_explicitly_requested_model_is_never_rerouted(catalog):
+    decision = route_model(prompt_tokens=100, requested_model=PRO)
+
+    assert (decision.model_name, decision.reason) == (PRO, "pinned")
+
+
+def test_prompt_size_and_trigger_action_choose_the_tier(catalog):
+    limit = model_router.settings.MODEL_ROUTING_FLASH_MAX_PROMPT_TOKENS
+
+    assert route_model(prompt_tokens=limit).tier == TIER_FLASH
+    assert route_model(prompt_tokens=limit + 1).tier == TIER_PRO
+    assert route_model(prompt_tokens=10, trigger_action="initial_analysis").reason == "trigger_action"
+
+
+def test_latency_target_uses_observed_latencies(catalog):
+    for _ in range(5):
+        model_router.latency_stats.record(PRO, 10.0, 1000, 100)
+
+    assert route_model(prompt_tokens=1000, latency_target_ms=5000).model_name == FLASH
+    assert route_model(prompt_tokens=1000, latency_target_ms=20000).model_name == PRO
+
+
+def test_no_routing_without_both_tiers_in_the_catalog(catalog, monkeypatch):
+    monkeypatch.setattr(model_router.model_catalog, "get_catalog_snapshot", lambda: {"models": [{"name": PRO}]})
+
+    assert (route_model(prompt_tokens=10).model_name, route_model(prompt_tokens=10).reason) == (PRO, "no_catalog")
+
+
+def test_latency_fit_follows_prompt_size():
+    stats = ModelLatencyStats(window=50)
+    for tokens in (1000, 2000, 3000, 4000, 5000):
+        stats.record(FLASH, 1.0 + tokens / 1000, tokens, 10)
+
+    assert stats.estimate_latency_seconds(FLASH, 10000) == pytest.approx(11.0)
+
+
+def test_dispatcher_reports_execution_time_without_queue_wait(monkeypatch):
+    def _slow_call(prompt_parts, **kwargs):
+        time.sleep(0.2)
+        return "answer", False
+
+    monkeypatch.setattr(gemini_dispatcher.gemini_service, "call_gemini_api", _slow_call)
+    dispatcher = GeminiDispatcher(["key-1"], rpm_limit=1, tpm_limit=0, interactive_reserved_share=0.0)
+
+    async def _main():
+        # The key allows one request per minute: the second call waits in the queue until the window frees up.
+        dispatcher._windows["key-1"].record(time.monotonic() - gemini_dispatcher._WINDOW_SECONDS + 0.5, 1)
+        started_at = time.perf_counter()
+        result = await dispatcher.submit_timed(["question"], FLASH)
+        return result, time.perf_counter() - started_at
+
+    (text, was_truncated, execution_seconds), total_seconds = asyncio.run(_main())
+
+    assert (text, was_truncated) == ("answer", False)
+    assert total_seconds >= 0.6
+    assert 0.2 <= execution_seconds < 0.4
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from app.services import context_cache
+from app.services.prompt_planner import _chars_for_tokens, allocate_budget, fit_prompt_parts, plan_prompt, trim_text_head_tail
+from app.utils.token_utils import estimate_tokens
+
+
+def _mixed_text(length, seed=0):
+    """Alternating runs of Chinese and English, as in the weekly posts and their market data notes."""
+    rng = random.Random(seed)
+    runs = []
+    while sum(map(len, runs)) < length:
+        if rng.random() < 0.5:
+            runs.append("山家狼本週分析市場動向與利率走勢。" * rng.randint(1, 40))
+        else:
+            runs.append("GDP grew 2.3% while CPI rose 0.4% m/m. " * rng.randint(1, 40))
+    return "".join(runs)
+
+
+@pytest.mark.parametrize("length,max_tokens", [(400000, 100000), (80000, 20000), (12000, 3000), (2000, 500)])
+def test_trim_text_head_tail_never_exceeds_budget_on_mixed_text(length, max_tokens):
+    text = _mixed_text(length)
+    assert estimate_tokens(text) > max_tokens
+
+    trimmed = trim_text_head_tail(text, max_tokens)
+
+    assert max_tokens * 0.98 <= estimate_tokens(trimmed) <= max_tokens
+    head, tail = trimmed.split("\n...[中略約")[0], trimmed.split("tokens]...\n")[-1]
+    assert text.startswith(head) and text.endswith(tail)
+    assert len(head) > len(tail) # 70% of the kept budget goes to the head
+
+
+def test_trim_text_head_tail_leaves_fitting_text_alone():
+    assert trim_text_head_tail("短文 short", 100) == "短文 short"
+    assert trim_text_head_tail("字" * 100, 5) == "" # Not even the omission marker fits
+
+
+def test_chars_for_tokens_is_the_longest_fitting_prefix():
+    text = _mixed_text(5000, seed=3)
+    for max_tokens in (1, 7, 100, 999):
+        chars = _chars_for_tokens(text, max_tokens)
+        assert estimate_tokens(text[:chars]) <= max_tokens < estimate_tokens(text[:chars + 1])
+
+
+def test_allocate_budget_gives_unused_share_to_larger_sections():
+    allocation = allocate_budget({"a": 10, "b": 1000, "c": 1000}, {"a": 1.0, "b": 1.0, "c": 2.0}, 310)
+
+    assert allocation == {"a": 10, "b": 100, "c": 200}
+
+
+def test_plan_prompt_fits_oversized_core_documents_into_budget():
+    docs = [{"name": "週報.txt", "content": _mixed_text(60000, seed=1)}, {"name": "notes.md", "content": "短"}]
+
+    plan = plan_prompt("系統提示", docs, None, None, "問題？", token_budget=5000)
+
+    assert plan.was_trimmed
+    assert sum(plan.section_tokens.values()) <= 5000
+    assert plan.core_docs_contents[1]["content"] == "短"
+
+
+def test_fit_prompt_parts_trims_middle_parts_within_budget():
+    parts = ["system", _mixed_text(20000, seed=2), _mixed_text(10000, seed=4), "question"]
+
+    fitted, was_truncated = fit_prompt_parts(parts, 3000)
+
+    assert was_truncated
+    assert fitted[0] == "system" and fitted[-1] == "question"
+    assert sum(estimate_tokens(p) for p in fitted) <= 3000
+
+
+def test_prefix_larger_than_budget_is_not_cached(monkeypatch):
+    monkeypatch.setattr(context_cache.settings, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(context_cache.gemini_service, "create_gemini_cache", lambda **kwargs: pytest.fail("must not create a cache"))
+
+    lease = context_cache.acquire_prefix_cache("key", "gemini-2.5-pro", "系統" * 3000, ["文件" * 3000], min_tokens=1, max_tokens=5000)
+
+    assert lease is None
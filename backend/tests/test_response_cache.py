@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from app.services import response_cache
+from app.services.response_cache import compute_response_cache_key, is_cacheable_request
+
+
+@pytest.fixture
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(response_cache.settings, "LLM_RESPONSE_CACHE_ENABLED", True)
+
+
+def test_cache_key_is_canonical():
+    key = compute_response_cache_key("gemini-2.5-pro", {"temperature": 0, "top_k": 1}, ["系統", "問題"])
+
+    assert key == compute_response_cache_key("models/gemini-2.5-pro", {"top_k": 1, "temperature": 0}, ["系統", "問題"])
+    assert key != compute_response_cache_key("gemini-2.5-pro", {"temperature": 0, "top_k": 1}, ["系統問題"])
+    assert key != compute_response_cache_key("gemini-2.5-flash", {"temperature": 0, "top_k": 1}, ["系統", "問題"])
+    assert key != compute_response_cache_key("gemini-2.5-pro", {"temperature": 0, "top_k": 1}, ["系統", "問題"], prefix_hash="abc")
+
+
+def test_only_deterministic_or_explicitly_reused_requests_are_cacheable(cache_enabled, monkeypatch):
+    assert is_cacheable_request({"temperature": 0})
+    assert is_cacheable_request({"temperature": "0.0"})
+    assert not is_cacheable_request({"temperature": 0.7})
+    assert not is_cacheable_request(None) # The model's default temperature is not 0
+    assert is_cacheable_request({"temperature": 0.7}, reuse=True)
+
+    monkeypatch.setattr(response_cache.settings, "LLM_RESPONSE_CACHE_ENABLED", False)
+    assert not is_cacheable_request({"temperature": 0}, reuse=True)
+
+
+def test_least_recently_used_entries_are_evicted_beyond_the_byte_bound(test_db, cache_enabled, monkeypatch):
+    monkeypatch.setattr(response_cache.settings, "LLM_RESPONSE_CACHE_MAX_BYTES", 30)
+
+    async def _main():
+        await response_cache.set_cached_response("a", "m", "a" * 10)
+        await response_cache.set_cached_response("b", "m", "b" * 10)
+        await response_cache.set_cached_response("c", "m", "c" * 10)
+        assert await response_cache.get_cached_response("a") == "a" * 10 # 'b' is now least recently used
+        await response_cache.set_cached_response("d", "m", "d" * 10)
+        await response_cache.set_cached_response("e", "m", "e" * 31) # Larger than the whole bound: not stored
+        return {key: await response_cache.get_cached_response(key) for key in "abcde"}
+
+    cached = asyncio.run(_main())
+
+    assert [key for key, value in cached.items() if value is not None] == ["a", "c", "d"]
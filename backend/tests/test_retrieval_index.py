@@ -0,0 +1,41 @@
+import asyncio
+
+from app.services import retrieval_index
+from app.services.retrieval_index import RetrievalIndex, chunk_text, tokenize
+
+
+def test_tokenize_indexes_cjk_characters_and_bigrams():
+    assert tokenize("山家狼 GDP 2.5") == ["山", "家", "狼", "山家", "家狼", "gdp", "2.5"]
+
+
+def test_one_character_query_matches_multi_character_runs(test_db, tmp_path):
+    source_dir = tmp_path / "source_documents"
+    source_dir.mkdir()
+    (source_dir / "2024-W01.txt").write_text("本週聯準會維持利率不變。", encoding="utf-8")
+    (source_dir / "2024-W02.txt").write_text("台股創新高，外資持續買超。", encoding="utf-8")
+    index = RetrievalIndex(str(source_dir))
+
+    asyncio.run(index.sync())
+
+    assert [r["name"] for r in index.search("率", top_k=5)] == ["2024-W01.txt"]
+    assert [r["name"] for r in index.search("外資", top_k=5)] == ["2024-W02.txt"]
+
+
+def test_chunk_text_merges_a_tail_that_is_almost_all_overlap():
+    assert [len(c) for c in chunk_text("a" * 1001, 1000, 200)] == [1001]
+    assert [len(c) for c in chunk_text("a" * 2500, 1000, 200)] == [1000, 1000, 900]
+    paragraph = "".join(chr(0x4e00 + i) for i in range(1150))
+    assert chunk_text(paragraph, 1000, 200) == [paragraph] # Nothing is lost when the tail is merged
+
+
+def test_index_version_change_reindexes_unchanged_files(test_db, tmp_path, monkeypatch):
+    source_dir = tmp_path / "source_documents"
+    source_dir.mkdir()
+    (source_dir / "post.txt").write_text("利率", encoding="utf-8")
+    index = RetrievalIndex(str(source_dir))
+    assert asyncio.run(index.sync())["added"] == 1
+    assert asyncio.run(index.sync())["unchanged"] == 1
+
+    monkeypatch.setattr(retrieval_index, "INDEX_VERSION", retrieval_index.INDEX_VERSION + 1)
+
+    assert asyncio.run(index.sync())["updated"] == 1
@@ -0,0 +1,43 @@
+import asyncio
+import sqlite3
+
+from app.db.init_db import get_db_path
+from app.services import search_index
+from app.services.retrieval_index import RetrievalIndex
+
+
+def _write_posts(source_dir):
+    source_dir.mkdir(exist_ok=True)
+    (source_dir / "2024-W01.txt").write_text("本週聯準會維持利率不變。", encoding="utf-8")
+    (source_dir / "2024-W02.txt").write_text("台股創新高，外資持續買超 NVDA。", encoding="utf-8")
+
+
+def test_source_documents_share_the_retrieval_chunks(test_db, tmp_path):
+    source_dir = tmp_path / "source_documents"
+    _write_posts(source_dir)
+
+    stats = asyncio.run(search_index.sync_search_index(str(source_dir), str(tmp_path)))
+    results = asyncio.run(search_index.search("外資"))
+
+    assert stats["added"] == 2
+    assert [(r["name"], r["week_id"]) for r in results] == [("2024-W02.txt", "2024-W02")]
+    assert "**外資**" in results[0]["snippet"]
+    with sqlite3.connect(get_db_path()) as db:
+        assert db.execute("SELECT COUNT(*) FROM search_fts WHERE text IS NOT NULL").fetchone()[0] == 0
+        assert db.execute("SELECT COUNT(*) FROM retrieval_chunks").fetchone()[0] == 2
+
+
+def test_changed_document_is_hidden_until_the_search_index_catches_up(test_db, tmp_path):
+    source_dir = tmp_path / "source_documents"
+    _write_posts(source_dir)
+    asyncio.run(search_index.sync_search_index(str(source_dir), str(tmp_path)))
+
+    (source_dir / "2024-W02.txt").write_text("債市殖利率回落。", encoding="utf-8")
+    asyncio.run(RetrievalIndex(str(source_dir)).sync()) # e.g. the chat endpoint's retrieval sync
+
+    assert asyncio.run(search_index.search("外資")) == []
+
+    stats = asyncio.run(search_index.sync_search_index(str(source_dir), str(tmp_path)))
+
+    assert (stats["updated"], stats["unchanged"]) == (1, 1)
+    assert [r["name"] for r in asyncio.run(search_index.search("殖利率"))] == ["2024-W02.txt"]
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.db.init_db import get_db_path
+from app.services import file_service
+
+
+@pytest.fixture
+def uploads(test_db, tmp_path, monkeypatch):
+    """Four single-file uploads of 100 bytes each, last accessed 40, 30, 20 and 10 days ago (oldest first)."""
+    monkeypatch.setattr(file_service.chat_sessions, "get_active_file_ids", _no_active_files)
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    file_ids = []
+    for i, age_days in enumerate((40, 30, 20, 10)):
+        temp_path = tmp_path / f"upload-{i}.tmp"
+        temp_path.write_bytes(bytes([i]) * 100)
+        record = asyncio.run(file_service.store_temp_file(str(temp_path), f"{i:064x}", 100, f"{i}.txt", "text/plain", str(upload_dir)))
+        _set_last_access(record["file_id"], datetime.now(timezone.utc) - timedelta(days=age_days))
+        file_ids.append(record["file_id"])
+    return str(upload_dir), file_ids
+
+
+async def _no_active_files(updated_since):
+    return set()
+
+
+def _set_last_access(file_id, when):
+    with sqlite3.connect(get_db_path()) as db:
+        db.execute("UPDATE uploaded_files SET last_accessed_at = ? WHERE file_id = ?", (when.isoformat(), file_id))
+
+
+def _remaining_file_ids():
+    with sqlite3.connect(get_db_path()) as db:
+        return {row[0] for row in db.execute("SELECT file_id FROM uploaded_files")}
+
+
+def test_expired_files_then_least_recently_used_until_under_quota(uploads):
+    upload_dir, file_ids = uploads
+
+    report = asyncio.run(file_service.collect_upload_garbage(upload_dir, max_age_days=35, quota_bytes=250))
+
+    # The 40-day-old file is expired; the 30-day-old one goes to bring 300 bytes under the 250 byte quota.
+    assert _remaining_file_ids() == set(file_ids[2:])
+    assert (report["files_deleted"], report["bytes_freed"], report["bytes_remaining"]) == (2, 200, 200)
+
+
+def test_files_of_active_sessions_and_recently_used_files_are_kept(uploads, monkeypatch):
+    upload_dir, file_ids = uploads
+    _set_last_access(file_ids[1], datetime.now(timezone.utc))
+
+    async def _active(updated_since):
+        return {file_ids[0]}
+
+    monkeypatch.setattr(file_service.chat_sessions, "get_active_file_ids", _active)
+
+    report = asyncio.run(file_service.collect_upload_garbage(upload_dir, max_age_days=1, quota_bytes=0))
+
+    assert _remaining_file_ids() == set(file_ids[:2])
+    assert report["bytes_remaining"] == 200
+
+
+def test_each_batch_is_checked_again_before_deletion(uploads, monkeypatch):
+    upload_dir, file_ids = uploads
+    monkeypatch.setattr(file_service.settings, "UPLOAD_GC_BATCH_SIZE", 1)
+    active_calls = []
+
+    async def _active(updated_since):
+        # A session selects the newest file after the GC has chosen its candidates.
+        active_calls.append(updated_since)
+        return {file_ids[3]} if len(active_calls) > 1 else set()
+
+    delete_files = file_service._delete_files
+
+    async def _delete_then_use_second_file(db, batch, base_upload_dir):
+        result = await delete_files(db, batch, base_upload_dir)
+        if batch == [file_ids[0]]:
+            _set_last_access(file_ids[1], datetime.now(timezone.utc)) # Read while the GC is between batches
+        return result
+
+    monkeypatch.setattr(file_service.chat_sessions, "get_active_file_ids", _active)
+    monkeypatch.setattr(file_service, "_delete_files", _delete_then_use_second_file)
+
+    report = asyncio.run(file_service.collect_upload_garbage(upload_dir, max_age_days=1, quota_bytes=0))
+
+    assert _remaining_file_ids() == {file_ids[1], file_ids[3]}
+    assert report["files_deleted"] == 2
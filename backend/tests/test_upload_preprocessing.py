@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import sys
+from collections import OrderedDict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints_files
+from app.config import settings
+from app.services import file_service, upload_preprocessing
+
+
+@pytest.fixture(autouse=True)
+def empty_text_cache(monkeypatch):
+    monkeypatch.setattr(upload_preprocessing, "_text_cache", OrderedDict())
+    monkeypatch.setattr(upload_preprocessing, "_text_cache_bytes", 0)
+
+
+def _store(tmp_path, content, file_name, content_type="text/plain"):
+    temp_path = tmp_path / f"{file_name}.tmp"
+    temp_path.write_bytes(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    saved = asyncio.run(file_service.store_temp_file(str(temp_path), sha256, len(content), file_name, content_type, str(tmp_path)))
+    return asyncio.run(file_service.get_file_record(saved["file_id"]))
+
+
+def _ensure(record, tmp_path, **kwargs):
+    return asyncio.run(upload_preprocessing.ensure_artifacts(record, str(tmp_path), **kwargs))
+
+
+def test_text_upload_gets_a_text_artifact(test_db, tmp_path):
+    record = _store(tmp_path, "第一行\nsecond line\n".encode("utf-8"), "notes.txt")
+
+    artifacts = _ensure(record, tmp_path)
+    text = asyncio.run(upload_preprocessing.load_document_text(record["file_id"], "notes.txt", str(tmp_path)))
+
+    assert artifacts["status"] == "ready" and artifacts["kind"] == "text"
+    assert artifacts["token_count"] > 0
+    assert text == "第一行\nsecond line\n"
+
+
+def test_csv_upload_gets_a_table_artifact_and_its_text(test_db, tmp_path):
+    record = _store(tmp_path, b"a,b\n1,x\n2,y\n3,z\n", "data.csv", "text/csv")
+
+    artifacts = _ensure(record, tmp_path)
+    preview = asyncio.run(upload_preprocessing.get_preview(record["file_id"], str(tmp_path), max_rows=2))
+
+    assert artifacts["kind"] == "table"
+    assert artifacts["summary"]["encoding"] == "utf-8"
+    assert preview["rows"] == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+    assert len(preview["sample"]) == 2
+    text = asyncio.run(upload_preprocessing.load_document_text(record["file_id"], "data.csv", str(tmp_path)))
+    assert text == "a,b\n1,x\n2,y\n3,z\n"
+
+
+def test_undecodable_upload_is_binary_without_text(test_db, tmp_path):
+    record = _store(tmp_path, b"\xff\xfe\x00\x81" * 16, "image.bin", "application/octet-stream")
+
+    artifacts = _ensure(record, tmp_path)
+
+    assert artifacts["status"] == "ready" and artifacts["kind"] == "binary"
+    assert asyncio.run(upload_preprocessing.load_document_text(record["file_id"], "image.bin", str(tmp_path))) is None
+
+
+def test_concurrent_callers_share_one_preprocessing_run(test_db, tmp_path, monkeypatch):
+    calls = []
+    build_artifacts = upload_preprocessing._build_artifacts
+
+    def _counting_build(*args):
+        calls.append(args)
+        return build_artifacts(*args)
+
+    monkeypatch.setattr(upload_preprocessing, "_build_artifacts", _counting_build)
+    record = _store(tmp_path, b"weekly post", "post.txt")
+    renamed = _store(tmp_path, b"weekly post", "copy.txt")
+
+    async def _main():
+        return await asyncio.gather(*(upload_preprocessing.ensure_artifacts(r, str(tmp_path)) for r in (record, renamed, record)))
+
+    results = asyncio.run(_main())
+
+    assert len(calls) == 1
+    assert all(result["status"] == "ready" for result in results)
+
+
+def test_failed_preprocessing_is_retried_on_reupload_or_after_the_back_off(test_db, tmp_path, monkeypatch):
+    build_artifacts = upload_preprocessing._build_artifacts
+
+    def _failing_build(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(upload_preprocessing, "_build_artifacts", _failing_build)
+    record = _store(tmp_path, b"weekly post", "post.txt")
+    assert _ensure(record, tmp_path) is None
+    assert asyncio.run(upload_preprocessing.get_artifacts(record["sha256"]))["error"] == "disk full"
+
+    monkeypatch.setattr(upload_preprocessing, "_build_artifacts", build_artifacts)
+    assert _ensure(record, tmp_path) is None # Still within the back-off
+    assert _ensure(record, tmp_path, retry_failed=True)["status"] == "ready" # The same content uploaded again
+
+    other = _store(tmp_path, b"monthly post", "other.txt")
+    monkeypatch.setattr(upload_preprocessing, "_build_artifacts", _failing_build)
+    assert _ensure(other, tmp_path) is None
+    monkeypatch.setattr(upload_preprocessing, "_build_artifacts", build_artifacts)
+    monkeypatch.setattr(settings, "UPLOAD_PREPROCESS_RETRY_SECONDS", 0)
+    assert _ensure(other, tmp_path)["status"] == "ready"
+
+
+def test_preview_endpoint(test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(endpoints_files, "AI_DATA_PATH", str(tmp_path))
+    app = FastAPI()
+    app.include_router(endpoints_files.router, prefix="/api/files")
+    client = TestClient(app)
+
+    uploaded = client.post("/api/files/upload", files={"file": ("data.csv", b"a,b\n1,x\n2,y\n", "text/csv")}).json()
+    response = client.get(f"/api/files/{uploaded['file_id']}/preview", params={"max_rows": 1})
+
+    assert response.status_code == 200
+    preview = response.json()
+    assert preview["status"] == "ready" and preview["kind"] == "table"
+    assert preview["rows"] == [{"a": 1, "b": "x"}]
+    assert client.get("/api/files/unknown/preview").status_code == 404
+
+
+def _count_artifact_reads(monkeypatch):
+    reads = []
+    open_record_document = upload_preprocessing._open_record_document
+
+    async def _counting_open(record, base_upload_dir):
+        reads.append(record["file_id"])
+        return await open_record_document(record, base_upload_dir)
+
+    monkeypatch.setattr(upload_preprocessing, "_open_record_document", _counting_open)
+    return reads
+
+
+def test_repeated_chat_turns_read_each_document_once(test_db, tmp_path, monkeypatch):
+    records = [_store(tmp_path, f"document {i}\n".encode() * 50, f"doc{i}.txt") for i in range(10)]
+    for record in records:
+        _ensure(record, tmp_path)
+    reads = _count_artifact_reads(monkeypatch)
+
+    async def _turn():
+        return await asyncio.gather(*(
+            upload_preprocessing.load_document_text(r["file_id"], r["file_name"], str(tmp_path), max_chars=10_000) for r in records
+        ))
+
+    turns = [asyncio.run(_turn()) for _ in range(20)]
+
+    assert len(reads) == 10
+    assert all(turn == turns[0] for turn in turns)
+    assert turns[0][3] == "document 3\n" * 50
+
+
+def test_text_cache_evicts_the_least_recently_used_text_by_bytes(test_db, tmp_path, monkeypatch):
+    texts = {name: name * 100 for name in "abc"}
+    records = {name: _store(tmp_path, text.encode(), f"{name}.txt") for name, text in texts.items()}
+    monkeypatch.setattr(settings, "DOCUMENT_TEXT_CACHE_MAX_BYTES", 2 * sys.getsizeof(texts["a"]) + 10)
+    reads = _count_artifact_reads(monkeypatch)
+
+    def _load(name):
+        return asyncio.run(upload_preprocessing.load_document_text(records[name]["file_id"], f"{name}.txt", str(tmp_path)))
+
+    for name in "aba": # The second "a" is a hit and makes "b" the least recently used
+        assert _load(name) == texts[name]
+    assert reads == [records["a"]["file_id"], records["b"]["file_id"]]
+
+    _load("c")
+
+    assert list(upload_preprocessing._text_cache) == [records["a"]["sha256"], records["c"]["sha256"]]
+    assert upload_preprocessing._text_cache_bytes <= settings.DOCUMENT_TEXT_CACHE_MAX_BYTES
+    _load("b")
+    assert len(reads) == 4
@@ -10,6 +10,7 @@ from utils.colab_utils import ensure_colab_drive_mount_if_needed # Changed impor
 import os
 import sys
 import requests # Added for API calls
+from utils.chunked_upload import upload_file, ChunkedUploadError
 # from utils.path_manager import SOURCE_DOCS_DIR, IN_COLAB # Already imported via file_processors or similar, ensure it's available
 from utils.path_manager import SOURCE_DOCS_DIR, IN_COLAB # Explicitly ensure it's here if direct use
 # Removed old data_fetchers
@@ -153,49 +154,54 @@ def render_main_page_content():
     if uploaded_files_from_widget: # User has selected files in the widget
         logger.info(f"主頁面：用戶在 file_uploader 中選擇了 {len(uploaded_files_from_widget)} 個檔案。")
 
-        # Prepare files for multipart/form-data upload
-        files_for_api_upload = []
-        for up_file in uploaded_files_from_widget:
-            files_for_api_upload.append(('files', (up_file.name, up_file.getvalue(), up_file.type)))
-
-        if files_for_api_upload:
-            backend_upload_url = f"{app_settings.FASTAPI_BACKEND_URL}/api/files/upload"
-            st.info(f"正在上傳 {len(files_for_api_upload)} 個文件到後端服務...")
-            try:
-                api_response = requests.post(backend_upload_url, files=files_for_api_upload, timeout=180) # Increased timeout for potentially large files
-                api_response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                response_json = api_response.json()
-
-                if response_json.get("success"):
-                    st.success(response_json.get("message", f"成功上傳 {len(files_for_api_upload)} 個文件到後端。"))
-
-                    # Replace old session state vars for uploaded file contents
-                    st.session_state.pop("uploaded_files_list", None)
-                    st.session_state.pop("uploaded_file_contents", None)
-
-                    # Store new backend-provided file info
-                    # It's better to append to or update an existing list to handle multiple upload batches.
-                    if "uploaded_documents_info" not in st.session_state:
-                        st.session_state.uploaded_documents_info = []
-
-                    new_files_info = response_json.get("uploaded_files_info", [])
-                    # Simple append for now. A more robust way would be to update by file_id if files can be re-uploaded.
-                    st.session_state.uploaded_documents_info.extend(new_files_info)
-
-                    logger.info(f"後端文件上傳成功。收到 {len(new_files_info)} 個文件的信息。")
-                    # Rerun to clear the file_uploader and reflect new state
-                    st.rerun()
-                else:
-                    error_msg = response_json.get("error", "後端處理文件上傳失敗，但未提供明確錯誤訊息。")
-                    st.error(f"後端錯誤: {error_msg}")
-                    logger.error(f"後端文件上傳API返回失敗: {error_msg}")
-
-            except requests.exceptions.RequestException as e:
-                st.error(f"上傳文件到後端失敗: {e}")
-                logger.error(f"上傳文件到後端失敗: {e}", exc_info=True)
-            except Exception as e:
-                st.error(f"處理文件上傳時發生未知錯誤: {e}")
-                logger.error(f"處理文件上傳時發生未知錯誤: {e}", exc_info=True)
+        # Each file goes through the backend's chunked upload API, so a failed chunk is retried on its own
+        # instead of re-sending the whole batch; an interrupted upload is resumed when the same file is uploaded again
+        if "chunked_upload_ids" not in st.session_state: # (file name, sha256) -> upload_id of an unfinished upload
+            st.session_state.chunked_upload_ids = {}
+        st.info(f"正在上傳 {len(uploaded_files_from_widget)} 個文件到後端服務...")
+        new_files_info = []
+        failed_files = []
+        progress_bar = st.progress(0.0)
+        with requests.Session() as http_session:
+            for i, up_file in enumerate(uploaded_files_from_widget):
+                try:
+                    uploaded = upload_file(
+                        app_settings.FASTAPI_BACKEND_URL, up_file.name, up_file.getvalue(), up_file.type, session=http_session,
+                        resume_store=st.session_state.chunked_upload_ids
+                    )
+                    new_files_info.append({
+                        "file_id": uploaded["file_id"],
+                        "filename": uploaded["file_name"],
+                        "content_type": uploaded.get("content_type") or "N/A",
+                        "size": uploaded.get("size", 0),
+                        "summary": "與先前上傳的文件內容相同，已重用。" if uploaded.get("deduplicated") else uploaded.get("message", ""),
+                    })
+                except ChunkedUploadError as e:
+                    failed_files.append(up_file.name)
+                    st.error(f"上傳文件 '{up_file.name}' 到後端失敗: {e}")
+                    logger.error(f"上傳文件 '{up_file.name}' 到後端失敗: {e}", exc_info=True)
+                except Exception as e:
+                    failed_files.append(up_file.name)
+                    st.error(f"處理文件 '{up_file.name}' 上傳時發生未知錯誤: {e}")
+                    logger.error(f"處理文件 '{up_file.name}' 上傳時發生未知錯誤: {e}", exc_info=True)
+                progress_bar.progress((i + 1) / len(uploaded_files_from_widget))
+
+        if new_files_info:
+            # Replace old session state vars for uploaded file contents
+            st.session_state.pop("uploaded_files_list", None)
+            st.session_state.pop("uploaded_file_contents", None)
+
+            if "uploaded_documents_info" not in st.session_state:
+                st.session_state.uploaded_documents_info = []
+            # Re-uploading a file returns the same file_id when the backend deduplicates it; keep one entry per ID
+            known_ids = {doc.get("file_id") for doc in st.session_state.uploaded_documents_info}
+            st.session_state.uploaded_documents_info.extend(doc for doc in new_files_info if doc["file_id"] not in known_ids)
+            logger.info(f"後端文件上傳成功。收到 {len(new_files_info)} 個文件的信息。")
+
+        if not failed_files:
+            st.success(f"成功上傳 {len(new_files_info)} 個文件到後端。")
+            # Rerun to clear the file_uploader and reflect new state
+            st.rerun()
         # It's important to clear the file uploader widget after an upload attempt (success or failure)
         # to prevent re-uploading the same files on next script run if not handled carefully.
         # A common way is st.rerun(), or manually resetting the key of file_uploader if possible,
@@ -234,6 +240,25 @@ def render_main_page_content():
     st.caption("從 `Wolf_Data/source_documents/` (本地掃描) 或已上傳到後端的文件中選擇核心文檔。") # Caption updated
     logger.debug("主頁面：渲染核心分析文件選擇區域。")
 
+    # --- Full-text search over uploads and source documents (backend FTS index) ---
+    search_query = st.text_input("🔍 全文搜尋 (已上傳文件與來源文件):", key="main_fulltext_search_query", placeholder="例如：聯準會 升息、TSLA")
+    if search_query.strip():
+        try:
+            search_response = requests.get(
+                f"{app_settings.FASTAPI_BACKEND_URL}/api/search", params={"q": search_query, "limit": 20}, timeout=30
+            )
+            search_response.raise_for_status()
+            search_json = search_response.json()
+            search_results = search_json.get("results", [])
+            st.caption(f"找到 {len(search_results)} 個片段 ({search_json.get('took_ms', 0):.1f} ms)。")
+            for hit in search_results:
+                source_label = "後端" if hit.get("source") == "upload" else "本地"
+                week_label = f" · {hit['week_id']} ({hit['week_start']})" if hit.get("week_id") else ""
+                st.markdown(f"**[{source_label}] {hit.get('name')}**{week_label}  \n{hit.get('snippet', '')}")
+        except requests.exceptions.RequestException as e:
+            st.error(f"全文搜尋失敗: {e}")
+            logger.error(f"全文搜尋失敗: {e}", exc_info=True)
+
     # --- Wolf_Data/source_documents/ 文件掃描邏輯 (Frontend local scan) ---
     # This part remains largely the same if SOURCE_DOCS_DIR is a locally accessible path by the frontend.
     # The `ensure_colab_drive_mount_if_needed` is still relevant for this local scanning part.
@@ -54,6 +54,12 @@ DEFAULT_CHAT_CONTAINER_HEIGHT = 400 # Default height for chat message container
 AGENT_BUTTONS_PER_ROW = 3 # Max agent buttons per row on main page
 ALLOWED_UPLOAD_FILE_TYPES = ["txt", "csv", "xls", "xlsx", "md", "py", "json", "xml", "html", "css", "js"]
 
+# --- Chunked Upload Settings (utils/chunked_upload.py) ---
+UPLOAD_CHUNK_SIZE_BYTES = 8 * 1024 * 1024 # Size of each chunk sent to the backend
+UPLOAD_PARALLEL_CHUNKS = 4 # Chunks sent concurrently per file
+UPLOAD_CHUNK_MAX_RETRIES = 3 # Retries per chunk before the upload fails
+UPLOAD_CHUNK_TIMEOUT_SECONDS = 60 # Request timeout for one chunk
+
 # yfinance數據的時間間隔選項
 YFINANCE_INTERVAL_OPTIONS = { # Renamed from interval_options for clarity
     "1 Day": "1d",
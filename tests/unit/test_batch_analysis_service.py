@@ -0,0 +1,183 @@
+import asyncio
+import sqlite3
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+from app.db import batch_checkpoints
+from app.services.ai_service import AIServiceError
+from app.services.batch_analysis_service import (
+    BatchJobError,
+    BatchSourceDirError,
+    MARKET_DATA_NOT_CACHED,
+    discover_weekly_posts,
+    find_stale_weeks,
+    get_batch_job_progress,
+    resolve_source_dir,
+    run_batch_job,
+)
+
+
+@pytest.fixture
+def batch_db(tmp_path, monkeypatch):
+    """Points the checkpoint module at a fresh SQLite file with the batch tables created."""
+    db_file = tmp_path / "batch_test.db"
+
+    def _connect():
+        conn = sqlite3.connect(db_file)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    monkeypatch.setattr(batch_checkpoints, "get_db_connection", _connect)
+    batch_checkpoints.initialize_batch_tables()
+    return db_file
+
+
+@pytest.fixture
+def posts_dir(tmp_path):
+    source_dir = tmp_path / "source_documents" / "shan_jia_lang"
+    source_dir.mkdir(parents=True)
+    (source_dir / "2023-10-02_post.txt").write_text("第一週貼文。", encoding="utf-8")
+    (source_dir / "2023-10-05_post.md").write_text("第一週第二篇。", encoding="utf-8") # Same ISO week as above
+    (source_dir / "2023-W41.txt").write_text("第二週貼文。", encoding="utf-8")
+    (source_dir / "notes.txt").write_text("沒有日期的貼文。", encoding="utf-8")
+    (source_dir / "image.png").write_bytes(b"\x89PNG") # Ignored extension
+    return source_dir
+
+
+def _fake_completion(prompt=None, usage_out=None, **kwargs):
+    if usage_out is not None:
+        usage_out.update(prompt_tokens=100, output_tokens=20, total_tokens=120)
+    return f"Report for prompt of length {len(prompt)}"
+
+
+def test_discover_weekly_posts_groups_files_by_iso_week(posts_dir):
+    weeks = discover_weekly_posts(posts_dir)
+
+    assert [w.week_id for w in weeks] == ["2023-W40", "2023-W41", "notes"]
+    first_week = weeks[0]
+    assert first_week.week_start == date(2023, 10, 2)
+    assert first_week.date_range == "2023-10-02至2023-10-08"
+    assert len(first_week.source_paths) == 2
+    assert "第一週貼文。" in first_week.read_text() and "第一週第二篇。" in first_week.read_text()
+    assert weeks[2].week_end is None
+
+
+def test_discover_weekly_posts_missing_directory_raises(tmp_path):
+    with pytest.raises(BatchJobError):
+        discover_weekly_posts(tmp_path / "does_not_exist")
+
+
+@patch("app.services.batch_analysis_service.build_week_market_data", return_value={"GDP": [{"date": "2023-07-01", "value": "1"}]})
+@patch("app.services.batch_analysis_service.get_ai_chat_completion", side_effect=_fake_completion)
+def test_run_batch_job_checkpoints_each_week_and_reports_progress(mock_completion, mock_market_data, batch_db, posts_dir):
+    progress = asyncio.run(run_batch_job("job-1", posts_dir, requests_per_minute=0))
+
+    assert mock_completion.call_count == 3
+    assert progress["status"] == "completed"
+    assert progress["completed_weeks"] == 3
+    assert progress["pending_weeks"] == 0
+    assert progress["prompt_tokens"] == 300
+    assert progress["total_tokens"] == 360
+    assert progress["throughput_weeks_per_hour"] > 0
+
+    week_result = batch_checkpoints.get_week_result("job-1", "2023-W40")
+    assert week_result["status"] == "completed"
+    assert week_result["report"].startswith("Report for prompt")
+
+
+@patch("app.services.batch_analysis_service.build_week_market_data", return_value=None)
+@patch("app.services.batch_analysis_service.get_ai_chat_completion")
+def test_run_batch_job_resumes_and_only_retries_unfinished_weeks(mock_completion, mock_market_data, batch_db, posts_dir):
+    def failing_second_week(prompt=None, usage_out=None, **kwargs):
+        if "第二週貼文。" in prompt:
+            raise AIServiceError("quota exceeded")
+        return _fake_completion(prompt, usage_out)
+
+    mock_completion.side_effect = failing_second_week
+    first_run = asyncio.run(run_batch_job("job-2", posts_dir, requests_per_minute=0, max_retries=0))
+    assert first_run["status"] == "completed_with_errors"
+    assert first_run["completed_weeks"] == 2
+    assert first_run["failed_weeks"] == 1
+
+    # Resume (e.g., after a disconnect): completed weeks are skipped, the failed week is generated again.
+    mock_completion.reset_mock()
+    mock_completion.side_effect = _fake_completion
+    second_run = asyncio.run(run_batch_job("job-2", posts_dir, requests_per_minute=0, max_retries=0))
+
+    assert mock_completion.call_count == 1
+    assert "第二週貼文。" in mock_completion.call_args.kwargs["prompt"]
+    assert second_run["status"] == "completed"
+    assert second_run["completed_weeks"] == 3
+    assert second_run["failed_weeks"] == 0
+
+
+@patch("app.services.batch_analysis_service.build_week_market_data", return_value=None)
+@patch("app.services.batch_analysis_service.get_ai_chat_completion", side_effect=_fake_completion)
+def test_rerun_only_regenerates_weeks_whose_inputs_changed(mock_completion, mock_market_data, batch_db, posts_dir):
+    asyncio.run(run_batch_job("job-3", posts_dir, requests_per_minute=0))
+    assert mock_completion.call_count == 3
+    assert find_stale_weeks("job-3") == []
+
+    # A corrected post only invalidates its own week.
+    (posts_dir / "2023-W41.txt").write_text("第二週貼文（修正版）。", encoding="utf-8")
+    assert find_stale_weeks("job-3") == [
+        {"week_id": "2023-W41", "date_range": "2023-10-09至2023-10-15", "changed_inputs": ["post_hash"]}
+    ]
+    mock_completion.reset_mock()
+    progress = asyncio.run(run_batch_job("job-3", posts_dir, requests_per_minute=0))
+    assert mock_completion.call_count == 1
+    assert "第二週貼文（修正版）。" in mock_completion.call_args.kwargs["prompt"]
+    assert progress["completed_weeks"] == 3
+
+    # New expert summaries invalidate every week.
+    with patch.dict("app.services.batch_analysis_service.DEFAULT_EXPERT_SUMMARIES", {"新專家": "新觀點。"}):
+        stale_weeks = find_stale_weeks("job-3")
+        assert [w["week_id"] for w in stale_weeks] == ["2023-W40", "2023-W41", "notes"]
+        assert all(w["changed_inputs"] == ["experts_hash"] for w in stale_weeks)
+
+
+def test_find_stale_weeks_unknown_job(batch_db):
+    with pytest.raises(BatchJobError):
+        find_stale_weeks("missing-job")
+
+
+def test_get_batch_job_progress_unknown_job(batch_db):
+    assert get_batch_job_progress("missing-job") is None
+
+
+def test_resolve_source_dir_rejects_paths_outside_source_documents(tmp_path, posts_dir):
+    with patch("app.services.batch_analysis_service.settings.SOURCE_DOCUMENTS_DIR", posts_dir.parent):
+        assert resolve_source_dir() == posts_dir.parent.resolve()
+        assert resolve_source_dir("shan_jia_lang") == posts_dir.resolve()
+        assert resolve_source_dir(str(posts_dir)) == posts_dir.resolve()
+        for outside in ("..", "shan_jia_lang/../../", str(tmp_path), "/etc"):
+            with pytest.raises(BatchSourceDirError):
+                resolve_source_dir(outside)
+
+
+@patch("app.services.batch_analysis_service.get_ai_chat_completion", side_effect=_fake_completion)
+def test_find_stale_weeks_uses_cached_market_data_only(mock_completion, batch_db, posts_dir):
+    with patch("app.services.batch_analysis_service.build_week_market_data", return_value=None):
+        asyncio.run(run_batch_job("job-4", posts_dir, requests_per_minute=0))
+
+    # Uncached market data is not fetched during the dry run; the other inputs are still compared.
+    with patch("app.services.batch_analysis_service.build_week_market_data", return_value=MARKET_DATA_NOT_CACHED) as mock_market_data, \
+            patch("app.services.batch_analysis_service.fetch_fred_data") as mock_fetch:
+        assert find_stale_weeks("job-4") == []
+        (posts_dir / "2023-W41.txt").write_text("第二週貼文（修正版）。", encoding="utf-8")
+        assert [w["week_id"] for w in find_stale_weeks("job-4")] == ["2023-W41"]
+    assert all(call.kwargs == {"cached_only": True} for call in mock_market_data.call_args_list)
+    mock_fetch.assert_not_called()
+
+
+def test_pending_weeks_counts_earlier_failures_as_pending_while_running(batch_db, posts_dir):
+    batch_checkpoints.start_batch_job_run("job-5", str(posts_dir), 3)
+    batch_checkpoints.save_week_result("job-5", "2023-W40", "a.txt", "r", "failed", error="quota exceeded", attempts=1)
+    assert get_batch_job_progress("job-5")["pending_weeks"] == 2
+
+    # A new run retries the failed week, so it is pending again until it finishes.
+    batch_checkpoints.start_batch_job_run("job-5", str(posts_dir), 3)
+    with patch.dict("app.services.batch_analysis_service._running_jobs", {"job-5": None}):
+        assert get_batch_job_progress("job-5")["pending_weeks"] == 3
@@ -0,0 +1,185 @@
+import hashlib
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+
+from utils.chunked_upload import upload_file, ChunkedUploadError
+
+BACKEND = "http://backend"
+
+
+class FakeUploadBackend:
+    """In-memory stand-in for the backend's /api/files/uploads endpoints, used as a requests.Session."""
+
+    def __init__(self, fail_puts=None, drop_chunks=None, fail_gets=0, fail_completes=0, reject_complete=False):
+        self.fail_puts = dict(fail_puts or {}) # chunk index -> number of PUTs to fail with a connection error
+        self.drop_chunks = set(drop_chunks or ()) # chunk indexes acknowledged once but not recorded
+        self.fail_gets = fail_gets # status requests to fail with a connection error
+        self.fail_completes = fail_completes # complete requests to fail with HTTP 503
+        self.reject_complete = reject_complete # answer complete with 409 (hash mismatch)
+        self.upload_id = None
+        self.chunks = {}
+        self.put_calls = []
+        self.creates = 0
+        self.deleted = False
+        self.lock = threading.Lock()
+
+    def _response(self, status_code=200, body=None):
+        response = MagicMock()
+        response.status_code = status_code
+        response.json.return_value = body
+        if status_code >= 400:
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status_code}")
+        return response
+
+    def _status(self):
+        missing = [i for i in range(self.total) if i not in self.chunks]
+        return {"upload_id": self.upload_id, "size": self.size, "chunk_size": self.chunk_size, "total_chunks": self.total, "missing_chunks": missing}
+
+    def post(self, url, json=None, timeout=None):
+        if url.endswith("/complete"):
+            if self.fail_completes > 0:
+                self.fail_completes -= 1
+                return self._response(503)
+            if self.reject_complete:
+                return self._response(409)
+            data = b"".join(self.chunks[i] for i in range(self.total))
+            assert hashlib.sha256(data).hexdigest() == self.sha256
+            return self._response(body={"file_id": "f1", "file_name": self.file_name, "size": len(data)})
+        self.file_name, self.size, self.chunk_size, self.sha256 = json["file_name"], json["size"], json["chunk_size"], json["sha256"]
+        self.total = max(1, -(-self.size // self.chunk_size))
+        self.creates += 1
+        self.upload_id = f"u{self.creates}"
+        return self._response(body=self._status())
+
+    def put(self, url, data=None, headers=None, timeout=None):
+        index = int(url.rsplit("/", 1)[-1])
+        with self.lock:
+            self.put_calls.append(index)
+            if self.fail_puts.get(index, 0) > 0:
+                self.fail_puts[index] -= 1
+                raise requests.exceptions.ConnectionError("connection reset")
+            if headers["X-Chunk-SHA256"] != hashlib.sha256(data).hexdigest():
+                return self._response(400)
+            if index in self.drop_chunks:
+                self.drop_chunks.discard(index)
+            else:
+                self.chunks[index] = data
+        return self._response(body=self._status())
+
+    def get(self, url, timeout=None):
+        if self.fail_gets > 0:
+            self.fail_gets -= 1
+            raise requests.exceptions.ConnectionError("connection reset")
+        if url.rsplit("/", 1)[-1] != self.upload_id:
+            return self._response(404) # Unknown, or discarded by the backend's TTL GC
+        return self._response(body=self._status())
+
+    def delete(self, url, timeout=None):
+        self.deleted = True
+        return self._response(body={})
+
+
+@pytest.fixture(autouse=True)
+def no_backoff_sleep():
+    with patch("utils.chunked_upload.time.sleep"):
+        yield
+
+
+def test_upload_file_sends_all_chunks_and_completes():
+    data = bytes(range(256)) * 40 # 10240 bytes -> 3 chunks of 4096
+    backend = FakeUploadBackend()
+
+    result = upload_file(BACKEND, "data.csv", data, "text/csv", session=backend, chunk_size=4096, parallel_chunks=3)
+
+    assert result["file_id"] == "f1"
+    assert sorted(backend.put_calls) == [0, 1, 2]
+    assert backend.chunks[2] == data[8192:]
+
+
+def test_upload_file_retries_only_the_failed_chunk():
+    data = b"x" * 10000
+    backend = FakeUploadBackend(fail_puts={1: 2})
+
+    upload_file(BACKEND, "data.txt", data, session=backend, chunk_size=4096, max_retries=3)
+
+    assert backend.put_calls.count(1) == 3
+    assert backend.put_calls.count(0) == 1
+    assert backend.put_calls.count(2) == 1
+
+
+def test_upload_file_resends_chunks_the_backend_reports_missing():
+    backend = FakeUploadBackend(drop_chunks={0})
+
+    upload_file(BACKEND, "data.txt", b"y" * 5000, session=backend, chunk_size=4096)
+
+    assert backend.put_calls.count(0) == 2
+
+
+def test_upload_file_keeps_the_upload_for_resuming_after_exhausting_retries():
+    backend = FakeUploadBackend(fail_puts={0: 100})
+    resume_store = {}
+
+    with pytest.raises(ChunkedUploadError):
+        upload_file(BACKEND, "data.txt", b"z" * 100, session=backend, chunk_size=4096, max_retries=1, resume_store=resume_store)
+
+    assert not backend.deleted
+    assert resume_store == {("data.txt", hashlib.sha256(b"z" * 100).hexdigest()): "u1"}
+
+
+def test_upload_file_resumes_an_interrupted_upload():
+    data = b"r" * 10000
+    backend = FakeUploadBackend(fail_puts={2: 100})
+    resume_store = {}
+    with pytest.raises(ChunkedUploadError):
+        upload_file(BACKEND, "data.txt", data, session=backend, chunk_size=4096, max_retries=1, resume_store=resume_store)
+    backend.fail_puts.clear()
+    backend.put_calls.clear()
+
+    result = upload_file(BACKEND, "data.txt", data, session=backend, chunk_size=4096, resume_store=resume_store)
+
+    assert result["file_id"] == "f1"
+    assert backend.creates == 1
+    assert backend.put_calls == [2]
+    assert resume_store == {}
+
+
+def test_upload_file_starts_over_when_the_stored_upload_expired():
+    backend = FakeUploadBackend()
+    resume_store = {("data.txt", hashlib.sha256(b"e" * 10).hexdigest()): "expired"}
+
+    upload_file(BACKEND, "data.txt", b"e" * 10, session=backend, chunk_size=4096, resume_store=resume_store)
+
+    assert backend.creates == 1
+    assert resume_store == {}
+
+
+def test_upload_file_retries_status_and_complete_calls():
+    backend = FakeUploadBackend(fail_gets=1, fail_completes=2)
+
+    result = upload_file(BACKEND, "data.txt", b"s" * 5000, session=backend, chunk_size=4096, max_retries=2)
+
+    assert result["file_id"] == "f1"
+    assert not backend.deleted
+
+
+def test_upload_file_discards_a_rejected_upload():
+    backend = FakeUploadBackend(reject_complete=True)
+    resume_store = {}
+
+    with pytest.raises(ChunkedUploadError):
+        upload_file(BACKEND, "data.txt", b"w" * 10, session=backend, chunk_size=4096, resume_store=resume_store)
+
+    assert backend.deleted
+    assert resume_store == {}
+
+
+def test_upload_file_empty_file_is_one_empty_chunk():
+    backend = FakeUploadBackend()
+
+    result = upload_file(BACKEND, "empty.txt", b"", session=backend, chunk_size=4096)
+
+    assert backend.put_calls == [0]
+    assert result["size"] == 0
@@ -2,6 +2,7 @@ import pytest
 from app.services.prompt_engineering_service import (
     build_initial_analysis_prompt,
     build_final_report_preview_prompt,
+    build_initial_analysis_section_prompts,
     DEFAULT_EXPERT_SUMMARIES # Import to check against default behavior
 )
 import json # For checking JSON formatting in prompt
@@ -122,3 +123,28 @@ def test_build_final_report_preview_prompt_missing_sections():
     assert "[C節內容未提供]" in prompt
     assert sections["D"] in prompt
     assert "[E節內容未提供]" in prompt
+
+def test_build_initial_analysis_section_prompts_share_context_prefix():
+    """Tests that each section prompt asks for one section and all share the same context prefix."""
+    ext_data = {"CPI": "3.0%"}
+    section_prompts = build_initial_analysis_section_prompts(
+        shan_jia_lang_post=MINIMAL_POST,
+        date_range=MINIMAL_DATE_RANGE,
+        external_data=ext_data
+    )
+
+    assert list(section_prompts.keys()) == ["A", "B", "C", "D", "E"]
+    prefixes = {prompt.split("**本次撰寫範圍：**", 1)[0] for prompt in section_prompts.values()}
+    assert len(prefixes) == 1 # Identical shared context for every section
+    shared_prefix = prefixes.pop()
+    assert MINIMAL_POST in shared_prefix
+    assert json.dumps(ext_data, indent=2, ensure_ascii=False) in shared_prefix
+
+    assert "B. 「善甲狼」核心觀點摘要:" in section_prompts["B"]
+    assert "C. 當週市場重點回顧:" not in section_prompts["B"]
+
+    # The single prompt keeps the same context followed by all five section requirements.
+    full_prompt = build_initial_analysis_prompt(
+        shan_jia_lang_post=MINIMAL_POST, date_range=MINIMAL_DATE_RANGE, external_data=ext_data
+    )
+    assert full_prompt.startswith(shared_prefix.rstrip())
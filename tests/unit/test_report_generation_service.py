@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+from app.services.ai_service import AIServiceError
+from app.services.report_generation_service import (
+    assemble_report_sections,
+    generate_initial_analysis_in_parallel,
+)
+
+MINIMAL_POST = "善甲狼本週貼文。"
+MINIMAL_DATE_RANGE = "2023-W01"
+SIMULATED_LATENCY_SECONDS = 0.2
+
+
+def _section_of(prompt: str) -> str:
+    """Finds which section a per-section prompt asks for (its requirement heading follows the scope note)."""
+    scope = prompt.split("**本次撰寫範圍：**", 1)[1]
+    for key in "ABCDE":
+        if f"**{key}. " in scope:
+            return key
+    raise AssertionError("Section prompt without a section requirement.")
+
+
+def _fake_completion(prompt=None, **kwargs):
+    time.sleep(SIMULATED_LATENCY_SECONDS)
+    return f"Section {_section_of(prompt)} text."
+
+
+def test_assemble_report_sections_orders_sections_and_marks_missing():
+    report = assemble_report_sections({"C": "Text C", "A": "Text A\n"})
+
+    assert report.index("**A. 週次與日期範圍:**\nText A") < report.index("**C. 當週市場重點回顧:**\nText C")
+    assert "[B節內容未提供]" in report
+    assert "[E節內容未提供]" in report
+
+
+@patch("app.services.report_generation_service.get_ai_chat_completion", side_effect=_fake_completion)
+def test_parallel_generation_is_faster_than_sequential(mock_completion):
+    started_at = time.perf_counter()
+    report = asyncio.run(generate_initial_analysis_in_parallel(MINIMAL_POST, MINIMAL_DATE_RANGE, max_concurrency=5))
+    elapsed = time.perf_counter() - started_at
+
+    assert mock_completion.call_count == 5
+    # Five sections in sequence would take at least 5 x the simulated latency.
+    assert elapsed < 5 * SIMULATED_LATENCY_SECONDS * 0.6
+    positions = [report.index(f"Section {key} text.") for key in "ABCDE"]
+    assert positions == sorted(positions)
+
+
+@patch("app.services.report_generation_service.get_ai_chat_completion")
+def test_parallel_generation_respects_max_concurrency(mock_completion):
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def tracking_completion(prompt=None, **kwargs):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+        return "ok"
+
+    mock_completion.side_effect = tracking_completion
+    asyncio.run(generate_initial_analysis_in_parallel(MINIMAL_POST, MINIMAL_DATE_RANGE, max_concurrency=2))
+
+    assert state["peak"] <= 2
+
+
+@patch("app.services.report_generation_service.get_ai_chat_completion")
+def test_failed_section_is_retried_alone(mock_completion):
+    failures = {"D": 1}
+
+    def flaky_completion(prompt=None, **kwargs):
+        section = _section_of(prompt)
+        if failures.get(section):
+            failures[section] -= 1
+            raise AIServiceError("transient failure")
+        return f"Section {section} text."
+
+    mock_completion.side_effect = flaky_completion
+    report = asyncio.run(generate_initial_analysis_in_parallel(
+        MINIMAL_POST, MINIMAL_DATE_RANGE, max_retries=1, retry_backoff_seconds=0
+    ))
+
+    assert mock_completion.call_count == 6 # Five sections plus one retry of D
+    assert "Section D text." in report
+
+
+@patch("app.services.report_generation_service.get_ai_chat_completion", side_effect=AIServiceError("down"))
+def test_section_failing_all_retries_raises(mock_completion):
+    with pytest.raises(AIServiceError, match="failed after 2 attempts"):
+        asyncio.run(generate_initial_analysis_in_parallel(
+            MINIMAL_POST, MINIMAL_DATE_RANGE, max_retries=1, retry_backoff_seconds=0
+        ))
+
+
+def test_assemble_report_sections_is_verbatim_and_byte_identical():
+    sections = {
+        "A": "2023-W01",
+        "B": "  * 縮排清單項目\n  * 第二項  ",
+        "C": "## 標題\n\n內文。\n\n",
+        "D": "> 引言",
+        "E": "**粗體** 結尾",
+    }
+
+    first = assemble_report_sections(sections)
+    second = assemble_report_sections(dict(sections))
+
+    assert first.encode("utf-8") == second.encode("utf-8")
+    assert "**B. 「善甲狼」核心觀點摘要:**\n  * 縮排清單項目\n  * 第二項  \n\n" in first
+    assert "**C. 當週市場重點回顧:**\n## 標題\n\n內文。\n\n**D." in first
+    assert first.endswith("**E. 「看到->想到->做到」框架下的潛在交易機會回顧:**\n**粗體** 結尾\n")
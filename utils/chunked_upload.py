@@ -0,0 +1,181 @@
+# utils/chunked_upload.py
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, MutableMapping, Optional, Tuple
+
+import requests
+
+from config import app_settings
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedUploadError(Exception):
+    """Raised when a chunked upload cannot be completed."""
+
+
+def _put_chunk(
+    session: requests.Session,
+    upload_url: str,
+    data: memoryview,
+    index: int,
+    chunk_size: int,
+    max_retries: int,
+    timeout: float
+) -> None:
+    """Sends one chunk, retrying with exponential backoff on network errors, 5xx and checksum mismatches."""
+    chunk = bytes(data[index * chunk_size:(index + 1) * chunk_size])
+    headers = {"X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(), "Content-Type": "application/octet-stream"}
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.put(f"{upload_url}/chunks/{index}", data=chunk, headers=headers, timeout=timeout)
+            if response.status_code < 500 and response.status_code != 400:
+                response.raise_for_status() # 404 etc. will not get better by retrying
+                return
+            reason = f"HTTP {response.status_code}"
+        except requests.exceptions.HTTPError:
+            raise
+        except requests.exceptions.RequestException as e:
+            reason = str(e)
+        if attempt < max_retries:
+            delay = 0.5 * 2 ** attempt
+            logger.warning(f"分段 {index} 上傳失敗 ({reason})，{delay:.1f} 秒後重試 ({attempt + 1}/{max_retries})。")
+            time.sleep(delay)
+    raise ChunkedUploadError(f"分段 {index} 在 {max_retries} 次重試後仍上傳失敗: {reason}")
+
+
+def _send(
+    session: requests.Session,
+    method: str,
+    url: str,
+    max_retries: int,
+    timeout: float,
+    **kwargs: Any
+) -> requests.Response:
+    """
+    Sends one request of the upload API, retrying with exponential backoff on network errors and 5xx.
+    Other responses (including 4xx) are returned for the caller to handle.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = getattr(session, method)(url, timeout=timeout, **kwargs)
+            if response.status_code < 500:
+                return response
+            reason = f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            reason = str(e)
+        if attempt < max_retries:
+            delay = 0.5 * 2 ** attempt
+            logger.warning(f"{method.upper()} {url} 失敗 ({reason})，{delay:.1f} 秒後重試 ({attempt + 1}/{max_retries})。")
+            time.sleep(delay)
+    raise ChunkedUploadError(f"{method.upper()} {url} 在 {max_retries} 次重試後仍失敗: {reason}")
+
+
+def upload_file(
+    backend_url: str,
+    file_name: str,
+    data: bytes,
+    content_type: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    chunk_size: int = app_settings.UPLOAD_CHUNK_SIZE_BYTES,
+    parallel_chunks: int = app_settings.UPLOAD_PARALLEL_CHUNKS,
+    max_retries: int = app_settings.UPLOAD_CHUNK_MAX_RETRIES,
+    timeout: float = app_settings.UPLOAD_CHUNK_TIMEOUT_SECONDS,
+    resume_store: Optional[MutableMapping[Tuple[str, str], str]] = None
+) -> Dict[str, Any]:
+    """
+    Uploads a file through the backend's chunked upload API (/api/files/uploads): creates an upload
+    session, sends the chunks in parallel (each retried on its own), asks the backend which chunks are
+    still missing and re-sends those, then completes the upload. Status and complete calls are retried
+    with backoff as well.
+
+    A failed upload is left on the backend (its TTL GC discards it if it is never finished). With
+    `resume_store` (e.g. st.session_state), its upload_id is kept there under (file_name, sha256), so
+    uploading the same file again resumes it through GET /uploads/{upload_id} and sends only the missing
+    chunks. The entry is removed once the upload completes or the backend no longer knows it.
+
+    Returns:
+        Dict[str, Any]: The backend's FileUploadResponse (file_id, file_name, size, sha256, ...).
+
+    Raises:
+        ChunkedUploadError: If chunks keep failing or the backend rejects the upload.
+    """
+    session = session or requests.Session()
+    uploads_url = f"{backend_url}/api/files/uploads"
+    sha256 = hashlib.sha256(data).hexdigest()
+    resume_key = (file_name, sha256)
+
+    def forget_upload() -> None:
+        if resume_store is not None:
+            resume_store.pop(resume_key, None)
+
+    status = None
+    upload_id = resume_store.get(resume_key) if resume_store is not None else None
+    if upload_id:
+        response = _send(session, "get", f"{uploads_url}/{upload_id}", max_retries, timeout)
+        if response.status_code == 200 and response.json()["size"] == len(data):
+            status = response.json()
+            logger.info(f"續傳 '{file_name}'，upload_id={upload_id}，尚缺 {len(status['missing_chunks'])} 個分段。")
+        else:
+            logger.info(f"'{file_name}' 先前的分段上傳 {upload_id} 已無法續傳 (HTTP {response.status_code})，重新建立。")
+            forget_upload()
+    if status is None:
+        response = _send(session, "post", uploads_url, max_retries, timeout, json={
+            "file_name": file_name,
+            "size": len(data),
+            "content_type": content_type,
+            "chunk_size": chunk_size,
+            "sha256": sha256,
+        })
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            raise ChunkedUploadError(f"無法建立 '{file_name}' 的分段上傳: {e}") from e
+        status = response.json()
+        if resume_store is not None:
+            resume_store[resume_key] = status["upload_id"]
+        logger.info(f"開始分段上傳 '{file_name}' ({len(data)} bytes, {status['total_chunks']} 個分段)，upload_id={status['upload_id']}。")
+    upload_url = f"{uploads_url}/{status['upload_id']}"
+
+    view = memoryview(data)
+    try:
+        missing: List[int] = status["missing_chunks"]
+        for _ in range(max_retries + 1):
+            if not missing:
+                break
+            with ThreadPoolExecutor(max_workers=max(1, min(parallel_chunks, len(missing)))) as executor:
+                futures = [
+                    executor.submit(_put_chunk, session, upload_url, view, index, status["chunk_size"], max_retries, timeout)
+                    for index in missing
+                ]
+                errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                logger.warning(f"'{file_name}' 有 {len(errors)} 個分段上傳失敗: {errors[0]}")
+            # The backend's record of received chunks is authoritative
+            response = _send(session, "get", upload_url, max_retries, timeout)
+            if response.status_code == 404:
+                forget_upload()
+            response.raise_for_status()
+            missing = response.json()["missing_chunks"]
+        if missing:
+            raise ChunkedUploadError(f"'{file_name}' 仍有 {len(missing)} 個分段未能上傳，再次上傳同一檔案即可續傳。")
+
+        response = _send(session, "post", f"{upload_url}/complete", max_retries, timeout)
+        if response.status_code >= 400:
+            # Rejected (e.g. the assembled file does not match its hash) or unknown: the next attempt starts over
+            forget_upload()
+            if response.status_code != 404:
+                try:
+                    session.delete(upload_url, timeout=timeout)
+                except requests.exceptions.RequestException:
+                    pass
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise ChunkedUploadError(f"分段上傳 '{file_name}' 失敗: {e}") from e
+    finally:
+        view.release()
+    forget_upload()
+    logger.info(f"'{file_name}' 分段上傳完成。")
+    return response.json()